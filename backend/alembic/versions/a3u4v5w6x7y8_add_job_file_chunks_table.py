@@ -0,0 +1,34 @@
+"""add job_file_chunks table (archivos de trabajos en la BD, no en disco)
+
+Revision ID: a3u4v5w6x7y8
+Revises: z2t3u4v5w6x7
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'a3u4v5w6x7y8'
+down_revision = 'z2t3u4v5w6x7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'job_file_chunks',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('file_key', sa.String(), nullable=False),
+        sa.Column('seq', sa.Integer(), nullable=False),
+        sa.Column('size', sa.Integer(), nullable=False),
+        sa.Column('data', sa.LargeBinary(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_job_file_chunks_file_key', 'job_file_chunks', ['file_key'])
+
+
+def downgrade():
+    op.drop_index('ix_job_file_chunks_file_key', table_name='job_file_chunks')
+    op.drop_table('job_file_chunks')
@@ -0,0 +1,31 @@
+"""add cost_updated_at / catalog_updated_at to materials (huellas sin movimientos de stock)
+
+Revision ID: b4v5w6x7y8z9
+Revises: a3u4v5w6x7y8
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'b4v5w6x7y8z9'
+down_revision = 'a3u4v5w6x7y8'
+branch_labels = None
+depends_on = None
+
+COLUMNS = ('cost_updated_at', 'catalog_updated_at')
+
+
+def upgrade():
+    for column in COLUMNS:
+        op.add_column('materials', sa.Column(column, sa.DateTime(), nullable=True))
+        # Renglones existentes: se parte de updated_at, así el primer ?since= no pierde nada
+        op.execute(f"UPDATE materials SET {column} = COALESCE(updated_at, CURRENT_TIMESTAMP)")
+        op.create_index(f'ix_materials_{column}', 'materials', [column])
+
+
+def downgrade():
+    for column in reversed(COLUMNS):
+        op.drop_index(f'ix_materials_{column}', table_name='materials')
+        op.drop_column('materials', column)
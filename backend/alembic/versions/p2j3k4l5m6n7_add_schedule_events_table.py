@@ -0,0 +1,57 @@
+"""add schedule_events table (proyección indexada del calendario)
+
+Revision ID: p2j3k4l5m6n7
+Revises: o1i2j3k4l5m6
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'p2j3k4l5m6n7'
+down_revision = 'o1i2j3k4l5m6'
+branch_labels = None
+depends_on = None
+
+
+LANES = (
+    ('PM', 'scheduled_prod_mdf'),
+    ('PP', 'scheduled_prod_stone'),
+    ('IM', 'scheduled_inst_mdf'),
+    ('IP', 'scheduled_inst_stone'),
+)
+
+
+def upgrade():
+    op.create_table(
+        'schedule_events',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('instance_id', sa.Integer(), nullable=False),
+        sa.Column('lane', sa.String(), nullable=False),
+        sa.Column('scheduled_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ['instance_id'], ['sales_order_item_instances.id'],
+            name='fk_schedule_events_instance_id', ondelete='CASCADE',
+        ),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_schedule_events_instance_id', 'schedule_events', ['instance_id'], unique=False)
+    op.create_index('ix_schedule_events_scheduled_at_lane', 'schedule_events', ['scheduled_at', 'lane', 'instance_id'], unique=False)
+    op.create_index('ux_schedule_events_instance_lane', 'schedule_events', ['instance_id', 'lane'], unique=True)
+
+    # Backfill: una píldora por carril con fecha
+    for lane, column in LANES:
+        op.execute(f"""
+            INSERT INTO schedule_events (instance_id, lane, scheduled_at)
+            SELECT id, '{lane}', {column}
+            FROM sales_order_item_instances
+            WHERE {column} IS NOT NULL
+        """)
+
+
+def downgrade():
+    op.drop_index('ux_schedule_events_instance_lane', table_name='schedule_events')
+    op.drop_index('ix_schedule_events_scheduled_at_lane', table_name='schedule_events')
+    op.drop_index('ix_schedule_events_instance_id', table_name='schedule_events')
+    op.drop_table('schedule_events')
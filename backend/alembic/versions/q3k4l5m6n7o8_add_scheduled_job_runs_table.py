@@ -0,0 +1,34 @@
+"""add scheduled_job_runs table (bitácora de tareas programadas)
+
+Revision ID: q3k4l5m6n7o8
+Revises: p2j3k4l5m6n7
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'q3k4l5m6n7o8'
+down_revision = 'p2j3k4l5m6n7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'scheduled_job_runs',
+        sa.Column('job_name', sa.String(), nullable=False),
+        sa.Column('last_started_at', sa.DateTime(), nullable=True),
+        sa.Column('last_finished_at', sa.DateTime(), nullable=True),
+        sa.Column('last_status', sa.String(), nullable=True),
+        sa.Column('last_result', sa.Integer(), nullable=True),
+        sa.Column('last_error', sa.String(), nullable=True),
+        sa.Column('last_trigger', sa.String(), nullable=True),
+        sa.Column('run_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.PrimaryKeyConstraint('job_name'),
+    )
+
+
+def downgrade():
+    op.drop_table('scheduled_job_runs')
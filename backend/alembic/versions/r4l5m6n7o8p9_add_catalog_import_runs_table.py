@@ -0,0 +1,51 @@
+"""add catalog_import_runs table (importaciones CSV reanudables)
+
+Revision ID: r4l5m6n7o8p9
+Revises: q3k4l5m6n7o8
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'r4l5m6n7o8p9'
+down_revision = 'q3k4l5m6n7o8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'catalog_import_runs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('entity', sa.String(), nullable=False),
+        sa.Column('filename', sa.String(), nullable=True),
+        sa.Column('file_sha256', sa.String(), nullable=False),
+        sa.Column('file_size', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('status', sa.String(), nullable=False, server_default='RUNNING'),
+        sa.Column('rows_committed', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('bytes_processed', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('chunks_committed', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('processed', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('created', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('updated', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('skipped', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('error_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('errors', sa.JSON(), nullable=True),
+        sa.Column('last_error', sa.String(), nullable=True),
+        sa.Column('created_by_user_id', sa.Integer(), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['created_by_user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_catalog_import_runs_entity', 'catalog_import_runs', ['entity'])
+    op.create_index('ix_catalog_import_runs_file_sha256', 'catalog_import_runs', ['file_sha256'])
+
+
+def downgrade():
+    op.drop_index('ix_catalog_import_runs_file_sha256', table_name='catalog_import_runs')
+    op.drop_index('ix_catalog_import_runs_entity', table_name='catalog_import_runs')
+    op.drop_table('catalog_import_runs')
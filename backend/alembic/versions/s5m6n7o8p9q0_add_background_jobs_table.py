@@ -0,0 +1,51 @@
+"""add background_jobs table (cola persistente de trabajos)
+
+Revision ID: s5m6n7o8p9q0
+Revises: r4l5m6n7o8p9
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 's5m6n7o8p9q0'
+down_revision = 'r4l5m6n7o8p9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'background_jobs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False, server_default='QUEUED'),
+        sa.Column('payload', sa.JSON(), nullable=True),
+        sa.Column('result', sa.JSON(), nullable=True),
+        sa.Column('error', sa.String(), nullable=True),
+        sa.Column('progress', sa.Float(), nullable=False, server_default='0'),
+        sa.Column('progress_message', sa.String(), nullable=True),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('max_attempts', sa.Integer(), nullable=False, server_default='3'),
+        sa.Column('run_after', sa.DateTime(), nullable=False),
+        sa.Column('cancel_requested', sa.Boolean(), nullable=False, server_default=sa.false()),
+        sa.Column('locked_by', sa.String(), nullable=True),
+        sa.Column('heartbeat_at', sa.DateTime(), nullable=True),
+        sa.Column('created_by_user_id', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['created_by_user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_background_jobs_kind', 'background_jobs', ['kind'])
+    op.create_index('ix_background_jobs_status', 'background_jobs', ['status'])
+    op.create_index('ix_background_jobs_run_after', 'background_jobs', ['run_after'])
+
+
+def downgrade():
+    op.drop_index('ix_background_jobs_run_after', table_name='background_jobs')
+    op.drop_index('ix_background_jobs_status', table_name='background_jobs')
+    op.drop_index('ix_background_jobs_kind', table_name='background_jobs')
+    op.drop_table('background_jobs')
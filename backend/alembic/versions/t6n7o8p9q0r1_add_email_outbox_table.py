@@ -0,0 +1,58 @@
+"""add email_outbox table (bandeja de salida de correo)
+
+Revision ID: t6n7o8p9q0r1
+Revises: s5m6n7o8p9q0
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 't6n7o8p9q0r1'
+down_revision = 's5m6n7o8p9q0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'email_outbox',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('tracking_id', sa.String(), nullable=False),
+        sa.Column('kind', sa.String(), nullable=False, server_default='GENERIC'),
+        sa.Column('purchase_order_id', sa.Integer(), nullable=True),
+        sa.Column('sender_name', sa.String(), nullable=False),
+        sa.Column('sender_email', sa.String(), nullable=False),
+        sa.Column('to_email', sa.String(), nullable=False),
+        sa.Column('cc', sa.JSON(), nullable=True),
+        sa.Column('subject', sa.String(), nullable=False),
+        sa.Column('text_content', sa.String(), nullable=False),
+        sa.Column('attachment_name', sa.String(), nullable=True),
+        sa.Column('attachment_content', sa.LargeBinary(), nullable=True),
+        sa.Column('status', sa.String(), nullable=False, server_default='QUEUED'),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('max_attempts', sa.Integer(), nullable=False, server_default='5'),
+        sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+        sa.Column('last_error', sa.String(), nullable=True),
+        sa.Column('provider_message_id', sa.String(), nullable=True),
+        sa.Column('created_by_user_id', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('claimed_at', sa.DateTime(), nullable=True),
+        sa.Column('sent_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['purchase_order_id'], ['purchase_orders.id']),
+        sa.ForeignKeyConstraint(['created_by_user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_email_outbox_tracking_id', 'email_outbox', ['tracking_id'], unique=True)
+    op.create_index('ix_email_outbox_purchase_order_id', 'email_outbox', ['purchase_order_id'])
+    op.create_index('ix_email_outbox_status', 'email_outbox', ['status'])
+    op.create_index('ix_email_outbox_next_attempt_at', 'email_outbox', ['next_attempt_at'])
+
+
+def downgrade():
+    op.drop_index('ix_email_outbox_next_attempt_at', table_name='email_outbox')
+    op.drop_index('ix_email_outbox_status', table_name='email_outbox')
+    op.drop_index('ix_email_outbox_purchase_order_id', table_name='email_outbox')
+    op.drop_index('ix_email_outbox_tracking_id', table_name='email_outbox')
+    op.drop_table('email_outbox')
@@ -0,0 +1,29 @@
+"""add claim/lease fields to print_jobs (despacho a agentes de impresión)
+
+Revision ID: u7o8p9q0r1s2
+Revises: t6n7o8p9q0r1
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'u7o8p9q0r1s2'
+down_revision = 't6n7o8p9q0r1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('print_jobs', sa.Column('claimed_by', sa.String(), nullable=True))
+    op.add_column('print_jobs', sa.Column('claimed_at', sa.DateTime(), nullable=True))
+    op.add_column('print_jobs', sa.Column('lease_expires_at', sa.DateTime(), nullable=True))
+    op.add_column('print_jobs', sa.Column('claim_count', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    op.drop_column('print_jobs', 'claim_count')
+    op.drop_column('print_jobs', 'lease_expires_at')
+    op.drop_column('print_jobs', 'claimed_at')
+    op.drop_column('print_jobs', 'claimed_by')
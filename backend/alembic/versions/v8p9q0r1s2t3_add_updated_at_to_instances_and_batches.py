@@ -0,0 +1,29 @@
+"""add updated_at to sales_order_item_instances and production_batches
+
+Revision ID: v8p9q0r1s2t3
+Revises: u7o8p9q0r1s2
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'v8p9q0r1s2t3'
+down_revision = 'u7o8p9q0r1s2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('sales_order_item_instances', 'production_batches'):
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+        # Renglones existentes: "modificados" al migrar, así el primer ?since= no pierde nada
+        op.execute(f"UPDATE {table} SET updated_at = CURRENT_TIMESTAMP")
+        op.create_index(f'ix_{table}_updated_at', table, ['updated_at'])
+
+
+def downgrade():
+    for table in ('production_batches', 'sales_order_item_instances'):
+        op.drop_index(f'ix_{table}_updated_at', table_name=table)
+        op.drop_column(table, 'updated_at')
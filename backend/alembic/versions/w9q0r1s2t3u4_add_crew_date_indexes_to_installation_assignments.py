@@ -0,0 +1,30 @@
+"""add crew/date indexes to installation_assignments
+
+Revision ID: w9q0r1s2t3u4
+Revises: v8p9q0r1s2t3
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+
+
+revision = 'w9q0r1s2t3u4'
+down_revision = 'v8p9q0r1s2t3'
+branch_labels = None
+depends_on = None
+
+CREW_COLUMNS = ('leader', 'helper_1', 'helper_2')
+
+
+def upgrade():
+    for crew in CREW_COLUMNS:
+        op.create_index(
+            f'ix_installation_assignments_{crew}_date',
+            'installation_assignments',
+            [f'{crew}_user_id', 'assignment_date'],
+        )
+
+
+def downgrade():
+    for crew in reversed(CREW_COLUMNS):
+        op.drop_index(f'ix_installation_assignments_{crew}_date', table_name='installation_assignments')
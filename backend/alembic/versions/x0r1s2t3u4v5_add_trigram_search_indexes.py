@@ -0,0 +1,49 @@
+"""add trigram search indexes (pg_trgm)
+
+Revision ID: x0r1s2t3u4v5
+Revises: w9q0r1s2t3u4
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+
+
+revision = 'x0r1s2t3u4v5'
+down_revision = 'w9q0r1s2t3u4'
+branch_labels = None
+depends_on = None
+
+# (tabla, columna) que consulta app/services/search_index.py
+SEARCH_COLUMNS = (
+    ('sales_orders', 'project_name'),
+    ('clients_v2', 'full_name'),
+    ('sales_order_item_instances', 'custom_name'),
+    ('sales_order_item_instances', 'street'),
+    ('sales_order_item_instances', 'lot'),
+    ('purchase_orders', 'folio'),
+    ('providers', 'business_name'),
+    ('materials', 'sku'),
+    ('materials', 'name'),
+)
+
+
+def upgrade():
+    # SQLite (desarrollo) usa la tabla FTS5 que arma el propio servicio
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table, column in SEARCH_COLUMNS:
+        op.create_index(
+            f'ix_{table}_{column}_trgm',
+            table,
+            [column],
+            postgresql_using='gin',
+            postgresql_ops={column: 'gin_trgm_ops'},
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table, column in reversed(SEARCH_COLUMNS):
+        op.drop_index(f'ix_{table}_{column}_trgm', table_name=table)
@@ -0,0 +1,44 @@
+"""add field_sync_operations table (sincronización offline de iPads)
+
+Revision ID: y1s2t3u4v5w6
+Revises: x0r1s2t3u4v5
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'y1s2t3u4v5w6'
+down_revision = 'x0r1s2t3u4v5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'field_sync_operations',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('op_id', sa.String(), nullable=False),
+        sa.Column('device_id', sa.String(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('op_type', sa.String(), nullable=False),
+        sa.Column('assignment_id', sa.Integer(), nullable=True),
+        sa.Column('instance_id', sa.Integer(), nullable=True),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('result', sa.JSON(), nullable=True),
+        sa.Column('recorded_at', sa.DateTime(), nullable=True),
+        sa.Column('applied_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_field_sync_operations_op_id', 'field_sync_operations', ['op_id'], unique=True)
+    op.create_index('ix_field_sync_operations_device_id', 'field_sync_operations', ['device_id'])
+    op.create_index('ix_field_sync_operations_user_id', 'field_sync_operations', ['user_id'])
+
+
+def downgrade():
+    op.drop_index('ix_field_sync_operations_user_id', table_name='field_sync_operations')
+    op.drop_index('ix_field_sync_operations_device_id', table_name='field_sync_operations')
+    op.drop_index('ix_field_sync_operations_op_id', table_name='field_sync_operations')
+    op.drop_table('field_sync_operations')
@@ -0,0 +1,41 @@
+"""add updated_at to the tables behind the heavy read endpoints (ETag / ?since=)
+
+Revision ID: z2t3u4v5w6x7
+Revises: y1s2t3u4v5w6
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'z2t3u4v5w6x7'
+down_revision = 'y1s2t3u4v5w6'
+branch_labels = None
+depends_on = None
+
+TABLES = (
+    'sales_orders',
+    'sales_order_items',
+    'customer_payments',
+    'clients_v2',
+    'design_product_masters',
+    'design_product_versions',
+    'design_version_components',
+    'materials',
+    'schedule_events',
+)
+
+
+def upgrade():
+    for table in TABLES:
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+        # Renglones existentes: "modificados" al migrar, así el primer ?since= no pierde nada
+        op.execute(f"UPDATE {table} SET updated_at = CURRENT_TIMESTAMP")
+        op.create_index(f'ix_{table}_updated_at', table, ['updated_at'])
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        op.drop_index(f'ix_{table}_updated_at', table_name=table)
+        op.drop_column(table, 'updated_at')
@@ -4,6 +4,8 @@ from app.api.v1.endpoints import foundations, auth, users, design, sales, invent
 from app.api.v1.endpoints import finance
 from app.api.v1.endpoints import planning
 from app.api.v1.endpoints import petty_cash
+from app.api.v1.endpoints import jobs
+from app.api.v1.endpoints import search
 
 api_router = APIRouter()
 
@@ -36,4 +38,10 @@ api_router.include_router(treasury.router, prefix="/treasury", tags=["Treasury"]
 api_router.include_router(planning.router, prefix="/planning", tags=["planning"])
 
 # --- CAJA CHICA ---
-api_router.include_router(petty_cash.router, prefix="/petty-cash", tags=["Petty Cash"])
\ No newline at end of file
+api_router.include_router(petty_cash.router, prefix="/petty-cash", tags=["Petty Cash"])
+
+# --- TRABAJOS EN SEGUNDO PLANO ---
+api_router.include_router(jobs.router, prefix="/jobs", tags=["jobs"])
+
+# --- BÚSQUEDA UNIFICADA ---
+api_router.include_router(search.router, prefix="/search", tags=["search"])
@@ -1,5 +1,6 @@
 from typing import Any
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlmodel import Session
 
@@ -16,7 +17,7 @@ from app.schemas.auth_schema import Token
 router = APIRouter()
 
 @router.post("/login", response_model=Token)
-def login_access_token(
+async def login_access_token(
     db: Session = Depends(get_session), 
     form_data: OAuth2PasswordRequestForm = Depends()
 ) -> Any:
@@ -24,10 +25,18 @@ def login_access_token(
     OAuth2 compatible token login, get an access token for future requests
     """
     # Buscar usuario
-    user = db.query(User).filter(User.email == form_data.username).first()
+    user = await run_in_threadpool(lambda: db.query(User).filter(User.email == form_data.username).first())
     
-    # Validar
-    if not user or not security.verify_password(form_data.password, user.hashed_password):
+    # Validar (bcrypt en su pool dedicado, ver security.verify_password_async)
+    try:
+        valid = bool(user) and await security.verify_password_async(form_data.password, user.hashed_password)
+    except security.PasswordHasherBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many concurrent logins, retry shortly",
+            headers={"Retry-After": "2"},
+        )
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -1,8 +1,8 @@
-from typing import List, Any, Dict, Optional
+from typing import List, Any, Optional, Union
 import math
 import time
 import uuid as uuid_lib
-from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, UploadFile, File
 from sqlalchemy import or_
 from sqlalchemy.orm import selectinload
 from sqlmodel import Session, select
@@ -22,7 +22,6 @@ from app.models.design import (
     ProductMaster, ProductVersion, VersionComponent, VersionStatus
 )
 from app.models.material import Material, ProductionRoute
-from app.models.foundations import Client
 from app.models.production import ProductionBatch, ProductionBatchStatus, PrintJob
 from app.models.sales import (
     InstanceStatus,
@@ -32,12 +31,17 @@ from app.models.sales import (
 )
 from app.services.cloud_storage import upload_to_gcs
 from app.services.label_printer import generate_all_labels, concatenate_zpl
-from app.services.planning_service import compute_semaphore
+from app.services.print_dispatch import notify_print_jobs
+from app.services import change_tracking, recipe_index
+from app.services.instance_context import resolve_instance_context, resolve_instance_contexts
+from app.services.batch_simulator import (
+    BatchSimulator, FeasibilityPlanner, load_pending_instances,
+)
 from datetime import datetime
 
 # Schemas
 from app.schemas.design_schema import (
-    ProductMasterCreate, ProductMasterRead,
+    ProductMasterCreate, ProductMasterRead, ProductMasterDelta,
     ProductVersionCreate, ProductVersionRead
 )
 
@@ -48,10 +52,6 @@ router = APIRouter()
 # -----------------------------------------------------------------------------
 BUCKET_NAME = "valentina-erp-v3-assets" 
 
-# Categorías que tienen poder de bloqueo según el proceso de fabricación
-CRITICAL_CATEGORIES_MDF = ["MDF", "TABLERO", "MELAMINA", "MADERA", "ENCHAPADO"]
-CRITICAL_CATEGORIES_PIEDRA = ["PIEDRA", "GRANITO", "CUARZO", "MARMOL", "SUPERFICIE"]
-
 # ==========================================
 # 1. GESTIÓN DE MAESTROS (Familia del Producto)
 # ==========================================
@@ -70,10 +70,18 @@ def create_product_master(
     session.refresh(master)
     return master
 
-@router.get("/masters", response_model=List[ProductMasterRead])
+# Todo lo que entra en el listado de diseños (huella del ETag). De Material sólo
+# se leen costo y factor: su huella es cost_updated_at, no la de existencias.
+MASTER_LIST_TABLES = (ProductMaster, ProductVersion, VersionComponent, Material.cost_updated_at)
+
+
+@router.get("/masters", response_model=Union[List[ProductMasterRead], ProductMasterDelta])
 def read_product_masters(
+    request: Request,
+    response: Response,
     client_id: int | None = None,
     only_ready: bool = Query(False),
+    since: Optional[datetime] = None,
     session: Session = Depends(get_session),
     current_user: User = Depends(get_current_active_user)
 ):
@@ -82,7 +90,18 @@ def read_product_masters(
     Lógica de permisos:
     - VENTAS (SALES): Solo ve productos 'READY' (Listos para venta).
     - DIRECTOR, ADMIN, DISEÑO: Ven TODO (Borradores y Listos).
+
+    Responde 304 si el cliente ya tiene esta versión (If-None-Match).
+    Con `since` (el server_time de la respuesta anterior) regresa sólo los diseños que
+    cambiaron ellos, sus versiones, sus componentes o el costo de los materiales de sus recetas,
+    más los ids vigentes del listado.
     """
+    cached = change_tracking.not_modified(request, response, session, MASTER_LIST_TABLES, current_user)
+    if cached:
+        return cached
+    server_time = datetime.utcnow()
+    response.headers["X-Server-Time"] = server_time.isoformat()
+
     query = select(ProductMaster).where(ProductMaster.is_active == True)
     
     if client_id:
@@ -96,6 +115,25 @@ def read_product_masters(
         query = query.join(ProductVersion).where(
             ProductVersion.status == VersionStatus.READY
         ).distinct()
+
+    current_ids = None
+    if since is not None:
+        cutoff = change_tracking.since_cutoff(since)
+        current_ids = list(session.exec(query.with_only_columns(ProductMaster.id)).all())
+        changed_versions = (
+            select(ProductVersion.master_id)
+            .outerjoin(VersionComponent, VersionComponent.version_id == ProductVersion.id)
+            .outerjoin(Material, Material.id == VersionComponent.material_id)
+            .where(or_(
+                ProductVersion.updated_at > cutoff,
+                VersionComponent.updated_at > cutoff,
+                Material.cost_updated_at > cutoff,
+            ))
+        )
+        query = query.where(or_(
+            ProductMaster.updated_at > cutoff,
+            ProductMaster.id.in_(changed_versions),
+        ))
     
     query = query.options(
         selectinload(ProductMaster.versions).selectinload(ProductVersion.components)
@@ -136,7 +174,9 @@ def read_product_masters(
             m_dict['versions'].append(v_dict)
         result.append(m_dict)
 
-    return result
+    if since is None:
+        return result
+    return {"server_time": server_time, "since": since, "items": result, "ids": current_ids}
 
 @router.get("/masters/{master_id}", response_model=ProductMasterRead)
 def read_product_master_detail(
@@ -196,6 +236,7 @@ def delete_product_master(
     versions = session.exec(
         select(ProductVersion).where(ProductVersion.master_id == master_id)
     ).all()
+    version_ids = [version.id for version in versions]
 
     for version in versions:
         components = session.exec(
@@ -209,6 +250,7 @@ def delete_product_master(
     session.delete(master)
     
     session.commit()
+    recipe_index.invalidate_recipe_index(version_ids)
     return {"ok": True, "message": "Producto y archivos eliminados correctamente."}
 
 # ==========================================
@@ -336,6 +378,7 @@ def create_product_version(
     session.add(db_version)
     session.commit()
     session.refresh(db_version)
+    recipe_index.invalidate_recipe_index([db_version.id])
     
     return db_version
 
@@ -390,10 +433,13 @@ def update_product_version(
         .where(VersionComponent.version_id == db_version.id)
     ).all()
     _update_version_flags(db_version, all_comps, session)
+    # Los componentes se reemplazan completos: marcar la versión aunque sus columnas no cambien (?since=)
+    db_version.updated_at = datetime.utcnow()
     session.add(db_version)
 
     session.commit()
     session.refresh(db_version)
+    recipe_index.invalidate_recipe_index([db_version.id])
     return db_version
 
 @router.get("/versions/{version_id}", response_model=ProductVersionRead)
@@ -512,7 +558,13 @@ def delete_product_version(
     # Nota: SQLAlchemy automáticamente borrará los VersionComponent asociados 
     # gracias a sa_relationship_kwargs={"cascade": "all, delete-orphan"}
     session.delete(version)
+    # El maestro pierde una versión: marcarlo para que ?since= lo vuelva a mandar
+    master = session.get(ProductMaster, version.master_id)
+    if master:
+        master.updated_at = datetime.utcnow()
+        session.add(master)
     session.commit()
+    recipe_index.invalidate_recipe_index([version_id])
     
     return {"ok": True, "message": "Versión y sus ingredientes eliminados correctamente."}
 
@@ -627,103 +679,89 @@ def simulate_batch(
     if not request.instance_ids:
         raise HTTPException(status_code=400, detail="Debe seleccionar al menos una instancia.")
 
-    # 1. Diccionario para acumular las cantidades requeridas
-    # Formato: { material_id: required_qty }
-    aggregated_bom: Dict[int, float] = {}
+    result = BatchSimulator.simulate(session, request.instance_ids, request.batch_type)
+    return SimulateBatchResponse(
+        suggested_status=result["suggested_status"],
+        materials=[SimulatedMaterial(**m) for m in result["materials"]],
+    )
 
-    # 2. Rastrear instancias y sumar recetas
-    for instance_id in request.instance_ids:
-        instance = session.exec(select(SalesOrderItemInstance).where(SalesOrderItemInstance.id == instance_id)).first()
-        if not instance:
-            continue
-            
-        item = session.exec(select(SalesOrderItem).where(SalesOrderItem.id == instance.sales_order_item_id)).first()
-        if not item or not item.origin_version_id:
-            continue
 
-        components = session.exec(
-            select(VersionComponent).where(VersionComponent.version_id == item.origin_version_id)
-        ).all()
+class BatchCandidate(BaseModel):
+    label: str
+    instance_ids: List[int]
 
-        for comp in components:
-            material = session.exec(
-                select(Material).where(Material.id == comp.material_id)
-            ).first()
-            cat_material = (material.category or "").upper() if material else ""
-            # PROCESO nunca es inventariable
-            if cat_material == "PROCESO":
-                continue
-            if request.batch_type.upper() == "MDF":
-                # En lote MDF, saltar materiales de piedra
-                if cat_material == "PIEDRA":
-                    continue
-            elif request.batch_type.upper() == "PIEDRA":
-                # En lote PIEDRA, incluir SOLO materiales de piedra
-                if cat_material != "PIEDRA":
-                    continue
-            if comp.material_id in aggregated_bom:
-                aggregated_bom[comp.material_id] += comp.quantity
-            else:
-                aggregated_bom[comp.material_id] = comp.quantity
-
-    # 3. Cruzar la suma total contra Inventario Físico
-    simulated_materials = []
-    batch_is_blocked = False
-
-    for mat_id, req_qty in aggregated_bom.items():
-        material = session.exec(select(Material).where(Material.id == mat_id)).first()
-        if not material:
-            continue
+class SimulateBatchesRequest(BaseModel):
+    batch_type: str  # "MDF" o "PIEDRA"
+    candidates: List[BatchCandidate]
+
+class SimulatedCandidate(SimulateBatchResponse):
+    label: str
+    instance_count: int
+    resolved_instances: int       # Instancias con receta (las demás no suman BOM)
+    blocking_materials: int       # Faltantes RED
+    shortage_materials: int       # Faltantes RED + YELLOW
+    total_shortage_qty: float     # Suma de (requerido - disponible) en faltantes
+
+class SimulateBatchesResponse(BaseModel):
+    candidates: List[SimulatedCandidate]
+    recommended_label: Optional[str] = None  # Candidato liberable con menos faltantes
+
+@router.post("/simulate_batches", response_model=SimulateBatchesResponse)
+def simulate_batches(
+    request: SimulateBatchesRequest,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Simula varios lotes candidatos en un solo request y los compara.
+    Cada candidato se evalúa contra las mismas existencias (no compiten entre sí).
+    """
+    if not request.candidates:
+        raise HTTPException(status_code=400, detail="Debe enviar al menos un lote candidato.")
+    labels = [c.label for c in request.candidates]
+    if len(set(labels)) != len(labels):
+        raise HTTPException(status_code=400, detail="Las etiquetas de los candidatos deben ser únicas.")
+    if any(not c.instance_ids for c in request.candidates):
+        raise HTTPException(status_code=400, detail="Cada candidato debe tener al menos una instancia.")
+
+    results = BatchSimulator.simulate_many(
+        session,
+        {c.label: c.instance_ids for c in request.candidates},
+        request.batch_type,
+    )
 
-        available_qty = material.physical_stock - material.committed_stock
-        is_shortage = req_qty > available_qty
-        
-        is_blocking = False
-        status_color = "GREEN"
-
-        if is_shortage:
-            cat_upper = material.category.upper()
-            
-            # Aplicar Regla de Oro: Dependencia estricta solo para categorías núcleo del lote
-            if request.batch_type == "MDF" and any(c in cat_upper for c in CRITICAL_CATEGORIES_MDF):
-                is_blocking = True
-                batch_is_blocked = True
-                status_color = "RED"
-            elif request.batch_type == "PIEDRA" and any(c in cat_upper for c in CRITICAL_CATEGORIES_PIEDRA):
-                is_blocking = True
-                batch_is_blocked = True
-                status_color = "RED"
-            else:
-                status_color = "YELLOW" # Falta, pero permitimos negativos
-
-        simulated_materials.append(
-            SimulatedMaterial(
-                material_id=material.id,
-                sku=material.sku,
-                name=material.name,
-                category=material.category,
-                required_qty=round(req_qty, 2),
-                available_qty=round(available_qty, 2),
-                is_blocking=is_blocking,
-                status_color=status_color
-            )
-        )
+    candidates = []
+    for c in request.candidates:
+        result = results[c.label]
+        shortages = [m for m in result["materials"] if m["status_color"] != "GREEN"]
+        candidates.append(SimulatedCandidate(
+            label=c.label,
+            instance_count=len(set(c.instance_ids)),
+            resolved_instances=result["resolved_instances"],
+            suggested_status=result["suggested_status"],
+            materials=[SimulatedMaterial(**m) for m in result["materials"]],
+            blocking_materials=sum(1 for m in shortages if m["is_blocking"]),
+            shortage_materials=len(shortages),
+            total_shortage_qty=round(
+                sum(m["required_qty"] - m["available_qty"] for m in shortages), 2
+            ),
+        ))
 
-    suggested_status = (
-        ProductionBatchStatus.ON_HOLD.value
-        if batch_is_blocked
-        else ProductionBatchStatus.DRAFT.value
+    releasable = [c for c in candidates if c.suggested_status == ProductionBatchStatus.DRAFT.value]
+    recommended = min(
+        releasable,
+        key=lambda c: (c.shortage_materials, c.total_shortage_qty, -c.resolved_instances),
+        default=None,
     )
 
-    return SimulateBatchResponse(
-        suggested_status=suggested_status,
-        materials=simulated_materials
+    return SimulateBatchesResponse(
+        candidates=candidates,
+        recommended_label=recommended.label if recommended else None,
     )
 
 # ==========================================
 # 10. RADAR DE INSTANCIAS PENDIENTES (SIMULADOR)
 # ==========================================
-from app.models.sales import PaymentStatus, SalesOrderStatus as _SOStatus
 
 class PendingInstanceResponse(BaseModel):
     id: int
@@ -735,15 +773,6 @@ class PendingInstanceResponse(BaseModel):
     semaphore: Optional[str] = None
     schedule: Optional[dict] = None
 
-# Órdenes confirmadas = tienen anticipo pagado O su status ya avanzó a producción
-_CONFIRMED_ORDER_STATUSES = {
-    _SOStatus.WAITING_ADVANCE,
-    _SOStatus.SOLD,
-    _SOStatus.IN_PRODUCTION,
-    _SOStatus.FINISHED,
-    _SOStatus.COMPLETED,
-}
-
 @router.get("/pending_instances", response_model=List[PendingInstanceResponse])
 def get_pending_instances(
     batch_type: str = "MDF",
@@ -755,66 +784,17 @@ def get_pending_instances(
     Regla ampliada: incluye OVs con anticipo pagado (PARTIAL/PAID)
     O cuyo estatus de orden ya es WAITING_ADVANCE/SOLD/IN_PRODUCTION.
     """
-    if batch_type.upper() == "PIEDRA":
-        instances = session.exec(
-            select(SalesOrderItemInstance)
-            .where(SalesOrderItemInstance.stone_batch_id == None)
-            .where(SalesOrderItemInstance.is_cancelled == False)
-        ).all()
-    else:
-        instances = session.exec(
-            select(SalesOrderItemInstance)
-            .where(SalesOrderItemInstance.production_batch_id == None)
-            .where(SalesOrderItemInstance.is_cancelled == False)
-        ).all()
-
     result = []
-    for inst in instances:
-        item = session.exec(
-            select(SalesOrderItem).where(SalesOrderItem.id == inst.sales_order_item_id)
-        ).first()
-        if not item:
-            continue
-        order = session.exec(
-            select(SalesOrder).where(SalesOrder.id == item.sales_order_id)
-        ).first()
-        if not order:
-            continue
-
-        is_paid = order.payment_status in [PaymentStatus.PARTIAL, PaymentStatus.PAID]
-        is_confirmed_status = order.status in _CONFIRMED_ORDER_STATUSES
-
-        if not (is_paid or is_confirmed_status):
-            continue
-
-        version = (
-            session.get(ProductVersion, item.origin_version_id)
-            if item.origin_version_id
-            else None
-        )
-
-        if batch_type.upper() == "PIEDRA":
-            if version and not version.has_stone_components:
-                continue
-        else:
-            if version and not version.has_mdf_components:
-                continue
-
-        # Obtener nombre del cliente
-        client_name = None
-        if order and order.client_id:
-            client = session.get(Client, order.client_id)
-            if client:
-                client_name = client.full_name
-
+    for p in load_pending_instances(session, batch_type):
+        inst = p["instance"]
         result.append(PendingInstanceResponse(
             id=inst.id,
             custom_name=inst.custom_name,
-            product_name=item.product_name,
-            order_project_name=order.project_name,
-            order_id=order.id,
-            client_name=client_name,
-            semaphore=compute_semaphore(inst, datetime.utcnow(), session=session),
+            product_name=p["product_name"],
+            order_project_name=p["order_project_name"],
+            order_id=p["order_id"],
+            client_name=p["client_name"],
+            semaphore=p["semaphore"],
             schedule={
                 "PM": inst.scheduled_prod_mdf.isoformat() if inst.scheduled_prod_mdf else None,
                 "PP": inst.scheduled_prod_stone.isoformat() if inst.scheduled_prod_stone else None,
@@ -825,6 +805,21 @@ def get_pending_instances(
     return result
 
 
+@router.get("/feasibility_plan")
+def get_feasibility_plan(
+    batch_type: str = "MDF",
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_active_user),
+):
+    """
+    Planeador de factibilidad multi-lote.
+    Reparte las existencias disponibles (físico - comprometido) entre TODAS las
+    instancias pendientes del radar, por urgencia (semáforo → fecha de entrega),
+    e indica por instancia si puede liberarse y qué materiales la bloquean.
+    """
+    return FeasibilityPlanner.plan(session, batch_type)
+
+
 # ==========================================
 # 11. CENTRO DE IMPRESIÓN — SOLICITUDES DE ETIQUETAS
 # ==========================================
@@ -863,19 +858,13 @@ def list_label_requests(
         )
     ).all()
 
+    contexts = resolve_instance_contexts(session, instances)
     result: List[LabelRequestItem] = []
     for inst in instances:
-        item = session.exec(
-            select(SalesOrderItem).where(SalesOrderItem.id == inst.sales_order_item_id)
-        ).first()
-        if not item:
-            continue
-        order = session.exec(
-            select(SalesOrder).where(SalesOrder.id == item.sales_order_id)
-        ).first()
-        if not order:
+        ctx = contexts.get(inst.id)
+        if not ctx or not ctx.item or not ctx.order:
             continue
-        client = session.get(Client, order.client_id)
+        order, client = ctx.order, ctx.client
         is_stone = (inst.stone_pieces or 0) > 0
         result.append(
             LabelRequestItem(
@@ -927,15 +916,8 @@ def generate_labels(
         )
 
     # Subir la cadena para obtener cliente y proyecto
-    item = session.exec(
-        select(SalesOrderItem)
-        .where(SalesOrderItem.id == instance.sales_order_item_id)
-    ).first()
-    order = session.exec(
-        select(SalesOrder)
-        .where(SalesOrder.id == item.sales_order_id)
-    ).first() if item else None
-    client = session.get(Client, order.client_id) if order and order.client_id else None
+    ctx = resolve_instance_context(session, instance)
+    order, client = ctx.order, ctx.client
 
     # Usar QR existente o generar uno nuevo
     qr_uuid = instance.qr_code or str(uuid_lib.uuid4())
@@ -967,6 +949,7 @@ def generate_labels(
             created_by_user_id=current_user.id,
         ))
     session.commit()
+    notify_print_jobs()
 
     return GenerateLabelsResponse(
         instance_id=instance_id,
@@ -1005,15 +988,8 @@ def generate_labels_pdf(
                    "Declara los bultos desde Producción primero.",
         )
 
-    item = session.exec(
-        select(SalesOrderItem)
-        .where(SalesOrderItem.id == instance.sales_order_item_id)
-    ).first()
-    order = session.exec(
-        select(SalesOrder)
-        .where(SalesOrder.id == item.sales_order_id)
-    ).first() if item else None
-    client = session.get(Client, order.client_id) if order and order.client_id else None
+    ctx = resolve_instance_context(session, instance)
+    order, client = ctx.order, ctx.client
 
     qr_uuid = instance.qr_code or str(uuid_lib.uuid4())
     if not instance.qr_code:
@@ -1066,7 +1042,7 @@ def generate_stone_manifest(
     from fastapi.responses import StreamingResponse
     from app.services.pdf_generator import PDFGenerator
     from app.models.production import InstallationAssignment
-    from app.models.foundations import GlobalConfig
+    from app.services.config_cache import get_global_config
 
     instance = session.get(SalesOrderItemInstance, instance_id)
     if not instance:
@@ -1080,16 +1056,9 @@ def generate_stone_manifest(
         )
 
     # Subir cadena para obtener OV, cliente y proyecto
-    item = session.exec(
-        select(SalesOrderItem)
-        .where(SalesOrderItem.id == instance.sales_order_item_id)
-    ).first()
-    order = session.exec(
-        select(SalesOrder)
-        .where(SalesOrder.id == item.sales_order_id)
-    ).first() if item else None
-    client = session.get(Client, order.client_id) if order and order.client_id else None
-    order_folio = f"OV-{str(order.id).zfill(4)}" if order else "S/OV"
+    ctx = resolve_instance_context(session, instance)
+    order, client = ctx.order, ctx.client
+    order_folio = ctx.order_folio or "S/OV"
 
     # Obtener equipo instalador (asignación IP más reciente)
     assignment = session.exec(
@@ -1121,7 +1090,7 @@ def generate_stone_manifest(
         session.commit()
 
     # Obtener config de empresa
-    config = session.exec(select(GlobalConfig)).first()
+    config = get_global_config(session)
 
     # Generar PDF
     generator = PDFGenerator()
@@ -18,8 +18,9 @@ from app.models.finance import (
 )
 from app.models.foundations import Provider
 from app.models.treasury import BankAccount, BankTransaction, TransactionType
-from app.models.inventory import PurchaseOrder, InventoryTransaction
+from app.models.inventory import PurchaseOrder
 from app.models.material import Material
+from app.services.stock_mutation import StockMutation
 
 from app.schemas.finance_schema import (
     PaymentRequestCreate, 
@@ -782,20 +783,17 @@ def create_credit_note(
     returned_detail = []
     if data.credit_type == CreditNoteType.RETURN and return_lines:
         session.flush()  # para obtener nc.id
+        # Baja de stock con incremento atómico y Kárdex negativo (el current_cost NO se toca)
+        mutation = StockMutation(session)
         for material, qty, unit_cost in return_lines:
-            # Bajar stock físico
-            material.physical_stock = float(material.physical_stock or 0) - qty
-            session.add(material)
-            # Kárdex negativo (el current_cost NO se toca)
-            mov = InventoryTransaction(
-                material_id=material.id,
-                quantity=-qty,
+            mutation.add(
+                material.id,
+                -qty,
+                "CREDIT_NOTE_RETURN",
                 unit_cost=unit_cost,
                 subtotal=round(-qty * unit_cost, 2),
-                transaction_type="CREDIT_NOTE_RETURN",
                 created_at=datetime.utcnow(),
             )
-            session.add(mov)
             # Guardar la línea de la NC
             nc_item = CreditNoteItem(
                 credit_note_id=nc.id,
@@ -811,6 +809,15 @@ def create_credit_note(
                 "unit_cost": unit_cost,
                 "line_total": round(qty * unit_cost, 2),
             })
+        # La validación de arriba leyó sin bloqueo: se repite contra el valor ya aplicado
+        for material_id, values in mutation.apply().items():
+            if values["physical_stock"] < 0:
+                session.rollback()
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"No hay stock suficiente del material {material_id} para la devolución "
+                           f"(otro movimiento lo bajó a {values['previous_physical_stock']}).",
+                )
 
     # --- Ajuste automatico de costo (PRICE_ADJUSTMENT, 1 partida, costo vigente coincide) ---
     costo_msg = None
@@ -822,7 +829,13 @@ def create_credit_note(
         ).all()
         if len(items) == 1:
             part = items[0]
-            material = session.get(Material, part.material_id) if part.material_id else None
+            # Fila bloqueada: el costo vigente se compara y se ajusta sin que otro lo cambie en medio
+            material = session.exec(
+                select(Material)
+                .where(Material.id == part.material_id)
+                .with_for_update()
+                .execution_options(populate_existing=True)
+            ).first() if part.material_id else None
             qty = float(part.quantity_received or 0)
             if material and qty > 0:
                 cur = round(float(material.current_cost or 0), 2)
@@ -831,8 +844,7 @@ def create_credit_note(
                     nc.previous_material_cost = material.current_cost
                     ajuste_unit = subtotal / qty
                     nuevo_costo = round(float(material.current_cost) - ajuste_unit, 2)
-                    material.current_cost = nuevo_costo
-                    session.add(material)
+                    StockMutation(session).set_cost(material.id, nuevo_costo).apply()
                     costo_msg = f"Costo del material ajustado de ${punit:,.2f} a ${nuevo_costo:,.2f}"
                 else:
                     costo_msg = f"Costo NO ajustado: el costo vigente (${cur:,.2f}) no corresponde a esta factura (${punit:,.2f}). Ajusta manualmente."
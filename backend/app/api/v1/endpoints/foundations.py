@@ -1,6 +1,3 @@
-import csv
-import io
-import math
 from datetime import datetime
 from uuid import uuid4  # <--- AGREGADO PARA NOMBRES ÚNICOS
 from typing import List, Optional
@@ -12,12 +9,18 @@ from sqlalchemy.exc import IntegrityError
 from app.core.database import get_session
 from app.core.deps import CurrentUser, SessionDep
 from app.services.cloud_storage import upload_to_gcs  # <--- LA TUBERÍA BLINDADA
-from app.services.inventory_manager import registrar_movimiento_inventario, calcular_saldo_a_fecha
+from app.services.inventory_manager import calcular_saldo_a_fecha, sembrar_saldo_apertura
+from app.services.stock_mutation import StockMutation
+from app.services.kardex_replay import KardexReplay
+from app.services.catalog_import import CatalogImporter, CatalogImportError
+from app.services.job_runner import enqueue, store_job_file
+from app.services import config_cache, recipe_index
 
 # --- MODELOS ---
 from app.models.foundations import GlobalConfig, Provider, Client, TaxRate
-from app.models.material import Material
+from app.models.material import STAMP_FIELDS, Material
 from app.models.inventory import InventoryTransaction
+from app.models.jobs import CatalogImportRun
 
 router = APIRouter()
 
@@ -26,7 +29,7 @@ router = APIRouter()
 # ==========================================
 @router.get("/config", response_model=GlobalConfig)
 def get_global_config(current_user: CurrentUser, session: Session = Depends(get_session)):
-    config = session.exec(select(GlobalConfig)).first()
+    config = config_cache.get_global_config(session)
     if not config:
         default_config = GlobalConfig(
             company_name="Mi Empresa SGP",
@@ -40,6 +43,7 @@ def get_global_config(current_user: CurrentUser, session: Session = Depends(get_
         session.add(default_config)
         session.commit()
         session.refresh(default_config)
+        config_cache.invalidate_config_cache()
         return default_config
     return config
 
@@ -48,25 +52,9 @@ def get_logo_base64(session: Session = Depends(get_session)):
     """
     Descarga el logo de la empresa desde GCS y lo devuelve como base64.
     Evita el problema de CORS al cargar imágenes desde el frontend para canvas/PDF.
+    La descarga se guarda en config_cache hasta que cambie el logo.
     """
-    import base64
-    import urllib.request
-
-    config = session.exec(select(GlobalConfig)).first()
-    if not config or not config.logo_path:
-        return {"base64": None, "content_type": None}
-
-    try:
-        with urllib.request.urlopen(config.logo_path, timeout=5) as response:
-            image_data = response.read()
-            content_type = response.headers.get('Content-Type', 'image/png')
-            encoded = base64.b64encode(image_data).decode('utf-8')
-            return {
-                "base64": f"data:{content_type};base64,{encoded}",
-                "content_type": content_type,
-            }
-    except Exception:
-        return {"base64": None, "content_type": None}
+    return config_cache.get_logo_base64(session)
 
 
 @router.put("/config", response_model=GlobalConfig)
@@ -78,6 +66,7 @@ def update_global_config(config_in: GlobalConfig, session: Session = Depends(get
         session.add(db_config)
         session.commit()
         session.refresh(db_config)
+        config_cache.invalidate_config_cache()
         return db_config
     
     config_data = config_in.model_dump(exclude_unset=True)
@@ -94,6 +83,7 @@ def update_global_config(config_in: GlobalConfig, session: Session = Depends(get
     session.add(db_config)
     session.commit()
     session.refresh(db_config)
+    config_cache.invalidate_config_cache()
     return db_config
 
 # --- SUBIDA DE LOGO CORREGIDA (Igual que Design) ---
@@ -134,6 +124,7 @@ async def upload_company_logo(
     session.add(db_config)
     session.commit()
     session.refresh(db_config)
+    config_cache.invalidate_config_cache()
 
     return {"url": public_url, "message": "Logo actualizado exitosamente"}
 
@@ -179,76 +170,14 @@ def delete_provider(provider_id: int, session: Session = Depends(get_session)):
     return {"ok": True}
 
 @router.post("/providers/import-csv")
-async def import_providers_csv(
+def import_providers_csv(
+    current_user: CurrentUser,
     file: UploadFile = File(...),
+    background: bool = False,
     session: Session = Depends(get_session)
 ):
-    """Importación masiva de proveedores desde CSV."""
-    if not file.filename.endswith('.csv'):
-        raise HTTPException(status_code=400, detail="El archivo debe ser un CSV.")
-
-    content = await file.read()
-    try:
-        csv_string = content.decode('utf-8-sig')
-    except UnicodeDecodeError:
-        csv_string = content.decode('latin-1')
-
-    import csv as csv_module
-
-    sample = csv_string[:2048]
-    try:
-        dialect = csv_module.Sniffer().sniff(sample)
-        delimiter = dialect.delimiter
-    except Exception:
-        delimiter = ','
-
-    csv_reader = csv_module.DictReader(io.StringIO(csv_string), delimiter=delimiter)
-    summary = {"processed": 0, "created": 0, "updated": 0, "errors": []}
-
-    for row_idx, row in enumerate(csv_reader):
-        try:
-            clean = {k.strip().lower(): (v.strip() if v else '') for k, v in row.items() if k}
-            business_name = clean.get('business_name', '').strip()
-            if not business_name:
-                continue
-
-            credit_days = 0
-            try:
-                credit_days = int(clean.get('credit_days', 0) or 0)
-            except ValueError:
-                credit_days = 0
-
-            existing = session.exec(
-                select(Provider).where(Provider.business_name == business_name)
-            ).first()
-
-            data = {
-                "business_name": business_name,
-                "rfc_tax_id": clean.get('rfc_tax_id') or None,
-                "credit_days": credit_days,
-                "phone": clean.get('phone') or None,
-                "phone2": clean.get('phone2') or None,
-                "contact_name": clean.get('contact_name') or None,
-                "contact_cellphone": clean.get('contact_cellphone') or None,
-                "contact_email": clean.get('contact_email') or None,
-                "is_active": True,
-            }
-
-            if existing:
-                for k, v in data.items():
-                    setattr(existing, k, v)
-                summary["updated"] += 1
-            else:
-                session.add(Provider(**data))
-                summary["created"] += 1
-
-            summary["processed"] += 1
-
-        except Exception as e:
-            summary["errors"].append(f"Fila {row_idx + 2}: {str(e)}")
-
-    session.commit()
-    return summary
+    """Importación masiva de proveedores desde CSV (en flujo, reanudable)."""
+    return _run_catalog_import(session, "PROVIDERS", file, current_user.id, background)
 
 # ==========================================
 # 3. CLIENTES
@@ -328,93 +257,21 @@ def delete_client(client_id: int, session: Session = Depends(get_session)):
     return {"ok": True}
 
 @router.post("/clients/import-csv")
-async def import_clients_csv(
+def import_clients_csv(
+    current_user: CurrentUser,
     file: UploadFile = File(...),
+    background: bool = False,
     session: Session = Depends(get_session)
 ):
-    """Importación masiva de clientes desde CSV."""
-    if not file.filename.endswith('.csv'):
-        raise HTTPException(status_code=400, detail="El archivo debe ser un CSV.")
-
-    content = await file.read()
-    try:
-        csv_string = content.decode('utf-8-sig')
-    except UnicodeDecodeError:
-        csv_string = content.decode('latin-1')
-
-    import csv as csv_module
-
-    sample = csv_string[:2048]
-    try:
-        dialect = csv_module.Sniffer().sniff(sample)
-        delimiter = dialect.delimiter
-    except Exception:
-        delimiter = ','
-
-    csv_reader = csv_module.DictReader(io.StringIO(csv_string), delimiter=delimiter)
-    summary = {"processed": 0, "created": 0, "updated": 0, "errors": []}
-
-    for row_idx, row in enumerate(csv_reader):
-        try:
-            clean = {k.strip().lower(): (v.strip() if v else '') for k, v in row.items() if k}
-            full_name = clean.get('full_name', '').strip()
-            email = clean.get('email', '').strip()
-            phone = clean.get('phone', '').strip()
-            if not full_name or not email or not phone:
-                continue
-
-            existing = session.exec(
-                select(Client).where(Client.full_name == full_name)
-            ).first()
-
-            data = {
-                "full_name": full_name,
-                "email": email,
-                "phone": phone,
-                "rfc_tax_id": clean.get('rfc_tax_id') or None,
-                "fiscal_address": clean.get('fiscal_address') or None,
-                "contact_name": clean.get('contact_name') or None,
-                "contact_phone": clean.get('contact_phone') or None,
-                "contact_dept": clean.get('contact_dept') or None,
-                "contact_email": clean.get('contact_email') or None,
-                "contact2_name": clean.get('contact2_name') or None,
-                "contact2_phone": clean.get('contact2_phone') or None,
-                "contact2_dept": clean.get('contact2_dept') or None,
-                "contact2_email": clean.get('contact2_email') or None,
-                "contact3_name": clean.get('contact3_name') or None,
-                "contact3_phone": clean.get('contact3_phone') or None,
-                "contact3_dept": clean.get('contact3_dept') or None,
-                "contact3_email": clean.get('contact3_email') or None,
-                "contact4_name": clean.get('contact4_name') or None,
-                "contact4_phone": clean.get('contact4_phone') or None,
-                "contact4_dept": clean.get('contact4_dept') or None,
-                "contact4_email": clean.get('contact4_email') or None,
-                "notes": clean.get('notes') or None,
-                "is_active": True,
-            }
-
-            if existing:
-                for k, v in data.items():
-                    setattr(existing, k, v)
-                summary["updated"] += 1
-            else:
-                session.add(Client(**data))
-                summary["created"] += 1
-
-            summary["processed"] += 1
-
-        except Exception as e:
-            summary["errors"].append(f"Fila {row_idx + 2}: {str(e)}")
-
-    session.commit()
-    return summary
+    """Importación masiva de clientes desde CSV (en flujo, reanudable)."""
+    return _run_catalog_import(session, "CLIENTS", file, current_user.id, background)
 
 # ==========================================
 # 4. TASAS DE IMPUESTOS
 # ==========================================
 @router.get("/tax-rates", response_model=List[TaxRate])
 def read_tax_rates(session: Session = Depends(get_session)):
-    return session.exec(select(TaxRate).where(TaxRate.is_active == True)).all()
+    return config_cache.list_tax_rates(session)
 
 @router.post("/tax-rates", response_model=TaxRate)
 def create_tax_rate(tax_rate: TaxRate, session: Session = Depends(get_session)):
@@ -422,6 +279,7 @@ def create_tax_rate(tax_rate: TaxRate, session: Session = Depends(get_session)):
     session.add(tax_rate)
     session.commit()
     session.refresh(tax_rate)
+    config_cache.invalidate_config_cache()
     return tax_rate
 
 @router.put("/tax-rates/{tax_id}", response_model=TaxRate)
@@ -439,6 +297,7 @@ def update_tax_rate(tax_id: int, tax_in: TaxRate, session: Session = Depends(get
     session.add(db_tax)
     session.commit()
     session.refresh(db_tax)
+    config_cache.invalidate_config_cache()
     return db_tax
 
 @router.delete("/tax-rates/{tax_id}")
@@ -451,6 +310,7 @@ def delete_tax_rate(tax_id: int, session: Session = Depends(get_session)):
     db_tax.is_active = False
     session.add(db_tax)
     session.commit()
+    config_cache.invalidate_config_cache()
     return {"ok": True, "message": "Impuesto eliminado correctamente"}
 
 @router.put("/tax-rates/{tax_id}/toggle", response_model=TaxRate)
@@ -463,6 +323,7 @@ def toggle_tax_rate(tax_id: int, session: Session = Depends(get_session)):
     session.add(tax)
     session.commit()
     session.refresh(tax)
+    config_cache.invalidate_config_cache()
     return tax
 
 # ==========================================
@@ -493,17 +354,19 @@ def adjust_material_stock(
         return {"ok": True, "message": "Sin diferencia, stock no modificado"}
 
     movement_type = "AJUSTE_POSITIVO" if difference > 0 else "AJUSTE_NEGATIVO"
-    material.physical_stock = counted
-    session.add(material)
+    # El conteo fija el valor; la diferencia se calcula contra la fila bloqueada
+    # (no contra la lectura de arriba) y queda en el Kárdex.
+    applied = StockMutation(session).set_physical(
+        material_id, counted, movement_type, reason_code="AJUSTE_INVENTARIO"
+    ).apply()[material_id]
     session.commit()
-    session.refresh(material)
 
     return {
         "ok": True,
         "material_id": material_id,
         "movement_type": movement_type,
-        "difference": difference,
-        "new_stock": material.physical_stock,
+        "difference": applied["physical_stock"] - applied["previous_physical_stock"],
+        "new_stock": applied["physical_stock"],
     }
 
 
@@ -562,8 +425,10 @@ def physical_count_with_date(
         )
     ).all()
 
+    mutation = StockMutation(session)
     for viejo in conteos_previos:
-        material.physical_stock = (material.physical_stock or 0.0) - (viejo.quantity or 0.0)
+        # Sin renglón de Kárdex: el renglón revertido se borra
+        mutation.add(material_id, -(viejo.quantity or 0.0), "AJUSTE_CONTEO_FISICO", record=False)
         session.delete(viejo)
 
     # Asegura que los borrados se materialicen antes de recalcular el saldo agregado,
@@ -576,7 +441,7 @@ def physical_count_with_date(
     if diferencia == 0:
         # No se registra movimiento nuevo, pero sí persistimos la posible reversión/borrado
         # de conteos previos de esta misma fecha (idempotencia), si los hubo.
-        session.add(material)
+        mutation.apply()
         session.commit()
         session.refresh(material)
         return {
@@ -589,19 +454,15 @@ def physical_count_with_date(
             "nuevo_physical_stock": material.physical_stock,
         }
 
-    registrar_movimiento_inventario(
-        session,
-        material_id=material_id,
-        cantidad=diferencia,
-        tipo="AJUSTE_CONTEO_FISICO",
-        costo_unitario=float(getattr(material, 'current_cost', 0.0) or 0.0),
+    # Ajuste por SUMA de la diferencia (preserva movimientos posteriores al conteo).
+    mutation.add(
+        material_id,
+        diferencia,
+        "AJUSTE_CONTEO_FISICO",
         reason_code="CONTEO_FISICO",
         created_at=fecha_fin_dia,
     )
-
-    # Ajuste por SUMA de la diferencia (preserva movimientos posteriores al conteo).
-    material.physical_stock = (material.physical_stock or 0.0) + diferencia
-    session.add(material)
+    mutation.apply()
     session.commit()
     session.refresh(material)
 
@@ -630,7 +491,7 @@ def get_inventory_valuation(session: Session = Depends(get_session)):
 
 
 @router.post("/materials/seed-kardex-opening")
-def seed_kardex_opening(current_user: CurrentUser, session: SessionDep):
+def seed_kardex_opening(current_user: CurrentUser, session: SessionDep, background: bool = False):
     """
     SIEMBRA DE SALDO DE APERTURA DEL KÁRDEX (Fase 3A) — uso administrativo, una sola vez.
 
@@ -639,6 +500,7 @@ def seed_kardex_opening(current_user: CurrentUser, session: SessionDep):
 
     IDEMPOTENTE: si un material ya tiene un AJUSTE_INICIAL, se salta (no duplica).
     NO modifica physical_stock de ningún material: solo deja el rastro histórico.
+    ?background=true lo encola como trabajo (ver /jobs) en vez de correrlo aquí.
     """
     role = current_user.role.value if hasattr(current_user.role, "value") \
         else str(current_user.role)
@@ -648,48 +510,45 @@ def seed_kardex_opening(current_user: CurrentUser, session: SessionDep):
             detail="Solo Dirección, Administración o Gerencia pueden sembrar el saldo de apertura."
         )
 
-    materials = session.exec(select(Material)).all()
+    if background:
+        return enqueue(session, "KARDEX_OPENING", user_id=current_user.id)
+
+    result = sembrar_saldo_apertura(session)
+    session.commit()
+    return result
 
-    sembrados = 0
-    saltados_existente = 0
-    saltados_stock_cero = 0
 
-    for material in materials:
-        ya_existe = session.exec(
-            select(InventoryTransaction).where(
-                InventoryTransaction.material_id == material.id,
-                InventoryTransaction.transaction_type == "AJUSTE_INICIAL",
-            )
-        ).first()
+@router.post("/materials/kardex-replay")
+def replay_kardex(
+    current_user: CurrentUser,
+    session: SessionDep,
+    correct: bool = False,
+    background: bool = False,
+):
+    """
+    RECONSTRUCCIÓN DESDE EL KÁRDEX — uso administrativo.
 
-        if ya_existe:
-            saltados_existente += 1
-            continue
-
-        stock_actual = float(material.physical_stock or 0.0)
-        if stock_actual <= 0:
-            saltados_stock_cero += 1
-            continue
-
-        registrar_movimiento_inventario(
-            session,
-            material_id=material.id,
-            cantidad=stock_actual,
-            tipo="AJUSTE_INICIAL",
-            costo_unitario=float(getattr(material, 'current_cost', 0.0) or 0.0),
-            reason_code="SALDO_APERTURA",
+    Recalcula physical_stock (suma del Kárdex) y committed_stock (reservas ACTIVA)
+    de cada material y reporta los descuadres. Con ?correct=true iguala los
+    contadores a sus libros; el físico de los materiales sin saldo de apertura NO se
+    toca (van en skipped_no_opening). Para bases grandes usar ?background=true
+    (trabajo en segundo plano) o scripts/replay_kardex.py.
+    """
+    role = current_user.role.value if hasattr(current_user.role, "value") \
+        else str(current_user.role)
+    if role.upper() not in ["DIRECTOR", "ADMIN", "MANAGER"]:
+        raise HTTPException(
+            status_code=403,
+            detail="Solo Dirección, Administración o Gerencia pueden reconstruir existencias."
         )
-        sembrados += 1
 
-    session.commit()
+    if background:
+        return enqueue(session, "KARDEX_REPLAY", {"correct": correct}, user_id=current_user.id)
 
-    return {
-        "ok": True,
-        "sembrados": sembrados,
-        "saltados_por_existir": saltados_existente,
-        "saltados_por_stock_cero": saltados_stock_cero,
-        "total_materiales": len(materials),
-    }
+    report = KardexReplay.replay(session, correct=correct)
+    if correct:
+        session.commit()
+    return report
 
 
 @router.get("/materials")
@@ -751,6 +610,9 @@ def update_material(material_id: int, material_in: Material, session: Session =
     
     material_data = material_in.model_dump(exclude_unset=True)
     material_data.pop("id", None)
+    # Las huellas las fija el servidor; un cliente que reenvía el material no las pisa
+    for stamp in STAMP_FIELDS:
+        material_data.pop(stamp, None)
     if "sku" in material_data and material_data["sku"]:
         material_data["sku"] = material_data["sku"].strip()
     if "name" in material_data and material_data["name"]:
@@ -761,6 +623,7 @@ def update_material(material_id: int, material_in: Material, session: Session =
     session.add(db_material)
     session.commit()
     session.refresh(db_material)
+    recipe_index.invalidate_material(material_id)
     return db_material
 
 @router.delete("/materials/{material_id}")
@@ -777,164 +640,54 @@ def delete_material(material_id: int, session: Session = Depends(get_session)):
 # 6. IMPORTACIÓN MASIVA (PROCESAMIENTO EN BLOQUE / BULK UPSERT)
 # ==========================================
 @router.post("/materials/import-csv")
-async def import_materials_csv(
+def import_materials_csv(
+    current_user: CurrentUser,
     file: UploadFile = File(...),
+    background: bool = False,
     session: Session = Depends(get_session)
 ):
+    """
+    Importación masiva de materiales desde CSV: se lee en flujo y cada bloque se
+    guarda con un INSERT ... ON CONFLICT (sku). Reanudable (ver catalog_import).
+    ?background=true responde de inmediato con el trabajo encolado (ver /jobs).
+    """
+    return _run_catalog_import(session, "MATERIALS", file, current_user.id, background)
+
+
+def _run_catalog_import(session: Session, entity: str, file: UploadFile, user_id: int, background: bool = False):
     if not file.filename.endswith('.csv'):
         raise HTTPException(status_code=400, detail="El archivo debe ser un CSV.")
-
-    content = await file.read()
+    if background:
+        # La petición termina antes que el trabajo y otra instancia lo puede tomar: el archivo va a la BD
+        file_key = store_job_file(session, file.file)
+        return enqueue(
+            session, "CATALOG_IMPORT",
+            {"entity": entity, "file_key": file_key, "filename": file.filename, "user_id": user_id},
+            user_id=user_id,
+        )
     try:
-        csv_string = content.decode('utf-8-sig')
-    except UnicodeDecodeError:
-        csv_string = content.decode('latin-1')
+        run = CatalogImporter.run(session, entity, file.file, filename=file.filename, user_id=user_id)
+    except CatalogImportError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return CatalogImporter.summary(run)
 
-    sample = csv_string[:2048]
-    try:
-        dialect = csv.Sniffer().sniff(sample)
-        delimiter = dialect.delimiter
-    except Exception:
-        delimiter = ','
-
-    csv_reader = csv.DictReader(io.StringIO(csv_string), delimiter=delimiter)
-    summary = {"processed": 0, "created": 0, "updated": 0, "errors": []}
-
-    def parse_money(value):
-        if not value: return 0.0
-        clean = value.replace('$', '').replace(',', '').strip()
-        try:
-            return float(clean)
-        except ValueError:
-            return 0.0
-
-    # =========================================================
-    # FASE 1: Lectura en memoria y recolección de llaves únicas
-    # =========================================================
-    parsed_rows = []
-    unique_skus = set()
-    unique_providers = set()
-
-    for row_idx, row in enumerate(csv_reader):
-        clean_row = {k.strip().lower(): v.strip() for k, v in row.items() if k}
-        if 'sku' not in clean_row or 'name' not in clean_row:
-            continue 
-
-        sku_val = clean_row['sku'].upper()
-        unique_skus.add(sku_val)
-        
-        provider_name_raw = clean_row.get('proveedor') or clean_row.get('provider')
-        if provider_name_raw:
-            unique_providers.add(provider_name_raw.strip())
-            
-        parsed_rows.append({"idx": row_idx, "data": clean_row, "sku": sku_val})
-
-    if not parsed_rows:
-        return summary
-
-    # =========================================================
-    # FASE 2: Procesamiento en Bloque de Proveedores (1 solo viaje)
-    # =========================================================
-    provider_map = {}
-    if unique_providers:
-        # Traemos todos los proveedores existentes de golpe
-        existing_provs = session.exec(select(Provider).where(Provider.business_name.in_(list(unique_providers)))).all()
-        for p in existing_provs:
-            provider_map[p.business_name.upper()] = p.id
-        
-        new_provs_to_create = []
-        for p_name in unique_providers:
-            if p_name.upper() not in provider_map:
-                new_provs_to_create.append(Provider(business_name=p_name, credit_days=0, is_active=True))
-        
-        # Insertamos los nuevos proveedores de golpe para obtener sus IDs
-        if new_provs_to_create:
-            session.add_all(new_provs_to_create)
-            session.flush() # Sincroniza con DB sin cerrar la transacción
-            for p in new_provs_to_create:
-                provider_map[p.business_name.upper()] = p.id
-
-    # =========================================================
-    # FASE 3: Procesamiento en Bloque de Materiales (La cura al N+1)
-    # =========================================================
-    # Traemos todos los materiales que coinciden con los SKUs del CSV de un solo golpe
-    existing_materials = session.exec(select(Material).where(Material.sku.in_(list(unique_skus)))).all()
-    material_map = {m.sku: m for m in existing_materials}
-
-    new_materials_to_create = []
-    valid_routes = ["MATERIAL", "PROCESO", "CONSUMIBLE", "SERVICIO"]
-
-    # =========================================================
-    # FASE 4: Cruce de datos en la memoria RAM (Milisegundos)
-    # =========================================================
-    for item in parsed_rows:
-        try:
-            clean_row = item["data"]
-            sku_val = item["sku"]
-
-            # Asignación de Proveedor desde el mapa en memoria
-            provider_name_raw = clean_row.get('proveedor') or clean_row.get('provider')
-            final_provider_id = None
-            if provider_name_raw:
-                final_provider_id = provider_map.get(provider_name_raw.strip().upper())
-
-            # Cálculos financieros
-            raw_factor = parse_money(clean_row.get('conversion_factor'))
-            conversion_factor = raw_factor if raw_factor > 0 else 1.0
-            
-            purchase_price = parse_money(clean_row.get('current_cost'))
-            raw_unit_cost = purchase_price / conversion_factor
-            final_unit_cost = math.ceil(raw_unit_cost * 100) / 100
-            
-            raw_route = clean_row.get('production_route', 'MATERIAL').upper()
-            final_route = raw_route if raw_route in valid_routes else "MATERIAL"
-            
-            material_data = {
-                "sku": sku_val,
-                "name": clean_row['name'],
-                "category": clean_row.get('category', 'General'),
-                "purchase_unit": clean_row.get('purchase_unit', 'Pieza'),
-                "usage_unit": clean_row.get('usage_unit', 'Pieza'),
-                "conversion_factor": conversion_factor,
-                "current_cost": final_unit_cost,
-                "provider_id": final_provider_id,
-                "associated_element_sku": clean_row.get('associated_element_sku', None),
-                "production_route": final_route,
-                "is_active": True
-            }
-
-            existing_mat = material_map.get(sku_val)
-
-            if existing_mat:
-                # Si existe, actualizamos sus atributos (el ORM lo trackea en memoria)
-                for k, v in material_data.items():
-                    if k == "provider_id" and v is None: continue 
-                    setattr(existing_mat, k, v)
-                summary["updated"] += 1
-            else:
-                # Si es nuevo, lo preparamos para inserción masiva
-                material_data["physical_stock"] = 0.0
-                material_data["committed_stock"] = 0.0
-                new_mat = Material(**material_data)
-                new_materials_to_create.append(new_mat)
-                # Lo metemos al mapa por si el CSV trae el mismo SKU duplicado más abajo
-                material_map[sku_val] = new_mat
-                summary["created"] += 1
-            
-            summary["processed"] += 1
-
-        except Exception as e:
-            summary["errors"].append(f"Fila {item['idx'] + 2}: {str(e)}")
-
-    # =========================================================
-    # FASE 5: Impacto Final en Base de Datos (1 solo commit)
-    # =========================================================
-    try:
-        if new_materials_to_create:
-            session.add_all(new_materials_to_create)
-        session.commit()
-    except Exception as e:
-        session.rollback()
-        raise HTTPException(status_code=500, detail=f"Error DB: {str(e)}")
-        
-    return summary
\ No newline at end of file
+
+@router.get("/imports")
+def read_catalog_imports(
+    session: SessionDep,
+    entity: Optional[str] = None,
+    limit: int = 20,
+):
+    """Últimas importaciones CSV (progreso, errores y punto de reanudación)."""
+    statement = select(CatalogImportRun).order_by(CatalogImportRun.id.desc()).limit(limit)
+    if entity:
+        statement = statement.where(CatalogImportRun.entity == entity.upper())
+    return [CatalogImporter.summary(run) for run in session.exec(statement).all()]
+
+
+@router.get("/imports/{run_id}")
+def read_catalog_import(run_id: int, session: SessionDep):
+    run = session.get(CatalogImportRun, run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Importación no encontrada")
+    return CatalogImporter.summary(run)
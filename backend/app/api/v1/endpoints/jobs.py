@@ -0,0 +1,59 @@
+"""
+jobs.py  –  Trabajos en segundo plano (ver app/services/job_runner.py)
+
+Rutas:
+  GET  /jobs                 → Últimos trabajos (filtros: status, kind)
+  GET  /jobs/{id}            → Estado y progreso de un trabajo (para sondear)
+  POST /jobs/{id}/cancel     → Cancelar (inmediato si está en cola; cooperativo si corre)
+  POST /jobs/{id}/retry      → Reencolar un trabajo FAILED o CANCELLED
+"""
+from typing import List, Optional
+
+from fastapi import APIRouter, HTTPException
+from sqlmodel import select
+
+from app.core.deps import CurrentUser, SessionDep
+from app.models.jobs import BackgroundJob
+from app.services import job_runner
+
+router = APIRouter()
+
+
+@router.get("/", response_model=List[BackgroundJob])
+def read_jobs(
+    session: SessionDep,
+    current_user: CurrentUser,
+    status: Optional[str] = None,
+    kind: Optional[str] = None,
+    limit: int = 50,
+):
+    statement = select(BackgroundJob).order_by(BackgroundJob.id.desc()).limit(min(limit, 200))
+    if status:
+        statement = statement.where(BackgroundJob.status == status.upper())
+    if kind:
+        statement = statement.where(BackgroundJob.kind == kind.upper())
+    return session.exec(statement).all()
+
+
+@router.get("/{job_id}", response_model=BackgroundJob)
+def read_job(job_id: int, session: SessionDep, current_user: CurrentUser):
+    job = session.get(BackgroundJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return job
+
+
+@router.post("/{job_id}/cancel", response_model=BackgroundJob)
+def cancel_job(job_id: int, session: SessionDep, current_user: CurrentUser):
+    try:
+        return job_runner.cancel(session, job_id)
+    except job_runner.JobError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+
+@router.post("/{job_id}/retry", response_model=BackgroundJob)
+def retry_job(job_id: int, session: SessionDep, current_user: CurrentUser):
+    try:
+        return job_runner.retry(session, job_id)
+    except job_runner.JobError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
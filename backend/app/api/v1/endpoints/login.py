@@ -2,13 +2,18 @@ from datetime import timedelta
 from typing import Any
 
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlmodel import Session, select
 from pydantic import BaseModel  # <--- 1. IMPORTAR ESTO
 
 from app.core.config import settings
 from app.core.database import get_session
-from app.core.security import create_access_token, get_password_hash, verify_password
+from app.core.deps import invalidate_principal_cache
+from app.core.security import (
+    PasswordHasherBusy, create_access_token, get_password_hash,
+    get_password_hash_async, password_needs_rehash, verify_password_async,
+)
 # from app.models.auth import Token  <--- YA NO USAREMOS ESTE MODELO SIMPLE
 from app.models.users import User, UserRole  
 
@@ -24,20 +29,33 @@ class TokenResponse(BaseModel):
     full_name: str
     email: str
 
+
+def _find_user_by_email(session: Session, email: str):
+    return session.exec(select(User).where(User.email == email)).first()
+
+
+def _save_password_hash(session: Session, user: User, hashed_password: str) -> None:
+    user.hashed_password = hashed_password
+    session.add(user)
+    session.commit()
+    session.refresh(user)
+    invalidate_principal_cache(user.id)
+
+
 @router.post("/access-token", response_model=TokenResponse) # <--- 3. USAR EL NUEVO MODELO
-def login_access_token(
+async def login_access_token(
     session: Session = Depends(get_session), 
     form_data: OAuth2PasswordRequestForm = Depends()
 ) -> Any:
     """
     OAuth2 compatible token login.
     Devuelve token + datos del usuario (rol, nombre) para actualizar el Frontend.
+    async: la consulta va al threadpool y bcrypt a su pool dedicado
+    (security._hash_executor), así una ráfaga de logins no deja sin hilos al resto del API.
     """
     # 1. Buscar usuario por email
     try:
-        user = session.exec(
-            select(User).where(User.email == form_data.username)
-        ).first()
+        user = await run_in_threadpool(_find_user_by_email, session, form_data.username)
     except Exception as e:
         print(f"Error DB en Login: {e}")
         raise HTTPException(status_code=500, detail="Error de conexión con base de datos")
@@ -45,13 +63,29 @@ def login_access_token(
     # 2. Validar credenciales
     if not user:
         raise HTTPException(status_code=400, detail="Email o contraseña incorrectos")
-        
-    if not verify_password(form_data.password, user.hashed_password):
+
+    try:
+        valid = await verify_password_async(form_data.password, user.hashed_password)
+    except PasswordHasherBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Demasiados inicios de sesión simultáneos. Intenta de nuevo en unos segundos.",
+            headers={"Retry-After": "2"},
+        )
+    if not valid:
         raise HTTPException(status_code=400, detail="Email o contraseña incorrectos")
 
     if not user.is_active:
         raise HTTPException(status_code=400, detail="Usuario inactivo")
 
+    # 2b. Si cambió BCRYPT_ROUNDS, actualizar el hash ahora que tenemos la contraseña en claro
+    if password_needs_rehash(user.hashed_password):
+        try:
+            new_hash = await get_password_hash_async(form_data.password)
+            await run_in_threadpool(_save_password_hash, session, user, new_hash)
+        except PasswordHasherBusy:
+            pass  # Se intenta en el siguiente login
+
     # 3. Crear token
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     
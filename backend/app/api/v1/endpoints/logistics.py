@@ -1,9 +1,10 @@
 import uuid
 from io import BytesIO
 
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile, status
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile, status
+from pydantic import BaseModel, ValidationError
 from sqlmodel import Session, select, text
+from starlette.concurrency import run_in_threadpool
 from typing import List, Optional
 from datetime import datetime, date
 
@@ -12,48 +13,18 @@ from app.models.production import (
     InstallationAssignment,
     InstallationAssignmentStatus,
     PayrollPayment,
-    PayrollPaymentType,
     PayrollStatus,
 )
-from app.models.sales import SalesOrderItemInstance, SalesOrderItem, SalesOrder, InstanceStatus
-from app.models.design import ProductVersion
-from app.models.foundations import GlobalConfig, Client
+from app.models.sales import SalesOrderItemInstance, InstanceStatus
 from app.models.users import User, UserRole
 from app.models.treasury import BankAccount, BankTransaction, TransactionType
-from app.models.inventory import InventoryReservation
-from app.models.material import Material
-from app.services.planning_service import trigger_double_green
 from app.services.cloud_storage import upload_to_gcs
-from app.services.inventory_manager import registrar_movimiento_inventario
+from app.services.instance_context import resolve_instance_context, resolve_instance_contexts
+from app.services import field_sync, installation_flow, qr_resolver
 
 router = APIRouter()
 
 
-def _check_all_lanes_installed(instance_id: int, session: Session) -> bool:
-    """
-    Retorna True si TODOS los carriles activos de la instancia
-    están en estado INSTALLED o COMPLETED.
-    Retorna False si algún carril está en SCHEDULED, IN_PROGRESS o CARGADO.
-    """
-    assignments = session.exec(
-        select(InstallationAssignment).where(
-            InstallationAssignment.instance_id == instance_id,
-            InstallationAssignment.status != InstallationAssignmentStatus.COMPLETED
-        )
-    ).all()
-
-    if not assignments:
-        return False
-
-    return all(
-        a.status in [
-            InstallationAssignmentStatus.INSTALLED,
-            InstallationAssignmentStatus.COMPLETED,
-        ]
-        for a in assignments
-    )
-
-
 def _upload_file_to_gcs(file_bytes: bytes, blob_name: str, content_type: str) -> str:
     """Adaptador sobre `upload_to_gcs` (espera un file-like), sin modificar cloud_storage."""
     url = upload_to_gcs(BytesIO(file_bytes), blob_name, content_type=content_type)
@@ -62,6 +33,10 @@ def _upload_file_to_gcs(file_bytes: bytes, blob_name: str, content_type: str) ->
     return url
 
 
+def _blob_extension(filename: Optional[str]) -> str:
+    return filename.rsplit(".", 1)[-1].lower() if filename and "." in filename else "jpg"
+
+
 # ==========================================
 # SCHEMAS
 # ==========================================
@@ -103,6 +78,27 @@ class QRScanPayload(BaseModel):
     bundle_qr_uuid: str  # UUID del bulto escaneado
 
 
+class QRResolveBatchPayload(BaseModel):
+    payloads: List[str]  # Contenido crudo de cada QR escaneado ("{qr}-{bulto}")
+
+
+class SyncOperationIn(BaseModel):
+    op_id: str                            # UUID generado en el iPad (llave de idempotencia)
+    type: str                             # SCAN | INSTALLED | SIGNATURE | EVIDENCE
+    assignment_id: Optional[int] = None   # SCAN, INSTALLED, SIGNATURE
+    instance_id: Optional[int] = None     # EVIDENCE
+    bundle_qr: Optional[str] = None       # SCAN: QR escaneado (sólo registro)
+    signature_url: Optional[str] = None
+    signature_file: Optional[str] = None  # SIGNATURE: nombre de un archivo del lote
+    files: List[str] = []                 # EVIDENCE: nombres de archivos del lote
+    recorded_at: Optional[datetime] = None
+
+
+class SyncUploadPayload(BaseModel):
+    device_id: str
+    operations: List[SyncOperationIn]
+
+
 class ReasignarEquipoPayload(BaseModel):
     leader_user_id: int
     helper_1_user_id: Optional[int] = None
@@ -153,18 +149,6 @@ def _serialize_payroll_row(r: PayrollPayment, session: Session) -> PayrollPaymen
     )
 
 
-# ==========================================
-# HELPER INTERNO
-# ==========================================
-def _get_installation_days(session: SessionDep, instance: SalesOrderItemInstance) -> float:
-    """Sube la cadena Instance → Item → ProductVersion para obtener los días presupuestados."""
-    item = session.get(SalesOrderItem, instance.sales_order_item_id)
-    if not item or not item.origin_version_id:
-        return 1.0
-    version = session.get(ProductVersion, item.origin_version_id)
-    return float(version.installation_days) if version and version.installation_days else 1.0
-
-
 # ==========================================
 # 2. GATILLO DE FIRMA — Libera nómina a READY_TO_PAY
 # ==========================================
@@ -180,32 +164,13 @@ def register_client_signature(
     - Cierra la instancia con signed_received_at (activa la garantía de 1 año).
     - Libera todos los registros de nómina de esta asignación a READY_TO_PAY.
     """
-    assignment = session.get(InstallationAssignment, assignment_id)
-    if not assignment:
-        raise HTTPException(status_code=404, detail="Asignación no encontrada.")
-
-    if not _check_all_lanes_installed(assignment.instance_id, session):
-        raise HTTPException(
-            status_code=400,
-            detail="No se puede firmar hasta que todos los carriles estén marcados como instalados."
-        )
-
-    now = datetime.utcnow()
-
-    assignment.client_signature_url = payload.signature_url
-    assignment.status = InstallationAssignmentStatus.COMPLETED
-    assignment.completed_at = now
-    assignment.warranty_end_date = datetime(now.year + 1, now.month, now.day)
-    session.add(assignment)
-
     # Disparar el Evento Maestro Doble Verde 🟢🟢
-    # → cambia a CLOSED, registra signed_received_at, libera nómina a READY_TO_PAY
-    double_green_result = {"payroll_released": [], "instance_id": None}
-    instance = session.get(SalesOrderItemInstance, assignment.instance_id)
-    if instance:
-        instance.current_location = "Instalado en Obra"
-        session.add(instance)
-        double_green_result = trigger_double_green(instance, session, signed_at=now)
+    try:
+        assignment, double_green_result = installation_flow.register_signature(
+            session, assignment_id, payload.signature_url,
+        )
+    except installation_flow.InstallationFlowError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
 
     session.commit()
     session.refresh(assignment)
@@ -230,21 +195,10 @@ def mark_assignment_installed(
     Verde Simple 🟢 — trabajo hecho, esperando firma.
     Cualquier usuario autenticado puede ejecutar este endpoint.
     """
-    assignment = session.get(InstallationAssignment, assignment_id)
-    if not assignment:
-        raise HTTPException(status_code=404, detail="Asignación no encontrada.")
-
-    if assignment.status not in [
-        InstallationAssignmentStatus.IN_PROGRESS,
-        InstallationAssignmentStatus.SCHEDULED,
-    ]:
-        raise HTTPException(
-            status_code=400,
-            detail="Solo se puede marcar como instalado desde SCHEDULED o IN_PROGRESS."
-        )
-
-    assignment.status = InstallationAssignmentStatus.INSTALLED
-    session.add(assignment)
+    try:
+        assignment = installation_flow.mark_installed(session, assignment_id)
+    except installation_flow.InstallationFlowError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
     session.commit()
     session.refresh(assignment)
 
@@ -415,16 +369,9 @@ def preview_bundle_scan(
         raise HTTPException(status_code=404, detail="Instancia no encontrada.")
 
     # Cliente y proyecto (instancia -> item -> orden -> cliente)
-    cliente_nombre = None
-    proyecto = None
-    item = session.get(SalesOrderItem, instance.sales_order_item_id)
-    if item:
-        orden = session.get(SalesOrder, item.sales_order_id)
-        if orden:
-            proyecto = orden.project_name
-            cli = session.get(Client, orden.client_id)
-            if cli:
-                cliente_nombre = getattr(cli, 'full_name', None) or getattr(cli, 'business_name', None)
+    ctx = resolve_instance_context(session, instance)
+    cliente_nombre = ctx.client_name
+    proyecto = ctx.project_name
 
     # Conteo de bultos: DISTINCT bundle_number por tipo para no inflar con reimpresiones
     filas = session.exec(text("""
@@ -574,134 +521,13 @@ def scan_bundle_qr(
     - Genera los registros de nómina con el equipo confirmado
     - A partir de aquí el equipo ya no puede modificarse
     """
-    allowed_scan = {UserRole.LOGISTICS, UserRole.DIRECTOR, UserRole.MANAGER}
-    if current_user.role not in allowed_scan:
-        raise HTTPException(
-            status_code=403,
-            detail="Solo el equipo de instalación puede escanear QRs.",
-        )
-
-    assignment = session.get(InstallationAssignment, assignment_id)
-    if not assignment:
-        raise HTTPException(status_code=404, detail="Asignación no encontrada.")
-
-    if assignment.status != InstallationAssignmentStatus.SCHEDULED:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Esta asignación ya fue procesada. Status actual: {assignment.status}",
-        )
-
-    # Verificar que quien escanea es el líder asignado
-    if current_user.id != assignment.leader_user_id:
-        raise HTTPException(
-            status_code=403,
-            detail="Solo el Líder asignado puede confirmar la carga al camión.",
-        )
-
-    instance = session.get(SalesOrderItemInstance, assignment.instance_id)
-    if not instance:
-        raise HTTPException(status_code=404, detail="Instancia no encontrada.")
-
-    if instance.production_status not in [InstanceStatus.READY]:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Bloqueo Logístico: la instancia debe estar en READY para cargarse. "
-                   f"Status actual: {instance.production_status}",
-        )
-
     now = datetime.utcnow()
-
-    # Confirmar equipo y marcar IN_PROGRESS
-    assignment.status = InstallationAssignmentStatus.IN_PROGRESS
-    assignment.started_at = now
-    session.add(assignment)
-
-    # Cambiar instancia a CARGADO 🔵🔵
-    instance.production_status = InstanceStatus.CARGADO
-    instance.current_location = "En Tránsito (Camión)"
-    session.add(instance)
-
-    # ── BAJA CONTABLE DE INVENTARIO ──────────────────────────
-    # Regla inmutable: la baja ocurre al escanear QR (CARGADO)
-    # Se consumen las reservas ACTIVA de esta instancia
-    reservations = session.exec(
-        select(InventoryReservation).where(
-            InventoryReservation.instance_id == instance.id,
-            InventoryReservation.status == "ACTIVA",
+    try:
+        assignment, instance, consumption, payroll_records = installation_flow.confirm_load(
+            session, assignment_id, current_user, now=now,
         )
-    ).all()
-
-    for res in reservations:
-        # Baja contable: reducir stock físico
-        material = session.get(Material, res.material_id)
-        if material:
-            material.physical_stock = max(
-                0.0,
-                (material.physical_stock or 0.0) - res.quantity_reserved
-            )
-            # Liberar committed_stock
-            material.committed_stock = max(
-                0.0,
-                (material.committed_stock or 0.0) - res.quantity_reserved
-            )
-            session.add(material)
-
-            # Rastro fechado en el Kárdex (Fase 2): SALIDA por carga al camión.
-            # No altera physical_stock/committed_stock (ya ajustados arriba); el commit
-            # lo sigue haciendo el endpoint. cantidad negativa porque es una salida.
-            registrar_movimiento_inventario(
-                session,
-                material_id=material.id,
-                cantidad=-res.quantity_reserved,
-                tipo="SALIDA_INSTALACION",
-                costo_unitario=float(getattr(material, 'current_cost', 0.0) or 0.0),
-                project_id=getattr(instance, 'sales_order_id', None),
-                reason_code="CARGA_CAMION",
-            )
-
-        # Marcar reserva como consumida
-        res.status = "CONSUMIDA"
-        session.add(res)
-    # ─────────────────────────────────────────────────────────
-
-    # Leer tabulador global
-    config = session.exec(select(GlobalConfig)).first()
-    leader_rate = config.default_leader_daily_rate if config else 800.0
-    helper_rate = config.default_helper_daily_rate if config else 700.0
-
-    # Días de instalación de la receta
-    installation_days = _get_installation_days(session, instance)
-
-    # Generar nómina con el equipo DEFINITIVO confirmado en este momento
-    session.add(PayrollPayment(
-        installation_assignment_id=assignment.id,
-        user_id=assignment.leader_user_id,
-        payment_type=PayrollPaymentType.LEADER,
-        days_worked=installation_days,
-        daily_rate=leader_rate,
-        total_amount=round(installation_days * leader_rate, 2),
-        status=PayrollStatus.PENDING_SIGNATURE,
-    ))
-    if assignment.helper_1_user_id:
-        session.add(PayrollPayment(
-            installation_assignment_id=assignment.id,
-            user_id=assignment.helper_1_user_id,
-            payment_type=PayrollPaymentType.HELPER,
-            days_worked=installation_days,
-            daily_rate=helper_rate,
-            total_amount=round(installation_days * helper_rate, 2),
-            status=PayrollStatus.PENDING_SIGNATURE,
-        ))
-    if assignment.helper_2_user_id:
-        session.add(PayrollPayment(
-            installation_assignment_id=assignment.id,
-            user_id=assignment.helper_2_user_id,
-            payment_type=PayrollPaymentType.HELPER,
-            days_worked=installation_days,
-            daily_rate=helper_rate,
-            total_amount=round(installation_days * helper_rate, 2),
-            status=PayrollStatus.PENDING_SIGNATURE,
-        ))
+    except installation_flow.InstallationFlowError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
 
     session.commit()
     session.refresh(assignment)
@@ -715,9 +541,51 @@ def scan_bundle_qr(
         "bundle_qr_uuid": payload.bundle_qr_uuid,
         "instance_status": instance.production_status,
         "leader": {"id": assignment.leader_user_id, "name": leader.full_name if leader else None},
-        "payroll_records_created": 1 + bool(assignment.helper_1_user_id) + bool(assignment.helper_2_user_id),
+        "payroll_records_created": payroll_records,
         "scanned_at": now.isoformat(),
-        "inventory_consumed": len(reservations),
+        "inventory_consumed": consumption["reservations"],
+    }
+
+
+# ==========================================
+# 4b. RESOLVER QR — ¿Qué bulto / casa es? (iPad)
+# ==========================================
+@router.get("/qr/resolve")
+def resolve_qr(
+    payload: str,
+    session: SessionDep,
+    current_user: CurrentUser,
+):
+    """
+    Contenido crudo de un QR -> instancia, OV, bultos, asignación vigente y
+    acciones permitidas. Sin id de asignación: el iPad lo obtiene de aquí.
+    """
+    result = qr_resolver.resolve_scans(session, [payload], current_user)[0]
+    if not result["found"]:
+        raise HTTPException(status_code=404, detail="QR no reconocido: no corresponde a ninguna instancia.")
+    return result
+
+
+@router.post("/qr/resolve")
+def resolve_qr_batch(
+    payload: QRResolveBatchPayload,
+    session: SessionDep,
+    current_user: CurrentUser,
+):
+    """
+    Varios escaneos de golpe (la tableta vuelve a tener red). Un resultado por
+    QR en el mismo orden; los no reconocidos regresan found=False.
+    """
+    if len(payload.payloads) > qr_resolver.MAX_BATCH:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Máximo {qr_resolver.MAX_BATCH} escaneos por envío.",
+        )
+    results = qr_resolver.resolve_scans(session, payload.payloads, current_user)
+    return {
+        "count": len(results),
+        "not_found": sum(1 for r in results if not r["found"]),
+        "results": results,
     }
 
 
@@ -737,24 +605,17 @@ async def upload_evidence_photos(
     Las URLs se agregan (append) a evidence_photos_urls en SalesOrderItemInstance.
     No hay candado de tiempo — se pueden subir aunque la instancia ya esté CLOSED.
     """
-    allowed_evidence = {UserRole.LOGISTICS, UserRole.DIRECTOR, UserRole.MANAGER}
-    if current_user.role not in allowed_evidence:
-        raise HTTPException(
-            status_code=403,
-            detail="No tienes permiso para subir evidencia.",
-        )
-
-    instance = session.get(SalesOrderItemInstance, instance_id)
-    if not instance:
-        raise HTTPException(status_code=404, detail="Instancia no encontrada.")
+    try:
+        instance = installation_flow.get_evidence_instance(session, instance_id, current_user)
+    except installation_flow.InstallationFlowError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
 
     # Subir cada foto a GCS y recopilar URLs
     uploaded_urls = []
     errors = []
     for photo in photos:
         try:
-            ext = photo.filename.rsplit(".", 1)[-1].lower() if photo.filename and "." in photo.filename else "jpg"
-            blob_name = f"evidence/instance_{instance_id}/{uuid.uuid4().hex}.{ext}"
+            blob_name = f"evidence/instance_{instance_id}/{uuid.uuid4().hex}.{_blob_extension(photo.filename)}"
             contents = await photo.read()
             url = _upload_file_to_gcs(
                 contents,
@@ -771,9 +632,7 @@ async def upload_evidence_photos(
             detail=f"No se pudo subir ninguna foto. Errores: {errors}",
         )
 
-    current_urls = instance.evidence_photos_urls or []
-    instance.evidence_photos_urls = current_urls + uploaded_urls
-    session.add(instance)
+    installation_flow.append_evidence(session, instance, uploaded_urls)
     session.commit()
     session.refresh(instance)
 
@@ -834,15 +693,16 @@ def get_my_workday(
         )
     assignments = session.exec(stmt).all()
 
+    contexts = resolve_instance_contexts(session, [a.instance_id for a in assignments])
     workday_items = []
     for assignment in assignments:
         instance = session.get(SalesOrderItemInstance, assignment.instance_id)
         if not instance:
             continue
 
-        item = session.get(SalesOrderItem, instance.sales_order_item_id)
-        order = session.get(SalesOrder, item.sales_order_id) if item else None
-        client = session.get(Client, order.client_id) if order and order.client_id else None
+        ctx = contexts.get(instance.id)
+        order = ctx.order if ctx else None
+        client = ctx.client if ctx else None
 
         helper_1 = session.get(User, assignment.helper_1_user_id) if assignment.helper_1_user_id else None
         helper_2 = session.get(User, assignment.helper_2_user_id) if assignment.helper_2_user_id else None
@@ -866,8 +726,8 @@ def get_my_workday(
             "leader_name": leader.full_name if leader else None,
             "evidence_photos_count": len(instance.evidence_photos_urls or []),
             "has_signature": bool(assignment.client_signature_url),
-            "all_lanes_installed": _check_all_lanes_installed(
-                assignment.instance_id, session
+            "all_lanes_installed": installation_flow.check_all_lanes_installed(
+                session, assignment.instance_id
             ),
             "team": {
                 "leader": {"id": assignment.leader_user_id, "name": leader.full_name if leader else None},
@@ -884,3 +744,80 @@ def get_my_workday(
         "total_assignments": len(workday_items),
         "items": workday_items,
     }
+
+
+# ==========================================
+# 7. SINCRONIZACIÓN OFFLINE (iPad) — ver app/services/field_sync.py
+# ==========================================
+@router.get("/sync/bundle")
+def get_sync_bundle(
+    session: SessionDep,
+    current_user: CurrentUser,
+    day: Optional[date] = None,
+    version: Optional[str] = None,
+):
+    """
+    Paquete del día para trabajar sin red. Si `version` es el que el iPad ya
+    tiene y nada cambió, regresa sólo {"version", "unchanged": true}.
+    """
+    try:
+        bundle = field_sync.build_day_bundle(session, current_user, day or date.today())
+    except field_sync.FieldSyncError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    if version and version == bundle["version"]:
+        return {"version": version, "unchanged": True}
+    return bundle
+
+
+@router.post("/sync/upload")
+async def upload_sync_batch(
+    session: SessionDep,
+    current_user: CurrentUser,
+    operations: str = Form(...),
+    files: List[UploadFile] = File(default=[]),
+):
+    """
+    Lote de operaciones encoladas sin red (multipart):
+      - operations: JSON {"device_id", "operations": [...]} en el orden del iPad.
+      - files: fotos y firmas; cada operación las nombra por filename.
+    Idempotente por op_id: reenviar el lote regresa los mismos resultados.
+    """
+    try:
+        payload = SyncUploadPayload.model_validate_json(operations)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+
+    contents = {}
+    for f in files:
+        contents[f.filename] = (await f.read(), f.content_type)
+
+    def upload(filename: str, prefix: str) -> str:
+        if filename not in contents:
+            raise installation_flow.InstallationFlowError(
+                f"El lote no trae el archivo {filename}.", status_code=422,
+            )
+        data, content_type = contents[filename]
+        blob_name = f"{prefix}/{uuid.uuid4().hex}.{_blob_extension(filename)}"
+        return _upload_file_to_gcs(data, blob_name, content_type or "image/jpeg")
+
+    # Archivos ya leídos: lo demás (BD y GCS) es síncrono y va al threadpool
+    try:
+        results = await run_in_threadpool(
+            field_sync.apply_operations,
+            session, current_user, payload.device_id, payload.operations, upload,
+        )
+    except field_sync.FieldSyncError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+    by_status = {}
+    for r in results:
+        by_status[r["status"]] = by_status.get(r["status"], 0) + 1
+    return {
+        "device_id": payload.device_id,
+        "count": len(results),
+        "applied": by_status.get("APPLIED", 0),
+        "conflicts": by_status.get("CONFLICT", 0),
+        "rejected": by_status.get("REJECTED", 0),
+        "errors": by_status.get("ERROR", 0),
+        "results": results,
+    }
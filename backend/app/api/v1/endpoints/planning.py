@@ -2,40 +2,52 @@
 planning.py  –  Endpoints del Módulo de Planeación Estratégica: Matriz de 4 Carriles
 
 Rutas:
-  GET  /planning/calendar              → Feed de píldoras para el Calendario Maestro
+  GET  /planning/calendar              → Feed de píldoras para el Calendario Maestro (mes, multi-mes o semana)
   GET  /planning/instances/health      → Panel de Salud agrupado por semáforo
   PATCH /planning/instances/{id}       → Editar custom_name y fechas programadas
   PATCH /planning/instances/{id}/reschedule → Drag & Drop con recálculo proporcional
+  POST /planning/reschedule-bulk       → Recorrer muchas instancias por filtro (con vista previa)
   POST /planning/instances/{id}/close  → Evento Maestro: Doble Verde 🟢🟢
   POST /planning/instances/{id}/reopen-warranty → Reabrir como Garantía ⚠️
   PATCH /planning/orders/{order_id}/baptize → Bautizo masivo de instancias (custom_names)
+  POST /planning/instances/{id}/assign-team → Asignar cuadrilla a un evento IM/IP
+  POST /planning/assign-teams          → Asignación masiva de cuadrillas (con detección de doble reserva)
+  POST /planning/assign-teams/suggest  → Propuesta de cuadrillas repartiendo la carga
+  GET  /planning/crews/double-bookings → Personas con instalaciones encimadas en un rango
 """
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from typing import Optional, List, Any, Union
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from pydantic import BaseModel
 from sqlmodel import Session, select
+from sqlalchemy import func, or_
 from sqlalchemy.orm import selectinload
 
 from app.core.database import get_session
 from app.core.deps import get_current_active_user
 from app.models.users import User, UserRole
+from app.models.foundations import Client
 from app.models.production import (
     InstallationAssignment,
     InstallationAssignmentStatus,
+    ProductionBatch,
 )
 from app.models.sales import (
     SalesOrderItemInstance, SalesOrderItem, SalesOrder,
     InstanceStatus, SalesOrderStatus,
 )
-from app.models.foundations import Client
 from app.models.design import ProductMaster, ProductVersion
+from app.models.planning import ScheduleEvent
 from app.services.planning_service import (
     compute_semaphore, compute_semaphore_label,
     trigger_double_green, reopen_as_warranty,
     recalculate_dates_proportionally, LANE_CODES,
+    load_batch_statuses, sync_schedule_events, bulk_reschedule,
 )
+from app.services.instance_context import resolve_instance_context, resolve_instance_contexts
+from app.services import change_tracking, crew_scheduler
+from app.services.crew_scheduler import Crew, CrewRequest, CrewSchedulingError
 
 router = APIRouter()
 
@@ -69,6 +81,21 @@ class ReschedulePayload(BaseModel):
     proportional: bool = True   # True = recalcular cadena; False = solo mover esa píldora
 
 
+class BulkReschedulePayload(BaseModel):
+    """Recorrer delta_days la píldora `lane` de todas las instancias que cumplan los filtros."""
+    lane: str                        # 'PM' | 'PP' | 'IM' | 'IP'
+    delta_days: int
+    proportional: bool = True        # Recorrer también las píldoras siguientes de la cadena
+    dry_run: bool = False            # Vista previa: fechas y semáforos nuevos sin guardar
+    # Filtros (al menos uno)
+    order_id: Optional[int] = None
+    batch_id: Optional[int] = None   # Lote MDF o de PIEDRA
+    street: Optional[str] = None
+    date_from: Optional[date] = None  # Rango sobre la fecha actual del carril
+    date_to: Optional[date] = None
+    instance_ids: Optional[List[int]] = None
+
+
 class CloseInstancePayload(BaseModel):
     signed_at: Optional[datetime] = None  # Si no se envía, usa datetime.utcnow()
 
@@ -92,10 +119,65 @@ class AssignTeamPayload(BaseModel):
     lane: str = "IM"  # "IM" o "IP"
 
 
+class BulkAssignTeamEntry(AssignTeamPayload):
+    instance_id: int
+
+
+class BulkAssignTeamsPayload(BaseModel):
+    assignments: List[BulkAssignTeamEntry]
+    dry_run: bool = False               # Sólo validar y reportar conflictos
+    allow_double_booking: bool = False  # Guardar aunque alguien quede en dos instalaciones encimadas
+
+
+class CrewPayload(BaseModel):
+    leader_user_id: int
+    helper_1_user_id: Optional[int] = None
+    helper_2_user_id: Optional[int] = None
+
+
+class SuggestEventEntry(BaseModel):
+    instance_id: int
+    lane: str = "IM"
+    assignment_date: Optional[date] = None  # Sin fecha: la programada del carril
+
+
+class SuggestTeamsPayload(BaseModel):
+    events: List[SuggestEventEntry]
+    crews: List[CrewPayload]
+    max_shift_days: int = 0  # Días que se puede recorrer un evento si no hay cuadrilla libre
+
+
 # ============================================================
 # HELPERS
 # ============================================================
 
+# Columnas de la instancia que necesita una píldora del calendario (y su semáforo)
+CALENDAR_INSTANCE_COLUMNS = (
+    SalesOrderItemInstance.id,
+    SalesOrderItemInstance.custom_name,
+    SalesOrderItemInstance.production_status,
+    SalesOrderItemInstance.production_batch_id,
+    SalesOrderItemInstance.stone_batch_id,
+    SalesOrderItemInstance.scheduled_prod_mdf,
+    SalesOrderItemInstance.scheduled_prod_stone,
+    SalesOrderItemInstance.scheduled_inst_mdf,
+    SalesOrderItemInstance.scheduled_inst_stone,
+    SalesOrderItemInstance.sales_order_item_id,
+    SalesOrderItemInstance.is_warranty_reopened,
+)
+
+
+# Tablas que leen el calendario y el panel de salud (huella del ETag)
+CALENDAR_TABLES = (
+    ScheduleEvent, SalesOrderItemInstance, SalesOrderItem,
+    ProductVersion, ProductMaster, ProductionBatch,
+)
+HEALTH_TABLES = (
+    SalesOrderItemInstance, SalesOrderItem, SalesOrder, Client,
+    ProductVersion, ProductMaster, ProductionBatch,
+)
+
+
 def _serialize_instance(inst: SalesOrderItemInstance, now: datetime, session: Optional[Session] = None) -> dict:
     """Serializa una instancia con semáforo calculado.
     Si se provee `session`, enriquece con product_name y order_folio del padre."""
@@ -114,24 +196,13 @@ def _serialize_instance(inst: SalesOrderItemInstance, now: datetime, session: Op
     client_name:      Optional[str] = None
     project_name:     Optional[str] = None
     if session:
-        item = session.get(SalesOrderItem, inst.sales_order_item_id)
-        if item:
-            product_name = item.product_name
-            # Walk version → master to get category from design_product_masters
-            if item.origin_version_id:
-                version = session.get(ProductVersion, item.origin_version_id)
-                if version:
-                    master = session.get(ProductMaster, version.master_id)
-                    if master:
-                        product_category = master.category
-            order = session.get(SalesOrder, item.sales_order_id)
-            if order:
-                order_folio  = f"OV-{str(order.id).zfill(4)}"
-                project_name = order.project_name
-                if order.client_id:
-                    client = session.get(Client, order.client_id)
-                    if client:
-                        client_name = client.full_name
+        # Para listas, resolve_instance_contexts() antes del ciclo deja esto en cache
+        ctx = resolve_instance_context(session, inst)
+        product_name     = ctx.product_name
+        product_category = ctx.product_category
+        order_folio      = ctx.order_folio
+        project_name     = ctx.project_name
+        client_name      = ctx.client.full_name if ctx.client else None
 
     return {
         "id": inst.id,
@@ -169,116 +240,104 @@ def _get_instance_or_404(instance_id: int, session: Session) -> SalesOrderItemIn
 
 @router.get("/calendar")
 def get_calendar_feed(
+    request: Request,
+    response: Response,
     year: int,
     month: int,
+    months: int = Query(1, ge=1, le=12),
+    week_start: Optional[date] = None,
     session: Session = Depends(get_session),
     current_user: User = Depends(get_current_active_user),
 ) -> Any:
     """
-    Retorna todas las píldoras (eventos programados) para un mes dado.
+    Retorna todas las píldoras (eventos programados) para una ventana de fechas.
     Cada píldora incluye: qué carril, qué instancia, fecha, semáforo.
+
+    Ventana:
+      - Por defecto el mes (year, month).
+      - `months` > 1 extiende la ventana a varios meses consecutivos.
+      - `week_start` (YYYY-MM-DD) pide sólo los 7 días desde esa fecha (ignora year/month).
+
+    Se sirve desde la proyección indexada schedule_events con UNA consulta de rango
+    (más una para el status de los lotes que alimenta el semáforo).
+    Responde 304 si el cliente ya tiene esta versión (ETag; caduca con la hora por el semáforo).
     """
-    # Construir rango del mes
+    cached = change_tracking.not_modified(
+        request, response, session, CALENDAR_TABLES, scope=(change_tracking.time_bucket(),)
+    )
+    if cached:
+        return cached
+
     from calendar import monthrange
-    _, days_in_month = monthrange(year, month)
-    month_start = datetime(year, month, 1)
-    month_end = datetime(year, month, days_in_month, 23, 59, 59)
+    if week_start is not None:
+        range_start = datetime.combine(week_start, datetime.min.time())
+        range_end = range_start + timedelta(days=7) - timedelta(seconds=1)
+    else:
+        end_year = year + (month - 1 + months - 1) // 12
+        end_month = (month - 1 + months - 1) % 12 + 1
+        _, days_in_end_month = monthrange(end_year, end_month)
+        range_start = datetime(year, month, 1)
+        range_end = datetime(end_year, end_month, days_in_end_month, 23, 59, 59)
 
     now = datetime.utcnow()
 
-    # Buscar todas las instancias que tengan al menos una fecha en el mes
-    stmt = select(SalesOrderItemInstance).where(
-        SalesOrderItemInstance.is_cancelled == False
-    ).where(
-        (
-            (SalesOrderItemInstance.scheduled_prod_mdf >= month_start) &
-            (SalesOrderItemInstance.scheduled_prod_mdf <= month_end)
-        ) | (
-            (SalesOrderItemInstance.scheduled_prod_stone >= month_start) &
-            (SalesOrderItemInstance.scheduled_prod_stone <= month_end)
-        ) | (
-            (SalesOrderItemInstance.scheduled_inst_mdf >= month_start) &
-            (SalesOrderItemInstance.scheduled_inst_mdf <= month_end)
-        ) | (
-            (SalesOrderItemInstance.scheduled_inst_stone >= month_start) &
-            (SalesOrderItemInstance.scheduled_inst_stone <= month_end)
+    # Píldoras en rango + instancia + categoría del producto en un solo join.
+    # Chain: ScheduleEvent → Instancia → SalesOrderItem → ProductVersion → ProductMaster.category
+    # Sólo se leen las columnas que usan la píldora y el semáforo (no la fila completa).
+    stmt = (
+        select(
+            ScheduleEvent.lane,
+            ScheduleEvent.scheduled_at,
+            *CALENDAR_INSTANCE_COLUMNS,
+            ProductMaster.category.label("product_category"),
         )
+        .select_from(ScheduleEvent)
+        .join(SalesOrderItemInstance, SalesOrderItemInstance.id == ScheduleEvent.instance_id)
+        .join(SalesOrderItem, SalesOrderItem.id == SalesOrderItemInstance.sales_order_item_id)
+        .outerjoin(ProductVersion, ProductVersion.id == SalesOrderItem.origin_version_id)
+        .outerjoin(ProductMaster, ProductMaster.id == ProductVersion.master_id)
+        .where(ScheduleEvent.scheduled_at >= range_start)
+        .where(ScheduleEvent.scheduled_at <= range_end)
+        .where(SalesOrderItemInstance.is_cancelled == False)
+        .order_by(ScheduleEvent.scheduled_at, ScheduleEvent.instance_id)
     )
-    instances = session.exec(stmt).all()
+    rows = session.exec(stmt).all()
 
-    # ── Bulk category lookup: 3 queries instead of N×3 ──────────────────────
-    # Chain: SalesOrderItem.origin_version_id → ProductVersion → ProductMaster.category
-    item_ids = list({inst.sales_order_item_id for inst in instances})
-    category_by_item: dict = {}
-    if item_ids:
-        items_q = session.exec(
-            select(SalesOrderItem).where(SalesOrderItem.id.in_(item_ids))
-        ).all()
-        version_ids = [it.origin_version_id for it in items_q if it.origin_version_id]
-        versions_map: dict = {}
-        if version_ids:
-            versions_map = {
-                v.id: v for v in session.exec(
-                    select(ProductVersion).where(ProductVersion.id.in_(version_ids))
-                ).all()
-            }
-        master_ids = list({v.master_id for v in versions_map.values()})
-        masters_map: dict = {}
-        if master_ids:
-            masters_map = {
-                m.id: m for m in session.exec(
-                    select(ProductMaster).where(ProductMaster.id.in_(master_ids))
-                ).all()
-            }
-        for it in items_q:
-            cat = None
-            if it.origin_version_id:
-                ver = versions_map.get(it.origin_version_id)
-                if ver:
-                    mst = masters_map.get(ver.master_id)
-                    if mst:
-                        cat = mst.category
-            category_by_item[it.id] = cat
-    # ────────────────────────────────────────────────────────────────────────
+    # Semáforo: status de lotes precargado en una consulta, una evaluación por instancia.
+    # Las filas exponen los mismos atributos que la instancia (id, production_status, lotes, fechas).
+    batch_statuses = load_batch_statuses(session, rows)
+    semaphore_by_instance: dict = {}
 
     # Construir píldoras por día
     pills_by_day: dict = {}
-    field_map = {
-        "scheduled_prod_mdf":   "PM",
-        "scheduled_prod_stone": "PP",
-        "scheduled_inst_mdf":   "IM",
-        "scheduled_inst_stone": "IP",
-    }
-
-    for inst in instances:
-        semaphore = compute_semaphore(inst, now, session=session)
-        product_category = category_by_item.get(inst.sales_order_item_id)
-        for field, code in field_map.items():
-            dt: Optional[datetime] = getattr(inst, field)
-            if dt is None:
-                continue
-            if not (month_start <= dt <= month_end):
-                continue
-            day_key = dt.strftime("%Y-%m-%d")
-            if day_key not in pills_by_day:
-                pills_by_day[day_key] = []
-            pills_by_day[day_key].append({
-                "instance_id": inst.id,
-                "custom_name": inst.custom_name,
-                "product_category": product_category,
-                "lane": code,
-                "lane_label": f"{code} {inst.custom_name}",
-                "datetime": dt.isoformat(),
-                "semaphore": semaphore,
-                "semaphore_label": compute_semaphore_label(semaphore),
-                "production_status": inst.production_status,
-                "sales_order_item_id": inst.sales_order_item_id,
-                "is_warranty_reopened": inst.is_warranty_reopened,
-            })
+    for inst in rows:
+        code, dt, product_category = inst.lane, inst.scheduled_at, inst.product_category
+        semaphore = semaphore_by_instance.get(inst.id)
+        if semaphore is None:
+            semaphore = compute_semaphore(inst, now, batch_statuses=batch_statuses)
+            semaphore_by_instance[inst.id] = semaphore
+        day_key = dt.strftime("%Y-%m-%d")
+        if day_key not in pills_by_day:
+            pills_by_day[day_key] = []
+        pills_by_day[day_key].append({
+            "instance_id": inst.id,
+            "custom_name": inst.custom_name,
+            "product_category": product_category,
+            "lane": code,
+            "lane_label": f"{code} {inst.custom_name}",
+            "datetime": dt.isoformat(),
+            "semaphore": semaphore,
+            "semaphore_label": compute_semaphore_label(semaphore),
+            "production_status": inst.production_status,
+            "sales_order_item_id": inst.sales_order_item_id,
+            "is_warranty_reopened": inst.is_warranty_reopened,
+        })
 
     return {
         "year": year,
         "month": month,
+        "range_start": range_start.isoformat(),
+        "range_end": range_end.isoformat(),
         "total_pills": sum(len(v) for v in pills_by_day.values()),
         "calendar": pills_by_day,
     }
@@ -290,13 +349,23 @@ def get_calendar_feed(
 
 @router.get("/instances/health")
 def get_health_panel(
+    request: Request,
+    response: Response,
     session: Session = Depends(get_session),
     current_user: User = Depends(get_current_active_user),
 ) -> Any:
     """
     Agrupa todas las instancias activas por color de semáforo.
     Usado por el Panel Lateral de Salud con sus 3 pestañas: 🔴 🟡 🔘
+    Responde 304 si nada cambió en el tramo de ETAG_TIME_BUCKET_SECONDS
+    (el `timestamp` es el de la respuesta que el cliente ya tiene).
     """
+    cached = change_tracking.not_modified(
+        request, response, session, HEALTH_TABLES, scope=(change_tracking.time_bucket(),)
+    )
+    if cached:
+        return cached
+
     now = datetime.utcnow()
 
     stmt = select(SalesOrderItemInstance).where(
@@ -319,6 +388,7 @@ def get_health_panel(
         "WARRANTY": [],
     }
 
+    resolve_instance_contexts(session, instances)
     for inst in instances:
         color = compute_semaphore(inst, now, session=session)
         if color in groups:
@@ -429,6 +499,7 @@ def update_instance_schedule(
             )
 
     session.add(inst)
+    sync_schedule_events(session, [inst])
     session.commit()
     session.refresh(inst)
 
@@ -470,6 +541,7 @@ def reschedule_pill(
         setattr(inst, field, value)
 
     session.add(inst)
+    sync_schedule_events(session, [inst])
     session.commit()
     session.refresh(inst)
 
@@ -480,6 +552,85 @@ def reschedule_pill(
     }
 
 
+@router.post("/reschedule-bulk")
+def reschedule_bulk(
+    payload: BulkReschedulePayload,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_active_user),
+) -> Any:
+    """
+    Recorre delta_days la píldora del carril indicado en todas las instancias que
+    cumplan los filtros (OV, lote, calle, rango de fechas del carril o ids), con
+    el mismo recálculo proporcional del Drag & Drop. Se guardan todas con un solo
+    UPDATE por lotes y las píldoras del calendario se sincronizan en la misma
+    transacción. dry_run=true regresa las fechas y semáforos nuevos sin guardar.
+    Se omiten instancias canceladas, cerradas y sin fecha en ese carril.
+    """
+    fields_by_code = {code: field for field, code in LANE_CODES.items()}
+    moved_field = fields_by_code.get((payload.lane or "").upper())
+    if not moved_field:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Carril inválido '{payload.lane}'. Válidos: {sorted(fields_by_code)}",
+        )
+    if payload.delta_days == 0:
+        raise HTTPException(status_code=400, detail="delta_days no puede ser 0.")
+    if not any([
+        payload.order_id, payload.batch_id, payload.street,
+        payload.date_from, payload.date_to, payload.instance_ids,
+    ]):
+        raise HTTPException(
+            status_code=400,
+            detail="Indica al menos un filtro (order_id, batch_id, street, date_from/date_to o instance_ids).",
+        )
+
+    moved_column = getattr(SalesOrderItemInstance, moved_field)
+    stmt = (
+        select(SalesOrderItemInstance)
+        .where(SalesOrderItemInstance.is_cancelled == False)
+        .where(SalesOrderItemInstance.production_status != InstanceStatus.CLOSED)
+        .where(moved_column != None)
+        .order_by(SalesOrderItemInstance.id)
+    )
+    if payload.order_id:
+        stmt = stmt.join(
+            SalesOrderItem, SalesOrderItem.id == SalesOrderItemInstance.sales_order_item_id
+        ).where(SalesOrderItem.sales_order_id == payload.order_id)
+    if payload.batch_id:
+        stmt = stmt.where(or_(
+            SalesOrderItemInstance.production_batch_id == payload.batch_id,
+            SalesOrderItemInstance.stone_batch_id == payload.batch_id,
+        ))
+    if payload.street:
+        stmt = stmt.where(func.lower(SalesOrderItemInstance.street) == payload.street.strip().lower())
+    if payload.date_from:
+        stmt = stmt.where(moved_column >= datetime.combine(payload.date_from, datetime.min.time()))
+    if payload.date_to:
+        stmt = stmt.where(moved_column <= datetime.combine(payload.date_to, datetime.max.time()))
+    if payload.instance_ids:
+        stmt = stmt.where(SalesOrderItemInstance.id.in_(payload.instance_ids))
+    if not payload.dry_run:
+        stmt = stmt.with_for_update(of=SalesOrderItemInstance)  # Postgres: nadie mueve estas fechas mientras tanto
+    instances = session.exec(stmt).all()
+
+    result = bulk_reschedule(
+        session,
+        instances,
+        moved_field,
+        timedelta(days=payload.delta_days),
+        proportional=payload.proportional,
+        apply=not payload.dry_run,
+    )
+    if not payload.dry_run:
+        session.commit()
+    return {
+        "dry_run": payload.dry_run,
+        "lane": payload.lane.upper(),
+        "delta_days": payload.delta_days,
+        **result,
+    }
+
+
 # ============================================================
 # 5. EVENTO MAESTRO: DOBLE VERDE 🟢🟢
 # ============================================================
@@ -619,91 +770,27 @@ def assign_installation_team(
             detail="Solo DIRECTOR, GERENCIA o DISEÑO pueden asignar equipos.",
         )
 
-    # Validar instancia
-    inst = _get_instance_or_404(instance_id, session)
-
-    if payload.lane not in ("IM", "IP"):
-        raise HTTPException(
-            status_code=400,
-            detail="El carril debe ser IM (Instalación MDF) o IP (Instalación Piedra).",
-        )
-
-    if payload.lane == "IM" and not inst.scheduled_inst_mdf:
-        raise HTTPException(
-            status_code=400,
-            detail="La instancia no tiene fecha IM programada en el calendario.",
-        )
-    if payload.lane == "IP" and not inst.scheduled_inst_stone:
-        raise HTTPException(
-            status_code=400,
-            detail="La instancia no tiene fecha IP programada en el calendario.",
-        )
-
-    # Validar usuarios — todos deben existir y tener rol LOGISTICS
-    leader = session.get(User, payload.leader_user_id)
-    if not leader:
-        raise HTTPException(status_code=404, detail="Usuario Líder no encontrado.")
-    if leader.role != UserRole.LOGISTICS:
-        raise HTTPException(
-            status_code=400,
-            detail=f"El Líder debe tener rol LOGISTICS. Rol actual: {leader.role}",
-        )
-    if payload.helper_1_user_id:
-        h1 = session.get(User, payload.helper_1_user_id)
-        if not h1:
-            raise HTTPException(status_code=404, detail="Ayudante 1 no encontrado.")
-        if h1.role != UserRole.LOGISTICS:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Ayudante 1 debe tener rol LOGISTICS. Rol actual: {h1.role}",
-            )
-    if payload.helper_2_user_id:
-        h2 = session.get(User, payload.helper_2_user_id)
-        if not h2:
-            raise HTTPException(status_code=404, detail="Ayudante 2 no encontrado.")
-        if h2.role != UserRole.LOGISTICS:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Ayudante 2 debe tener rol LOGISTICS. Rol actual: {h2.role}",
-            )
-
-    # Buscar asignación existente para esta instancia, carril (IM/IP) y SCHEDULED
-    # Si existe → reasignar (update). Si no → crear nueva.
-    assignment_dt = datetime.combine(payload.assignment_date, datetime.min.time())
-    stmt = select(InstallationAssignment).where(
-        InstallationAssignment.instance_id == instance_id,
-        InstallationAssignment.lane == payload.lane,
-        InstallationAssignment.status == InstallationAssignmentStatus.SCHEDULED,
-    )
-    existing = session.exec(stmt).first()
-
-    if existing:
-        existing.leader_user_id = payload.leader_user_id
-        existing.helper_1_user_id = payload.helper_1_user_id
-        existing.helper_2_user_id = payload.helper_2_user_id
-        existing.assignment_date = assignment_dt
-        existing.lane = payload.lane
-        session.add(existing)
-        assignment = existing
-    else:
-        assignment = InstallationAssignment(
-            instance_id=instance_id,
-            lane=payload.lane,
-            leader_user_id=payload.leader_user_id,
-            helper_1_user_id=payload.helper_1_user_id,
-            helper_2_user_id=payload.helper_2_user_id,
-            assignment_date=assignment_dt,
-            status=InstallationAssignmentStatus.SCHEDULED,
-        )
-        session.add(assignment)
-
+    # Instancia, carril, fecha programada y cuadrilla los valida el planificador
+    # (una sola carga de usuarios). La doble reserva no bloquea la asignación
+    # individual: se avisa en la respuesta.
+    crew = Crew(payload.leader_user_id, payload.helper_1_user_id, payload.helper_2_user_id)
+    request = CrewRequest(instance_id, payload.lane, payload.assignment_date, crew)
+    plan = crew_scheduler.plan_assignments(session, [request])
+    if plan["errors"]:
+        first = plan["errors"][0]
+        raise HTTPException(status_code=first["status_code"], detail=first["detail"])
+    inst = plan["instances"][instance_id]
+    members = plan["members"]
+
+    # Misma regla que la asignación masiva: reasigna la SCHEDULED del carril o crea una nueva
+    [(assignment, created)] = crew_scheduler.apply_assignments(session, [request])
     session.commit()
     session.refresh(assignment)
 
     # Serializar respuesta enriquecida
-    leader_name = leader.full_name
-    h1_name = session.get(User, payload.helper_1_user_id).full_name if payload.helper_1_user_id else None
-    h2_name = session.get(User, payload.helper_2_user_id).full_name if payload.helper_2_user_id else None
+    leader_name = members[payload.leader_user_id].full_name
+    h1_name = members[payload.helper_1_user_id].full_name if payload.helper_1_user_id else None
+    h2_name = members[payload.helper_2_user_id].full_name if payload.helper_2_user_id else None
 
     return {
         "assignment_id": assignment.id,
@@ -715,5 +802,147 @@ def assign_installation_team(
         "leader": {"id": payload.leader_user_id, "name": leader_name},
         "helper_1": {"id": payload.helper_1_user_id, "name": h1_name} if payload.helper_1_user_id else None,
         "helper_2": {"id": payload.helper_2_user_id, "name": h2_name} if payload.helper_2_user_id else None,
-        "action": "updated" if existing else "created",
+        "action": "created" if created else "updated",
+        "conflicts": plan["conflicts"],
+    }
+
+
+# ============================================================
+# 9. ASIGNACIÓN MASIVA DE CUADRILLAS (IM/IP)
+# ============================================================
+
+def _require_team_planner(current_user: User) -> None:
+    if current_user.role not in {UserRole.DIRECTOR, UserRole.MANAGER, UserRole.DESIGN}:
+        raise HTTPException(
+            status_code=403,
+            detail="Solo DIRECTOR, GERENCIA o DISEÑO pueden asignar equipos.",
+        )
+
+
+def _member_ref(members: dict, user_id: Optional[int]) -> Optional[dict]:
+    if not user_id:
+        return None
+    return {"id": user_id, "name": members[user_id].full_name}
+
+
+@router.post("/assign-teams")
+def bulk_assign_installation_teams(
+    payload: BulkAssignTeamsPayload,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_active_user),
+) -> Any:
+    """
+    (DIRECTOR / GERENCIA / DESIGN)
+    Asigna cuadrillas a muchos eventos IM/IP en una sola transacción (todo o nada).
+    Líderes y ayudantes se validan con una sola consulta. Si alguien queda en dos
+    instalaciones encimadas (contra lo ya programado o dentro del mismo lote) se
+    responde 409 con los conflictos, salvo allow_double_booking=true.
+    dry_run=true sólo valida y regresa lo que se haría.
+    """
+    _require_team_planner(current_user)
+    requests = [
+        CrewRequest(
+            entry.instance_id, entry.lane, entry.assignment_date,
+            Crew(entry.leader_user_id, entry.helper_1_user_id, entry.helper_2_user_id),
+        )
+        for entry in payload.assignments
+    ]
+    try:
+        plan = crew_scheduler.plan_assignments(session, requests)
+    except CrewSchedulingError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+    if plan["errors"]:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "message": f"{len(plan['errors'])} asignación(es) inválida(s). No se guardó ninguna.",
+                "errors": plan["errors"],
+            },
+        )
+    if plan["conflicts"] and not payload.allow_double_booking and not payload.dry_run:
+        raise HTTPException(
+            status_code=409,
+            detail={
+                "message": f"Doble reserva de cuadrilla en {len({c['index'] for c in plan['conflicts']})} "
+                           f"asignación(es). Corrige o envía allow_double_booking=true.",
+                "conflicts": plan["conflicts"],
+            },
+        )
+    if payload.dry_run:
+        return {"dry_run": True, "count": len(requests), "conflicts": plan["conflicts"]}
+
+    applied = crew_scheduler.apply_assignments(session, requests)
+    session.commit()
+
+    members, instances = plan["members"], plan["instances"]
+    return {
+        "count": len(applied),
+        "created": sum(1 for _, created in applied if created),
+        "updated": sum(1 for _, created in applied if not created),
+        "conflicts": plan["conflicts"],
+        "assignments": [
+            {
+                "assignment_id": assignment.id,
+                "instance_id": request.instance_id,
+                "instance_name": instances[request.instance_id].custom_name,
+                "assignment_date": request.assignment_date.isoformat(),
+                "lane": request.lane,
+                "status": assignment.status,
+                "leader": _member_ref(members, request.crew.leader_user_id),
+                "helper_1": _member_ref(members, request.crew.helper_1_user_id),
+                "helper_2": _member_ref(members, request.crew.helper_2_user_id),
+                "action": "created" if created else "updated",
+            }
+            for request, (assignment, created) in zip(requests, applied)
+        ],
     }
+
+
+@router.post("/assign-teams/suggest")
+def suggest_installation_teams(
+    payload: SuggestTeamsPayload,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_active_user),
+) -> Any:
+    """
+    Propone qué cuadrilla va a cada evento sin escribir nada: nadie queda en dos
+    instalaciones encimadas y la carga se reparte (gana la cuadrilla libre con
+    menos días ocupados). La lista `assignments` se puede mandar tal cual a
+    POST /planning/assign-teams.
+    """
+    _require_team_planner(current_user)
+    try:
+        return crew_scheduler.suggest_assignments(
+            session,
+            [(e.instance_id, e.lane, e.assignment_date) for e in payload.events],
+            [Crew(c.leader_user_id, c.helper_1_user_id, c.helper_2_user_id) for c in payload.crews],
+            max_shift_days=payload.max_shift_days,
+        )
+    except CrewSchedulingError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+
+@router.get("/crews/double-bookings")
+def get_crew_double_bookings(
+    date_from: date,
+    date_to: date,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_active_user),
+) -> Any:
+    """Personas con dos instalaciones vigentes (SCHEDULED / IN_PROGRESS) encimadas en el rango."""
+    if date_to < date_from:
+        raise HTTPException(status_code=400, detail="date_to debe ser posterior a date_from.")
+    calendar = crew_scheduler.load_calendar(session, date_from, date_to)
+    first_day, last_day = date_from.isoformat(), date_to.isoformat()
+    overlaps = [
+        o for o in calendar.double_bookings()
+        # La parte encimada debe caer dentro del rango (la agenda trae días previos)
+        if max(o["first"]["date_from"], o["second"]["date_from"]) <= last_day
+        and min(o["first"]["date_to"], o["second"]["date_to"]) >= first_day
+    ]
+    members = crew_scheduler.load_crew_members(session, (o["user_id"] for o in overlaps))
+    return [
+        {**overlap, "user_name": members[overlap["user_id"]].full_name if overlap["user_id"] in members else None}
+        for overlap in overlaps
+    ]
@@ -1,11 +1,13 @@
 import math
-from datetime import datetime
+from datetime import datetime, timezone
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from pydantic import BaseModel
 from typing import List, Optional
-from sqlalchemy import or_, func
+from sqlalchemy import and_, case, or_, func
+from sqlalchemy.orm import aliased
 from sqlmodel import Session, select
+from starlette.concurrency import run_in_threadpool
 
 # Asumiendo que tu dependencia de base de datos está en app.api.deps o app.db.session
 # Ajusta esta importación si tu get_db está en otro lado
@@ -15,9 +17,14 @@ from app.models.production import ProductionBatch, ProductionBatchStatus, PrintJ
 from app.models.foundations import Client
 from app.models.sales import SalesOrderItemInstance, SalesOrderItem, SalesOrder, PaymentStatus, InstanceStatus, CustomerPayment
 from app.models.inventory import InventoryReservation
-from app.models.design import VersionComponent, ProductVersion
+from app.models.design import ProductMaster, ProductVersion, VersionComponent
 from app.models.material import Material
 from app.services.planning_service import compute_semaphore
+from app.services.batch_assignment import BatchAssigner, RTMViolation
+from app.services.stock_mutation import StockMutation
+from app.services import change_tracking, print_dispatch, recipe_index
+from app.services.print_dispatch import PrintDispatchError, wait_and_claim
+from app.services.instance_context import InstanceContext, resolve_instance_context, resolve_instance_contexts
 
 router = APIRouter()
 
@@ -26,6 +33,7 @@ HERRAJES_CATEGORIES = {
     "HERRAJES", "ACCESORIO", "ELECTRICIDAD",
     "ELECTRODOMÉSTICO", "VIDRIO"
 }
+HERRAJES_BUCKETS = recipe_index.normalize_categories(HERRAJES_CATEGORIES)
 
 # --- SCHEMAS DE RESPUESTA EXTENDIDOS (V3.5) ---
 class HerrajeItem(BaseModel):
@@ -210,8 +218,28 @@ def create_production_batch(
     return new_batch
 
 
+# Todo lo que lee el tablero de lotes (huella del ETag). De Material sólo sku,
+# nombre, unidad y categoría (recipe_index): su huella es catalog_updated_at.
+BATCH_BOARD_TABLES = (
+    ProductionBatch, SalesOrderItemInstance, SalesOrderItem, SalesOrder, Client,
+    CustomerPayment, ProductMaster, ProductVersion, VersionComponent, Material.catalog_updated_at,
+)
+
+
 @router.get("/", response_model=List[ProductionBatchResponse])
-def read_batches(current_user: CurrentUser, db: Session = Depends(get_session)):
+def read_batches(
+    current_user: CurrentUser,
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_session),
+):
+    # 304 si el cliente ya tiene esta versión; el semáforo depende de la hora → time_bucket
+    cached = change_tracking.not_modified(
+        request, response, db, BATCH_BOARD_TABLES, scope=(change_tracking.time_bucket(),)
+    )
+    if cached:
+        return cached
+
     batches = db.exec(
         select(ProductionBatch)
         .where(ProductionBatch.status != ProductionBatchStatus.DEAD)
@@ -254,6 +282,11 @@ def read_batches(current_user: CurrentUser, db: Session = Depends(get_session)):
         # 2. Lógica Financiera: Verificar anticipo pagado leyendo directamente de customer_payments
         #    (fuente de verdad, no depende del campo denormalizado sales_orders.payment_status)
         is_payment_cleared = True
+        contexts = resolve_instance_contexts(db, instances)
+        recipes = recipe_index.get_recipes(
+            db, (ctx.item.origin_version_id for ctx in contexts.values() if ctx.item)
+        )
+        target_category = 'PIEDRA' if batch.batch_type.upper() == 'PIEDRA' else 'TABLERO'
         if not instances:
             # Regla: Un lote sin instancias no se puede enviar a producción
             is_payment_cleared = False
@@ -261,11 +294,9 @@ def read_batches(current_user: CurrentUser, db: Session = Depends(get_session)):
             # Reunir los IDs únicos de todas las OVs vinculadas a este lote
             order_ids_in_batch = set()
             for inst in instances:
-                item = db.exec(
-                    select(SalesOrderItem).where(SalesOrderItem.id == inst.sales_order_item_id)
-                ).first()
-                if item:
-                    order_ids_in_batch.add(item.sales_order_id)
+                ctx = contexts.get(inst.id)
+                if ctx and ctx.item:
+                    order_ids_in_batch.add(ctx.item.sales_order_id)
 
             # Opción X: el anticipo es UNA factura (CustomerPayment ADVANCE) que pasa a PAID
             # cuando sus abonos la saldan (register_installment). El lote se libera solo si esa
@@ -287,53 +318,24 @@ def read_batches(current_user: CurrentUser, db: Session = Depends(get_session)):
         batch_data["is_payment_cleared"] = is_payment_cleared
         enriched_instances = []
         for i in instances:
-            order_folio = None
-            client_name = None
-            project_name = None
-
-            item = db.exec(
-                select(SalesOrderItem)
-                .where(SalesOrderItem.id == i.sales_order_item_id)
-            ).first()
-
-            if item:
-                order = db.exec(
-                    select(SalesOrder)
-                    .where(SalesOrder.id == item.sales_order_id)
-                ).first()
-                if order:
-                    order_folio = f"OV-{str(order.id).zfill(4)}"
-                    project_name = order.project_name
-                    if order.client_id:
-                        client = db.exec(
-                            select(Client)
-                            .where(Client.id == order.client_id)
-                        ).first()
-                        if client:
-                            client_name = client.full_name
+            ctx = contexts.get(i.id) or InstanceContext(i.id)
+            item = ctx.item
+            order_folio = ctx.order_folio
+            client_name = ctx.client.full_name if ctx.client else None
+            project_name = ctx.project_name
 
             # Material(es) clave según tipo de lote — lista, no un único material.
             # Redondeo hacia arriba (math.ceil) sobre comp.quantity.
             key_materials_list: List[KeyMaterial] = []
 
             if item and item.origin_version_id:
-                components = db.exec(
-                    select(VersionComponent)
-                    .where(VersionComponent.version_id == item.origin_version_id)
-                ).all()
-                target_category = 'PIEDRA' if batch.batch_type.upper() == 'PIEDRA' else 'TABLERO'
-                for comp in components:
-                    mat = db.get(Material, comp.material_id)
-                    if not mat:
-                        continue
-                    cat = (mat.category or '').upper()
-                    if cat == target_category:
-                        key_materials_list.append(KeyMaterial(
-                            sku=mat.sku,
-                            name=mat.name,
-                            quantity=math.ceil(float(comp.quantity or 0)),
-                            usage_unit=mat.usage_unit or '',
-                        ))
+                for line in recipes.get(item.origin_version_id, {}).get(target_category, ()):
+                    key_materials_list.append(KeyMaterial(
+                        sku=line.sku,
+                        name=line.name,
+                        quantity=math.ceil(line.quantity),
+                        usage_unit=line.usage_unit,
+                    ))
 
             enriched_instances.append(InstanceDetail(
                 id=i.id,
@@ -374,6 +376,7 @@ def assign_instance_to_batch(
     """
     CANDADO RTM: Asigna una instancia (bultos) a un Lote de Producción.
     Aquí validamos que la instancia sea apta para fabricarse.
+    Las reglas y las reservas viven en BatchAssigner (mismo camino que la asignación masiva).
     """
     allowed = {"DESIGN", "ADMIN", "MANAGER", "DIRECTOR"}
     role = current_user.role.value if hasattr(current_user.role, 'value') else str(current_user.role)
@@ -384,104 +387,69 @@ def assign_instance_to_batch(
     batch = db.get(ProductionBatch, batch_id)
     if not batch:
         raise HTTPException(status_code=404, detail="Lote de producción no encontrado.")
-    
-    # 2. Buscar Instancia
+
+    # 2. Candado RTM + reservas de material
+    try:
+        BatchAssigner.assign_many(db, batch, [instance_id])
+    except RTMViolation as e:
+        db.rollback()
+        code = 404 if e.violations[0]["code"] == "NOT_FOUND" else 400
+        raise HTTPException(status_code=code, detail=str(e))
+
+    db.commit()
     instance = db.get(SalesOrderItemInstance, instance_id)
-    if not instance:
-        raise HTTPException(status_code=404, detail="Instancia no encontrada.")
 
-    # ---------------------------------------------------------
-    # 🛡️ REGLAS DEL CANDADO RTM (Release To Manufacturing) 🛡️
-    # ---------------------------------------------------------
-    
-    # Regla A: No procesar nada cancelado
-    if instance.is_cancelled:
-        raise HTTPException(
-            status_code=400, 
-            detail="CANDADO RTM: Esta instancia está cancelada. No puede pasar a producción."
-        )
-    
-    # Regla B: Verificar que el lote correspondiente no esté asignado
-    if batch.batch_type.upper() == "PIEDRA":
-        if instance.stone_batch_id is not None:
-            raise HTTPException(
-                status_code=400,
-                detail=f"CANDADO RTM: Esta instancia ya tiene un "
-                       f"Lote Piedra asignado "
-                       f"(stone_batch_id={instance.stone_batch_id})."
-            )
-    else:  # MDF u otros
-        if instance.production_batch_id is not None:
-            raise HTTPException(
-                status_code=400,
-                detail=f"CANDADO RTM: Esta instancia ya tiene un "
-                       f"Lote MDF asignado "
-                       f"(production_batch_id={instance.production_batch_id})."
-            )
-        
-    # (Futuro) Regla C: Aquí podríamos cruzar con Tesorería para ver si la orden de venta tiene anticipo pagado.
+    return {"message": "Instancia asignada exitosamente al lote", "instance": instance}
 
-    # ---------------------------------------------------------
 
-    # Si pasa los candados, asignamos la llave foránea y cambiamos el estatus
-    if batch.batch_type.upper() == "PIEDRA":
-        instance.stone_batch_id = batch.id
-    else:
-        instance.production_batch_id = batch.id
-    # NO cambiamos production_status aquí.
-    # El status cambia cuando el Jefe mueve el lote a IN_PRODUCTION.
+class BulkAssignBody(BaseModel):
+    instance_ids: List[int]
 
-    db.add(instance)
 
-    # Leer BOM de la instancia para comprometer material
-    item = db.exec(
-        select(SalesOrderItem)
-        .where(SalesOrderItem.id == instance.sales_order_item_id)
-    ).first()
+@router.post("/{batch_id}/assign_instances")
+def bulk_assign_instances_to_batch(
+    *,
+    current_user: CurrentUser,
+    db: Session = Depends(get_session),
+    batch_id: int,
+    body: BulkAssignBody,
+):
+    """
+    CANDADO RTM masivo: asigna varias instancias a un lote en UNA transacción.
+    Todo o nada: si alguna instancia no pasa el candado, no se asigna ninguna
+    y se devuelve el detalle de cada instancia rechazada.
+    """
+    allowed = {"DESIGN", "ADMIN", "MANAGER", "DIRECTOR"}
+    role = current_user.role.value if hasattr(current_user.role, 'value') else str(current_user.role)
+    if role.upper() not in allowed:
+        raise HTTPException(status_code=403, detail="No tienes permisos para esta operación.")
+
+    if not body.instance_ids:
+        raise HTTPException(status_code=400, detail="Debes enviar al menos una instancia.")
 
-    if item and item.origin_version_id:
-        components = db.exec(
-            select(VersionComponent)
-            .where(VersionComponent.version_id == item.origin_version_id)
-        ).all()
+    batch = db.get(ProductionBatch, batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="Lote de producción no encontrado.")
 
-        # Categorías inventariables según tipo de lote
-        if batch.batch_type.upper() == "MDF":
-            skip_categories = {"PROCESO", "PIEDRA"}
-        elif batch.batch_type.upper() == "PIEDRA":
-            skip_categories = {
-                "PROCESO", "TABLERO", "HERRAJES",
-                "CHAPACINTA", "ACCESORIO", "ELECTRICIDAD",
-                "ELECTRODOMÉSTICO", "ESPECIAL",
-                "INSUMOS", "VIDRIO",
-            }
-        else:
-            skip_categories = {"PROCESO"}
-
-        for comp in components:
-            material = db.get(Material, comp.material_id)
-            if material and (material.category or "").upper() in skip_categories:
-                continue
-
-            reservation = InventoryReservation(
-                production_batch_id=batch.id,
-                instance_id=instance.id,
-                material_id=comp.material_id,
-                quantity_reserved=comp.quantity,
-                status="ACTIVA",
-            )
-            db.add(reservation)
-
-            if material:
-                material.committed_stock = (
-                    material.committed_stock or 0.0
-                ) + comp.quantity
-                db.add(material)
+    try:
+        summary = BatchAssigner.assign_many(db, batch, body.instance_ids)
+    except RTMViolation as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "message": f"CANDADO RTM: {len(e.violations)} instancia(s) rechazada(s). No se asignó ninguna.",
+                "violations": e.violations,
+            },
+        )
 
     db.commit()
-    db.refresh(instance)
-    
-    return {"message": "Instancia asignada exitosamente al lote", "instance": instance}
+
+    return {
+        "message": f"{summary['assigned_instances']} instancia(s) asignada(s) al lote {batch.folio}",
+        "batch_id": batch.id,
+        **summary,
+    }
 
 @router.patch("/{batch_id}/status")
 def update_batch_status(batch_id: int, status: str, current_user: CurrentUser, db: Session = Depends(get_session)):
@@ -596,18 +564,13 @@ def delete_production_batch(
         .where(InventoryReservation.status == "ACTIVA")
     ).all()
 
+    mutation = StockMutation(db)
     for res in reservations:
         res.status = "CANCELADA"
         db.add(res)
-
-        material = db.get(Material, res.material_id)
-        if material:
-            material.committed_stock = max(
-                0.0,
-                (material.committed_stock or 0.0) - res.quantity_reserved
-            )
-            db.add(material)
+        mutation.reserve(res.material_id, -(res.quantity_reserved or 0.0), floor_zero=True)
         db.delete(res)
+    mutation.apply()
 
     # 3. Eliminar el lote
     db.delete(batch)
@@ -666,14 +629,7 @@ def get_instance_blueprint(
     if not instance:
         raise HTTPException(status_code=404, detail="Instancia no encontrada.")
 
-    item = db.exec(
-        select(SalesOrderItem)
-        .where(SalesOrderItem.id == instance.sales_order_item_id)
-    ).first()
-    if not item or not item.origin_version_id:
-        return {"blueprint_path": None}
-
-    version = db.get(ProductVersion, item.origin_version_id)
+    version = resolve_instance_context(db, instance).version
     if not version:
         return {"blueprint_path": None}
 
@@ -709,46 +665,25 @@ def get_instance_herrajes(
         )
 
     # Subir cadena para obtener cliente y proyecto
-    item = db.exec(
-        select(SalesOrderItem)
-        .where(SalesOrderItem.id == instance.sales_order_item_id)
-    ).first()
-    order = db.exec(
-        select(SalesOrder)
-        .where(SalesOrder.id == item.sales_order_id)
-    ).first() if item else None
-    client = db.get(Client, order.client_id) \
-        if order and order.client_id else None
-    order_folio = f"OV-{str(order.id).zfill(4)}" if order else None
-
-    # Leer BOM y filtrar herrajes
-    herrajes = []
-    if item and item.origin_version_id:
-        components = db.exec(
-            select(VersionComponent)
-            .where(VersionComponent.version_id ==
-                   item.origin_version_id)
-        ).all()
-        for comp in components:
-            mat = db.get(Material, comp.material_id)
-            if not mat:
-                continue
-            cat = (mat.category or '').upper()
-            # Normalizar ELECTRODOMÉSTICO con o sin tilde
-            cat_norm = cat.replace('É', 'E').replace('Ó', 'O')
-            cats_norm = {
-                c.replace('É', 'E').replace('Ó', 'O')
-                for c in HERRAJES_CATEGORIES
-            }
-            if cat_norm in cats_norm:
-                herrajes.append(HerrajeItem(
-                    material_id=mat.id,
-                    sku=mat.sku,
-                    name=mat.name,
-                    category=mat.category,
-                    quantity=comp.quantity,
-                    usage_unit=mat.usage_unit,
-                ))
+    ctx = resolve_instance_context(db, instance)
+    item, order, client = ctx.item, ctx.order, ctx.client
+    order_folio = ctx.order_folio
+
+    # Receta ya agrupada por categoría (ELECTRODOMÉSTICO con o sin tilde es la misma)
+    herrajes = [
+        HerrajeItem(
+            material_id=line.material_id,
+            sku=line.sku,
+            name=line.name,
+            category=line.category,
+            quantity=line.quantity,
+            usage_unit=line.usage_unit,
+        )
+        for line in recipe_index.lines_in(
+            recipe_index.get_recipe(db, item.origin_version_id if item else None),
+            HERRAJES_BUCKETS,
+        )
+    ]
 
     return HerrajesResponse(
         instance_id=instance_id,
@@ -760,96 +695,152 @@ def get_instance_herrajes(
     )
 
 
+def _status_value(value):
+    return value.value if hasattr(value, 'value') else value
+
+
+def _ready_board_query(since: Optional[datetime] = None):
+    """
+    UNA consulta para el tablero "Listo para Instalar": lote listo + instancia +
+    partida + OV + cliente + estado del lote del otro track.
+    Un lote PIEDRA se liga por stone_batch_id; cualquier otro por production_batch_id.
+    """
+    other = aliased(ProductionBatch)
+    is_stone = func.upper(ProductionBatch.batch_type) == "PIEDRA"
+    stmt = (
+        select(
+            SalesOrderItemInstance.id,
+            SalesOrderItemInstance.custom_name,
+            SalesOrderItemInstance.production_status,
+            SalesOrderItemInstance.qr_code,
+            ProductionBatch.folio,
+            ProductionBatch.batch_type,
+            SalesOrder.id,
+            SalesOrder.project_name,
+            Client.full_name,
+            other.status,
+        )
+        .join(ProductionBatch, or_(
+            and_(is_stone, SalesOrderItemInstance.stone_batch_id == ProductionBatch.id),
+            and_(~is_stone, SalesOrderItemInstance.production_batch_id == ProductionBatch.id),
+        ))
+        .outerjoin(SalesOrderItem, SalesOrderItem.id == SalesOrderItemInstance.sales_order_item_id)
+        .outerjoin(SalesOrder, SalesOrder.id == SalesOrderItem.sales_order_id)
+        .outerjoin(Client, Client.id == SalesOrder.client_id)
+        .outerjoin(other, other.id == case(
+            (is_stone, SalesOrderItemInstance.production_batch_id),
+            else_=SalesOrderItemInstance.stone_batch_id,
+        ))
+        .where(ProductionBatch.status == ProductionBatchStatus.READY_TO_INSTALL)
+        .where(or_(SalesOrderItemInstance.is_cancelled == False, SalesOrderItemInstance.is_cancelled.is_(None)))  # noqa: E712
+        .where(SalesOrderItemInstance.production_status != InstanceStatus.CLOSED)
+        .order_by(ProductionBatch.id, SalesOrderItemInstance.id)
+    )
+    if since is not None:
+        stmt = stmt.where(or_(
+            SalesOrderItemInstance.updated_at > since,
+            ProductionBatch.updated_at > since,
+            other.updated_at > since,
+        ))
+    return stmt
+
+
+def _ready_board_entry(row) -> dict:
+    (instance_id, custom_name, production_status, qr_code, batch_folio, batch_type,
+     order_id, project_name, client_name, other_status) = row
+    return {
+        "id": instance_id,
+        "track": "PIEDRA" if (batch_type or "").upper() == "PIEDRA" else "MDF",
+        "custom_name": custom_name,
+        "production_status": _status_value(production_status),
+        "qr_code": qr_code,
+        "order_folio": f"OV-{str(order_id).zfill(4)}" if order_id else None,
+        "client_name": client_name,
+        "project_name": project_name,
+        "batch_folio": batch_folio,
+        "batch_type": batch_type,
+        "other_track_status": _status_value(other_status),
+    }
+
+
+def _ready_board_removed(db: Session, since: datetime) -> List[dict]:
+    """
+    Tarjetas que pudieron salir del tablero desde `since`: instancias modificadas
+    (cambio de estado, cancelación, cambio de lote) y las de lotes modificados que
+    ya no están listos. Se reporta cada (id, track) que hoy NO está en el tablero;
+    el cliente ignora los que no tenía.
+    """
+    candidates = set()
+    changed_instances = db.exec(
+        select(SalesOrderItemInstance.id).where(SalesOrderItemInstance.updated_at > since)
+    ).all()
+    for instance_id in changed_instances:
+        candidates.add((instance_id, "MDF"))
+        candidates.add((instance_id, "PIEDRA"))
+
+    left_batches = db.exec(
+        select(ProductionBatch.id, ProductionBatch.batch_type)
+        .where(ProductionBatch.updated_at > since)
+        .where(ProductionBatch.status != ProductionBatchStatus.READY_TO_INSTALL)
+    ).all()
+    stone_ids = [bid for bid, btype in left_batches if (btype or "").upper() == "PIEDRA"]
+    mdf_ids = [bid for bid, btype in left_batches if (btype or "").upper() != "PIEDRA"]
+    if stone_ids:
+        for instance_id in db.exec(
+            select(SalesOrderItemInstance.id).where(SalesOrderItemInstance.stone_batch_id.in_(stone_ids))
+        ).all():
+            candidates.add((instance_id, "PIEDRA"))
+    if mdf_ids:
+        for instance_id in db.exec(
+            select(SalesOrderItemInstance.id).where(SalesOrderItemInstance.production_batch_id.in_(mdf_ids))
+        ).all():
+            candidates.add((instance_id, "MDF"))
+
+    if not candidates:
+        return []
+    # Las que siguen en el tablero no se reportan (ya vinieron en items si cambiaron)
+    candidate_ids = sorted({instance_id for instance_id, _ in candidates})
+    still_on_board = set()
+    for start in range(0, len(candidate_ids), 500):
+        chunk = candidate_ids[start:start + 500]
+        for row in db.exec(_ready_board_query().where(SalesOrderItemInstance.id.in_(chunk))).all():
+            entry = _ready_board_entry(row)
+            still_on_board.add((entry["id"], entry["track"]))
+    return [{"id": i, "track": t} for i, t in sorted(candidates - still_on_board)]
+
+
 @router.get("/instances/ready")
-def get_ready_instances(current_user: CurrentUser, db: Session = Depends(get_session)):
+def get_ready_instances(
+    current_user: CurrentUser,
+    response: Response,
+    since: Optional[datetime] = None,
+    db: Session = Depends(get_session),
+):
     """
     Devuelve una entrada POR CADA TRACK LISTO de una instancia.
     Una instancia puede aparecer dos veces si tanto su lote MDF como su lote PIEDRA
     están en READY_TO_INSTALL. Cada entrada representa un track independiente
     que puede instalarse por separado.
-    """
-    # Buscar todos los lotes en READY_TO_INSTALL
-    ready_batches = db.exec(
-        select(ProductionBatch)
-        .where(ProductionBatch.status == ProductionBatchStatus.READY_TO_INSTALL)
-    ).all()
-
-    result = []
-    for batch in ready_batches:
-        is_stone_batch = batch.batch_type.upper() == "PIEDRA"
 
-        # Obtener instancias de este lote
-        if is_stone_batch:
-            instances = db.exec(
-                select(SalesOrderItemInstance)
-                .where(SalesOrderItemInstance.stone_batch_id == batch.id)
-            ).all()
-        else:
-            instances = db.exec(
-                select(SalesOrderItemInstance)
-                .where(SalesOrderItemInstance.production_batch_id == batch.id)
-            ).all()
+    Sin `since`: el tablero completo (lista). Con `since` (el X-Server-Time de la
+    consulta anterior): {"server_time", "items": tarjetas nuevas o modificadas,
+    "removed": [{id, track}] que ya no están en el tablero}. Los cambios sólo en
+    OV o cliente (nombre del proyecto) no cuentan como modificación.
+    """
+    server_time = datetime.utcnow()
+    response.headers["X-Server-Time"] = server_time.isoformat()
 
-        for i in instances:
-            # Omitir instancias canceladas
-            if i.is_cancelled:
-                continue
-            # Omitir instancias ya cerradas globalmente
-            if i.production_status == InstanceStatus.CLOSED:
-                continue
-
-            # Enriquecer con OV/cliente/proyecto
-            order_folio = None
-            client_name = None
-            project_name = None
-
-            item = db.exec(
-                select(SalesOrderItem)
-                .where(SalesOrderItem.id == i.sales_order_item_id)
-            ).first()
-            if item:
-                order = db.exec(
-                    select(SalesOrder)
-                    .where(SalesOrder.id == item.sales_order_id)
-                ).first()
-                if order:
-                    order_folio = f"OV-{str(order.id).zfill(4)}"
-                    project_name = order.project_name
-                    if order.client_id:
-                        client = db.get(Client, order.client_id)
-                        if client:
-                            client_name = client.full_name
-
-            # Estado del otro track (para mostrar indicador en la tarjeta)
-            other_track_status = None
-            if is_stone_batch and i.production_batch_id:
-                other = db.get(ProductionBatch, i.production_batch_id)
-                if other:
-                    other_track_status = other.status.value if hasattr(other.status, 'value') else other.status
-            elif not is_stone_batch and i.stone_batch_id:
-                other = db.get(ProductionBatch, i.stone_batch_id)
-                if other:
-                    other_track_status = other.status.value if hasattr(other.status, 'value') else other.status
-
-            result.append({
-                "id": i.id,
-                "track": "PIEDRA" if is_stone_batch else "MDF",
-                "custom_name": i.custom_name,
-                "production_status": (
-                    i.production_status.value
-                    if hasattr(i.production_status, 'value')
-                    else i.production_status
-                ),
-                "qr_code": i.qr_code,
-                "order_folio": order_folio,
-                "client_name": client_name,
-                "project_name": project_name,
-                "batch_folio": batch.folio,
-                "batch_type": batch.batch_type,
-                "other_track_status": other_track_status,
-            })
+    if since is None:
+        return [_ready_board_entry(row) for row in db.exec(_ready_board_query()).all()]
 
-    return result
+    if since.tzinfo is not None:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    return {
+        "server_time": server_time,
+        "since": since,
+        "items": [_ready_board_entry(row) for row in db.exec(_ready_board_query(since)).all()],
+        "removed": _ready_board_removed(db, since),
+    }
 
 
 @router.patch("/instances/{instance_id}/ready")
@@ -935,16 +926,12 @@ def mark_instance_ready(
                 .where(InventoryReservation.status == "ACTIVA")
             ).all()
 
+            mutation = StockMutation(db)
             for res in dead_reservations:
                 res.status = "CANCELADA"
                 db.add(res)
-                material = db.get(Material, res.material_id)
-                if material:
-                    material.committed_stock = max(
-                        0.0,
-                        (material.committed_stock or 0.0) - res.quantity_reserved
-                    )
-                    db.add(material)
+                mutation.reserve(res.material_id, -(res.quantity_reserved or 0.0), floor_zero=True)
+            mutation.apply()
 
             batch.status = ProductionBatchStatus.DEAD
             db.add(batch)
@@ -975,11 +962,39 @@ class PrintJobCreatedRead(PendingPrintJobRead):
     is_reprint: bool
 
 
+class ClaimedPrintJobRead(PendingPrintJobRead):
+    is_reprint: bool
+    claim_count: int
+    lease_expires_at: datetime
+
+
+@router.post("/print_jobs/claim", response_model=List[ClaimedPrintJobRead])
+async def claim_print_jobs(
+    current_user: CurrentUser,
+    db: Session = Depends(get_session),
+    agent_id: Optional[str] = None,
+    limit: int = 20,
+    wait: float = 25.0,
+):
+    """
+    Long-poll para agentes de impresión: toma (con arrendamiento) los trabajos
+    PENDING y responde en cuanto los hay, o vacío tras `wait` segundos.
+    Cada trabajo llega a UN solo agente; confirmar con /mark_printed?agent_id=.
+    Es POST porque tomar cambia estado (CLAIMED + lease).
+    """
+    agent = agent_id or f"user:{current_user.id}"
+    # `db` es la misma sesión que usó la autenticación: se cierra antes de esperar
+    # para devolver su conexión al pool (el claim abre la suya en el threadpool).
+    await run_in_threadpool(db.close)
+    return await wait_and_claim(agent, limit=limit, wait_seconds=wait)
+
+
 @router.get("/print_jobs/pending", response_model=List[PendingPrintJobRead])
 def list_pending_print_jobs(
     current_user: CurrentUser,
     db: Session = Depends(get_session),
 ):
+    """Legacy: todos los PENDING con su ZPL en cada consulta. Los agentes nuevos usan POST /print_jobs/claim."""
     jobs = db.exec(
         select(PrintJob)
         .where(PrintJob.status == "PENDING")
@@ -1002,15 +1017,29 @@ def list_pending_print_jobs(
 def mark_print_job_printed(
     job_id: int,
     current_user: CurrentUser,
+    agent_id: Optional[str] = None,
     db: Session = Depends(get_session),
 ):
-    job = db.get(PrintJob, job_id)
-    if not job:
-        raise HTTPException(status_code=404, detail="Trabajo de impresión no encontrado.")
-    job.status = "PRINTED"
-    job.printed_at = datetime.utcnow()
-    db.add(job)
-    db.commit()
+    try:
+        job = print_dispatch.acknowledge(db, job_id, agent_id)
+    except PrintDispatchError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return {"ok": True, "job_id": job_id, "status": job.status}
+
+
+@router.post("/print_jobs/{job_id}/release")
+def release_print_job(
+    job_id: int,
+    current_user: CurrentUser,
+    agent_id: Optional[str] = None,
+    error: bool = False,
+    db: Session = Depends(get_session),
+):
+    """El agente devuelve un trabajo tomado que no imprimió (a PENDING, o a ERROR con error=true)."""
+    try:
+        job = print_dispatch.release(db, job_id, agent_id, error=error)
+    except PrintDispatchError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
     return {"ok": True, "job_id": job_id, "status": job.status}
 
 
@@ -1036,6 +1065,7 @@ def reprint_print_job(
     db.add(new_job)
     db.commit()
     db.refresh(new_job)
+    print_dispatch.notify_print_jobs()
     return PrintJobCreatedRead(
         id=new_job.id,
         instance_id=new_job.instance_id,
@@ -3,22 +3,35 @@ from fastapi.responses import StreamingResponse
 from sqlmodel import Session, select, text, Field, SQLModel
 from typing import List, Optional
 from pydantic import BaseModel
-from datetime import datetime, timedelta, date
+from datetime import datetime, date
 from sqlalchemy import func, or_
 from types import SimpleNamespace
 
 from app.models.inventory import PurchaseRequisition, PurchaseOrder, PurchaseOrderItem
 from app.models.material import Material
-from app.models.foundations import Provider, GlobalConfig
+from app.models.foundations import Provider
+from app.models.outbox import OutboundEmail
 from app.models.users import UserRole
 from app.core.deps import get_session, CurrentUser
-from app.services.purchase_manager import PurchaseManager
+from app.services.purchase_manager import PurchaseManager, invalidate_pending_tasks_cache
+from app.services.scheduler import requisition_job
+from app.services.job_runner import enqueue
 from app.services.pdf_generator import PDFGenerator
-from app.services.email_service import send_purchase_order_email
-from app.services.inventory_manager import registrar_movimiento_inventario
+from app.services.config_cache import get_global_config
+from app.services.email_service import compose_purchase_order_email
+from app.services.email_outbox import enqueue_email, email_status, pending_for_purchase_order
+from app.services.purchase_reception import PurchaseReceptionEngine, ReceptionError
 
 router = APIRouter()
 
+
+def _purchases_changed(reevaluate: bool = False) -> None:
+    """Tras cambiar requisiciones u OCs: refresca el contador del menú y, si cambió
+    el tránsito, agenda (con debounce) la evaluación de requisiciones automáticas."""
+    invalidate_pending_tasks_cache()
+    if reevaluate:
+        requisition_job.trigger("PURCHASE_CHANGE")
+
 # --- ESQUEMAS ---
 class ManualOrderItemCreate(BaseModel):
     sku: Optional[str] = ""
@@ -59,12 +72,12 @@ def create_requisition(*, db: Session = Depends(get_session), req_in: Requisitio
     db.add(requisition)
     db.commit()
     db.refresh(requisition)
+    _purchases_changed()
     return requisition
 
 @router.get("/requisitions/", response_model=List[dict])
 def read_requisitions(db: Session = Depends(get_session), skip: int = 0, limit: int = 100):
-    PurchaseManager.evaluate_and_create_automatic_requisitions(db)
-    
+    # Sólo lectura: las requisiciones automáticas las genera la tarea programada (services/scheduler.py)
     result = db.execute(
         text("SELECT * FROM purchase_requisitions LIMIT :limit OFFSET :skip"),
         {"limit": limit, "skip": skip}
@@ -81,6 +94,7 @@ def delete_purchase_requisition(*, db: Session = Depends(get_session), req_id: i
         raise HTTPException(status_code=400, detail="No se puede eliminar una solicitud procesada.")
     db.delete(req)
     db.commit()
+    _purchases_changed(reevaluate=True)
     return {"status": "success"}
 
 @router.put("/requisitions/{req_id}/transfer")
@@ -101,6 +115,7 @@ def update_requisition_status(*, db: Session = Depends(get_session), req_id: int
     db.add(req)
     db.commit()
     db.refresh(req)
+    _purchases_changed(reevaluate=True)
     return req
 
 @router.put("/requisitions/{req_id}/assign")
@@ -209,7 +224,6 @@ def read_purchase_orders(*, db: Session = Depends(get_session), status: str | No
     # 5. Anticipos pagados por OC (facturas ANT- con pagos PAID)
     advance_paid_by_po = {}
     if order_ids:
-        from app.models.finance import PurchaseInvoice, SupplierPayment, PaymentStatus
         _ant_rows = db.exec(text("""
             SELECT po.id as po_id, COALESCE(SUM(sp.amount), 0) as total_paid
             FROM purchase_orders po
@@ -340,6 +354,7 @@ def emit_bulk_purchase_order(*, db: Session = Depends(get_session), data: POCrea
 
     po.total_estimated_amount = total_amount
     db.commit()
+    _purchases_changed(reevaluate=True)
     return {"status": "success", "po_id": po.id, "folio": new_folio}
 
 @router.put("/orders/{po_id}/authorize")
@@ -368,6 +383,7 @@ def authorize_purchase_order(*, db: Session = Depends(get_session), po_id: int,
     db.add(po)
     db.commit() 
     db.refresh(po)
+    _purchases_changed()
     return po
 
 @router.put("/orders/{po_id}/revoke")
@@ -381,6 +397,7 @@ def revoke_purchase_order(*, db: Session = Depends(get_session), po_id: int, cur
     po.authorized_at = None
     db.add(po)
     db.commit()
+    _purchases_changed()
     return {"status": "success"}
 
 @router.post("/orders/{po_id}/reject")
@@ -413,6 +430,7 @@ def reject_purchase_order(*, db: Session = Depends(get_session), po_id: int, act
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Error al rechazar la orden: {str(e)}")
 
+    _purchases_changed(reevaluate=True)
     return {"status": "success", "message": f"Orden rechazada. Acción: {action}"}
 
 @router.delete("/orders/{po_id}/items/{item_id}")
@@ -445,6 +463,7 @@ def remove_item_from_purchase_order(*, db: Session = Depends(get_session), po_id
         db.add(po)
         
     db.commit()
+    _purchases_changed(reevaluate=True)
     return {"status": "success", "message": "Partida removida exitosamente."}
 
 @router.put("/orders/{po_id}/dispatch")
@@ -462,6 +481,7 @@ def dispatch_purchase_order(*, db: Session = Depends(get_session), po_id: int, c
     po.status = "ENVIADA"
     db.add(po)
     db.commit()
+    _purchases_changed()
     return {"status": "success", "message": "Orden despachada exitosamente."}
 
 # --- BOTÓN DE PÁNICO Y RESCATE ---
@@ -494,328 +514,49 @@ def cancel_dispatched_order(*, db: Session = Depends(get_session), po_id: int, c
     
     db.add(po)
     db.commit()
+    _purchases_changed(reevaluate=True)
     return {"status": "success", "message": "Orden cancelada y materiales devueltos a Planeación."}
 
 @router.put("/orders/{po_id}/receive")
 def receive_purchase_order(*, db: Session = Depends(get_session), po_id: int, current_user: CurrentUser, data: dict = Body(...)):
-    from app.models.finance import PurchaseInvoice, SupplierPayment, PaymentStatus, InvoiceStatus
-    
-    po = db.get(PurchaseOrder, po_id)
-    if not po: raise HTTPException(status_code=404, detail="Orden no encontrada")
-
-    po.status = "RECIBIDA_PARCIAL"  # Se ajustará después según items
-    setattr(po, 'invoice_folio_reported', data.get("invoice_folio"))
-    setattr(po, 'invoice_total_reported', data.get("invoice_total"))
-    po.is_advance = False
-    
-    # 1. Ingresar stock físico
-    # Construir diccionarios de cantidades recibidas.
-    # Si el frontend manda item_id, usamos esa clave para soportar múltiples
-    # renglones del mismo SKU (ej. piedra con precios diferentes).
-    # Si no, usamos SKU como antes (compatibilidad hacia atrás).
-    received_map = {}       # sku -> qty (para lógica de stock)
-    edited_by_sku = {}      # sku o item_id -> dict con campos editados
-    edited_by_item_id = {}  # item_id -> dict (tiene prioridad sobre SKU)
-    received_by_item_id = {}  # item_id -> qty (tiene prioridad sobre SKU)
-    for ri in (data.get("received_items") or []):
-        _sku = ri.get("sku", "")
-        _item_id = ri.get("item_id")
-        _rq = ri.get("received_qty")
-        if _rq is None:
-            _rq = ri.get("expected_qty") or 0
-        received_map[_sku] = received_map.get(_sku, 0) + float(_rq)
-        _edit_data = {
-            "sku": ri.get("sku"),
-            "description": ri.get("description"),
-            "unit_cost": ri.get("unit_cost"),
-        }
-        if _item_id:
-            edited_by_item_id[int(_item_id)] = _edit_data
-            received_by_item_id[int(_item_id)] = float(_rq)
-        else:
-            edited_by_sku[_sku] = _edit_data
-
-    # --- 5c parte A: sembrar renglones NUEVOS agregados en la recepción ---
-    # El frontend marca cada renglón agregado con is_new=True y su material_id.
-    # Se crea su PurchaseOrderItem en la OC (quantity_ordered=0) ANTES del loop,
-    # para que el flujo normal (stock, kárdex, factura) lo procese como a cualquier renglón.
-    for ri in (data.get("received_items") or []):
-        if not ri.get("is_new"):
-            continue
-        _new_mat_id = ri.get("material_id")
-        if not _new_mat_id:
-            continue
-        # Evitar duplicar si ya existe un renglón de ese material en la OC
-        _exists = db.exec(
-            select(PurchaseOrderItem).where(
-                PurchaseOrderItem.purchase_order_id == po.id,
-                PurchaseOrderItem.material_id == _new_mat_id,
-            )
-        ).first()
-        if _exists:
-            continue
-        _new_cost = ri.get("unit_cost")
-        _new_item = PurchaseOrderItem(
-            purchase_order_id=po.id,
-            material_id=_new_mat_id,
-            quantity_ordered=0,
-            quantity_received=0,
-            expected_unit_cost=float(_new_cost) if _new_cost is not None else 0.0,
-        )
-        db.add(_new_item)
-    db.flush()  # Asigna id y deja los nuevos items visibles al select siguiente
-
-    items = db.exec(select(PurchaseOrderItem).where(PurchaseOrderItem.purchase_order_id == po.id)).all()
-    all_complete = True
-    invoice_detail_rows = []
-    for item in items:
-        qty_ordered = float(item.quantity_ordered or 0)
-        qty_this_delivery = 0.0
-        mat = db.get(Material, item.material_id) if item.material_id else None
-
-        if item.material_id:
-            mat = db.get(Material, item.material_id)
-            if mat:
-                mat_sku = mat.sku or ""
-                route = (getattr(mat, 'production_route', 'MATERIAL') or 'MATERIAL').upper()
-                if item.id in received_by_item_id:
-                    qty_this_delivery = received_by_item_id[item.id]
-                else:
-                    qty_this_delivery = received_map.get(mat_sku, 0)
-
-                # Solo ingresar stock para materiales físicos
-                if route == 'MATERIAL' and qty_this_delivery > 0:
-                    factor = float(getattr(mat, 'conversion_factor', 1) or 1)
-                    qty_in_usage_units = qty_this_delivery * factor
-                    mat.physical_stock = (mat.physical_stock or 0) + qty_in_usage_units
-                    db.add(mat)
-
-                    # Rastro fechado en el Kárdex (Fase 1): ENTRADA por recepción de OC.
-                    # No altera physical_stock (ya sumado arriba); el commit lo hace el endpoint.
-                    _edited = edited_by_item_id.get(item.id) or edited_by_sku.get(mat_sku, {})
-                    _edited_cost = _edited.get("unit_cost")
-                    _costo_kardex = float(_edited_cost) if _edited_cost is not None else float(getattr(item, 'expected_unit_cost', 0.0) or 0.0)
-                    registrar_movimiento_inventario(
-                        db,
-                        material_id=mat.id,
-                        cantidad=qty_in_usage_units,
-                        tipo="ENTRADA_COMPRA",
-                        costo_unitario=_costo_kardex,
-                        reason_code="RECEPCION_OC",
-                    )
-        else:
-            # Item sin material (descripción libre)
-            if item.id in received_by_item_id:
-                qty_this_delivery = received_by_item_id[item.id]
-            else:
-                qty_this_delivery = received_map.get(item.custom_description or "", 0)
-
-        # Acumular quantity_received para TODOS los items
-        prev_received = float(item.quantity_received or 0)
-        item.quantity_received = prev_received + qty_this_delivery
-        db.add(item)
-
-        # Camino B: juntar snapshot de este renglón para guardarlo si se genera CxP
-        if qty_this_delivery > 0:
-            # Resolver el sku base para buscar lo editado
-            _base_sku = (mat.sku if (item.material_id and mat) else None)
-            _edited = edited_by_item_id.get(item.id) or edited_by_sku.get(_base_sku or "", {})
-            # sku/description/unit_cost EDITADOS con respaldo al comportamiento actual
-            if item.material_id and mat:
-                _desc_default = mat.name
-                _sku_default = mat.sku
-            else:
-                _desc_default = item.custom_description
-                _sku_default = None
-            _final_sku = _edited.get("sku") or _sku_default
-            _final_desc = _edited.get("description") or _desc_default
-            _final_cost = _edited.get("unit_cost")
-            if _final_cost is None:
-                _final_cost = float(getattr(item, 'expected_unit_cost', 0.0) or 0.0)
-            else:
-                _final_cost = float(_final_cost)
-            invoice_detail_rows.append({
-                "purchase_order_item_id": item.id,
-                "material_id": item.material_id,
-                "description": _final_desc,
-                "sku": _final_sku,
-                "quantity_received": qty_this_delivery,
-                "unit_cost": _final_cost,
-            })
+    # Motor de recepción: partidas precargadas, stock atómico y Kárdex en bloque
+    try:
+        PurchaseReceptionEngine.receive(db, po_id, data)
+    except ReceptionError as e:
+        db.rollback()
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
 
-        # Verificar completitud para TODOS los items
-        if qty_ordered > 0 and item.quantity_received < qty_ordered:
-            all_complete = False
+    db.commit()
+    _purchases_changed()
+    return {"status": "success", "message": "Inventario ingresado y finanzas conciliadas."}
 
-    # Determinar status final
-    po.status = "RECIBIDA_TOTAL" if all_complete else "RECIBIDA_PARCIAL"
+class BatchReceptionItem(BaseModel):
+    po_id: int
+    data: dict
 
-    # 2. MATEMÁTICAS DE ANTICIPO VS SALDO
-    ant_invoices = db.exec(select(PurchaseInvoice).where(PurchaseInvoice.invoice_number == f"ANT-{po.folio}")).all()
-    total_pagado_anticipos = 0.0
-    
-    for ant in ant_invoices:
-        # Sumamos solo lo que Tesorería realmente pagó y aprobó
-        pagos = db.exec(select(func.sum(SupplierPayment.amount)).where(
-            SupplierPayment.purchase_invoice_id == ant.id,
-            SupplierPayment.status == getattr(PaymentStatus, "PAID", "PAID")
-        )).one() or 0.0
-        total_pagado_anticipos += float(pagos)
-
-        # Matamos el documento proforma en Finanzas
-        ant.status = getattr(InvoiceStatus, "PAID", "PAID")
-        ant.outstanding_balance = 0
-        db.add(ant)
-
-    # 3. La Resta: Total Real - Lo que ya pagó Finanzas
-    tax_rate = float(data.get("tax_rate", 0.16) or 0.16)
-    # Subtotal calculado del detalle real (suma de qty*unit_cost editado)
-    _subtotal_detalle = sum(r["quantity_received"] * r["unit_cost"] for r in invoice_detail_rows)
-    if _subtotal_detalle > 0:
-        # Hay detalle: el total se calcula del detalle + IVA
-        total_recibido_con_iva = round(_subtotal_detalle * (1 + tax_rate), 2)
-    else:
-        # Respaldo: usar el invoice_total tecleado (comportamiento viejo)
-        total_recibido_con_iva = float(data.get("invoice_total", 0))
-    saldo_restante = total_recibido_con_iva - total_pagado_anticipos
-
-    # Si hay saldo vivo, se genera la deuda en CxP
-    if saldo_restante > 0.01:
-        invoice_folio = data.get("invoice_folio")
-        if invoice_folio:
-            existing_ap = db.exec(text("""
-                SELECT id FROM accounts_payable
-                WHERE provider_id = :prov AND invoice_folio = :folio AND status != 'CANCELADO'
-            """).bindparams(prov=po.provider_id, folio=invoice_folio)).first()
-            if existing_ap:
-                raise HTTPException(status_code=400, detail=f"La factura {invoice_folio} ya está registrada para este proveedor.")
-            existing_inv = db.exec(select(PurchaseInvoice).where(
-                PurchaseInvoice.invoice_number == invoice_folio,
-                PurchaseInvoice.provider_id == po.provider_id
-            )).first()
-            if existing_inv:
-                raise HTTPException(status_code=400, detail=f"La factura {invoice_folio} ya está registrada para este proveedor.")
-
-        prov = db.get(Provider, po.provider_id)
-        credit_days = getattr(prov, 'credit_days', 0) or 0
-        due_date = datetime.now() + timedelta(days=credit_days)
-
-        tax_rate = float(data.get("tax_rate", 0.16) or 0.16)
-        _subtotal = round(saldo_restante / (1 + tax_rate), 2) if (1 + tax_rate) != 0 else saldo_restante
-        _tax_amount = round(saldo_restante - _subtotal, 2)
-
-        new_payable = text("""
-            INSERT INTO accounts_payable (
-                provider_id, purchase_order_id, invoice_folio,
-                total_amount, subtotal, tax_rate, tax_amount,
-                due_date, status, created_at, overhead_category
-            ) VALUES (
-                :prov_id, :po_id, :folio, :total, :subtotal, :tax_rate, :tax_amount,
-                :due, 'PENDIENTE', :now, :category
-            )
-            RETURNING id
-        """)
-        result_ap = db.exec(new_payable.bindparams(
-            prov_id=po.provider_id,
-            po_id=po.id,
-            folio=data.get("invoice_folio"),
-            total=saldo_restante,
-            subtotal=_subtotal,
-            tax_rate=tax_rate,
-            tax_amount=_tax_amount,
-            due=due_date,
-            now=datetime.now(),
-            category=getattr(po, 'overhead_category', None)
-        ))
-        new_ap_id = result_ap.scalar() if hasattr(result_ap, "scalar") else result_ap.first()[0]
-
-        # Camino B: guardar el detalle de materiales que ampara esta CxP/entrega
-        from app.models.finance import PurchaseInvoiceItem
-        for row in invoice_detail_rows:
-            db.add(PurchaseInvoiceItem(
-                accounts_payable_id=new_ap_id,
-                purchase_order_item_id=row["purchase_order_item_id"],
-                material_id=row["material_id"],
-                description=row["description"],
-                sku=row["sku"],
-                quantity_received=row["quantity_received"],
-                unit_cost=row["unit_cost"],
-            ))
+class BatchReceptionRequest(BaseModel):
+    receptions: List[BatchReceptionItem]
 
-    else:
-        # Anticipo cubrió el 100% — crear la factura directamente como PAID
-        # sin pasar por accounts_payable ni _sync_pos_to_invoices
-        from app.models.finance import PurchaseInvoice, InvoiceStatus
-        invoice_folio = data.get("invoice_folio")
-        invoice_total = total_recibido_con_iva if total_recibido_con_iva > 0 else float(data.get("invoice_total", 0))
-        if invoice_folio and invoice_total > 0:
-            # Candado anti-duplicados
-            existing = db.exec(select(PurchaseInvoice).where(
-                PurchaseInvoice.invoice_number == invoice_folio,
-                PurchaseInvoice.provider_id == po.provider_id
-            )).first()
-            if existing:
-                raise HTTPException(status_code=400, detail=f"La factura {invoice_folio} ya está registrada para este proveedor.")
-            tax_rate = float(data.get("tax_rate", 0.16) or 0.16)
-            _subtotal = round(invoice_total / (1 + tax_rate), 2)
-            _tax_amount = round(invoice_total - _subtotal, 2)
-            paid_invoice = PurchaseInvoice(
-                provider_id=po.provider_id,
-                invoice_number=invoice_folio,
-                issue_date=datetime.now().date(),
-                due_date=datetime.now().date(),
-                total_amount=invoice_total,
-                outstanding_balance=0.0,
-                status=getattr(InvoiceStatus, "PAID", "PAID"),
-                subtotal=_subtotal,
-                tax_rate=tax_rate,
-                tax_amount=_tax_amount,
-            )
-            db.add(paid_invoice)
-
-    # --- Cierre diferido de renglones marcados en la recepción ---
-    # El frontend manda items_to_close: lista de purchase_order_item.id a cerrar.
-    # Regla (misma que /no-more): recibido > 0 -> satisfecho; recibido 0 -> cancelado.
-    # Se evalúa con quantity_received YA actualizado por esta recepción.
-    items_to_close = data.get("items_to_close") or []
-    for _item_id in items_to_close:
-        _it = db.get(PurchaseOrderItem, _item_id)
-        if not _it or _it.purchase_order_id != po_id:
-            continue
-        _recibido = float(_it.quantity_received or 0)
-        if _recibido <= 0:
-            _it.is_cancelled = True
-            _it.is_fulfilled = False
-        else:
-            _it.is_fulfilled = True
-            _it.is_cancelled = False
-        _it.cancel_reason = "Cerrado durante recepción"
-        db.add(_it)
-    db.flush()
-
-    # --- Recalcular estado real de la OC (mismo criterio que /no-more) ---
-    _all_items = db.exec(select(PurchaseOrderItem).where(PurchaseOrderItem.purchase_order_id == po_id)).all()
-    _hay_pendiente = False
-    _hay_recibido = False
-    for _it in _all_items:
-        _rec = float(_it.quantity_received or 0)
-        if _it.is_cancelled or _it.is_fulfilled:
-            if _rec > 0:
-                _hay_recibido = True
-            continue
-        _ord = float(_it.quantity_ordered or 0)
-        if _rec > 0:
-            _hay_recibido = True
-        if _ord > 0 and _rec < _ord:
-            _hay_pendiente = True
-    if not _hay_pendiente:
-        po.status = "RECIBIDA_TOTAL" if _hay_recibido else "CANCELADA"
-    else:
-        po.status = "RECIBIDA_PARCIAL"
+@router.post("/orders/receive-batch")
+def receive_purchase_orders_batch(*, db: Session = Depends(get_session), current_user: CurrentUser, body: BatchReceptionRequest):
+    """
+    Recepción de varias OCs (ej. un camión con entregas de varias órdenes) en UNA
+    transacción. Cada `data` es el mismo cuerpo de PUT /orders/{po_id}/receive.
+    Todo o nada: si una OC falla, no se ingresa ninguna.
+    """
+    if not body.receptions:
+        raise HTTPException(status_code=400, detail="No hay órdenes por recibir.")
+    try:
+        results = PurchaseReceptionEngine.receive_many(
+            db, [(r.po_id, r.data) for r in body.receptions]
+        )
+    except ReceptionError as e:
+        db.rollback()
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
 
-    db.add(po)
     db.commit()
-    return {"status": "success", "message": "Inventario ingresado y finanzas conciliadas."}
+    _purchases_changed()
+    return {"status": "success", "message": f"{len(results)} orden(es) recibida(s).", "orders": results}
 
 @router.put("/orders/{po_id}/items/{item_id}/no-more")
 def mark_item_no_more(*, db: Session = Depends(get_session), po_id: int, item_id: int, current_user: CurrentUser, data: dict = Body(...)):
@@ -912,8 +653,7 @@ def report_cost_discrepancy(*, db: Session = Depends(get_session), po_id: int, d
 # --- CEREBRO DE PLANEACIÓN (Corregido el error 500) ---
 @router.get("/planning/consolidated", response_model=List[dict])
 def get_purchase_planning(db: Session = Depends(get_session)):
-    PurchaseManager.evaluate_and_create_automatic_requisitions(db)
-    
+    # Sólo lectura: las requisiciones automáticas las genera la tarea programada (services/scheduler.py)
     reqs = db.exec(
         select(PurchaseRequisition)
         .where(PurchaseRequisition.status.in_(["PENDIENTE", "EN_COMPRA"]))
@@ -969,31 +709,24 @@ def get_purchase_planning(db: Session = Depends(get_session)):
 # --- SINCRONIZADOR DE MENÚ LATERAL (Sin Fantasmas) ---
 @router.get("/notifications/pending-tasks")
 def get_admin_pending_tasks(db: Session = Depends(get_session)):
-    PurchaseManager.evaluate_and_create_automatic_requisitions(db)
-    
-    # 1. Cuenta solo las pendientes reales (Card A)
-    reqs_pendientes = db.execute(
-        text("SELECT COUNT(id) FROM purchase_requisitions WHERE UPPER(status) IN ('PENDIENTE', 'EN_COMPRA')")
-    ).scalar() or 0
-    
-    # 2. Cuenta solo las que están en borrador (Card B)
-    orders_to_authorize = db.execute(
-        text("SELECT COUNT(id) FROM purchase_orders WHERE UPPER(status) = 'DRAFT'")
-    ).scalar() or 0
-
-    # 3. Cuenta solo las autorizadas por despachar (Card C)
-    orders_to_dispatch = db.execute(
-        text("SELECT COUNT(id) FROM purchase_orders WHERE UPPER(status) = 'AUTORIZADA'")
-    ).scalar() or 0
-    
-    # Total exacto y transparente
-    total_general = reqs_pendientes + orders_to_authorize + orders_to_dispatch
-    
-    return {
-        "pending_requisitions": reqs_pendientes,
-        "orders_to_authorize": orders_to_authorize,
-        "total_alerts": total_general 
-    }
+    # Contador barato (cache de pocos segundos); Card A + Card B + Card C
+    return PurchaseManager.get_pending_task_counts(db)
+
+# --- TAREA PROGRAMADA: EVALUACIÓN DE REQUISICIONES AUTOMÁTICAS ---
+@router.get("/planning/evaluation-status")
+def get_requisition_evaluation_status(db: Session = Depends(get_session)):
+    """Última corrida de la evaluación automática de requisiciones y la siguiente agendada."""
+    return requisition_job.status(db)
+
+@router.post("/planning/evaluate")
+def run_requisition_evaluation(*, db: Session = Depends(get_session), current_user: CurrentUser):
+    """
+    Botón 'Recalcular' de Compras: encola la evaluación como trabajo y responde de
+    inmediato con él; el avance y las requisiciones creadas se consultan en /jobs/{id}.
+    """
+    if current_user.role.upper() not in ["ADMIN", "MANAGER", "DIRECTOR"]:
+        raise HTTPException(status_code=403, detail="No tienes permisos para esta operación.")
+    return enqueue(db, "REQUISITION_SWEEP", user_id=current_user.id)
 
 @router.get("/orders/{po_id}/pdf")
 def download_purchase_order_pdf(po_id: int, db: Session = Depends(get_session)):
@@ -1034,7 +767,7 @@ def download_purchase_order_pdf(po_id: int, db: Session = Depends(get_session)):
     provider = db.get(Provider, po.provider_id)
     if not provider: raise HTTPException(status_code=404, detail="Proveedor no encontrado")
         
-    config = db.exec(select(GlobalConfig)).first()
+    config = get_global_config(db)
     
     pdf_gen = PDFGenerator()
     pdf_buffer = pdf_gen.generate_po_pdf(order=mock_po, provider=provider, config=config)
@@ -1299,13 +1032,23 @@ def send_purchase_order_by_email(
     if not to_email or "@" not in to_email:
         raise HTTPException(status_code=400, detail="Correo del proveedor inválido")
 
-    config = db.exec(select(GlobalConfig)).first()
+    config = get_global_config(db)
     if not config or not config.smtp_email or not config.smtp_password:
         raise HTTPException(
             status_code=400,
             detail="Configura el correo de envío en Ajustes antes de usar esta función (smtp_email y smtp_password en GlobalConfig)."
         )
 
+    # Si ya hay un envío pendiente de esta OC, no se encola otro
+    pending = pending_for_purchase_order(db, po.id)
+    if pending:
+        return {
+            "status": "queued",
+            "message": f"OC {po.folio} ya está en cola de envío a {pending.to_email}",
+            "tracking_id": pending.tracking_id,
+            "email_status": pending.status,
+        }
+
     # Generar PDF
     items = db.exec(
         select(PurchaseOrderItem).where(PurchaseOrderItem.purchase_order_id == po.id)
@@ -1345,41 +1088,46 @@ def send_purchase_order_by_email(
         raise HTTPException(status_code=404, detail="Proveedor no encontrado")
 
     company_name = getattr(config, "company_name", "Valentina") or "Valentina"
-    smtp_host = getattr(config, "smtp_host", None) or "smtp.gmail.com"
 
     pdf_gen = PDFGenerator()
     pdf_buffer = pdf_gen.generate_po_pdf(
         order=mock_po, provider=provider, config=config
     )
 
-    try:
-        send_purchase_order_email(
-            smtp_host=smtp_host,
-            smtp_email=config.smtp_email,
-            smtp_password=config.smtp_password,
-            to_email=to_email,
-            provider_name=provider.business_name,
-            folio=po.folio,
-            pdf_buffer=pdf_buffer,
-            company_name=company_name
-        )
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error al enviar el correo: {str(e)}"
-        )
-
-    # Marcar como ENVIADA automáticamente
-    po.status = "ENVIADA"
-    db.add(po)
-    db.commit()
+    # Se encola: el hilo de envío entrega el correo y marca la OC como ENVIADA
+    content = compose_purchase_order_email(provider.business_name, po.folio, company_name)
+    email = enqueue_email(
+        db,
+        sender_name=company_name,
+        sender_email=config.smtp_email,
+        to_email=to_email,
+        cc=[config.smtp_email],
+        subject=content["subject"],
+        text_content=content["text_content"],
+        attachment_name=content["attachment_name"],
+        attachment_content=pdf_buffer.getvalue(),
+        kind="PURCHASE_ORDER",
+        purchase_order_id=po.id,
+        user_id=current_user.id,
+    )
 
     return {
-        "status": "success",
-        "message": f"OC {po.folio} enviada por correo a {to_email}"
+        "status": "queued",
+        "message": f"OC {po.folio} en cola de envío a {to_email}",
+        "tracking_id": email.tracking_id,
+        "email_status": email.status,
     }
 
 
+@router.get("/emails/{tracking_id}")
+def get_email_status(*, db: Session = Depends(get_session), tracking_id: str, current_user: CurrentUser):
+    """Estado de un correo encolado (QUEUED, SENDING, SENT o FAILED)."""
+    email = db.exec(select(OutboundEmail).where(OutboundEmail.tracking_id == tracking_id)).first()
+    if not email:
+        raise HTTPException(status_code=404, detail="Correo no encontrado")
+    return email_status(email)
+
+
 @router.put("/orders/{po_id}/items/{item_id}/correct-reception")
 def correct_reception_item(*, db: Session = Depends(get_session), po_id: int, item_id: int, current_user: CurrentUser, data: dict = Body(...)):
     """
@@ -1389,7 +1137,7 @@ def correct_reception_item(*, db: Session = Depends(get_session), po_id: int, it
            con pagos aplicados -> SOLO GERENCIA.
     """
     from app.models.finance import PurchaseInvoice, SupplierPayment, PurchaseInvoiceItem
-    from app.services.inventory_manager import registrar_movimiento_inventario
+    from app.services.stock_mutation import StockMutation
     try:
         po = db.get(PurchaseOrder, po_id)
         if not po:
@@ -1445,16 +1193,13 @@ def correct_reception_item(*, db: Session = Depends(get_session), po_id: int, it
         if mat and (getattr(mat, 'production_route', 'MATERIAL') or 'MATERIAL').upper() == 'MATERIAL':
             factor = float(getattr(mat, 'conversion_factor', 1) or 1)
             qty_units = delta * factor
-            mat.physical_stock = (mat.physical_stock or 0) - qty_units
-            db.add(mat)
-            registrar_movimiento_inventario(
-                db,
-                material_id=mat.id,
-                cantidad=-qty_units,
-                tipo="AJUSTE_CORRECCION",
-                costo_unitario=costo,
+            StockMutation(db).add(
+                mat.id,
+                -qty_units,
+                "AJUSTE_CORRECCION",
+                unit_cost=costo,
                 reason_code="CORRECCION_RECEPCION",
-            )
+            ).apply()
 
         # --- 2) Ajustar la CxP (y su gemela) por el monto revertido ---
         monto_revertido = delta * costo
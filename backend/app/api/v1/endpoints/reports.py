@@ -9,9 +9,10 @@ from sqlmodel import select
 
 from app.core.deps import SessionDep, CurrentUser
 from app.models.finance import SupplierPayment, PaymentStatus, PaymentMethod, PurchaseInvoice, InvoiceStatus
-from app.models.foundations import Provider, GlobalConfig
+from app.models.foundations import Provider
 from app.models.users import User
 from app.services.pdf_generator import PDFGenerator
+from app.services.config_cache import get_global_config
 
 router = APIRouter()
 
@@ -308,7 +309,7 @@ def supplier_payments_report_pdf(
     )
 
     status_label = STATUS_FILTER_LABELS.get(status_filter, status_filter)
-    config = session.exec(select(GlobalConfig)).first()
+    config = get_global_config(session)
 
     payments_payload = [
         {
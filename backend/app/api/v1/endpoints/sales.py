@@ -1,10 +1,10 @@
-from typing import Optional, List, Any, Dict
+from typing import Optional, List, Any, Dict, Union
 from pydantic import BaseModel
 from datetime import datetime
 import math
-from fastapi import APIRouter, Depends, HTTPException, status, Body, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Body, Query, Request, Response
 from sqlmodel import Session, select, delete
-from sqlalchemy import func
+from sqlalchemy import func, or_
 from sqlalchemy.orm import selectinload
 from fastapi.responses import StreamingResponse
 
@@ -19,15 +19,17 @@ from app.models.sales import (
 )
 from app.models.design import ProductVersion
 from app.models.material import Material
-from app.models.foundations import TaxRate, GlobalConfig, Client
+from app.models.foundations import Client
 from app.models.users import User, UserRole
 from app.services.pdf_generator import PDFGenerator
+from app.services import change_tracking
 
 # --- IMPORTAMOS LOS MOTORES (V3.5) ---
 from app.services.cost_engine import CostEngine
+from app.services.config_cache import get_global_config, get_tax_rate
 
 from app.schemas.sales_schema import (
-    SalesOrderCreate, SalesOrderRead, SalesOrderUpdate,
+    SalesOrderCreate, SalesOrderRead, SalesOrderUpdate, SalesOrderDelta,
     SalesOrderItemCreate,
     AddItemsPayload,
     CustomerPaymentRead,
@@ -149,7 +151,7 @@ def _recalculate_order_totals(session: Session, order: SalesOrder) -> None:
     session.refresh(order)
     items_sum = sum(float(it.subtotal_price or 0.0) for it in order.items)
 
-    tax_rate_obj = session.get(TaxRate, order.tax_rate_id)
+    tax_rate_obj = get_tax_rate(session, order.tax_rate_id)
     tax_multiplier = tax_rate_obj.rate if tax_rate_obj else 0.16
 
     comm_percent = order.applied_commission_percent or 0.0
@@ -181,7 +183,7 @@ def create_sales_order(
     current_user: User = Depends(get_current_active_user)
 ):
     try:
-        tax_rate = session.get(TaxRate, order_in.tax_rate_id)
+        tax_rate = get_tax_rate(session, order_in.tax_rate_id)
         if not tax_rate: raise HTTPException(status_code=400, detail="Tasa de impuestos inválida")
 
         raw_commission = current_user.commission_rate if current_user.commission_rate is not None else 0.0
@@ -282,29 +284,75 @@ def create_sales_order(
 # ==========================================
 # 2. LISTAR ORDENES
 # ==========================================
-@router.get("/orders", response_model=List[SalesOrderRead])
+# Todo lo que entra en el listado de órdenes (huella del ETag)
+ORDER_LIST_TABLES = (
+    SalesOrder, SalesOrderItem, SalesOrderItemInstance, CustomerPayment, Client, User,
+)
+
+
+@router.get("/orders", response_model=Union[List[SalesOrderRead], SalesOrderDelta])
 def read_sales_orders(
+    request: Request,
+    response: Response,
     status: SalesOrderStatus | None = None,
     client_id: int | None = None,
+    since: Optional[datetime] = None,
     session: Session = Depends(get_session),
     current_user: User = Depends(get_current_active_user)
 ):
     """
     Listado de órdenes: SALES/VENTAS → solo `user_id` del asesor; staff (ADMIN, GERENCIA, DIRECTOR, …)
     → sin filtro por vendedor (misma amplitud que monitor de administración).
+
+    Responde 304 si el cliente ya tiene esta versión (If-None-Match).
+    Con `since` (el server_time de la respuesta anterior) regresa sólo las OVs que cambiaron
+    ellas, sus partidas, instancias, pagos o su cliente, más los ids vigentes del listado.
     """
-    query = select(SalesOrder).options(
+    cached = change_tracking.not_modified(request, response, session, ORDER_LIST_TABLES, current_user)
+    if cached:
+        return cached
+    server_time = datetime.utcnow()
+    response.headers["X-Server-Time"] = server_time.isoformat()
+
+    filters = []
+    if _is_seller_scoped_role(current_user):
+        filters.append(SalesOrder.user_id == current_user.id)
+    if status: filters.append(SalesOrder.status == status)
+    if client_id: filters.append(SalesOrder.client_id == client_id)
+    query = select(SalesOrder).where(*filters).options(
         selectinload(SalesOrder.client),
         selectinload(SalesOrder.items).selectinload(SalesOrderItem.instances),
         selectinload(SalesOrder.payments),
         selectinload(SalesOrder.user)
     )
-    if _is_seller_scoped_role(current_user):
-        query = query.where(SalesOrder.user_id == current_user.id)
-    if status: query = query.where(SalesOrder.status == status)
-    if client_id: query = query.where(SalesOrder.client_id == client_id)
-    
-    return session.exec(query.order_by(SalesOrder.id.desc())).unique().all()
+
+    if since is None:
+        return session.exec(query.order_by(SalesOrder.id.desc())).unique().all()
+
+    # Las bajas de partidas/instancias recalculan la OV (_recalculate_order_totals), que se marca sola
+    cutoff = change_tracking.since_cutoff(since)
+    changed = query.where(or_(
+        SalesOrder.updated_at > cutoff,
+        SalesOrder.id.in_(
+            select(SalesOrderItem.sales_order_id).where(SalesOrderItem.updated_at > cutoff)
+        ),
+        SalesOrder.id.in_(
+            select(SalesOrderItem.sales_order_id)
+            .join(SalesOrderItemInstance, SalesOrderItemInstance.sales_order_item_id == SalesOrderItem.id)
+            .where(SalesOrderItemInstance.updated_at > cutoff)
+        ),
+        SalesOrder.id.in_(
+            select(CustomerPayment.sales_order_id).where(CustomerPayment.updated_at > cutoff)
+        ),
+        SalesOrder.client_id.in_(select(Client.id).where(Client.updated_at > cutoff)),
+    ))
+    ids_query = select(SalesOrder.id).where(*filters).order_by(SalesOrder.id.desc())
+    return {
+        "server_time": server_time,
+        "since": since,
+        "items": session.exec(changed.order_by(SalesOrder.id.desc())).unique().all(),
+        "ids": list(session.exec(ids_query).all()),
+    }
 
 # ==========================================
 # 3. DETALLE ORDEN
@@ -498,7 +546,7 @@ def update_sales_order(
         real_subtotal = base_products_sum
         
         # Obtenemos la tasa de IVA (por defecto 16%)
-        tax_rate_obj = session.get(TaxRate, db_order.tax_rate_id)
+        tax_rate_obj = get_tax_rate(session, db_order.tax_rate_id)
         tax_multiplier = tax_rate_obj.rate if tax_rate_obj else 0.16
         
         # Calculamos el IVA sobre el subtotal que ya incluye la comisión
@@ -611,7 +659,7 @@ def add_items_to_order(
     session.refresh(order)
     _create_instances_for_order(session, order)
 
-    tax_rate_obj = session.get(TaxRate, order.tax_rate_id)
+    tax_rate_obj = get_tax_rate(session, order.tax_rate_id)
     tax_multiplier = tax_rate_obj.rate if tax_rate_obj else 0.16
 
     nuevo_subtotal = (order.subtotal or 0.0) + added_sum
@@ -1070,7 +1118,7 @@ def confirm_cxc_payment(order_id: int, cxc_id: int, session: Session = Depends(g
         order.status = SalesOrderStatus.FINISHED
 
     # --- BASE ANTES DE IVA ---
-    tax_rate_obj = session.get(TaxRate, order.tax_rate_id)
+    tax_rate_obj = get_tax_rate(session, order.tax_rate_id)
     tax_multiplier = tax_rate_obj.rate if tax_rate_obj else 0.16
     base_before_tax = cxc.amount / (1.0 + tax_multiplier)
 
@@ -1114,7 +1162,7 @@ def _liberar_comision_anticipo(session, order, payment, base_con_iva):
     TOTAL del anticipo (base_con_iva = importe de la factura de anticipo), replicando la
     misma lógica de comisión vendedor + directores globales de confirm_cxc_payment.
     """
-    tax_rate_obj = session.get(TaxRate, order.tax_rate_id)
+    tax_rate_obj = get_tax_rate(session, order.tax_rate_id)
     tax_multiplier = tax_rate_obj.rate if tax_rate_obj else 0.16
     base_before_tax = base_con_iva / (1.0 + tax_multiplier)
 
@@ -1233,7 +1281,7 @@ def download_quote_pdf(order_id: int, session: Session = Depends(get_session)):
         raise HTTPException(status_code=404, detail="Cotización no encontrada")
 
     client = session.get(Client, order.client_id) if order.client_id else None
-    config = session.exec(select(GlobalConfig)).first()
+    config = get_global_config(session)
     seller = session.get(User, order.user_id) if order.user_id else None
     
     seller_name = seller.full_name if seller else "Departamento de Ventas"
@@ -0,0 +1,36 @@
+"""
+search.py  –  Búsqueda unificada (ver app/services/search_index.py)
+
+Rutas:
+  GET  /search?q=...          → OV, casas, QR (de casa o de bulto), OC y materiales por relevancia
+       &types=order,material  → Limitar a esos tipos (order, instance, purchase_order, material)
+       &limit=20              → Máximo de resultados (tope 50)
+"""
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException
+
+from app.core.deps import CurrentUser, SessionDep
+from app.services import search_index
+
+router = APIRouter()
+
+
+@router.get("/")
+def search(
+    session: SessionDep,
+    current_user: CurrentUser,
+    q: str,
+    types: Optional[str] = None,
+    limit: int = 20,
+):
+    wanted = None
+    if types:
+        wanted = [t.strip().lower() for t in types.split(",") if t.strip()]
+        unknown = sorted(set(wanted) - set(search_index.SEARCH_TYPES))
+        if unknown:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Tipos no válidos: {', '.join(unknown)}. Use: {', '.join(search_index.SEARCH_TYPES)}.",
+            )
+    return search_index.search(session, q, types=wanted, limit=limit)
@@ -6,7 +6,7 @@ from sqlmodel import Session, select
 from app.core.database import get_session
 from app.core.security import get_password_hash
 # --- IMPORTANTE: Necesitamos esto para identificar al usuario logueado ---
-from app.core.deps import get_current_active_user 
+from app.core.deps import get_current_active_user, invalidate_principal_cache
 
 # 2. Importaciones de tus Modelos
 from app.models.users import User, UserCreate, UserUpdate, UserPublic, UserRole
@@ -106,6 +106,7 @@ def update_user(
 
     session.add(user_db)
     session.commit()
+    invalidate_principal_cache(user_id)
     session.refresh(user_db)
     return user_db
 
@@ -131,4 +132,5 @@ def delete_user(
     
     session.delete(user)
     session.commit()
+    invalidate_principal_cache(user_id)
     return {"ok": True}
\ No newline at end of file
@@ -24,6 +24,54 @@ class Settings(BaseSettings):
 
     DATABASE_URL: str = "sqlite:///./local_dev.db"
 
+    # Tareas programadas (app/services/scheduler.py)
+    SCHEDULER_ENABLED: bool = True
+    REQUISITION_EVAL_INTERVAL_SECONDS: int = 15 * 60   # Corrida periódica de respaldo
+    REQUISITION_EVAL_DEBOUNCE_SECONDS: int = 30        # Espera tras un movimiento de stock
+    REQUISITION_EVAL_MAX_DELAY_SECONDS: int = 5 * 60   # Tope si los movimientos no paran
+
+    # Contraseñas (app/core/security.py)
+    BCRYPT_ROUNDS: int = 12               # Al cambiarlo, cada hash se actualiza en el siguiente login
+    PASSWORD_HASH_WORKERS: int = 2        # Hilos dedicados a bcrypt por proceso
+    PASSWORD_HASH_MAX_PENDING: int = 64   # Logins en espera antes de responder 503
+
+    # Cache de usuarios autenticados (app/core/deps.py)
+    AUTH_CACHE_TTL_SECONDS: int = 60      # 0 = sin cache (cada request lee la tabla users)
+    AUTH_CACHE_MAX_USERS: int = 1024
+
+    # Cache de GlobalConfig, impuestos y logo (app/services/config_cache.py)
+    CONFIG_CACHE_TTL_SECONDS: int = 5 * 60  # Lo que tarda otro proceso en ver un cambio
+
+    # Índice de recetas por categoría (app/services/recipe_index.py)
+    RECIPE_INDEX_TTL_SECONDS: int = 5 * 60  # Lo que tarda otro proceso en ver una receta o material editado
+
+    # Búsqueda unificada (app/services/search_index.py)
+    SEARCH_MIN_SCORE: float = 0.3            # Parecido mínimo (0-1) para que un resultado aparezca
+    SEARCH_SQLITE_REFRESH_SECONDS: int = 60  # Sólo SQLite: cada cuánto se reconstruye search_fts
+
+    # ETag y ?since= de los listados pesados (app/services/change_tracking.py)
+    CHANGE_TRACKING_LAG_SECONDS: int = 60    # Margen para transacciones que confirman tarde
+    ETAG_TIME_BUCKET_SECONDS: int = 5 * 60   # Vida del ETag de vistas con semáforos que dependen de la hora
+
+    # Despacho de etiquetas a agentes de impresión (app/services/print_dispatch.py)
+    PRINT_LEASE_SECONDS: int = 120         # Sin confirmar en este tiempo = agente caído, se reasigna
+    PRINT_LONG_POLL_MAX_SECONDS: int = 30  # Tope de espera de POST /print_jobs/claim
+    PRINT_RECHECK_SECONDS: int = 3         # Revisión de la BD durante la espera (trabajos de otros procesos)
+
+    # Trabajos en segundo plano (app/services/job_runner.py)
+    JOB_WORKERS: int = 2                  # Hilos por proceso; 0 = no procesar trabajos aquí
+    JOB_POLL_SECONDS: int = 2             # Revisión de la cola (trabajos de otros procesos)
+    JOB_LEASE_SECONDS: int = 15 * 60      # Sin latido en este tiempo = trabajador caído, se reencola
+    JOB_RETRY_BASE_SECONDS: int = 30      # Espera del 1er reintento; se duplica en cada uno
+
+    # Bandeja de salida de correo (app/services/email_outbox.py)
+    EMAIL_TRANSPORT: str = "brevo"        # brevo | fake (pruebas: no sale nada a internet)
+    EMAIL_SENDER_ENABLED: bool = True
+    EMAIL_POLL_SECONDS: int = 10
+    EMAIL_BATCH_SIZE: int = 20            # Correos tomados por vuelta (misma conexión HTTPS)
+    EMAIL_RETRY_BASE_SECONDS: int = 60    # Espera del 1er reintento; se duplica en cada uno
+    EMAIL_SEND_TIMEOUT_SECONDS: int = 30
+
     # Google Cloud
     GOOGLE_APPLICATION_CREDENTIALS: Optional[str] = None
     GOOGLE_CLOUD_BUCKET_NAME: Optional[str] = None
@@ -1,22 +1,22 @@
-from typing import Generator, Annotated
+import threading
+import time
+from collections import OrderedDict
+from typing import Annotated, Dict, Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
 from pydantic import ValidationError
+from sqlalchemy.orm import make_transient_to_detached
 from sqlmodel import Session, select
 
-from app.core.database import engine
+# 1. Generador de Sesión de Base de Datos
+# Es LA MISMA función que app.core.database.get_session: FastAPI resuelve una
+# dependencia una sola vez por request, así que la autenticación y el handler
+# comparten la sesión sin importar de qué módulo la importe cada endpoint.
+from app.core.database import get_session
 from app.core.config import settings
 from app.models.users import User
 
-# 1. Generador de Sesión de Base de Datos
-def get_session() -> Generator[Session, None, None]:
-    """
-    Crea una sesión nueva por cada request y la cierra al terminar.
-    """
-    with Session(engine) as session:
-        yield session
-
 # Definición de la Dependencia de Sesión
 SessionDep = Annotated[Session, Depends(get_session)]
 
@@ -25,7 +25,62 @@ reusable_oauth2 = OAuth2PasswordBearer(
     tokenUrl=f"{settings.API_V1_STR}/login/access-token"
 )
 
-# 3. Obtener Usuario Actual (Base)
+# 3. Cache de usuarios autenticados (por proceso)
+# Evita leer la tabla users en cada request. Guarda los valores de las columnas
+# por id (LRU acotado + TTL); users.py invalida al crear/editar/borrar. Con
+# varios procesos, un cambio hecho en otro proceso se ve al vencer el TTL.
+_principal_cache: "OrderedDict[int, tuple]" = OrderedDict()
+_principal_lock = threading.Lock()
+
+
+def invalidate_principal_cache(user_id: Optional[int] = None) -> None:
+    """Olvida un usuario (o todos) para que el siguiente request lo lea de la BD."""
+    with _principal_lock:
+        if user_id is None:
+            _principal_cache.clear()
+        else:
+            _principal_cache.pop(user_id, None)
+
+
+def _cache_principal(user: User) -> None:
+    if settings.AUTH_CACHE_TTL_SECONDS <= 0:
+        return
+    values = {column.key: getattr(user, column.key) for column in User.__table__.columns}
+    with _principal_lock:
+        _principal_cache[user.id] = (time.monotonic() + settings.AUTH_CACHE_TTL_SECONDS, values)
+        _principal_cache.move_to_end(user.id)
+        while len(_principal_cache) > settings.AUTH_CACHE_MAX_USERS:
+            _principal_cache.popitem(last=False)
+
+
+def _cached_principal(session: Session, user_id) -> Optional[User]:
+    """Usuario desde el cache, ligado a la sesión del request sin hacer consulta."""
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    with _principal_lock:
+        entry = _principal_cache.get(user_id)
+        if entry is None:
+            return None
+        expires_at, values = entry
+        if expires_at < time.monotonic():
+            del _principal_cache[user_id]
+            return None
+        _principal_cache.move_to_end(user_id)
+    # Ya está en la sesión (raro: otra dependencia lo cargó): usar esa instancia
+    existing = session.identity_map.get(session.identity_key(User, user_id))
+    if existing is not None:
+        return existing
+    # Copia nueva por request: nadie comparte ni modifica el objeto cacheado.
+    # make_transient_to_detached + add = instancia persistente "limpia" en la sesión.
+    user = User(**values)
+    make_transient_to_detached(user)
+    session.add(user)
+    return user
+
+
+# 4. Obtener Usuario Actual (Base)
 def get_current_user(
     session: Session = Depends(get_session),
     token: str = Depends(reusable_oauth2)
@@ -55,7 +110,13 @@ def get_current_user(
     
     # BÚSQUEDA DEL USUARIO
     user = None
-    
+
+    # Estrategia 0: Cache en proceso (sin consulta)
+    if token_user_id:
+        user = _cached_principal(session, token_user_id)
+        if user:
+            return user
+
     # Estrategia A: Buscar por ID (Más rápido)
     if token_user_id:
         user = session.get(User, token_user_id)
@@ -73,10 +134,11 @@ def get_current_user(
 
     if not user:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
-        
+
+    _cache_principal(user)
     return user
 
-# 4. Obtener Usuario Activo
+# 5. Obtener Usuario Activo
 def get_current_active_user(
     current_user: User = Depends(get_current_user),
 ) -> User:
@@ -84,6 +146,6 @@ def get_current_active_user(
         raise HTTPException(status_code=400, detail="Usuario inactivo")
     return current_user
 
-# 5. EL ALIAS QUE FALTABA (CurrentUser)
+# 6. EL ALIAS QUE FALTABA (CurrentUser)
 # Esto es lo que busca finance.py
 CurrentUser = Annotated[User, Depends(get_current_active_user)]
\ No newline at end of file
@@ -0,0 +1,78 @@
+"""
+etag.py  –  ETag y 304 para las respuestas GET en JSON
+
+ETagMiddleware es la red de seguridad: a cualquier GET que responda 200 en JSON
+sin ETag propio le calcula uno con el hash del cuerpo, y si el cliente ya lo
+tenía (If-None-Match) responde 304 sin cuerpo. El servidor arma la respuesta
+igual, pero no viaja por la red otra vez.
+
+Los endpoints pesados ponen su propio ETag ANTES de consultar nada
+(app/services/change_tracking.py); a esos el middleware no los toca.
+"""
+import hashlib
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Comparación débil (RFC 9110): W/"x" y "x" son el mismo."""
+    if not if_none_match:
+        return False
+    wanted = etag.removeprefix("W/")
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == wanted:
+            return True
+    return False
+
+
+class ETagMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+
+        if_none_match = Headers(scope=scope).get("if-none-match")
+        start: Optional[Message] = None
+        chunks = []
+        passthrough = False
+
+        async def send_with_etag(message: Message) -> None:
+            nonlocal start, passthrough
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if (
+                    message["status"] != 200
+                    or "etag" in headers
+                    or not headers.get("content-type", "").startswith("application/json")
+                ):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start = message  # Se manda hasta tener el cuerpo completo
+                return
+            if passthrough:
+                await send(message)
+                return
+
+            chunks.append(message.get("body", b""))
+            if message.get("more_body"):
+                return
+            body = b"".join(chunks)
+            etag = f'W/"{hashlib.sha1(body).hexdigest()[:20]}"'
+            headers = MutableHeaders(raw=start["headers"])
+            headers["ETag"] = etag
+            if etag_matches(if_none_match, etag):
+                del headers["content-length"]
+                await send({"type": "http.response.start", "status": 304, "headers": headers.raw})
+                await send({"type": "http.response.body", "body": b""})
+                return
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_with_etag)
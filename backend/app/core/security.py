@@ -1,4 +1,6 @@
+import asyncio
 import bcrypt
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Any, Union, Optional
 from jose import jwt
@@ -42,9 +44,55 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     except Exception:
         return False
 
-def get_password_hash(password: str) -> str:
-    """Genera el hash usando bcrypt directamente."""
+def get_password_hash(password: str, rounds: Optional[int] = None) -> str:
+    """Genera el hash usando bcrypt directamente (costo BCRYPT_ROUNDS)."""
     password_bytes = password.encode('utf-8')
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=rounds or settings.BCRYPT_ROUNDS)
     hashed_bytes = bcrypt.hashpw(password_bytes, salt)
-    return hashed_bytes.decode('utf-8') # Regresamos string para la BD
\ No newline at end of file
+    return hashed_bytes.decode('utf-8') # Regresamos string para la BD
+
+def password_hash_cost(hashed_password: str) -> Optional[int]:
+    """Costo de un hash bcrypt ("$2b$12$..." -> 12); None si no es bcrypt."""
+    parts = (hashed_password or "").split("$")
+    if len(parts) < 4 or not parts[1].startswith("2"):
+        return None
+    try:
+        return int(parts[2])
+    except ValueError:
+        return None
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """True si el hash se generó con un costo distinto al configurado."""
+    return password_hash_cost(hashed_password) != settings.BCRYPT_ROUNDS
+
+# --- BCRYPT FUERA DEL HILO DEL REQUEST ---
+# Cada verificación cuesta cientos de ms de CPU a propósito. Si corre en el
+# threadpool compartido de FastAPI, una ráfaga de logins (el turno de las 7am)
+# ocupa todos sus hilos y el resto del API deja de responder. Aquí corre en un
+# pool propio y acotado (bcrypt libera el GIL, así que no frena al event loop);
+# si la fila de espera se llena se rechaza con PasswordHasherBusy en vez de
+# acumular requests.
+
+class PasswordHasherBusy(Exception):
+    """Hay más de PASSWORD_HASH_MAX_PENDING verificaciones esperando."""
+
+_hash_executor = ThreadPoolExecutor(
+    max_workers=max(1, settings.PASSWORD_HASH_WORKERS), thread_name_prefix="bcrypt"
+)
+_hash_pending = 0  # Sólo se toca desde el event loop (un solo hilo)
+
+async def _run_hashing(func, *args):
+    global _hash_pending
+    if _hash_pending >= settings.PASSWORD_HASH_MAX_PENDING:
+        raise PasswordHasherBusy()
+    _hash_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, func, *args)
+    finally:
+        _hash_pending -= 1
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_hashing(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    return await _run_hashing(get_password_hash, password)
\ No newline at end of file
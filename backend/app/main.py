@@ -14,6 +14,10 @@ from app.core.database import create_db_and_tables, engine
 
 from app.api.v1.api import api_router
 from app.core.config import settings
+from app.core.etag import ETagMiddleware
+from app.services.scheduler import start_scheduler, stop_scheduler
+from app.services.job_runner import start_job_workers, stop_job_workers
+from app.services.email_outbox import start_email_sender, stop_email_sender
 
 # --- PUENTE GOOGLE CLOUD ---
 if settings.GOOGLE_APPLICATION_CREDENTIALS and os.path.exists(settings.GOOGLE_APPLICATION_CREDENTIALS):
@@ -74,8 +78,16 @@ async def lifespan(app: FastAPI):
         print("--> Sistema listo.")
     except Exception as e:
         print(f"Error crítico en BD: {e}")
+
+    # Tareas periódicas (evaluación de requisiciones automáticas, etc.)
+    start_scheduler()
+    start_job_workers()
+    start_email_sender()
     yield
     print("--> Apagando sistema...")
+    stop_scheduler()
+    stop_job_workers()
+    stop_email_sender()
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -106,12 +118,16 @@ if settings.BACKEND_CORS_ORIGINS:
     extra_origins = [str(origin).rstrip("/") for origin in settings.BACKEND_CORS_ORIGINS]
     origins.extend(extra_origins)
 
+# 304 para GET en JSON que no cambiaron (va por dentro de CORS)
+app.add_middleware(ETagMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,  # <-- Ahora 'origins' es una lista sólida
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Server-Time"],
 )
 
 # ---------------------------------------------------------
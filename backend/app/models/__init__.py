@@ -27,11 +27,21 @@ from .production import (
     PayrollPaymentType,
     PayrollStatus,
     PrintJob,
+    FieldSyncOperation,
 )
 
 # --- Módulo de Caja Chica ---
 from .petty_cash import PettyCashFund, PettyCashMovement
 
+# --- Módulo de Planeación (Proyección del Calendario Maestro) ---
+from .planning import ScheduleEvent
+
+# --- Tareas Programadas ---
+from .jobs import ScheduledJobRun, CatalogImportRun, BackgroundJob, JobFileChunk
+
+# --- Correo Saliente ---
+from .outbox import OutboundEmail
+
 # Exportación explícita para Alembic/SQLModel
 __all__ = [
     # Cimientos
@@ -86,8 +96,21 @@ __all__ = [
     "PayrollPaymentType",
     "PayrollStatus",
     "PrintJob",
+    "FieldSyncOperation",
 
     # Caja Chica
     "PettyCashFund",
     "PettyCashMovement",
+
+    # Planeación
+    "ScheduleEvent",
+
+    # Tareas Programadas
+    "ScheduledJobRun",
+    "CatalogImportRun",
+    "BackgroundJob",
+    "JobFileChunk",
+
+    # Correo Saliente
+    "OutboundEmail",
 ]
\ No newline at end of file
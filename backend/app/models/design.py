@@ -26,6 +26,11 @@ class ProductMaster(SQLModel, table=True):
     category: str = Field(default="General") # Cocina, Closet, Baño
     created_at: datetime = Field(default_factory=datetime.utcnow)
     is_active: bool = Field(default=True)
+    # Última modificación (la fija SQLAlchemy en cada INSERT/UPDATE); base del ETag y de ?since=
+    updated_at: Optional[datetime] = Field(
+        default=None, index=True,
+        sa_column_kwargs={"default": datetime.utcnow, "onupdate": datetime.utcnow},
+    )
     
     # Relaciones
     client: Optional["Client"] = Relationship()
@@ -55,6 +60,11 @@ class ProductVersion(SQLModel, table=True):
     is_active: bool = Field(default=True)
     blueprint_path: Optional[str] = Field(default=None)
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    # Última modificación (la fija SQLAlchemy en cada INSERT/UPDATE); base del ETag y de ?since=
+    updated_at: Optional[datetime] = Field(
+        default=None, index=True,
+        sa_column_kwargs={"default": datetime.utcnow, "onupdate": datetime.utcnow},
+    )
     
     # Relaciones
     master: Optional["ProductMaster"] = Relationship(back_populates="versions")
@@ -75,6 +85,12 @@ class VersionComponent(SQLModel, table=True):
     material_id: int = Field(foreign_key="materials.id", index=True)
     
     quantity: float  # Cantidad Neta (Ej. 5.5 hojas)
+
+    # Última modificación (la fija SQLAlchemy en cada INSERT/UPDATE); base del ETag y de ?since=
+    updated_at: Optional[datetime] = Field(
+        default=None, index=True,
+        sa_column_kwargs={"default": datetime.utcnow, "onupdate": datetime.utcnow},
+    )
     
     # Relaciones
     version: Optional["ProductVersion"] = Relationship(back_populates="components")
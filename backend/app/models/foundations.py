@@ -116,4 +116,9 @@ class Client(SQLModel, table=True):
     
     notes: Optional[str] = None
     registration_date: datetime = Field(default_factory=datetime.utcnow)
-    is_active: bool = Field(default=True)
\ No newline at end of file
+    is_active: bool = Field(default=True)
+    # Última modificación (la fija SQLAlchemy en cada INSERT/UPDATE); base del ETag y de ?since=
+    updated_at: Optional[datetime] = Field(
+        default=None, index=True,
+        sa_column_kwargs={"default": datetime.utcnow, "onupdate": datetime.utcnow},
+    )
@@ -0,0 +1,109 @@
+from typing import Any, Dict, List, Optional
+from datetime import datetime
+from sqlalchemy import LargeBinary
+from sqlmodel import SQLModel, Field, Column, JSON
+
+
+# ==========================================
+# TAREAS PROGRAMADAS (BITÁCORA DE CORRIDAS)
+# ==========================================
+class ScheduledJobRun(SQLModel, table=True):
+    """
+    Última corrida de cada tarea periódica del backend (ej. evaluación de
+    requisiciones automáticas). Una fila por tarea; se sobreescribe en cada corrida.
+    """
+    __tablename__ = "scheduled_job_runs"
+
+    job_name: str = Field(primary_key=True)
+    last_started_at: Optional[datetime] = Field(default=None)
+    last_finished_at: Optional[datetime] = Field(default=None)
+    last_status: Optional[str] = Field(default=None)  # OK | ERROR
+    last_result: Optional[int] = Field(default=None)
+    last_error: Optional[str] = Field(default=None)
+    last_trigger: Optional[str] = Field(default=None)  # PERIODIC | STOCK_CHANGE | MANUAL | STARTUP
+    run_count: int = Field(default=0)
+
+
+# ==========================================
+# IMPORTACIONES DE CATÁLOGO (CSV)
+# ==========================================
+class CatalogImportRun(SQLModel, table=True):
+    """
+    Una importación CSV de materiales, clientes o proveedores. Se actualiza en
+    la misma transacción de cada bloque, así que rows_committed siempre apunta
+    al último bloque guardado: una importación interrumpida se reanuda desde ahí.
+    """
+    __tablename__ = "catalog_import_runs"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    entity: str = Field(index=True)  # MATERIALS | CLIENTS | PROVIDERS
+    filename: Optional[str] = Field(default=None)
+    file_sha256: str = Field(index=True)
+    file_size: int = Field(default=0)
+    status: str = Field(default="RUNNING")  # RUNNING | COMPLETED | FAILED
+
+    rows_committed: int = Field(default=0)  # Renglones de datos ya guardados (punto de reanudación)
+    bytes_processed: int = Field(default=0)
+    chunks_committed: int = Field(default=0)
+    processed: int = Field(default=0)
+    created: int = Field(default=0)
+    updated: int = Field(default=0)
+    skipped: int = Field(default=0)
+    error_count: int = Field(default=0)
+    errors: List[str] = Field(default_factory=list, sa_column=Column(JSON))  # Primeros N errores por renglón
+    last_error: Optional[str] = Field(default=None)
+
+    created_by_user_id: Optional[int] = Field(default=None, foreign_key="users.id")
+    started_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = Field(default=None)
+
+
+# ==========================================
+# TRABAJOS EN SEGUNDO PLANO (COLA PERSISTENTE)
+# ==========================================
+class BackgroundJob(SQLModel, table=True):
+    """
+    Trabajo largo encolado desde un endpoint (importaciones, siembras, barridos).
+    Lo toman los hilos de app/services/job_runner.py; la fila es la cola y
+    también el estado que consulta el frontend.
+    """
+    __tablename__ = "background_jobs"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    kind: str = Field(index=True)  # CATALOG_IMPORT | KARDEX_OPENING | KARDEX_REPLAY | REQUISITION_SWEEP
+    status: str = Field(default="QUEUED", index=True)  # QUEUED | RUNNING | SUCCEEDED | FAILED | CANCELLED
+    payload: Dict[str, Any] = Field(default_factory=dict, sa_column=Column(JSON))
+    result: Optional[Dict[str, Any]] = Field(default=None, sa_column=Column(JSON))
+    error: Optional[str] = Field(default=None)
+
+    progress: float = Field(default=0.0)  # 0 a 100
+    progress_message: Optional[str] = Field(default=None)
+
+    attempts: int = Field(default=0)
+    max_attempts: int = Field(default=3)
+    run_after: datetime = Field(default_factory=datetime.utcnow, index=True)  # Reintento con espera
+    cancel_requested: bool = Field(default=False)
+
+    locked_by: Optional[str] = Field(default=None)  # proceso:hilo que lo tomó
+    heartbeat_at: Optional[datetime] = Field(default=None)
+
+    created_by_user_id: Optional[int] = Field(default=None, foreign_key="users.id")
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = Field(default=None)
+    finished_at: Optional[datetime] = Field(default=None)
+
+
+class JobFileChunk(SQLModel, table=True):
+    """
+    Archivo subido para un trabajo (p. ej. CSV de importación), en bloques de ~1 MB.
+    Vive en la BD y no en disco porque el trabajo lo puede tomar otra instancia.
+    """
+    __tablename__ = "job_file_chunks"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    file_key: str = Field(index=True)  # Va en el payload del trabajo
+    seq: int
+    size: int
+    data: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    created_at: datetime = Field(default_factory=datetime.utcnow)
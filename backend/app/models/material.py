@@ -1,4 +1,6 @@
 from typing import Optional, TYPE_CHECKING
+from datetime import datetime
+from sqlalchemy import event, inspect
 from sqlmodel import SQLModel, Field, Relationship
 from enum import Enum
 
@@ -52,7 +54,42 @@ class Material(SQLModel, table=True):
     
     # Lógica de Tapacanto
     associated_element_sku: Optional[str] = Field(default=None)
+
+    # Última modificación (la fija SQLAlchemy en cada INSERT/UPDATE); base del ETag y de ?since=
+    updated_at: Optional[datetime] = Field(
+        default=None, index=True,
+        sa_column_kwargs={"default": datetime.utcnow, "onupdate": datetime.utcnow},
+    )
+    # updated_at se mueve con cada reserva o consumo. Los listados que no muestran
+    # existencias usan estas huellas (ver _stamp_material y StockMutation):
+    cost_updated_at: Optional[datetime] = Field(  # current_cost / conversion_factor
+        default=None, index=True, sa_column_kwargs={"default": datetime.utcnow},
+    )
+    catalog_updated_at: Optional[datetime] = Field(  # lo demás (sku, nombre, unidades, categoría...)
+        default=None, index=True, sa_column_kwargs={"default": datetime.utcnow},
+    )
     
     # Relaciones
     provider_id: Optional[int] = Field(default=None, foreign_key="providers.id")
-    provider: Optional["Provider"] = Relationship(back_populates="materials")
\ No newline at end of file
+    provider: Optional["Provider"] = Relationship(back_populates="materials")
+
+
+# Qué mueve cada huella de Material
+STOCK_FIELDS = frozenset({"physical_stock", "committed_stock"})
+COST_FIELDS = frozenset({"current_cost", "conversion_factor"})
+STAMP_FIELDS = frozenset({"updated_at", "cost_updated_at", "catalog_updated_at"})
+
+
+@event.listens_for(Material, "before_update")
+def _stamp_material(mapper, connection, target: Material) -> None:
+    """Ediciones por ORM. Los UPDATE directos (StockMutation, importador) fijan sus huellas."""
+    state = inspect(target)
+    changed = {
+        column.key for column in mapper.column_attrs
+        if state.attrs[column.key].history.has_changes()
+    }
+    now = datetime.utcnow()
+    if changed & COST_FIELDS:
+        target.cost_updated_at = now
+    if changed - STOCK_FIELDS - COST_FIELDS - STAMP_FIELDS:
+        target.catalog_updated_at = now
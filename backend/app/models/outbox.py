@@ -0,0 +1,40 @@
+from typing import List, Optional
+from datetime import datetime
+from sqlmodel import SQLModel, Field, Column, JSON, LargeBinary
+
+
+# ==========================================
+# BANDEJA DE SALIDA DE CORREO
+# ==========================================
+class OutboundEmail(SQLModel, table=True):
+    """
+    Correo encolado por un endpoint; lo envía el hilo de app/services/email_outbox.py.
+    La llave de la API NO se guarda aquí: se lee de GlobalConfig al enviar.
+    """
+    __tablename__ = "email_outbox"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    tracking_id: str = Field(index=True, unique=True)
+    kind: str = Field(default="GENERIC")  # PURCHASE_ORDER | GENERIC
+    purchase_order_id: Optional[int] = Field(default=None, foreign_key="purchase_orders.id", index=True)
+
+    sender_name: str
+    sender_email: str
+    to_email: str
+    cc: List[str] = Field(default_factory=list, sa_column=Column(JSON))
+    subject: str
+    text_content: str
+    attachment_name: Optional[str] = Field(default=None)
+    attachment_content: Optional[bytes] = Field(default=None, sa_column=Column(LargeBinary))
+
+    status: str = Field(default="QUEUED", index=True)  # QUEUED | SENDING | SENT | FAILED
+    attempts: int = Field(default=0)
+    max_attempts: int = Field(default=5)
+    next_attempt_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+    last_error: Optional[str] = Field(default=None)
+    provider_message_id: Optional[str] = Field(default=None)
+
+    created_by_user_id: Optional[int] = Field(default=None, foreign_key="users.id")
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    claimed_at: Optional[datetime] = Field(default=None)
+    sent_at: Optional[datetime] = Field(default=None)
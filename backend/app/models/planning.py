@@ -0,0 +1,39 @@
+from typing import Optional
+from datetime import datetime
+from sqlmodel import SQLModel, Field
+from sqlalchemy import Index
+
+
+# ==========================================
+# PROYECCIÓN DEL CALENDARIO MAESTRO (4 CARRILES)
+# ==========================================
+class ScheduleEvent(SQLModel, table=True):
+    """
+    Una píldora del calendario: un carril (PM/PP/IM/IP) de una instancia en una fecha.
+
+    Es una proyección normalizada de los 4 campos scheduled_* de
+    SalesOrderItemInstance. La fuente de verdad sigue siendo la instancia;
+    esta tabla se sincroniza en cada reprogramación (planning_service.sync_schedule_events)
+    y se reconstruye completa con scripts/rebuild_schedule_events.py.
+    """
+    __tablename__ = "schedule_events"
+    __table_args__ = (
+        # Consulta del calendario: rango de fechas (índice cubriente: no lee la tabla)
+        Index("ix_schedule_events_scheduled_at_lane", "scheduled_at", "lane", "instance_id"),
+        # Un carril por instancia
+        Index("ux_schedule_events_instance_lane", "instance_id", "lane", unique=True),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    instance_id: int = Field(
+        foreign_key="sales_order_item_instances.id",
+        ondelete="CASCADE",
+        index=True,
+    )
+    lane: str  # "PM" | "PP" | "IM" | "IP"
+    scheduled_at: datetime
+    # Última modificación (la fija SQLAlchemy en cada INSERT/UPDATE); base del ETag y de ?since=
+    updated_at: Optional[datetime] = Field(
+        default=None, index=True,
+        sa_column_kwargs={"default": datetime.utcnow, "onupdate": datetime.utcnow},
+    )
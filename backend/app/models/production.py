@@ -2,6 +2,7 @@ from typing import Optional, List, Dict, Any
 from datetime import datetime
 from enum import Enum
 from sqlmodel import SQLModel, Field, Column, JSON
+from sqlalchemy import Index
 
 # ==========================================
 # ENUMS DE NÓMINA
@@ -57,6 +58,12 @@ class ProductionBatch(SQLModel, table=True):
     actual_overhead_cost: Optional[float] = Field(default=0.0) # Gastos fijos absorbidos
     # ========================================================
 
+    # Última modificación (la fija SQLAlchemy en cada INSERT/UPDATE); base de las consultas ?since=
+    updated_at: Optional[datetime] = Field(
+        default=None, index=True,
+        sa_column_kwargs={"default": datetime.utcnow, "onupdate": datetime.utcnow},
+    )
+
 
 # ==========================================
 # 2. ASIGNACIONES DE INSTALACIÓN (OBRA)
@@ -70,6 +77,12 @@ class InstallationAssignmentStatus(str, Enum):
 
 class InstallationAssignment(SQLModel, table=True):
     __tablename__ = "installation_assignments"
+    __table_args__ = (
+        # Agenda de cuadrillas (crew_scheduler): asignaciones de una persona en un rango de fechas
+        Index("ix_installation_assignments_leader_date", "leader_user_id", "assignment_date"),
+        Index("ix_installation_assignments_helper_1_date", "helper_1_user_id", "assignment_date"),
+        Index("ix_installation_assignments_helper_2_date", "helper_2_user_id", "assignment_date"),
+    )
 
     id: Optional[int] = Field(default=None, primary_key=True)
     instance_id: int = Field(index=True) # Ligado a sales_order_item_instances.id
@@ -138,8 +151,37 @@ class PrintJob(SQLModel, table=True):
     total_bundles: int
     bundle_type: str  # "MDF" o "HERRAJES"
     zpl_content: str
-    status: str = Field(default="PENDING", index=True)  # PENDING / PRINTED / ERROR
+    status: str = Field(default="PENDING", index=True)  # PENDING / CLAIMED / PRINTED / ERROR
     is_reprint: bool = Field(default=False)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     printed_at: Optional[datetime] = Field(default=None)
-    created_by_user_id: Optional[int] = Field(default=None, foreign_key="users.id")
\ No newline at end of file
+    created_by_user_id: Optional[int] = Field(default=None, foreign_key="users.id")
+
+    # Despacho a agentes de impresión (app/services/print_dispatch.py)
+    claimed_by: Optional[str] = Field(default=None)           # Identificador del agente
+    claimed_at: Optional[datetime] = Field(default=None)
+    lease_expires_at: Optional[datetime] = Field(default=None)  # Vencido = agente caído, vuelve a PENDING
+    claim_count: int = Field(default=0)
+
+# ==========================================
+# 5. SINCRONIZACIÓN OFFLINE DE IPADS
+# ==========================================
+class FieldSyncOperation(SQLModel, table=True):
+    """
+    Una operación que el iPad encoló sin red (escaneo, carril instalado, firma,
+    evidencia) y subió en lote. op_id lo genera el iPad: si el lote se reenvía,
+    la operación ya registrada no se vuelve a aplicar y se regresa este resultado.
+    """
+    __tablename__ = "field_sync_operations"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    op_id: str = Field(unique=True, index=True)  # UUID del iPad (llave de idempotencia)
+    device_id: str = Field(index=True)
+    user_id: int = Field(foreign_key="users.id", index=True)
+    op_type: str  # SCAN | INSTALLED | SIGNATURE | EVIDENCE
+    assignment_id: Optional[int] = Field(default=None)
+    instance_id: Optional[int] = Field(default=None)
+    status: str  # APPLIED | CONFLICT | REJECTED
+    result: Dict[str, Any] = Field(default_factory=dict, sa_column=Column(JSON))
+    recorded_at: Optional[datetime] = Field(default=None)  # Cuándo ocurrió en el iPad
+    applied_at: datetime = Field(default_factory=datetime.utcnow)
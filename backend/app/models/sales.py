@@ -114,6 +114,11 @@ class CustomerPayment(SQLModel, table=True):
     
     created_at: datetime = Field(default_factory=datetime.utcnow)
     created_by_user_id: int 
+    # Última modificación (la fija SQLAlchemy en cada INSERT/UPDATE); base del ETag y de ?since=
+    updated_at: Optional[datetime] = Field(
+        default=None, index=True,
+        sa_column_kwargs={"default": datetime.utcnow, "onupdate": datetime.utcnow},
+    )
     
     order: Optional["SalesOrder"] = Relationship(back_populates="payments")
     instances_paid: List["SalesOrderItemInstance"] = Relationship(back_populates="payment")
@@ -197,6 +202,12 @@ class SalesOrderItemInstance(SQLModel, table=True):
         default=None, sa_column=Column(JSON)
     )
 
+    # Última modificación (la fija SQLAlchemy en cada INSERT/UPDATE); base de las consultas ?since=
+    updated_at: Optional[datetime] = Field(
+        default=None, index=True,
+        sa_column_kwargs={"default": datetime.utcnow, "onupdate": datetime.utcnow},
+    )
+
     payment: Optional["CustomerPayment"] = Relationship(back_populates="instances_paid")
     item: Optional["SalesOrderItem"] = Relationship(back_populates="instances")
 
@@ -226,6 +237,12 @@ class SalesOrderItem(SQLModel, table=True):
     # Ejemplo: {"MDF": 5000, "Granito": 12000, "Mano_Obra": 4000}
     category_breakdown_snapshot: Optional[str] = Field(default=None)
 
+    # Última modificación (la fija SQLAlchemy en cada INSERT/UPDATE); base del ETag y de ?since=
+    updated_at: Optional[datetime] = Field(
+        default=None, index=True,
+        sa_column_kwargs={"default": datetime.utcnow, "onupdate": datetime.utcnow},
+    )
+
     order: Optional["SalesOrder"] = Relationship(back_populates="items")
     instances: List[SalesOrderItemInstance] = Relationship(
         back_populates="item", 
@@ -251,6 +268,11 @@ class SalesOrder(SQLModel, table=True):
     status: SalesOrderStatus = Field(default=SalesOrderStatus.DRAFT)
     
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    # Última modificación (la fija SQLAlchemy en cada INSERT/UPDATE); base del ETag y de ?since=
+    updated_at: Optional[datetime] = Field(
+        default=None, index=True,
+        sa_column_kwargs={"default": datetime.utcnow, "onupdate": datetime.utcnow},
+    )
     valid_until: datetime
     delivery_date: Optional[datetime] = None
     
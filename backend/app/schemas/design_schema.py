@@ -73,4 +73,11 @@ class ProductMasterRead(ProductMasterBase):
     created_at: datetime
     is_active: bool
     # Incluye sus versiones hijas
-    versions: List[ProductVersionRead] = []
\ No newline at end of file
+    versions: List[ProductVersionRead] = []
+
+# OUTPUT: Cambios desde ?since= (GET /design/masters)
+class ProductMasterDelta(SQLModel):
+    server_time: datetime                  # El ?since= de la siguiente consulta
+    since: datetime
+    items: List[ProductMasterRead] = []    # Diseños nuevos o con cambios (reemplazan a los que ya tenía el cliente)
+    ids: List[int] = []                    # Todos los diseños vigentes del listado: los que falten se quitan
\ No newline at end of file
@@ -170,6 +170,13 @@ class SalesOrderRead(SalesOrderBase):
     items: List[SalesOrderItemRead] = []
     payments: List[CustomerPaymentRead] = []
 
+# OUTPUT: Cambios desde ?since= (GET /sales/orders)
+class SalesOrderDelta(SQLModel):
+    server_time: datetime                  # El ?since= de la siguiente consulta
+    since: datetime
+    items: List[SalesOrderRead] = []       # OVs nuevas o con cambios (reemplazan a las que ya tenía el cliente)
+    ids: List[int] = []                    # Todas las OVs vigentes del listado: las que falten se quitan
+
 # INPUT: Actualización
 class SalesOrderUpdate(SQLModel):
     project_name: Optional[str] = None
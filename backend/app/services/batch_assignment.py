@@ -0,0 +1,232 @@
+"""
+batch_assignment.py  –  Asignación de instancias a Lotes de Producción
+
+Responsabilidades:
+  1. Validar el CANDADO RTM (Release To Manufacturing) para un conjunto de
+     instancias con UNA consulta (bloqueando las filas en Postgres).
+  2. Leer las recetas de todas las instancias del índice de recetas
+     (recipe_index), omitiendo las categorías no inventariables.
+  3. Insertar las reservas en bloque y comprometer el material con
+     StockMutation (committed_stock = committed_stock + :qty, en un UPDATE por lotes).
+
+Todo ocurre en la transacción del llamador: este módulo no hace commit.
+"""
+from datetime import datetime
+from typing import Dict, Iterable, List, Tuple
+
+from sqlmodel import Session, select
+from sqlalchemy import update
+
+from app.models.inventory import InventoryReservation
+from app.models.production import ProductionBatch
+from app.models.sales import SalesOrderItem, SalesOrderItemInstance
+from app.services.stock_mutation import StockMutation
+from app.services import recipe_index
+
+
+# Categorías que NO se reservan según el tipo de lote
+SKIP_CATEGORIES_MDF = {"PROCESO", "PIEDRA"}
+SKIP_CATEGORIES_PIEDRA = {
+    "PROCESO", "TABLERO", "HERRAJES",
+    "CHAPACINTA", "ACCESORIO", "ELECTRICIDAD",
+    "ELECTRODOMÉSTICO", "ESPECIAL",
+    "INSUMOS", "VIDRIO",
+}
+SKIP_CATEGORIES_DEFAULT = {"PROCESO"}
+
+
+def skip_categories_for(batch_type: str) -> set:
+    batch_type = (batch_type or "").upper()
+    if batch_type == "MDF":
+        return SKIP_CATEGORIES_MDF
+    if batch_type == "PIEDRA":
+        return SKIP_CATEGORIES_PIEDRA
+    return SKIP_CATEGORIES_DEFAULT
+
+
+class RTMViolation(ValueError):
+    """Una o más instancias no pasan el CANDADO RTM. Trae el detalle por instancia."""
+
+    def __init__(self, violations: List[dict]):
+        self.violations = violations
+        super().__init__(violations[0]["detail"] if violations else "CANDADO RTM")
+
+
+class BatchAssigner:
+    @staticmethod
+    def batch_column(batch: ProductionBatch):
+        """Columna de la instancia que apunta al lote según su tipo (MDF u otros / PIEDRA)."""
+        if batch.batch_type.upper() == "PIEDRA":
+            return SalesOrderItemInstance.stone_batch_id
+        return SalesOrderItemInstance.production_batch_id
+
+    @staticmethod
+    def load_for_update(
+        session: Session,
+        instance_ids: Iterable[int],
+    ) -> Dict[int, Tuple[SalesOrderItemInstance, int]]:
+        """
+        {instance_id: (instancia, origin_version_id)} con UN join.
+        En Postgres bloquea las filas de las instancias (FOR UPDATE OF) para que
+        dos asignaciones simultáneas no tomen la misma instancia.
+        """
+        ids = set(instance_ids)
+        if not ids:
+            return {}
+        rows = session.exec(
+            select(SalesOrderItemInstance, SalesOrderItem.origin_version_id)
+            .outerjoin(SalesOrderItem, SalesOrderItem.id == SalesOrderItemInstance.sales_order_item_id)
+            .where(SalesOrderItemInstance.id.in_(ids))
+            .with_for_update(of=SalesOrderItemInstance)
+        ).all()
+        return {inst.id: (inst, version_id) for inst, version_id in rows}
+
+    @staticmethod
+    def validate_rtm(
+        batch: ProductionBatch,
+        instance_ids: List[int],
+        loaded: Dict[int, Tuple[SalesOrderItemInstance, int]],
+    ) -> List[dict]:
+        """
+        Aplica las reglas del CANDADO RTM a cada instancia y devuelve TODAS las
+        violaciones (lista vacía = todas aptas).
+          Regla A: No procesar nada cancelado.
+          Regla B: La instancia no debe tener ya un lote del mismo tipo.
+        """
+        is_stone = batch.batch_type.upper() == "PIEDRA"
+        violations = []
+        for instance_id in instance_ids:
+            entry = loaded.get(instance_id)
+            if entry is None:
+                violations.append({
+                    "instance_id": instance_id,
+                    "code": "NOT_FOUND",
+                    "detail": "Instancia no encontrada.",
+                })
+                continue
+            instance = entry[0]
+
+            if instance.is_cancelled:
+                violations.append({
+                    "instance_id": instance_id,
+                    "code": "CANCELLED",
+                    "detail": "CANDADO RTM: Esta instancia está cancelada. No puede pasar a producción.",
+                })
+            elif is_stone and instance.stone_batch_id is not None:
+                violations.append({
+                    "instance_id": instance_id,
+                    "code": "ALREADY_ASSIGNED",
+                    "detail": f"CANDADO RTM: Esta instancia ya tiene un "
+                              f"Lote Piedra asignado "
+                              f"(stone_batch_id={instance.stone_batch_id}).",
+                })
+            elif not is_stone and instance.production_batch_id is not None:
+                violations.append({
+                    "instance_id": instance_id,
+                    "code": "ALREADY_ASSIGNED",
+                    "detail": f"CANDADO RTM: Esta instancia ya tiene un "
+                              f"Lote MDF asignado "
+                              f"(production_batch_id={instance.production_batch_id}).",
+                })
+            # (Futuro) Regla C: cruzar con Tesorería para ver si la OV tiene anticipo pagado.
+        return violations
+
+    @staticmethod
+    def load_recipes(
+        session: Session,
+        version_ids: Iterable[int],
+        batch_type: str,
+    ) -> Dict[int, Dict[int, float]]:
+        """
+        {version_id: {material_id: cantidad}} desde el índice de recetas,
+        sin las categorías que el lote no reserva.
+        """
+        return recipe_index.material_quantities(
+            session, version_ids, exclude=skip_categories_for(batch_type),
+        )
+
+    @staticmethod
+    def assign_many(
+        session: Session,
+        batch: ProductionBatch,
+        instance_ids: List[int],
+    ) -> dict:
+        """
+        Asigna varias instancias a un lote en la transacción actual (todo o nada).
+
+        Consultas: 1 (instancias + versión, con bloqueo) + 1 (recetas, si no están en el índice)
+        + 1 UPDATE de instancias + 1 INSERT multi-fila de reservas
+        + StockMutation (bloqueo de materiales + 1 UPDATE por lotes).
+
+        Lanza RTMViolation con el detalle de todas las instancias rechazadas;
+        en ese caso no se escribe nada.
+        """
+        # Quitar duplicados preservando el orden
+        instance_ids = list(dict.fromkeys(instance_ids))
+
+        loaded = BatchAssigner.load_for_update(session, instance_ids)
+        violations = BatchAssigner.validate_rtm(batch, instance_ids, loaded)
+        if violations:
+            raise RTMViolation(violations)
+
+        # 1. Llave foránea del lote. NO cambiamos production_status aquí:
+        #    el status cambia cuando el Jefe mueve el lote a IN_PRODUCTION.
+        column = BatchAssigner.batch_column(batch)
+        result = session.exec(
+            update(SalesOrderItemInstance)
+            .where(SalesOrderItemInstance.id.in_(instance_ids))
+            .where(column == None)
+            .values({column.key: batch.id})
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != len(instance_ids):
+            # Otra transacción tomó alguna instancia entre la lectura y el UPDATE
+            # (sólo posible sin FOR UPDATE, p.ej. SQLite)
+            raise RTMViolation([{
+                "instance_id": None,
+                "code": "CONCURRENT_ASSIGNMENT",
+                "detail": "CANDADO RTM: Alguna instancia fue asignada a otro lote al mismo tiempo. Reintenta.",
+            }])
+
+        # 2. Reservas por (instancia, material) en un solo INSERT
+        recipes = BatchAssigner.load_recipes(
+            session,
+            {version_id for _, version_id in loaded.values() if version_id},
+            batch.batch_type,
+        )
+        now = datetime.utcnow()
+        reservation_rows = []
+        committed: Dict[int, float] = {}
+        for instance_id in instance_ids:
+            version_id = loaded[instance_id][1]
+            for material_id, qty in recipes.get(version_id, {}).items():
+                reservation_rows.append({
+                    "production_batch_id": batch.id,
+                    "instance_id": instance_id,
+                    "material_id": material_id,
+                    "quantity_reserved": qty,
+                    "status": "ACTIVA",
+                    "created_at": now,
+                })
+                committed[material_id] = committed.get(material_id, 0.0) + qty
+
+        if reservation_rows:
+            session.execute(InventoryReservation.__table__.insert(), reservation_rows)
+
+        # 3. Comprometer material: incrementos atómicos en bloque (sin leer-modificar-escribir)
+        mutation = StockMutation(session)
+        for material_id, qty in committed.items():
+            mutation.reserve(material_id, qty)
+        mutation.apply()
+
+        # Las instancias cargadas en la sesión quedan con el valor viejo del lote
+        for instance_id in instance_ids:
+            session.expire(loaded[instance_id][0])
+
+        return {
+            "assigned_instances": len(instance_ids),
+            "reservations_created": len(reservation_rows),
+            "committed_by_material": {
+                material_id: round(qty, 4) for material_id, qty in committed.items()
+            },
+        }
@@ -0,0 +1,459 @@
+"""
+batch_simulator.py  –  Motor de Simulación de Lotes (BOM por lotes)
+
+Responsabilidades:
+  1. Resolver un conjunto de instancias a sus versiones (receta) con UN join.
+  2. Agregar la receta por (versión, material) desde el índice de recetas
+     (recipe_index), filtrando las categorías que no aplican al tipo de lote.
+  3. Cruzar lo requerido contra existencias disponibles (físico - comprometido)
+     con UN mapa de materiales compartido por todos los lotes candidatos.
+
+El número de consultas es constante (3, o 2 con las recetas ya en el índice)
+sin importar cuántas instancias o cuántos lotes candidatos se simulen.
+
+Además contiene el Planeador de Factibilidad: reparte las existencias entre
+TODAS las instancias pendientes (lotes que compiten por el mismo tablero)
+por orden de urgencia, en memoria.
+"""
+from datetime import datetime
+from typing import Dict, List, Iterable, Optional
+from sqlmodel import Session, select
+from sqlalchemy import or_
+
+from app.models.design import ProductVersion
+from app.models.material import Material
+from app.models.foundations import Client
+from app.models.sales import (
+    SalesOrder, SalesOrderItem, SalesOrderItemInstance,
+    PaymentStatus, SalesOrderStatus,
+)
+from app.models.production import ProductionBatchStatus
+from app.services.planning_service import (
+    compute_semaphore, load_batch_statuses, semaphore_severity,
+)
+from app.services import recipe_index
+
+
+# Categorías que tienen poder de bloqueo según el proceso de fabricación
+CRITICAL_CATEGORIES_MDF = ["MDF", "TABLERO", "MELAMINA", "MADERA", "ENCHAPADO"]
+CRITICAL_CATEGORIES_PIEDRA = ["PIEDRA", "GRANITO", "CUARZO", "MARMOL", "SUPERFICIE"]
+
+# Órdenes confirmadas = tienen anticipo pagado O su status ya avanzó a producción
+CONFIRMED_ORDER_STATUSES = {
+    SalesOrderStatus.WAITING_ADVANCE,
+    SalesOrderStatus.SOLD,
+    SalesOrderStatus.IN_PRODUCTION,
+    SalesOrderStatus.FINISHED,
+    SalesOrderStatus.COMPLETED,
+}
+
+
+def is_critical_category(category: Optional[str], batch_type: str) -> bool:
+    """Regla de Oro: sólo las categorías núcleo del tipo de lote pueden bloquearlo."""
+    cat_upper = (category or "").upper()
+    if batch_type == "MDF":
+        return any(c in cat_upper for c in CRITICAL_CATEGORIES_MDF)
+    if batch_type == "PIEDRA":
+        return any(c in cat_upper for c in CRITICAL_CATEGORIES_PIEDRA)
+    return False
+
+
+class BatchSimulator:
+    @staticmethod
+    def resolve_instance_versions(
+        session: Session,
+        instance_ids: Iterable[int],
+    ) -> Dict[int, int]:
+        """
+        {instance_id: version_id} para las instancias que tienen receta.
+        Instancias inexistentes o partidas manuales (sin origin_version_id) se omiten.
+        """
+        ids = set(instance_ids)
+        if not ids:
+            return {}
+        rows = session.exec(
+            select(SalesOrderItemInstance.id, SalesOrderItem.origin_version_id)
+            .join(SalesOrderItem, SalesOrderItem.id == SalesOrderItemInstance.sales_order_item_id)
+            .where(SalesOrderItemInstance.id.in_(ids))
+            .where(SalesOrderItem.origin_version_id != None)
+        ).all()
+        return {inst_id: version_id for inst_id, version_id in rows}
+
+    @staticmethod
+    def load_recipes(
+        session: Session,
+        version_ids: Iterable[int],
+        batch_type: str,
+    ) -> Dict[int, Dict[int, float]]:
+        """
+        {version_id: {material_id: cantidad}} desde el índice de recetas
+        (recipe_index), sumando los componentes repetidos de una misma receta.
+
+        Reglas de categoría (iguales al simulador original):
+          - PROCESO nunca es inventariable.
+          - Lote MDF: se excluyen materiales de PIEDRA.
+          - Lote PIEDRA: se incluyen SOLO materiales de PIEDRA.
+        """
+        batch_type = batch_type.upper()
+        return recipe_index.material_quantities(
+            session,
+            version_ids,
+            include={"PIEDRA"} if batch_type == "PIEDRA" else None,
+            exclude={"PROCESO", "PIEDRA"} if batch_type == "MDF" else {"PROCESO"},
+        )
+
+    @staticmethod
+    def aggregate_bom(
+        instance_ids: Iterable[int],
+        instance_versions: Dict[int, int],
+        recipes: Dict[int, Dict[int, float]],
+    ) -> Dict[int, float]:
+        """
+        Suma en memoria las recetas de un lote: {material_id: cantidad requerida}.
+        Cada instancia es una unidad física, así que cuenta su receta una vez.
+        """
+        units_per_version: Dict[int, int] = {}
+        for inst_id in set(instance_ids):
+            version_id = instance_versions.get(inst_id)
+            if version_id is not None:
+                units_per_version[version_id] = units_per_version.get(version_id, 0) + 1
+
+        aggregated: Dict[int, float] = {}
+        for version_id, units in units_per_version.items():
+            for material_id, qty in recipes.get(version_id, {}).items():
+                aggregated[material_id] = aggregated.get(material_id, 0.0) + qty * units
+        return aggregated
+
+    @staticmethod
+    def load_materials(session: Session, material_ids: Iterable[int]) -> Dict[int, Material]:
+        ids = set(material_ids)
+        if not ids:
+            return {}
+        return {
+            m.id: m for m in session.exec(select(Material).where(Material.id.in_(ids))).all()
+        }
+
+    @staticmethod
+    def evaluate(
+        aggregated_bom: Dict[int, float],
+        materials: Dict[int, Material],
+        batch_type: str,
+    ) -> dict:
+        """
+        Cruza lo requerido contra existencias disponibles (physical - committed).
+        Regla de Oro: sólo las categorías núcleo del lote bloquean (RED);
+        el resto de faltantes se permite en negativo (YELLOW).
+        """
+        simulated_materials: List[dict] = []
+        batch_is_blocked = False
+
+        for mat_id, req_qty in aggregated_bom.items():
+            material = materials.get(mat_id)
+            if not material:
+                continue
+
+            available_qty = material.physical_stock - material.committed_stock
+            is_shortage = req_qty > available_qty
+
+            is_blocking = False
+            status_color = "GREEN"
+
+            if is_shortage:
+                if is_critical_category(material.category, batch_type):
+                    is_blocking = True
+                    batch_is_blocked = True
+                    status_color = "RED"
+                else:
+                    status_color = "YELLOW"  # Falta, pero permitimos negativos
+
+            simulated_materials.append({
+                "material_id": material.id,
+                "sku": material.sku,
+                "name": material.name,
+                "category": material.category,
+                "required_qty": round(req_qty, 2),
+                "available_qty": round(available_qty, 2),
+                "is_blocking": is_blocking,
+                "status_color": status_color,
+            })
+
+        suggested_status = (
+            ProductionBatchStatus.ON_HOLD.value
+            if batch_is_blocked
+            else ProductionBatchStatus.DRAFT.value
+        )
+        return {"suggested_status": suggested_status, "materials": simulated_materials}
+
+    @staticmethod
+    def simulate_many(
+        session: Session,
+        candidates: Dict[str, List[int]],
+        batch_type: str,
+    ) -> Dict[str, dict]:
+        """
+        Simula varios lotes candidatos (etiqueta → instance_ids) en un solo pase.
+        Cada candidato se evalúa por separado contra las MISMAS existencias
+        (no compiten entre sí); útil para comparar alternativas de lotificación.
+        """
+        all_ids = {iid for ids in candidates.values() for iid in ids}
+        instance_versions = BatchSimulator.resolve_instance_versions(session, all_ids)
+        recipes = BatchSimulator.load_recipes(session, set(instance_versions.values()), batch_type)
+
+        boms = {
+            label: BatchSimulator.aggregate_bom(ids, instance_versions, recipes)
+            for label, ids in candidates.items()
+        }
+        materials = BatchSimulator.load_materials(
+            session, {mat_id for bom in boms.values() for mat_id in bom}
+        )
+
+        results: Dict[str, dict] = {}
+        for label, bom in boms.items():
+            result = BatchSimulator.evaluate(bom, materials, batch_type)
+            result["resolved_instances"] = sum(
+                1 for iid in set(candidates[label]) if iid in instance_versions
+            )
+            results[label] = result
+        return results
+
+    @staticmethod
+    def simulate(session: Session, instance_ids: List[int], batch_type: str) -> dict:
+        return BatchSimulator.simulate_many(session, {"_": instance_ids}, batch_type)["_"]
+
+
+# ============================================================
+# RADAR DE INSTANCIAS PENDIENTES
+# ============================================================
+
+def load_pending_instances(
+    session: Session,
+    batch_type: str,
+    now: Optional[datetime] = None,
+) -> List[dict]:
+    """
+    Instancias sin lote del tipo pedido cuya OV está confirmada, con su
+    contexto (partida, orden, cliente, versión) en UN join y el semáforo
+    calculado con los status de lote precargados.
+
+    Regla ampliada: incluye OVs con anticipo pagado (PARTIAL/PAID)
+    O cuyo estatus de orden ya es WAITING_ADVANCE/SOLD/IN_PRODUCTION/...
+    Se omiten recetas que no tienen componentes del tipo de lote.
+    """
+    now = now or datetime.utcnow()
+    is_stone = batch_type.upper() == "PIEDRA"
+    batch_column = (
+        SalesOrderItemInstance.stone_batch_id if is_stone
+        else SalesOrderItemInstance.production_batch_id
+    )
+    has_components = (
+        ProductVersion.has_stone_components if is_stone
+        else ProductVersion.has_mdf_components
+    )
+
+    rows = session.exec(
+        select(
+            SalesOrderItemInstance,
+            SalesOrderItem.product_name,
+            SalesOrderItem.origin_version_id,
+            SalesOrder.id,
+            SalesOrder.project_name,
+            Client.full_name,
+        )
+        .join(SalesOrderItem, SalesOrderItem.id == SalesOrderItemInstance.sales_order_item_id)
+        .join(SalesOrder, SalesOrder.id == SalesOrderItem.sales_order_id)
+        .outerjoin(Client, Client.id == SalesOrder.client_id)
+        .outerjoin(ProductVersion, ProductVersion.id == SalesOrderItem.origin_version_id)
+        .where(batch_column == None)
+        .where(SalesOrderItemInstance.is_cancelled == False)
+        .where(or_(
+            SalesOrder.payment_status.in_([PaymentStatus.PARTIAL, PaymentStatus.PAID]),
+            SalesOrder.status.in_(CONFIRMED_ORDER_STATUSES),
+        ))
+        .where(or_(ProductVersion.id == None, has_components == True))
+        .order_by(SalesOrderItemInstance.id)
+    ).all()
+
+    batch_statuses = load_batch_statuses(session, (row[0] for row in rows))
+    return [
+        {
+            "instance": inst,
+            "product_name": product_name,
+            "version_id": version_id,
+            "order_id": order_id,
+            "order_project_name": project_name,
+            "client_name": client_name,
+            "semaphore": compute_semaphore(inst, now, batch_statuses=batch_statuses),
+        }
+        for inst, product_name, version_id, order_id, project_name, client_name in rows
+    ]
+
+
+# ============================================================
+# PLANEADOR DE FACTIBILIDAD (lotes que compiten por existencias)
+# ============================================================
+
+def allocate_greedy(
+    demands: List[dict],
+    recipes: Dict[int, Dict[int, float]],
+    available: Dict[int, float],
+    critical: Dict[int, bool],
+) -> List[dict]:
+    """
+    Reparto voraz en memoria (sin BD). `demands` ya viene ordenada por prioridad;
+    cada elemento trae al menos "instance_id" y "version_id".
+
+    Por cada instancia, en orden:
+      - Si algún material crítico (núcleo del lote) no alcanza con lo que queda,
+        la instancia queda BLOQUEADA y no consume nada (el material queda para
+        las siguientes, que quizá sí completan).
+      - Si todo lo crítico alcanza, se LIBERA y consume toda su receta; los
+        faltantes no críticos se permiten en negativo y se reportan como aviso.
+
+    Retorna una entrada por demanda con releasable, blocking y warnings.
+    `available` se muta con el remanente final.
+    """
+    results = []
+    for demand in demands:
+        recipe = recipes.get(demand["version_id"]) if demand["version_id"] is not None else None
+        if not recipe:
+            results.append({
+                **demand,
+                "releasable": True,
+                "blocking": [],
+                "warnings": [],
+                "has_recipe": False,
+            })
+            continue
+
+        blocking = []
+        for mat_id, qty in recipe.items():
+            if critical.get(mat_id) and qty > available.get(mat_id, 0.0):
+                blocking.append({
+                    "material_id": mat_id,
+                    "required_qty": qty,
+                    "available_qty": available.get(mat_id, 0.0),
+                })
+
+        warnings = []
+        if not blocking:
+            for mat_id, qty in recipe.items():
+                remaining = available.get(mat_id, 0.0)
+                if qty > remaining:
+                    warnings.append({
+                        "material_id": mat_id,
+                        "required_qty": qty,
+                        "available_qty": remaining,
+                    })
+                available[mat_id] = remaining - qty
+
+        results.append({
+            **demand,
+            "releasable": not blocking,
+            "blocking": blocking,
+            "warnings": warnings,
+            "has_recipe": True,
+        })
+    return results
+
+
+class FeasibilityPlanner:
+    @staticmethod
+    def plan(session: Session, batch_type: str, now: Optional[datetime] = None) -> dict:
+        """
+        Toma todas las instancias pendientes del radar, las ordena por urgencia
+        (semáforo más atrasado → fecha de entrega más próxima → id) y reparte
+        las existencias disponibles (físico - comprometido) con allocate_greedy.
+
+        Consultas: radar (1 join + lotes) + recetas agrupadas + materiales.
+        """
+        batch_type = batch_type.upper()
+        pending = load_pending_instances(session, batch_type, now=now)
+
+        version_ids = {p["version_id"] for p in pending if p["version_id"] is not None}
+        recipes = BatchSimulator.load_recipes(session, version_ids, batch_type)
+        materials = BatchSimulator.load_materials(
+            session, {mat_id for recipe in recipes.values() for mat_id in recipe}
+        )
+        initial = {
+            m.id: float(m.physical_stock or 0.0) - float(m.committed_stock or 0.0)
+            for m in materials.values()
+        }
+        critical = {m.id: is_critical_category(m.category, batch_type) for m in materials.values()}
+
+        far_future = datetime.max
+        pending.sort(key=lambda p: (
+            semaphore_severity(p["semaphore"]),
+            p["instance"].delivery_deadline or far_future,
+            p["instance"].id,
+        ))
+        demands = [
+            {
+                "instance_id": p["instance"].id,
+                "version_id": p["version_id"],
+                "context": p,
+            }
+            for p in pending
+        ]
+
+        available = dict(initial)
+        allocations = allocate_greedy(demands, recipes, available, critical)
+
+        def _material_line(line: dict) -> dict:
+            mat = materials[line["material_id"]]
+            return {
+                "material_id": mat.id,
+                "sku": mat.sku,
+                "name": mat.name,
+                "category": mat.category,
+                "required_qty": round(line["required_qty"], 2),
+                "available_qty": round(line["available_qty"], 2),
+            }
+
+        instances = []
+        blocked_demand: Dict[int, float] = {}
+        for rank, alloc in enumerate(allocations, start=1):
+            ctx = alloc["context"]
+            inst = ctx["instance"]
+            if not alloc["releasable"]:
+                for mat_id, qty in recipes.get(alloc["version_id"], {}).items():
+                    if critical.get(mat_id):
+                        blocked_demand[mat_id] = blocked_demand.get(mat_id, 0.0) + qty
+            instances.append({
+                "rank": rank,
+                "instance_id": inst.id,
+                "custom_name": inst.custom_name,
+                "product_name": ctx["product_name"],
+                "order_id": ctx["order_id"],
+                "order_project_name": ctx["order_project_name"],
+                "client_name": ctx["client_name"],
+                "semaphore": ctx["semaphore"],
+                "delivery_deadline": inst.delivery_deadline.isoformat() if inst.delivery_deadline else None,
+                "releasable": alloc["releasable"],
+                "has_recipe": alloc["has_recipe"],
+                "blocking_materials": [_material_line(l) for l in alloc["blocking"]],
+                "warning_materials": [_material_line(l) for l in alloc["warnings"]],
+            })
+
+        material_summary = []
+        for mat in sorted(materials.values(), key=lambda m: (not critical[m.id], m.sku)):
+            material_summary.append({
+                "material_id": mat.id,
+                "sku": mat.sku,
+                "name": mat.name,
+                "category": mat.category,
+                "is_critical": critical[mat.id],
+                "initial_available_qty": round(initial[mat.id], 2),
+                "allocated_qty": round(initial[mat.id] - available[mat.id], 2),
+                "remaining_qty": round(available[mat.id], 2),
+                "blocked_demand_qty": round(blocked_demand.get(mat.id, 0.0), 2),
+            })
+
+        releasable = sum(1 for i in instances if i["releasable"])
+        return {
+            "batch_type": batch_type,
+            "total_instances": len(instances),
+            "releasable_count": releasable,
+            "blocked_count": len(instances) - releasable,
+            "instances": instances,
+            "materials": material_summary,
+        }
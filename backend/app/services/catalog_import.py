@@ -0,0 +1,482 @@
+"""
+catalog_import.py  –  Importación CSV en flujo (materiales, clientes, proveedores)
+
+El archivo NUNCA se carga completo en memoria:
+  1. Una pasada por bloques de bytes calcula el SHA-256 (para reanudar) y
+     decide la codificación (utf-8-sig, o latin-1 si no es UTF-8 válido).
+  2. Se decodifica y parsea renglón por renglón (TextIOWrapper + DictReader).
+  3. Cada CHUNK_SIZE renglones se valida y se guarda con UNA operación en
+     bloque y UN commit, que también avanza el registro CatalogImportRun.
+
+Materiales: INSERT ... ON CONFLICT (sku) DO UPDATE por bloque.
+Clientes y proveedores: su llave (full_name / business_name) no es única en la
+base, así que no admite ON CONFLICT; por bloque se hace UNA consulta de llaves,
+UN INSERT multi-fila de los nuevos y UN UPDATE por lotes de los existentes.
+
+Si un bloque falla en la base, se reintenta renglón por renglón (cada uno en
+su savepoint) para reportar el renglón culpable sin perder el resto.
+Si el proceso se cae, volver a subir el MISMO archivo reanuda desde el último
+bloque guardado.
+
+Este módulo SÍ hace commit (uno por bloque): es lo que lo hace reanudable.
+"""
+import codecs
+import csv
+import hashlib
+import io
+import math
+from datetime import datetime, timedelta
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple
+
+from sqlmodel import Session, select
+from sqlalchemy import bindparam, case, func, or_
+
+from app.models.foundations import Client, Provider
+from app.models.jobs import CatalogImportRun
+from app.models.material import COST_FIELDS, Material
+from app.services import recipe_index
+
+CHUNK_SIZE = 1_000
+READ_BLOCK_BYTES = 1024 * 1024
+MAX_STORED_ERRORS = 500
+STALE_RUN_MINUTES = 10  # Una corrida RUNNING sin avance en este tiempo se considera caída
+
+VALID_ROUTES = ["MATERIAL", "PROCESO", "CONSUMIBLE", "SERVICIO"]
+
+
+class CatalogImportError(ValueError):
+    """Error de la importación; trae el status HTTP que debe devolver el endpoint."""
+
+    def __init__(self, detail: str, status_code: int = 400):
+        self.detail = detail
+        self.status_code = status_code
+        super().__init__(detail)
+
+
+# ============================================================
+# LECTURA EN FLUJO
+# ============================================================
+
+def inspect_upload(fileobj: BinaryIO) -> Tuple[str, int, str]:
+    """(sha256, tamaño, codificación) recorriendo el archivo por bloques."""
+    digest = hashlib.sha256()
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    size = 0
+    is_utf8 = True
+    fileobj.seek(0)
+    while True:
+        block = fileobj.read(READ_BLOCK_BYTES)
+        if not block:
+            break
+        digest.update(block)
+        size += len(block)
+        if is_utf8:
+            try:
+                decoder.decode(block)
+            except UnicodeDecodeError:
+                is_utf8 = False
+    if is_utf8:
+        try:
+            decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            is_utf8 = False
+    fileobj.seek(0)
+    return digest.hexdigest(), size, "utf-8-sig" if is_utf8 else "latin-1"
+
+
+def open_csv_reader(fileobj: BinaryIO, encoding: str) -> Tuple[io.TextIOWrapper, csv.DictReader]:
+    """DictReader sobre el archivo decodificado al vuelo; el delimitador se detecta con una muestra."""
+    text = io.TextIOWrapper(fileobj, encoding=encoding, newline="")
+    sample = text.read(2048)
+    text.seek(0)
+    try:
+        delimiter = csv.Sniffer().sniff(sample).delimiter
+    except Exception:
+        delimiter = ","
+    return text, csv.DictReader(text, delimiter=delimiter)
+
+
+def _clean_row(row: dict) -> dict:
+    return {k.strip().lower(): (v.strip() if isinstance(v, str) else "") for k, v in row.items() if k}
+
+
+def _parse_money(value) -> float:
+    if not value:
+        return 0.0
+    clean = value.replace("$", "").replace(",", "").strip()
+    try:
+        return float(clean)
+    except ValueError:
+        return 0.0
+
+
+# ============================================================
+# VALIDACIÓN POR RENGLÓN (None = renglón vacío, se salta)
+# ============================================================
+
+def _parse_material(clean: dict) -> Optional[dict]:
+    if not clean.get("sku") or "name" not in clean:
+        return None
+
+    raw_factor = _parse_money(clean.get("conversion_factor"))
+    conversion_factor = raw_factor if raw_factor > 0 else 1.0
+    purchase_price = _parse_money(clean.get("current_cost"))
+    final_unit_cost = math.ceil(purchase_price / conversion_factor * 100) / 100
+
+    raw_route = (clean.get("production_route") or "MATERIAL").upper()
+    provider_name = (clean.get("proveedor") or clean.get("provider") or "").strip()
+    return {
+        "sku": clean["sku"].upper(),
+        "name": clean["name"],
+        "category": clean.get("category") or "General",
+        "purchase_unit": clean.get("purchase_unit") or "Pieza",
+        "usage_unit": clean.get("usage_unit") or "Pieza",
+        "conversion_factor": conversion_factor,
+        "current_cost": final_unit_cost,
+        "associated_element_sku": clean.get("associated_element_sku") or None,
+        "production_route": raw_route if raw_route in VALID_ROUTES else "MATERIAL",
+        "is_active": True,
+        "_provider_name": provider_name or None,
+    }
+
+
+def _parse_client(clean: dict) -> Optional[dict]:
+    full_name = clean.get("full_name", "")
+    email = clean.get("email", "")
+    phone = clean.get("phone", "")
+    if not full_name or not email or not phone:
+        return None
+    data = {"full_name": full_name, "email": email, "phone": phone, "is_active": True}
+    for field in (
+        "rfc_tax_id", "fiscal_address",
+        "contact_name", "contact_phone", "contact_dept", "contact_email",
+        "contact2_name", "contact2_phone", "contact2_dept", "contact2_email",
+        "contact3_name", "contact3_phone", "contact3_dept", "contact3_email",
+        "contact4_name", "contact4_phone", "contact4_dept", "contact4_email",
+        "notes",
+    ):
+        data[field] = clean.get(field) or None
+    return data
+
+
+def _parse_provider(clean: dict) -> Optional[dict]:
+    business_name = clean.get("business_name", "")
+    if not business_name:
+        return None
+    try:
+        credit_days = int(clean.get("credit_days", 0) or 0)
+    except ValueError:
+        credit_days = 0
+    return {
+        "business_name": business_name,
+        "rfc_tax_id": clean.get("rfc_tax_id") or None,
+        "credit_days": credit_days,
+        "phone": clean.get("phone") or None,
+        "phone2": clean.get("phone2") or None,
+        "contact_name": clean.get("contact_name") or None,
+        "contact_cellphone": clean.get("contact_cellphone") or None,
+        "contact_email": clean.get("contact_email") or None,
+        "is_active": True,
+    }
+
+
+# ============================================================
+# GUARDADO POR BLOQUE  ->  (creados, actualizados)
+# ============================================================
+
+def _dialect_insert(session: Session):
+    if session.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def _resolve_providers(session: Session, names: set) -> Dict[str, int]:
+    """{NOMBRE_EN_MAYÚSCULAS: provider_id}; crea de golpe los proveedores que no existan."""
+    if not names:
+        return {}
+    by_upper = {name.upper(): name for name in names}
+    provider_map = {}
+    for provider_id, business_name in session.exec(
+        select(Provider.id, Provider.business_name)
+        .where(func.upper(Provider.business_name).in_(list(by_upper)))
+        .order_by(Provider.id)
+    ).all():
+        provider_map.setdefault(business_name.upper(), provider_id)
+
+    missing = [name for upper, name in by_upper.items() if upper not in provider_map]
+    if missing:
+        table = Provider.__table__
+        created = session.execute(
+            table.insert().returning(table.c.id, table.c.business_name),
+            [{"business_name": name, "credit_days": 0, "is_active": True} for name in missing],
+        ).all()
+        for provider_id, business_name in created:
+            provider_map[business_name.upper()] = provider_id
+    return provider_map
+
+
+def _stamp_if_changed(table, new_values: dict, stamp):
+    """CASE para ON CONFLICT: `stamp` si alguna columna cambia, si no la huella guardada."""
+    changed = or_(*(table.c[key].is_distinct_from(value) for key, value in new_values.items()))
+    return case((changed, stamp), else_=table.c[stamp.key])
+
+
+def _upsert_materials(session: Session, rows: List[dict]) -> Tuple[int, int]:
+    provider_map = _resolve_providers(session, {r["_provider_name"] for r in rows if r["_provider_name"]})
+
+    # Un SKU repetido dentro del bloque: gana el último renglón (conservando proveedor si el último no trae)
+    by_sku: Dict[str, dict] = {}
+    repeated = 0
+    for row in rows:
+        data = {k: v for k, v in row.items() if k != "_provider_name"}
+        data["provider_id"] = provider_map.get((row["_provider_name"] or "").upper())
+        if data["sku"] in by_sku:
+            repeated += 1
+            if data["provider_id"] is None:
+                data["provider_id"] = by_sku[data["sku"]]["provider_id"]
+        by_sku[data["sku"]] = data
+
+    existing = set(session.exec(select(Material.sku).where(Material.sku.in_(list(by_sku)))).all())
+
+    table = Material.__table__
+    stmt = _dialect_insert(session)(table)
+    set_ = {
+        "name": stmt.excluded.name,
+        "category": stmt.excluded.category,
+        "purchase_unit": stmt.excluded.purchase_unit,
+        "usage_unit": stmt.excluded.usage_unit,
+        "conversion_factor": stmt.excluded.conversion_factor,
+        "current_cost": stmt.excluded.current_cost,
+        "associated_element_sku": stmt.excluded.associated_element_sku,
+        "production_route": stmt.excluded.production_route,
+        "is_active": stmt.excluded.is_active,
+        # Un CSV sin proveedor no borra el proveedor que ya tenía el material
+        "provider_id": func.coalesce(stmt.excluded.provider_id, table.c.provider_id),
+    }
+    # ON CONFLICT no dispara el onupdate ni _stamp_material: las huellas se fijan aquí,
+    # las de costo y catálogo sólo si el renglón trae algo distinto a lo guardado
+    cost = {key: value for key, value in set_.items() if key in COST_FIELDS}
+    catalog = {key: value for key, value in set_.items() if key not in COST_FIELDS}
+    set_["updated_at"] = stmt.excluded.updated_at
+    set_["cost_updated_at"] = _stamp_if_changed(table, cost, stmt.excluded.cost_updated_at)
+    set_["catalog_updated_at"] = _stamp_if_changed(table, catalog, stmt.excluded.catalog_updated_at)
+    stmt = stmt.on_conflict_do_update(index_elements=[table.c.sku], set_=set_)
+    # Las existencias sólo se fijan al crear; en conflicto no se tocan
+    session.execute(stmt, [{**data, "physical_stock": 0.0, "committed_stock": 0.0} for data in by_sku.values()])
+
+    created = len(by_sku) - len(existing & set(by_sku))
+    return created, len(rows) - created
+
+
+def _keyed_upsert(model, key: str) -> Callable[[Session, List[dict]], Tuple[int, int]]:
+    """Upsert por una llave NO única: una consulta de llaves + INSERT multi-fila + UPDATE por lotes."""
+    table = model.__table__
+
+    def upsert(session: Session, rows: List[dict]) -> Tuple[int, int]:
+        by_key: Dict[str, dict] = {}
+        for row in rows:
+            by_key[row[key]] = row  # Repetido en el bloque: gana el último
+
+        existing: Dict[str, int] = {}
+        for row_id, value in session.exec(
+            select(model.id, getattr(model, key)).where(getattr(model, key).in_(list(by_key))).order_by(model.id)
+        ).all():
+            existing.setdefault(value, row_id)
+
+        new_rows = [data for value, data in by_key.items() if value not in existing]
+        if new_rows:
+            if "registration_date" in table.c:
+                now = datetime.utcnow()
+                new_rows = [{**data, "registration_date": now} for data in new_rows]
+            session.execute(table.insert(), new_rows)
+
+        updates = [{"b_id": existing[value], **data} for value, data in by_key.items() if value in existing]
+        if updates:
+            session.execute(table.update().where(table.c.id == bindparam("b_id")), updates)
+
+        return len(new_rows), len(rows) - len(new_rows)
+
+    return upsert
+
+
+ENTITIES: Dict[str, Tuple[Callable[[dict], Optional[dict]], Callable]] = {
+    "MATERIALS": (_parse_material, _upsert_materials),
+    "CLIENTS": (_parse_client, _keyed_upsert(Client, "full_name")),
+    "PROVIDERS": (_parse_provider, _keyed_upsert(Provider, "business_name")),
+}
+
+
+# ============================================================
+# ORQUESTADOR
+# ============================================================
+
+class CatalogImporter:
+    @staticmethod
+    def find_resumable(session: Session, entity: str, file_sha256: str) -> Optional[CatalogImportRun]:
+        """Última corrida sin terminar del mismo archivo. Una RUNNING reciente sigue viva: 409."""
+        run = session.exec(
+            select(CatalogImportRun)
+            .where(CatalogImportRun.entity == entity)
+            .where(CatalogImportRun.file_sha256 == file_sha256)
+            .where(CatalogImportRun.status != "COMPLETED")
+            .order_by(CatalogImportRun.id.desc())
+        ).first()
+        if run and run.status == "RUNNING" \
+                and datetime.utcnow() - run.updated_at < timedelta(minutes=STALE_RUN_MINUTES):
+            raise CatalogImportError(
+                f"Este archivo ya se está importando (corrida {run.id}).", status_code=409
+            )
+        return run
+
+    @staticmethod
+    def run(
+        session: Session,
+        entity: str,
+        fileobj: BinaryIO,
+        filename: Optional[str] = None,
+        user_id: Optional[int] = None,
+        chunk_size: int = CHUNK_SIZE,
+        on_progress: Optional[Callable[[CatalogImportRun], None]] = None,
+    ) -> CatalogImportRun:
+        """
+        Importa el archivo en bloques de chunk_size renglones, con un commit por
+        bloque. Si hay una corrida sin terminar del mismo archivo, la reanuda.
+        """
+        parse_row, upsert_chunk = ENTITIES[entity]
+        file_sha256, file_size, encoding = inspect_upload(fileobj)
+
+        run = CatalogImporter.find_resumable(session, entity, file_sha256)
+        if run is None:
+            run = CatalogImportRun(
+                entity=entity, filename=filename, file_sha256=file_sha256,
+                file_size=file_size, created_by_user_id=user_id, errors=[],
+            )
+        run.status = "RUNNING"
+        run.last_error = None
+        run.updated_at = datetime.utcnow()
+        session.add(run)
+        session.commit()
+        session.refresh(run)
+        resume_from = run.rows_committed
+
+        text, reader = open_csv_reader(fileobj, encoding)
+        try:
+            chunk: List[Tuple[int, dict]] = []
+            row_idx = -1
+            for row_idx, row in enumerate(reader):
+                if row_idx < resume_from:
+                    continue  # Ya guardado en una corrida anterior
+                chunk.append((row_idx, row))
+                if len(chunk) >= chunk_size:
+                    CatalogImporter._commit_chunk(session, run, chunk, parse_row, upsert_chunk, fileobj)
+                    chunk = []
+                    if on_progress:
+                        on_progress(run)
+            if chunk:
+                CatalogImporter._commit_chunk(session, run, chunk, parse_row, upsert_chunk, fileobj)
+
+            run.status = "COMPLETED"
+            run.bytes_processed = run.file_size
+            run.finished_at = run.updated_at = datetime.utcnow()
+            session.add(run)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            run = session.get(CatalogImportRun, run.id)
+            run.status = "FAILED"
+            run.last_error = f"{type(e).__name__}: {e}"
+            run.updated_at = datetime.utcnow()
+            session.add(run)
+            session.commit()
+            raise CatalogImportError(
+                f"La importación se detuvo en el renglón {run.rows_committed + 2}. "
+                f"Vuelve a subir el mismo archivo para continuar (corrida {run.id}).",
+                status_code=500,
+            )
+        finally:
+            text.detach()  # No cerrar el archivo subido: es del llamador
+            if entity == "MATERIALS":
+                # Nombre, unidad o categoría de materiales en recetas pudo cambiar
+                recipe_index.invalidate_recipe_index()
+        return run
+
+    @staticmethod
+    def _commit_chunk(
+        session: Session,
+        run: CatalogImportRun,
+        chunk: List[Tuple[int, dict]],
+        parse_row: Callable[[dict], Optional[dict]],
+        upsert_chunk: Callable[[Session, List[dict]], Tuple[int, int]],
+        fileobj: BinaryIO,
+    ) -> None:
+        valid: List[Tuple[int, dict]] = []
+        errors: List[str] = []
+        skipped = 0
+        for row_idx, row in chunk:
+            try:
+                data = parse_row(_clean_row(row))
+            except Exception as e:
+                errors.append(f"Fila {row_idx + 2}: {e}")
+                continue
+            if data is None:
+                skipped += 1
+            else:
+                valid.append((row_idx, data))
+
+        created = updated = 0
+        if valid:
+            try:
+                with session.begin_nested():
+                    created, updated = upsert_chunk(session, [data for _, data in valid])
+            except Exception:
+                # Aislar el renglón culpable: uno por uno, cada uno en su savepoint
+                for row_idx, data in valid:
+                    try:
+                        with session.begin_nested():
+                            c, u = upsert_chunk(session, [data])
+                        created += c
+                        updated += u
+                    except Exception as e:
+                        errors.append(f"Fila {row_idx + 2}: {e.__class__.__name__}: {str(e).splitlines()[0]}")
+
+        run.rows_committed = chunk[-1][0] + 1
+        run.chunks_committed += 1
+        run.processed += created + updated
+        run.created += created
+        run.updated += updated
+        run.skipped += skipped
+        run.error_count += len(errors)
+        if errors and len(run.errors or []) < MAX_STORED_ERRORS:
+            # Reasignar (no mutar) para que el JSON se marque como modificado
+            run.errors = (run.errors or []) + errors[:MAX_STORED_ERRORS - len(run.errors or [])]
+        try:
+            run.bytes_processed = min(fileobj.tell(), run.file_size)
+        except Exception:
+            pass
+        run.updated_at = datetime.utcnow()
+        session.add(run)
+        session.commit()
+
+    @staticmethod
+    def summary(run: CatalogImportRun) -> dict:
+        return {
+            "run_id": run.id,
+            "entity": run.entity,
+            "filename": run.filename,
+            "status": run.status,
+            "processed": run.processed,
+            "created": run.created,
+            "updated": run.updated,
+            "skipped": run.skipped,
+            "errors": run.errors or [],
+            "error_count": run.error_count,
+            "rows_committed": run.rows_committed,
+            "chunks_committed": run.chunks_committed,
+            "progress_percent": round(100.0 * run.bytes_processed / run.file_size, 1) if run.file_size else 100.0,
+            "last_error": run.last_error,
+            "started_at": run.started_at,
+            "updated_at": run.updated_at,
+            "finished_at": run.finished_at,
+        }
@@ -0,0 +1,115 @@
+"""
+change_tracking.py  –  ¿Cambió algo desde la última vez? (ETag y ?since=)
+
+Los listados pesados (lotes, salud de instancias, calendario, órdenes de venta,
+catálogo de diseño) arman miles de filas aunque nada haya cambiado. Antes de
+consultarlas, collection_version() saca en UNA consulta una huella barata de
+las tablas que alimentan la vista: por tabla count(*), max(id) y max(updated_at),
+más las filas tocadas dentro del margen CHANGE_TRACKING_LAG_SECONDS. Si el
+cliente ya tiene esa versión (If-None-Match), se responde 304 sin tocar lo demás.
+
+El margen cubre a la transacción que fija updated_at y confirma después de que
+otra, más nueva, ya subió el max(updated_at): su fila no mueve el máximo, pero
+sí el conteo de filas recientes. El mismo margen se resta al ?since= del
+cliente (since_cutoff): pueden repetirse filas ya enviadas, nunca perderse.
+
+Una vista que sólo lee parte de una tabla puede pasar, en lugar del modelo, la
+columna de huella que le toca (p. ej. Material.cost_updated_at): así los
+movimientos de existencias, que sí mueven materials.updated_at, no le cambian
+la versión.
+
+Lo que la huella NO ve: tablas sin updated_at que se editan en sitio (ahí sólo
+cuentan altas y bajas) y todo lo que no está en la lista de modelos de la vista;
+por eso cada endpoint lista TODAS las tablas que lee.
+"""
+import hashlib
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional
+
+from fastapi import Request, Response
+from sqlalchemy import func, select
+from sqlalchemy.orm.attributes import InstrumentedAttribute
+from sqlmodel import Session
+
+from app.core.config import settings
+from app.core.etag import etag_matches
+
+CACHE_CONTROL = "private, no-cache"  # El navegador guarda, pero revalida siempre
+
+
+def _table_stats(source, cutoff: datetime) -> list:
+    """`source`: un modelo (huella = su updated_at) o una columna de huella de un modelo."""
+    if isinstance(source, InstrumentedAttribute):
+        table = source.class_.__table__
+        stamp = table.c[source.key]
+    else:
+        table = source.__table__
+        stamp = table.c.get("updated_at")
+    stats = [
+        select(func.count()).select_from(table).scalar_subquery(),
+        select(func.max(table.c.id)).scalar_subquery(),
+    ]
+    if stamp is not None:
+        stats.append(select(func.max(stamp)).scalar_subquery())
+        stats.append(
+            select(func.count()).select_from(table)
+            .where(stamp > cutoff)
+            .scalar_subquery()
+        )
+    return stats
+
+
+def collection_version(session: Session, models: Iterable, *scope) -> str:
+    """Huella corta de las tablas (o columnas de huella) de `models` + lo que distinga la vista (`scope`)."""
+    cutoff = datetime.utcnow() - timedelta(seconds=settings.CHANGE_TRACKING_LAG_SECONDS)
+    columns = [stat for model in models for stat in _table_stats(model, cutoff)]
+    row = session.execute(select(*columns)).one()
+    return hashlib.sha1(repr((tuple(row), scope)).encode()).hexdigest()[:20]
+
+
+def time_bucket(seconds: Optional[int] = None) -> int:
+    """Para vistas cuyo resultado cambia con la hora (semáforos por días): el ETag caduca solo."""
+    return int(time.time() // (seconds or settings.ETAG_TIME_BUCKET_SECONDS))
+
+
+def not_modified(
+    request: Request,
+    response: Response,
+    session: Session,
+    models: Iterable,
+    user=None,
+    scope: tuple = (),
+) -> Optional[Response]:
+    """
+    Pone ETag y Cache-Control en `response` y, si el cliente ya tiene esta versión,
+    regresa el 304 que el endpoint debe devolver tal cual. None = hay que armar la respuesta.
+    La versión incluye ruta, query string y usuario (los listados filtran por rol/vendedor).
+    """
+    version = collection_version(
+        session,
+        models,
+        request.url.path,
+        sorted(request.query_params.multi_items()),
+        getattr(user, "id", None),
+        str(getattr(user, "role", "")),
+        *scope,
+    )
+    etag = f'W/"{version}"'
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+    return None
+
+
+def naive_utc(value: datetime) -> datetime:
+    """Las columnas guardan UTC sin zona: un ?since= con zona se convierte y se le quita."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def since_cutoff(since: datetime) -> datetime:
+    """El ?since= del cliente menos el margen de transacciones tardías."""
+    return naive_utc(since) - timedelta(seconds=settings.CHANGE_TRACKING_LAG_SECONDS)
@@ -0,0 +1,127 @@
+"""
+config_cache.py  –  Cache en proceso de la configuración
+
+GlobalConfig (un solo renglón), las tasas de impuesto (tabla chica) y el logo
+en base64 casi nunca cambian, pero se leían en cada cotización, PDF y cálculo
+de totales. Aquí se leen una vez y se sirven de memoria:
+
+  - get_global_config / get_tax_rate / list_tax_rates: lectura a través del
+    cache; en un fallo se usa la sesión del llamador (sin conexión extra).
+    Regresan una COPIA suelta (no ligada a ninguna sesión): es de sólo lectura;
+    para modificar, leer el renglón de la BD como siempre.
+  - get_logo_base64: el logo descargado, mientras no cambie logo_path.
+  - invalidate_config_cache(): la llaman los endpoints que escriben
+    configuración o impuestos. Con varios procesos, los demás se enteran al
+    vencer CONFIG_CACHE_TTL_SECONDS.
+"""
+import base64
+import threading
+import time
+import urllib.request
+from typing import Dict, List, Optional
+
+from sqlmodel import Session, select
+
+from app.core.config import settings
+from app.models.foundations import GlobalConfig, TaxRate
+
+# generation cambia en cada invalidación: una lectura que empezó antes de
+# invalidar no puede dejar en el cache el valor viejo.
+_cache: Dict = {"config": None, "tax_rates": None, "logo": None, "expires_at": 0.0, "generation": 0}
+_lock = threading.Lock()
+
+
+def _clear() -> None:
+    _cache["config"] = None
+    _cache["tax_rates"] = None
+    _cache["logo"] = None
+    _cache["generation"] += 1
+
+
+def invalidate_config_cache() -> None:
+    """Fuerza a que la siguiente lectura de configuración, impuestos o logo vaya a la fuente."""
+    with _lock:
+        _clear()
+        _cache["expires_at"] = 0.0
+
+
+def _read(key: str):
+    """(valor cacheado o None, generación). Vacía el cache si ya venció."""
+    with _lock:
+        if _cache["expires_at"] < time.monotonic():
+            _clear()
+            _cache["expires_at"] = time.monotonic() + settings.CONFIG_CACHE_TTL_SECONDS
+        return _cache[key], _cache["generation"]
+
+
+def _store(key: str, value, generation: int) -> None:
+    with _lock:
+        if _cache["generation"] == generation:
+            _cache[key] = value
+
+
+def _values(obj) -> dict:
+    return {column.key: getattr(obj, column.key) for column in obj.__table__.columns}
+
+
+def get_global_config(session: Session) -> Optional[GlobalConfig]:
+    values, generation = _read("config")
+    if values is None:
+        config = session.exec(select(GlobalConfig)).first()
+        if config is None:
+            return None  # Sin configuración todavía: no se cachea la ausencia
+        values = _values(config)
+        _store("config", values, generation)
+    return GlobalConfig(**values)
+
+
+def _tax_rates(session: Session) -> Dict[int, dict]:
+    rates, generation = _read("tax_rates")
+    if rates is None:
+        rates = {rate.id: _values(rate) for rate in session.exec(select(TaxRate)).all()}
+        _store("tax_rates", rates, generation)
+    return rates
+
+
+def get_tax_rate(session: Session, tax_rate_id: Optional[int]) -> Optional[TaxRate]:
+    """TaxRate por id (incluye las desactivadas: las órdenes viejas las siguen usando)."""
+    if tax_rate_id is None:
+        return None
+    rates = _tax_rates(session)
+    values = rates.get(tax_rate_id)
+    return TaxRate(**values) if values else None
+
+
+def list_tax_rates(session: Session, active_only: bool = True) -> List[TaxRate]:
+    rates = _tax_rates(session)
+    return [
+        TaxRate(**values) for _, values in sorted(rates.items())
+        if values["is_active"] or not active_only
+    ]
+
+
+def get_logo_base64(session: Session) -> dict:
+    """Logo de la empresa como data URI. Las descargas fallidas no se cachean."""
+    config = get_global_config(session)
+    logo_path = config.logo_path if config else None
+    if not logo_path:
+        return {"base64": None, "content_type": None}
+
+    logo, generation = _read("logo")
+    if logo and logo["logo_path"] == logo_path:
+        return logo["payload"]
+
+    try:
+        with urllib.request.urlopen(logo_path, timeout=5) as response:
+            image_data = response.read()
+            content_type = response.headers.get('Content-Type', 'image/png')
+    except Exception:
+        return {"base64": None, "content_type": None}
+
+    encoded = base64.b64encode(image_data).decode('utf-8')
+    payload = {
+        "base64": f"data:{content_type};base64,{encoded}",
+        "content_type": content_type,
+    }
+    _store("logo", {"logo_path": logo_path, "payload": payload}, generation)
+    return payload
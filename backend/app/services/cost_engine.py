@@ -1,8 +1,8 @@
-from sqlmodel import Session, select
+from sqlmodel import Session
 from app.models.material import Material
 from app.models.design import ProductVersion
 from app.models.sales import SalesOrder
-from app.models.foundations import GlobalConfig
+from app.services.config_cache import get_global_config
 
 class CostEngine:
     @staticmethod
@@ -12,7 +12,7 @@ class CostEngine:
         Compara los costos congelados en la cotización vs los costos reales de almacén hoy.
         """
         # 1. Obtener tolerancia global (por defecto 3%)
-        config = session.exec(select(GlobalConfig)).first()
+        config = get_global_config(session)
         tolerance = config.cost_tolerance_percent if config else 0.03
         
         total_frozen_cost = 0.0
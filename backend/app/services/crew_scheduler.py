@@ -0,0 +1,471 @@
+"""
+crew_scheduler.py  –  Agenda de cuadrillas de instalación (carriles IM/IP)
+
+Responsabilidades:
+  1. Validar en UNA consulta a todos los líderes y ayudantes de un lote de
+     asignaciones (existen, están activos y tienen rol LOGISTICS).
+  2. Detectar doble reserva: una persona en dos instalaciones que se enciman.
+     Cada asignación ocupa [fecha, fecha + días de instalación de la versión).
+     Las asignaciones vigentes se leen con UNA consulta por rango de fechas
+     (índices persona + fecha) y se acomodan en CrewCalendar, un índice en
+     memoria por persona ordenado por inicio: revisar un intervalo es una
+     búsqueda binaria más los pocos vecinos que pueden alcanzarlo.
+  3. Sugerir cuadrillas para muchos eventos repartiendo la carga: a cada
+     evento le toca la cuadrilla libre con menos días ocupados.
+
+Todo ocurre en la transacción del llamador: este módulo no hace commit.
+"""
+import math
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlmodel import Session, select
+from sqlalchemy import func, or_
+
+from app.models.design import ProductVersion
+from app.models.production import InstallationAssignment, InstallationAssignmentStatus
+from app.models.sales import SalesOrderItemInstance
+from app.models.users import User, UserRole
+from app.services.instance_context import resolve_instance_contexts
+
+LANES = ("IM", "IP")
+# Estados que ocupan a la cuadrilla (INSTALLED/COMPLETED ya liberaron la fecha)
+BUSY_STATUSES = (InstallationAssignmentStatus.SCHEDULED, InstallationAssignmentStatus.IN_PROGRESS)
+CREW_ROLES = (
+    ("leader_user_id", "Líder"),
+    ("helper_1_user_id", "Ayudante 1"),
+    ("helper_2_user_id", "Ayudante 2"),
+)
+
+
+class CrewSchedulingError(ValueError):
+    def __init__(self, detail, status_code: int = 400):
+        self.detail = detail
+        self.status_code = status_code
+        super().__init__(detail if isinstance(detail, str) else "Error de programación de cuadrillas")
+
+
+@dataclass(frozen=True)
+class Crew:
+    leader_user_id: int
+    helper_1_user_id: Optional[int] = None
+    helper_2_user_id: Optional[int] = None
+
+    @property
+    def members(self) -> List[int]:
+        return [uid for uid in (self.leader_user_id, self.helper_1_user_id, self.helper_2_user_id) if uid]
+
+
+@dataclass
+class CrewRequest:
+    """Una asignación pedida: cuadrilla para el carril IM/IP de una instancia en una fecha."""
+    instance_id: int
+    lane: str
+    assignment_date: date
+    crew: Crew
+
+    @property
+    def key(self) -> Tuple[int, str]:
+        return self.instance_id, self.lane
+
+
+# ------------------------------------------------------------
+# Validación de personas
+# ------------------------------------------------------------
+def load_crew_members(session: Session, user_ids: Iterable[Optional[int]]) -> Dict[int, User]:
+    """{user_id: User} con UNA consulta. Los que no existen simplemente no aparecen."""
+    ids = {uid for uid in user_ids if uid}
+    if not ids:
+        return {}
+    return {user.id: user for user in session.exec(select(User).where(User.id.in_(ids))).all()}
+
+
+def crew_errors(crew: Crew, members: Dict[int, User]) -> List[Tuple[int, str]]:
+    """[(status_code, detalle)] de la cuadrilla: inexistentes, inactivos, sin rol LOGISTICS o repetidos."""
+    errors: List[Tuple[int, str]] = []
+    seen = set()
+    for field, label in CREW_ROLES:
+        user_id = getattr(crew, field)
+        if not user_id:
+            continue
+        user = members.get(user_id)
+        if not user:
+            errors.append((404, f"{label} no encontrado (usuario {user_id})."))
+        elif user.role != UserRole.LOGISTICS:
+            errors.append((400, f"{label} debe tener rol LOGISTICS. Rol actual: {user.role}"))
+        elif not user.is_active:
+            errors.append((400, f"{label} ({user.full_name}) está inactivo."))
+        if user_id in seen:
+            errors.append((400, f"{label} ya está en la cuadrilla (usuario {user_id})."))
+        seen.add(user_id)
+    return errors
+
+
+# ------------------------------------------------------------
+# Duración de las instalaciones
+# ------------------------------------------------------------
+def _span(installation_days: Optional[float]) -> int:
+    return max(1, math.ceil(installation_days or 1))
+
+
+def installation_spans(session: Session, instance_ids: Iterable[int]) -> Dict[int, int]:
+    """{instance_id: días que ocupa la instalación} (installation_days de la versión, mínimo 1)."""
+    contexts = resolve_instance_contexts(session, instance_ids)
+    return {
+        instance_id: _span(ctx.version.installation_days if ctx.version else None)
+        for instance_id, ctx in contexts.items()
+    }
+
+
+def max_installation_span(session: Session) -> int:
+    """La instalación más larga del catálogo: cota para buscar asignaciones que alcanzan una fecha."""
+    return _span(session.exec(select(func.max(ProductVersion.installation_days))).one())
+
+
+# ------------------------------------------------------------
+# Agenda en memoria
+# ------------------------------------------------------------
+class CrewCalendar:
+    """
+    Por persona, intervalos [inicio, fin) en días (ordinales) ordenados por
+    inicio. Como ninguna instalación dura más de max_span días, sólo los
+    intervalos que empiezan en (inicio - max_span, fin) pueden encimarse.
+    """
+
+    def __init__(self, max_span: int):
+        self.max_span = max_span
+        self._starts: Dict[int, List[int]] = {}
+        self._entries: Dict[int, List[Tuple[int, int, dict]]] = {}
+        self._booked_days: Dict[int, int] = {}
+
+    def add(self, user_id: int, start: date, days: int, ref: dict) -> None:
+        first = start.toordinal()
+        starts = self._starts.setdefault(user_id, [])
+        entries = self._entries.setdefault(user_id, [])
+        index = bisect_right(starts, first)
+        starts.insert(index, first)
+        entries.insert(index, (first, first + days, ref))
+        self._booked_days[user_id] = self._booked_days.get(user_id, 0) + days
+
+    def overlapping(
+        self,
+        user_id: int,
+        start: date,
+        days: int,
+        ignore: Optional[Tuple[int, str]] = None,
+    ) -> List[dict]:
+        """Referencias de las asignaciones de la persona que se enciman con [start, start + days)."""
+        starts = self._starts.get(user_id)
+        if not starts:
+            return []
+        first = start.toordinal()
+        end = first + days
+        found = []
+        index = bisect_left(starts, end) - 1
+        entries = self._entries[user_id]
+        while index >= 0 and entries[index][0] > first - self.max_span:
+            _, entry_end, ref = entries[index]
+            if entry_end > first and (ignore is None or (ref["instance_id"], ref["lane"]) != ignore):
+                found.append(ref)
+            index -= 1
+        found.reverse()
+        return found
+
+    def booked_days(self, user_id: int) -> int:
+        return self._booked_days.get(user_id, 0)
+
+    def double_bookings(self) -> List[dict]:
+        """Todas las parejas de asignaciones encimadas, por persona."""
+        result = []
+        for user_id, entries in self._entries.items():
+            for index, (_, end, ref) in enumerate(entries):
+                following = index + 1
+                while following < len(entries) and entries[following][0] < end:
+                    result.append({"user_id": user_id, "first": ref, "second": entries[following][2]})
+                    following += 1
+        return result
+
+
+def _ref(instance_id: int, lane: str, start: date, days: int, assignment_id: Optional[int] = None) -> dict:
+    return {
+        "assignment_id": assignment_id,
+        "instance_id": instance_id,
+        "lane": lane,
+        "date_from": start.isoformat(),
+        "date_to": (start + timedelta(days=days - 1)).isoformat(),
+    }
+
+
+def load_calendar(
+    session: Session,
+    date_from: date,
+    date_to: date,
+    user_ids: Optional[Iterable[int]] = None,
+) -> CrewCalendar:
+    """
+    Agenda de las asignaciones vigentes que tocan [date_from, date_to] con UNA
+    consulta (más la duración de cada instalación). Sin user_ids: toda la plantilla.
+    """
+    max_span = max_installation_span(session)
+    lower = datetime.combine(date_from - timedelta(days=max_span - 1), time.min)
+    upper = datetime.combine(date_to, time.max)
+    stmt = (
+        select(InstallationAssignment)
+        .where(InstallationAssignment.status.in_(BUSY_STATUSES))
+        .where(InstallationAssignment.assignment_date >= lower)
+        .where(InstallationAssignment.assignment_date <= upper)
+    )
+    wanted = None
+    if user_ids is not None:
+        wanted = set(user_ids)
+        if not wanted:
+            return CrewCalendar(max_span)
+        stmt = stmt.where(or_(
+            InstallationAssignment.leader_user_id.in_(wanted),
+            InstallationAssignment.helper_1_user_id.in_(wanted),
+            InstallationAssignment.helper_2_user_id.in_(wanted),
+        ))
+    assignments = session.exec(stmt).all()
+
+    spans = installation_spans(session, {a.instance_id for a in assignments})
+    calendar = CrewCalendar(max_span)
+    for assignment in assignments:
+        start = assignment.assignment_date.date()
+        days = spans.get(assignment.instance_id, 1)
+        ref = _ref(assignment.instance_id, assignment.lane, start, days, assignment.id)
+        for field, _ in CREW_ROLES:
+            user_id = getattr(assignment, field)
+            if user_id and (wanted is None or user_id in wanted):
+                calendar.add(user_id, start, days, ref)
+    return calendar
+
+
+# ------------------------------------------------------------
+# Asignación masiva
+# ------------------------------------------------------------
+def plan_assignments(session: Session, requests: List[CrewRequest]) -> dict:
+    """
+    Valida un lote de asignaciones sin escribir nada. Regresa:
+      errors:    [{index, instance_id, lane, status_code, detail}]  (bloquean el lote)
+      conflicts: [{index, instance_id, lane, user_id, user_name, with}]  (doble reserva)
+      members, instances, spans: lo ya cargado, para apply_assignments y la respuesta.
+    Los conflictos incluyen los del propio lote (dos eventos del lote con la misma persona).
+    """
+    if not requests:
+        raise CrewSchedulingError("No se enviaron asignaciones.")
+
+    instances = {
+        inst.id: inst for inst in session.exec(
+            select(SalesOrderItemInstance)
+            .where(SalesOrderItemInstance.id.in_({r.instance_id for r in requests}))
+        ).all()
+    }
+    members = load_crew_members(session, (uid for r in requests for uid in r.crew.members))
+    spans = installation_spans(session, instances.keys())
+
+    errors: List[dict] = []
+    seen_keys = set()
+    for index, request in enumerate(requests):
+        def error(detail: str, status_code: int = 400) -> None:
+            errors.append({
+                "index": index, "instance_id": request.instance_id, "lane": request.lane,
+                "status_code": status_code, "detail": detail,
+            })
+
+        inst = instances.get(request.instance_id)
+        if request.lane not in LANES:
+            error("El carril debe ser IM (Instalación MDF) o IP (Instalación Piedra).")
+        elif not inst:
+            error("Instancia no encontrada.", 404)
+        elif inst.is_cancelled:
+            error("La instancia está cancelada.")
+        elif request.lane == "IM" and not inst.scheduled_inst_mdf:
+            error("La instancia no tiene fecha IM programada en el calendario.")
+        elif request.lane == "IP" and not inst.scheduled_inst_stone:
+            error("La instancia no tiene fecha IP programada en el calendario.")
+        if request.key in seen_keys:
+            error("El carril de esta instancia viene dos veces en el lote.")
+        seen_keys.add(request.key)
+        for status_code, detail in crew_errors(request.crew, members):
+            error(detail, status_code)
+
+    conflicts: List[dict] = []
+    if not errors:
+        calendar = load_calendar(
+            session,
+            min(r.assignment_date for r in requests),
+            max(r.assignment_date + timedelta(days=spans.get(r.instance_id, 1) - 1) for r in requests),
+            user_ids=members.keys(),
+        )
+        for index, request in enumerate(requests):
+            days = spans.get(request.instance_id, 1)
+            for user_id in request.crew.members:
+                for other in calendar.overlapping(user_id, request.assignment_date, days, ignore=request.key):
+                    conflicts.append({
+                        "index": index,
+                        "instance_id": request.instance_id,
+                        "lane": request.lane,
+                        "user_id": user_id,
+                        "user_name": members[user_id].full_name,
+                        "with": other,
+                    })
+            ref = _ref(request.instance_id, request.lane, request.assignment_date, days)
+            for user_id in request.crew.members:
+                calendar.add(user_id, request.assignment_date, days, ref)
+
+    return {
+        "errors": errors,
+        "conflicts": conflicts,
+        "members": members,
+        "instances": instances,
+        "spans": spans,
+    }
+
+
+def apply_assignments(session: Session, requests: List[CrewRequest]) -> List[Tuple[InstallationAssignment, bool]]:
+    """
+    Crea o reasigna (si ya hay una SCHEDULED para la instancia y carril) en la
+    transacción actual. Regresa [(asignación, creada)] en el orden de requests.
+    """
+    existing: Dict[Tuple[int, str], InstallationAssignment] = {}
+    for assignment in session.exec(
+        select(InstallationAssignment)
+        .where(InstallationAssignment.instance_id.in_({r.instance_id for r in requests}))
+        .where(InstallationAssignment.status == InstallationAssignmentStatus.SCHEDULED)
+        .order_by(InstallationAssignment.id)
+    ).all():
+        existing.setdefault((assignment.instance_id, assignment.lane), assignment)
+
+    result = []
+    for request in requests:
+        assignment = existing.get(request.key)
+        created = assignment is None
+        assignment_dt = datetime.combine(request.assignment_date, time.min)
+        if created:
+            assignment = InstallationAssignment(
+                instance_id=request.instance_id,
+                lane=request.lane,
+                status=InstallationAssignmentStatus.SCHEDULED,
+                leader_user_id=request.crew.leader_user_id,
+                assignment_date=assignment_dt,
+            )
+        assignment.leader_user_id = request.crew.leader_user_id
+        assignment.helper_1_user_id = request.crew.helper_1_user_id
+        assignment.helper_2_user_id = request.crew.helper_2_user_id
+        assignment.assignment_date = assignment_dt
+        session.add(assignment)
+        result.append((assignment, created))
+    session.flush()
+    return result
+
+
+# ------------------------------------------------------------
+# Sugerencia de cuadrillas
+# ------------------------------------------------------------
+def suggest_assignments(
+    session: Session,
+    events: List[Tuple[int, str, Optional[date]]],
+    crews: List[Crew],
+    max_shift_days: int = 0,
+) -> dict:
+    """
+    Propone una cuadrilla (y fecha) para cada evento (instance_id, carril, fecha o None).
+    Sin fecha se usa la programada del carril. Reglas, en orden:
+      1. Nadie de la cuadrilla puede tener otra instalación encimada.
+      2. Se prefiere la fecha pedida; si no hay cuadrilla libre, se recorre
+         hasta max_shift_days días hacia adelante.
+      3. Entre las libres gana la de menos días ocupados de su líder (reparte la carga).
+    Los eventos se acomodan por fecha y, el mismo día, los más largos primero.
+    """
+    if not crews:
+        raise CrewSchedulingError("Indica al menos una cuadrilla.")
+
+    crews = list(dict.fromkeys(crews))
+    members = load_crew_members(session, (uid for crew in crews for uid in crew.members))
+    crew_problems = [
+        {"leader_user_id": crew.leader_user_id, "detail": detail}
+        for crew in crews for _, detail in crew_errors(crew, members)
+    ]
+    if crew_problems:
+        raise CrewSchedulingError(crew_problems)
+
+    instances = {
+        inst.id: inst for inst in session.exec(
+            select(SalesOrderItemInstance)
+            .where(SalesOrderItemInstance.id.in_({instance_id for instance_id, _, _ in events}))
+        ).all()
+    }
+    spans = installation_spans(session, instances.keys())
+
+    pending = []
+    unassigned = []
+    for instance_id, lane, wanted_date in events:
+        inst = instances.get(instance_id)
+        scheduled = None
+        if inst and lane in LANES:
+            scheduled = inst.scheduled_inst_mdf if lane == "IM" else inst.scheduled_inst_stone
+        start = wanted_date or (scheduled.date() if scheduled else None)
+        if not inst or lane not in LANES or not start:
+            unassigned.append({"instance_id": instance_id, "lane": lane, "reason": "Sin instancia, carril o fecha de instalación."})
+            continue
+        pending.append((start, -spans.get(instance_id, 1), instance_id, lane))
+    pending.sort()
+
+    proposals = []
+    if pending:
+        longest = max(-negative_span for _, negative_span, _, _ in pending)
+        calendar = load_calendar(
+            session,
+            pending[0][0],
+            max(start for start, *_ in pending) + timedelta(days=max(0, max_shift_days) + longest),
+            user_ids=members.keys(),
+        )
+        for start, negative_span, instance_id, lane in pending:
+            days = -negative_span
+            choice = None
+            for shift in range(max(0, max_shift_days) + 1):
+                day = start + timedelta(days=shift)
+                free = [
+                    crew for crew in crews
+                    if not any(calendar.overlapping(uid, day, days, ignore=(instance_id, lane)) for uid in crew.members)
+                ]
+                if free:
+                    crew = min(free, key=lambda c: (calendar.booked_days(c.leader_user_id), c.leader_user_id))
+                    choice = (day, crew)
+                    break
+            if not choice:
+                unassigned.append({
+                    "instance_id": instance_id, "lane": lane,
+                    "reason": f"Ninguna cuadrilla libre entre {start.isoformat()} y "
+                              f"{(start + timedelta(days=max(0, max_shift_days))).isoformat()}.",
+                })
+                continue
+            day, crew = choice
+            ref = _ref(instance_id, lane, day, days)
+            for uid in crew.members:
+                calendar.add(uid, day, days, ref)
+            proposals.append({
+                "instance_id": instance_id,
+                "instance_name": instances[instance_id].custom_name,
+                "lane": lane,
+                "assignment_date": day.isoformat(),
+                "shifted_days": (day - start).days,
+                "installation_days": days,
+                "leader_user_id": crew.leader_user_id,
+                "helper_1_user_id": crew.helper_1_user_id,
+                "helper_2_user_id": crew.helper_2_user_id,
+            })
+        crew_load = [
+            {
+                "leader_user_id": crew.leader_user_id,
+                "leader_name": members[crew.leader_user_id].full_name,
+                "booked_days": calendar.booked_days(crew.leader_user_id),
+            }
+            for crew in crews
+        ]
+    else:
+        crew_load = []
+
+    return {"assignments": proposals, "unassigned": unassigned, "crew_load": crew_load}
@@ -0,0 +1,273 @@
+"""
+email_outbox.py  –  Bandeja de salida de correo
+
+Los endpoints encolan (enqueue_email) y responden de inmediato con un
+tracking_id. Un hilo por proceso (EmailSender):
+  1. Toma hasta EMAIL_BATCH_SIZE correos vencidos con UN UPDATE ... RETURNING
+     (QUEUED -> SENDING): con varios procesos ninguno se toma dos veces.
+  2. Los envía uno tras otro por el MISMO transporte (una requests.Session:
+     la conexión HTTPS se reutiliza en todo el lote).
+  3. Marca SENT o reprograma con espera exponencial; los rechazos definitivos
+     (4xx) o agotar max_attempts dejan FAILED.
+
+Cada correo se resuelve en su propia transacción: antes de enviarlo se renueva
+su claimed_at y el resultado se escribe sólo si el correo sigue SENDING con ese
+mismo claimed_at (como job_runner._leased). Un lote lento no deja correos ya
+entregados sin confirmar, y si otro proceso reencoló y tomó uno, éste lo suelta.
+
+Efectos al entregar: una OC AUTORIZADA pasa a ENVIADA.
+Un SENDING sin resolver en SENDING_LEASE_MINUTES (proceso caído a media
+entrega) se reencola; sólo en ese caso raro el correo puede salir dos veces.
+"""
+import threading
+import traceback
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlmodel import Session, select
+from sqlalchemy import update
+
+from app.core.config import settings
+from app.core.database import engine
+from app.models.inventory import PurchaseOrder
+from app.models.outbox import OutboundEmail
+from app.services.config_cache import get_global_config
+from app.services.email_service import BrevoTransport, FakeTransport, TransportError
+
+SENDING_LEASE_MINUTES = 5
+MAX_RETRY_DELAY_SECONDS = 6 * 60 * 60
+PENDING_STATUSES = ("QUEUED", "SENDING")
+
+
+def enqueue_email(
+    session: Session,
+    *,
+    sender_name: str,
+    sender_email: str,
+    to_email: str,
+    subject: str,
+    text_content: str,
+    cc: Optional[List[str]] = None,
+    attachment_name: Optional[str] = None,
+    attachment_content: Optional[bytes] = None,
+    kind: str = "GENERIC",
+    purchase_order_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+) -> OutboundEmail:
+    """Encola y hace commit; despierta al hilo de envío de este proceso."""
+    email = OutboundEmail(
+        tracking_id=uuid.uuid4().hex,
+        kind=kind,
+        purchase_order_id=purchase_order_id,
+        sender_name=sender_name,
+        sender_email=sender_email,
+        to_email=to_email,
+        cc=cc or [],
+        subject=subject,
+        text_content=text_content,
+        attachment_name=attachment_name,
+        attachment_content=attachment_content,
+        created_by_user_id=user_id,
+    )
+    session.add(email)
+    session.commit()
+    session.refresh(email)
+    email_sender.wake()
+    return email
+
+
+def pending_for_purchase_order(session: Session, po_id: int) -> Optional[OutboundEmail]:
+    """Correo de la OC que todavía no sale (para no encolar dos veces el mismo envío)."""
+    return session.exec(
+        select(OutboundEmail)
+        .where(OutboundEmail.purchase_order_id == po_id)
+        .where(OutboundEmail.status.in_(PENDING_STATUSES))
+        .order_by(OutboundEmail.id.desc())
+    ).first()
+
+
+def email_status(email: OutboundEmail) -> dict:
+    return {
+        "tracking_id": email.tracking_id,
+        "kind": email.kind,
+        "purchase_order_id": email.purchase_order_id,
+        "to_email": email.to_email,
+        "subject": email.subject,
+        "status": email.status,
+        "attempts": email.attempts,
+        "max_attempts": email.max_attempts,
+        "next_attempt_at": email.next_attempt_at if email.status == "QUEUED" else None,
+        "last_error": email.last_error,
+        "provider_message_id": email.provider_message_id,
+        "created_at": email.created_at,
+        "sent_at": email.sent_at,
+    }
+
+
+def _make_transport():
+    if settings.EMAIL_TRANSPORT.lower() == "fake":
+        return FakeTransport()
+    return BrevoTransport(timeout=settings.EMAIL_SEND_TIMEOUT_SECONDS)
+
+
+class EmailSender:
+    def __init__(self, batch_size: int, poll_seconds: int):
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.transport = None  # Se crea al primer uso; las pruebas pueden asignar un FakeTransport
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._run_lock = threading.Lock()
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="email-sender", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+        if self.transport:
+            self.transport.close()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                handled = self.run_once()
+            except Exception:
+                traceback.print_exc()
+                handled = 0
+            if handled >= self.batch_size:
+                continue  # Probablemente hay más en cola
+            self._wake.wait(timeout=self.poll_seconds)
+            self._wake.clear()
+
+    # ------------------------------------------------------------
+    # Una vuelta: tomar lote, enviar, registrar
+    # ------------------------------------------------------------
+    def claim_batch(self, session: Session) -> Tuple[List[int], datetime]:
+        """Toma el lote. Regresa (ids, claimed_at con que quedaron tomados)."""
+        now = datetime.utcnow()
+        session.exec(
+            update(OutboundEmail)
+            .where(OutboundEmail.status == "SENDING")
+            .where(OutboundEmail.claimed_at < now - timedelta(minutes=SENDING_LEASE_MINUTES))
+            .values(status="QUEUED", next_attempt_at=now)
+        )
+        due = select(OutboundEmail.id).where(OutboundEmail.status == "QUEUED") \
+            .where(OutboundEmail.next_attempt_at <= now) \
+            .order_by(OutboundEmail.next_attempt_at, OutboundEmail.id).limit(self.batch_size)
+        claimed = session.execute(
+            update(OutboundEmail)
+            .where(OutboundEmail.id.in_(due.scalar_subquery()))
+            .where(OutboundEmail.status == "QUEUED")
+            .values(status="SENDING", claimed_at=now, attempts=OutboundEmail.attempts + 1)
+            .returning(OutboundEmail.id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        session.commit()
+        return sorted(claimed), now
+
+    @staticmethod
+    def _leased(email_id: int, claimed_at: datetime):
+        """UPDATE que sólo aplica si el correo sigue tomado por esta vuelta."""
+        return (
+            update(OutboundEmail)
+            .where(OutboundEmail.id == email_id)
+            .where(OutboundEmail.status == "SENDING")
+            .where(OutboundEmail.claimed_at == claimed_at)
+            .execution_options(synchronize_session=False)
+        )
+
+    def run_once(self) -> int:
+        """Procesa un lote. Regresa cuántos correos tomó."""
+        with self._run_lock:
+            if self.transport is None:
+                self.transport = _make_transport()
+            with Session(engine) as session:
+                ids, claimed_at = self.claim_batch(session)
+                if not ids:
+                    return 0
+                config = get_global_config(session)
+                api_key = config.smtp_password if config else None
+
+                delivered = 0
+                for email_id in ids:
+                    if self._send_one(session, email_id, claimed_at, api_key):
+                        delivered += 1
+
+            if delivered:
+                from app.services.purchase_manager import invalidate_pending_tasks_cache
+                invalidate_pending_tasks_cache()
+            return len(ids)
+
+    def _send_one(self, session: Session, email_id: int, claimed_at: datetime, api_key: Optional[str]) -> bool:
+        """
+        Renueva el arrendamiento, envía y confirma el resultado en su propia transacción.
+        Regresa True si se entregó un correo de OC (hay que invalidar pendientes).
+        """
+        lease = datetime.utcnow()
+        renewed = session.execute(self._leased(email_id, claimed_at).values(claimed_at=lease)).rowcount
+        session.commit()
+        if not renewed:
+            return False  # Reencolado por vencido y tomado por otro proceso: ya no es nuestro
+        email = session.get(OutboundEmail, email_id)
+
+        try:
+            if not api_key:
+                raise TransportError("No hay llave de API de correo en GlobalConfig.", retryable=True)
+            values = {
+                "provider_message_id": self.transport.send(email, api_key),
+                "status": "SENT",
+                "sent_at": datetime.utcnow(),
+                "last_error": None,
+            }
+        except TransportError as e:
+            values = self._retry_values(email, str(e), e.retryable, lease)
+        except Exception as e:
+            values = self._retry_values(email, f"{type(e).__name__}: {e}", True, lease)
+
+        written = session.execute(self._leased(email_id, lease).values(**values)).rowcount
+        po_delivered = bool(written and values["status"] == "SENT" and email.purchase_order_id)
+        if po_delivered:
+            # Marcar como ENVIADA (sólo si sigue AUTORIZADA)
+            session.exec(
+                update(PurchaseOrder)
+                .where(PurchaseOrder.id == email.purchase_order_id)
+                .where(PurchaseOrder.status == "AUTORIZADA")
+                .values(status="ENVIADA")
+            )
+        session.commit()
+        return po_delivered
+
+    @staticmethod
+    def _retry_values(email: OutboundEmail, error: str, retryable: bool, now: datetime) -> dict:
+        values = {"last_error": error[:1000]}
+        if retryable and email.attempts < email.max_attempts:
+            delay = min(settings.EMAIL_RETRY_BASE_SECONDS * 2 ** (email.attempts - 1), MAX_RETRY_DELAY_SECONDS)
+            values.update(status="QUEUED", next_attempt_at=now + timedelta(seconds=delay))
+        else:
+            values["status"] = "FAILED"
+        return values
+
+
+email_sender = EmailSender(settings.EMAIL_BATCH_SIZE, settings.EMAIL_POLL_SECONDS)
+
+
+def start_email_sender() -> None:
+    if settings.EMAIL_SENDER_ENABLED:
+        email_sender.start()
+
+
+def stop_email_sender() -> None:
+    email_sender.stop()
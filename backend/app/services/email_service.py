@@ -1,59 +1,120 @@
+"""
+email_service.py  –  Redacción de correos y transportes de envío
+
+Los endpoints NO envían: redactan con compose_* y encolan en la bandeja de
+salida (email_outbox.py). El hilo de envío usa un transporte:
+  - BrevoTransport: API HTTP de Brevo sobre UNA requests.Session con pool
+    de conexiones (se reutiliza la conexión HTTPS entre correos).
+  - FakeTransport:  guarda los mensajes en memoria; para pruebas (EMAIL_TRANSPORT=fake).
+"""
 import base64
+import threading
+import uuid
+from typing import List, Optional
+
 import requests
-from io import BytesIO
+from requests.adapters import HTTPAdapter
+
+BREVO_URL = "https://api.brevo.com/v3/smtp/email"
+
 
+class TransportError(Exception):
+    """Fallo al enviar. retryable=False para rechazos definitivos (ej. 400 de la API)."""
 
-def send_purchase_order_email(
-    smtp_host: str,
-    smtp_email: str,
-    smtp_password: str,
-    to_email: str,
-    provider_name: str,
-    folio: str,
-    pdf_buffer: BytesIO = None,
-    company_name: str = "Valentina"
-) -> None:
+    def __init__(self, message: str, retryable: bool = True):
+        self.retryable = retryable
+        super().__init__(message)
 
+
+def compose_purchase_order_email(provider_name: str, folio: str, company_name: str = "Valentina") -> dict:
+    """Asunto y cuerpo del correo de una Orden de Compra."""
     body = (
         f"Estimado proveedor {provider_name},\n\n"
         f"Adjuntamos la Orden de Compra {folio} para su atencion.\n"
         f"Por favor confirme de recibido.\n\n"
         f"Saludos,\n{company_name}"
     )
-
-    payload = {
-        "sender": {
-            "name": company_name,
-            "email": smtp_email
-        },
-        "to": [{"email": to_email}],
-        "cc": [{"email": smtp_email}],
+    return {
         "subject": f"Orden de Compra {folio} — {company_name}",
-        "textContent": body
+        "text_content": body,
+        "attachment_name": f"OC_{folio}.pdf",
     }
 
-    if pdf_buffer is not None:
-        pdf_buffer.seek(0)
-        pdf_b64 = base64.b64encode(pdf_buffer.read()).decode('utf-8')
-        payload["attachment"] = [
-            {
-                "name": f"OC_{folio}.pdf",
-                "content": pdf_b64
-            }
-        ]
-
-    response = requests.post(
-        "https://api.brevo.com/v3/smtp/email",
-        headers={
-            "accept": "application/json",
-            "content-type": "application/json",
-            "api-key": smtp_password
-        },
-        json=payload,
-        timeout=30
-    )
 
-    if response.status_code not in (200, 201, 202):
-        raise Exception(
-            f"Brevo API error {response.status_code}: {response.text}"
-        )
+class BrevoTransport:
+    def __init__(self, timeout: int = 30, pool_size: int = 4):
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+
+    def send(self, email, api_key: str) -> Optional[str]:
+        """Envía un OutboundEmail; regresa el messageId de Brevo."""
+        payload = {
+            "sender": {"name": email.sender_name, "email": email.sender_email},
+            "to": [{"email": email.to_email}],
+            "subject": email.subject,
+            "textContent": email.text_content,
+        }
+        if email.cc:
+            payload["cc"] = [{"email": cc} for cc in email.cc]
+        if email.attachment_content:
+            payload["attachment"] = [{
+                "name": email.attachment_name or "adjunto.pdf",
+                "content": base64.b64encode(email.attachment_content).decode("utf-8"),
+            }]
+        try:
+            response = self.session.post(
+                BREVO_URL,
+                headers={
+                    "accept": "application/json",
+                    "content-type": "application/json",
+                    "api-key": api_key,
+                    # Idempotencia de nuestro lado: el mismo tracking_id en cada reintento
+                    "X-Mailin-custom": f"tracking_id:{email.tracking_id}",
+                },
+                json=payload,
+                timeout=self.timeout,
+            )
+        except requests.RequestException as e:
+            raise TransportError(f"Error de red: {e}", retryable=True)
+
+        if response.status_code in (200, 201, 202):
+            try:
+                return response.json().get("messageId")
+            except ValueError:
+                return None
+        # 429 y 5xx se reintentan; el resto (llave inválida, datos mal formados) no
+        retryable = response.status_code == 429 or response.status_code >= 500
+        raise TransportError(f"Brevo API error {response.status_code}: {response.text[:500]}", retryable=retryable)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class FakeTransport:
+    """Transporte local: no sale nada a internet. fail_next permite simular errores."""
+
+    def __init__(self):
+        self.sent: List[dict] = []
+        self.fail_next: List[TransportError] = []
+        self._lock = threading.Lock()
+
+    def send(self, email, api_key: str) -> Optional[str]:
+        with self._lock:
+            if self.fail_next:
+                raise self.fail_next.pop(0)
+            message_id = f"<fake-{uuid.uuid4().hex}@localhost>"
+            self.sent.append({
+                "tracking_id": email.tracking_id,
+                "to": email.to_email,
+                "cc": list(email.cc or []),
+                "subject": email.subject,
+                "attachment_name": email.attachment_name,
+                "attachment_bytes": len(email.attachment_content or b""),
+                "message_id": message_id,
+            })
+            return message_id
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,317 @@
+"""
+field_sync.py  –  Sincronización offline de los iPads de instalación
+
+En obra casi no hay señal, y cada paso (jornada, escaneo, instalado, firma,
+evidencia) era una llamada en línea. El iPad ahora trabaja así:
+
+  1. Con red, baja el paquete del día (build_day_bundle): asignaciones,
+     casas con su QR y bultos, equipo, y un `version` que cambia cuando
+     cambia cualquier dato del paquete. Si manda el version que ya tiene y
+     nada cambió, la respuesta es sólo {"unchanged": true}.
+  2. Sin red, encola escaneos, instalados, firmas y fotos con un op_id
+     propio (UUID).
+  3. Al volver la red, sube TODO en un lote (apply_operations). Se aplica en
+     el orden del iPad con las mismas reglas que los endpoints en línea
+     (installation_flow). Cada operación va en su propio savepoint: una que
+     choca (otro ya cargó la casa, el equipo se reasignó) no tumba a las demás.
+
+Idempotencia: cada resultado queda en field_sync_operations por op_id. Reenviar
+el lote (se cortó la red a la mitad de la respuesta) regresa el mismo resultado
+sin volver a aplicar nada ni subir otra vez las fotos.
+"""
+import hashlib
+import json
+from datetime import date, datetime
+from typing import Callable, Dict, List, Optional
+
+from sqlmodel import Session, select
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from app.models.production import (
+    FieldSyncOperation,
+    InstallationAssignment,
+    InstallationAssignmentStatus,
+    PrintJob,
+)
+from app.models.sales import SalesOrderItemInstance
+from app.models.users import User, UserRole
+from app.services import installation_flow
+from app.services.change_tracking import naive_utc
+from app.services.instance_context import resolve_instance_contexts
+
+MAX_OPERATIONS = 200
+OPERATION_TYPES = ("SCAN", "INSTALLED", "SIGNATURE", "EVIDENCE")
+BUNDLE_ROLES = {UserRole.LOGISTICS, UserRole.DIRECTOR, UserRole.MANAGER}
+
+# Subida de un archivo del lote: (nombre del archivo en el lote, prefijo del blob) -> URL
+Uploader = Callable[[str, str], str]
+
+
+class FieldSyncError(ValueError):
+    def __init__(self, detail: str, status_code: int = 400):
+        self.detail = detail
+        self.status_code = status_code
+        super().__init__(detail)
+
+
+def _value(status) -> Optional[str]:
+    return getattr(status, "value", status)
+
+
+def _iso(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+# ------------------------------------------------------------
+# 1. Paquete del día
+# ------------------------------------------------------------
+def bundle_version(content: dict) -> str:
+    """Huella del contenido: igual contenido, igual version (sin importar cuándo se generó)."""
+    canonical = json.dumps(content, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()[:16]
+
+
+def build_day_bundle(session: Session, user: User, day: date) -> dict:
+    """
+    Todo lo que el iPad necesita para trabajar el día sin red. LOGISTICS recibe
+    las asignaciones donde es líder o ayudante; Dirección y Gerencia, todas las del día.
+    """
+    if user.role not in BUNDLE_ROLES:
+        raise FieldSyncError("Acceso restringido al módulo de instalación.", status_code=403)
+
+    day_start = datetime.combine(day, datetime.min.time())
+    day_end = datetime.combine(day, datetime.max.time())
+    stmt = select(InstallationAssignment).where(
+        InstallationAssignment.assignment_date >= day_start,
+        InstallationAssignment.assignment_date <= day_end,
+    )
+    if user.role == UserRole.LOGISTICS:
+        stmt = stmt.where(
+            (InstallationAssignment.leader_user_id == user.id)
+            | (InstallationAssignment.helper_1_user_id == user.id)
+            | (InstallationAssignment.helper_2_user_id == user.id)
+        )
+    assignments = session.exec(stmt.order_by(InstallationAssignment.assignment_date, InstallationAssignment.id)).all()
+
+    instance_ids = sorted({a.instance_id for a in assignments})
+    instances: Dict[int, SalesOrderItemInstance] = {}
+    printed: Dict[int, int] = {}
+    open_lanes: Dict[int, List[str]] = {}
+    if instance_ids:
+        instances = {
+            i.id: i for i in session.exec(
+                select(SalesOrderItemInstance).where(SalesOrderItemInstance.id.in_(instance_ids))
+            ).all()
+        }
+        printed = dict(session.exec(
+            select(PrintJob.instance_id, func.count(func.distinct(PrintJob.bundle_number)))
+            .where(PrintJob.instance_id.in_(instance_ids))
+            .group_by(PrintJob.instance_id)
+        ).all())
+        # Estado de TODOS los carriles abiertos (también los de otras cuadrillas) para saber si ya se puede firmar
+        for instance_id, status in session.exec(
+            select(InstallationAssignment.instance_id, InstallationAssignment.status)
+            .where(InstallationAssignment.instance_id.in_(instance_ids))
+            .where(InstallationAssignment.status != InstallationAssignmentStatus.COMPLETED)
+        ).all():
+            open_lanes.setdefault(instance_id, []).append(_value(status))
+    contexts = resolve_instance_contexts(session, instance_ids)
+
+    member_ids = {
+        user_id
+        for a in assignments
+        for user_id in (a.leader_user_id, a.helper_1_user_id, a.helper_2_user_id)
+        if user_id
+    }
+    team = {}
+    if member_ids:
+        team = {
+            u.id: {"id": u.id, "name": u.full_name}
+            for u in session.exec(select(User).where(User.id.in_(member_ids))).all()
+        }
+
+    content = {
+        "day": day.isoformat(),
+        "assignments": [
+            {
+                "id": a.id,
+                "instance_id": a.instance_id,
+                "lane": a.lane,
+                "assignment_date": _iso(a.assignment_date),
+                "status": _value(a.status),
+                "leader_user_id": a.leader_user_id,
+                "helper_user_ids": [h for h in (a.helper_1_user_id, a.helper_2_user_id) if h],
+                "has_signature": bool(a.client_signature_url),
+                "started_at": _iso(a.started_at),
+                "completed_at": _iso(a.completed_at),
+            }
+            for a in assignments
+        ],
+        "instances": [
+            {
+                "id": instance.id,
+                "name": instance.custom_name,
+                "qr_code": instance.qr_code,  # El iPad reconoce los bultos "{qr_code}-{n}" sin red
+                "street": instance.street,
+                "lot": instance.lot,
+                "production_status": _value(instance.production_status),
+                "mdf_bundles": instance.mdf_bundles or 0,
+                "hardware_bundles": instance.hardware_bundles or 0,
+                "labels_printed": printed.get(instance.id, 0),
+                "evidence_photos_count": len(instance.evidence_photos_urls or []),
+                "all_lanes_installed": bool(open_lanes.get(instance.id)) and all(
+                    s == InstallationAssignmentStatus.INSTALLED.value for s in open_lanes[instance.id]
+                ),
+                "order_folio": ctx.order_folio if ctx else None,
+                "project_name": ctx.project_name if ctx else None,
+                "client_name": ctx.client_name if ctx else None,
+                "client_address": getattr(ctx.client, "fiscal_address", None) if ctx else None,
+            }
+            for instance, ctx in ((instances[i], contexts.get(i)) for i in instance_ids if i in instances)
+        ],
+        "team": sorted(team.values(), key=lambda member: member["id"]),
+    }
+    return {"version": bundle_version(content), "generated_at": datetime.utcnow().isoformat(), **content}
+
+
+# ------------------------------------------------------------
+# 2. Lote de operaciones
+# ------------------------------------------------------------
+def _recorded_at(op, now: datetime) -> datetime:
+    """La hora del iPad si es creíble (no en el futuro); si no, la del servidor."""
+    recorded = getattr(op, "recorded_at", None)
+    if recorded is None:
+        return now
+    recorded = naive_utc(recorded)
+    return recorded if recorded <= now else now
+
+
+def _apply(session: Session, op, user: User, upload: Uploader, now: datetime) -> dict:
+    if op.type == "SCAN":
+        assignment, instance, consumption, payroll_records = installation_flow.confirm_load(
+            session, op.assignment_id, user, now=now,
+        )
+        return {
+            "assignment_id": assignment.id,
+            "instance_id": instance.id,
+            "instance_status": _value(instance.production_status),
+            "payroll_records_created": payroll_records,
+            "inventory_consumed": consumption["reservations"],
+        }
+
+    if op.type == "INSTALLED":
+        assignment = installation_flow.mark_installed(session, op.assignment_id)
+        return {"assignment_id": assignment.id, "status": _value(assignment.status)}
+
+    if op.type == "SIGNATURE":
+        signature_url = op.signature_url
+        if not signature_url and op.signature_file:
+            signature_url = upload(op.signature_file, f"signatures/assignment_{op.assignment_id}")
+        if not signature_url:
+            raise installation_flow.InstallationFlowError("La firma no trae signature_url ni signature_file.")
+        assignment, double_green = installation_flow.register_signature(
+            session, op.assignment_id, signature_url, now=now,
+        )
+        return {
+            "assignment_id": assignment.id,
+            "instance_id": double_green.get("instance_id"),
+            "payroll_released": len(double_green.get("payroll_released", [])),
+            "warranty_end_date": _iso(assignment.warranty_end_date),
+        }
+
+    # EVIDENCE
+    instance = installation_flow.get_evidence_instance(session, op.instance_id, user)
+    if not op.files:
+        raise installation_flow.InstallationFlowError("La evidencia no trae fotos.")
+    urls = [upload(name, f"evidence/instance_{instance.id}") for name in op.files]
+    installation_flow.append_evidence(session, instance, urls)
+    return {
+        "instance_id": instance.id,
+        "uploaded_urls": urls,
+        "total_evidence_photos": len(instance.evidence_photos_urls or []),
+    }
+
+
+def _outcome(record: FieldSyncOperation, replayed: bool) -> dict:
+    return {
+        "op_id": record.op_id,
+        "type": record.op_type,
+        "status": record.status,
+        "replayed": replayed,
+        "result": record.result,
+    }
+
+
+def apply_operations(
+    session: Session,
+    user: User,
+    device_id: str,
+    operations: list,
+    upload: Uploader,
+) -> List[dict]:
+    """
+    Aplica las operaciones en orden (hace commit después de cada una). Estados:
+      APPLIED   se aplicó.
+      CONFLICT  el servidor ya no está como el iPad lo vio (otro la procesó,
+                carriles sin instalar, la casa no está READY...).
+      REJECTED  sin permiso o no existe.
+      ERROR     falla transitoria (p. ej. subir la foto): NO se registra, el
+                iPad la reintenta en el siguiente lote.
+    """
+    if len(operations) > MAX_OPERATIONS:
+        raise FieldSyncError(f"Máximo {MAX_OPERATIONS} operaciones por lote.")
+    op_ids = [op.op_id for op in operations]
+    if len(set(op_ids)) != len(op_ids):
+        raise FieldSyncError("Hay op_id repetidos en el lote.")
+    unknown = sorted({op.type for op in operations} - set(OPERATION_TYPES))
+    if unknown:
+        raise FieldSyncError(f"Tipos de operación no válidos: {', '.join(unknown)}.")
+
+    done = {
+        record.op_id: record
+        for record in session.exec(select(FieldSyncOperation).where(FieldSyncOperation.op_id.in_(op_ids))).all()
+    } if op_ids else {}
+
+    results = []
+    for op in operations:
+        if op.op_id in done:
+            results.append(_outcome(done[op.op_id], replayed=True))
+            continue
+
+        now = datetime.utcnow()
+        try:
+            with session.begin_nested():
+                result = _apply(session, op, user, upload, _recorded_at(op, now))
+            status = "APPLIED"
+        except installation_flow.InstallationFlowError as e:
+            status = "CONFLICT" if e.status_code in (400, 409) else "REJECTED"
+            result = {"detail": e.detail, "status_code": e.status_code}
+        except Exception as e:
+            results.append({"op_id": op.op_id, "type": op.type, "status": "ERROR", "replayed": False,
+                            "result": {"detail": str(e)}})
+            continue
+
+        record = FieldSyncOperation(
+            op_id=op.op_id,
+            device_id=device_id,
+            user_id=user.id,
+            op_type=op.type,
+            assignment_id=getattr(op, "assignment_id", None),
+            instance_id=getattr(op, "instance_id", None),
+            status=status,
+            result=result,
+            recorded_at=getattr(op, "recorded_at", None) and naive_utc(op.recorded_at),
+            applied_at=now,
+        )
+        session.add(record)
+        try:
+            session.commit()
+        except IntegrityError:
+            # Otro envío del mismo lote ganó la carrera: lo suyo es lo que vale
+            session.rollback()
+            record = session.exec(select(FieldSyncOperation).where(FieldSyncOperation.op_id == op.op_id)).one()
+            results.append(_outcome(record, replayed=True))
+            continue
+        results.append(_outcome(record, replayed=False))
+    return results
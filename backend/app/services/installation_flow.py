@@ -0,0 +1,246 @@
+"""
+installation_flow.py  –  Pasos de la instalación en obra (iPad)
+
+Las reglas de cada paso viven aquí para que los endpoints en línea de
+logistics.py y la sincronización por lotes (field_sync.py) apliquen
+exactamente lo mismo:
+
+  confirm_load        Escaneo del bulto al subir al camión (CARGADO, baja de
+                      inventario y nómina con el equipo definitivo).
+  mark_installed      El carril quedó instalado físicamente.
+  register_signature  Firma del cliente: cierra la instancia (Doble Verde).
+  append_evidence     Agrega URLs de fotos de evidencia a la instancia.
+
+Ninguna función hace commit: la transacción es de quien llama. Los rechazos
+salen como InstallationFlowError con el status HTTP que corresponde.
+"""
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlmodel import Session, select
+
+from app.models.production import (
+    InstallationAssignment,
+    InstallationAssignmentStatus,
+    PayrollPayment,
+    PayrollPaymentType,
+    PayrollStatus,
+)
+from app.models.sales import InstanceStatus, SalesOrderItemInstance
+from app.models.users import User, UserRole
+from app.services.config_cache import get_global_config
+from app.services.instance_context import resolve_instance_context
+from app.services.inventory_manager import InventoryManager
+from app.services.planning_service import trigger_double_green
+
+LOAD_ROLES = {UserRole.LOGISTICS, UserRole.DIRECTOR, UserRole.MANAGER}
+EVIDENCE_ROLES = {UserRole.LOGISTICS, UserRole.DIRECTOR, UserRole.MANAGER}
+
+
+class InstallationFlowError(ValueError):
+    def __init__(self, detail: str, status_code: int = 400):
+        self.detail = detail
+        self.status_code = status_code
+        super().__init__(detail)
+
+
+def _get_assignment(session: Session, assignment_id: int) -> InstallationAssignment:
+    assignment = session.get(InstallationAssignment, assignment_id)
+    if not assignment:
+        raise InstallationFlowError("Asignación no encontrada.", status_code=404)
+    return assignment
+
+
+def check_all_lanes_installed(session: Session, instance_id: int) -> bool:
+    """
+    True si TODOS los carriles activos de la instancia están en INSTALLED o COMPLETED.
+    False si algún carril está en SCHEDULED, IN_PROGRESS o CARGADO.
+    """
+    assignments = session.exec(
+        select(InstallationAssignment).where(
+            InstallationAssignment.instance_id == instance_id,
+            InstallationAssignment.status != InstallationAssignmentStatus.COMPLETED
+        )
+    ).all()
+
+    if not assignments:
+        return False
+
+    return all(
+        a.status in [
+            InstallationAssignmentStatus.INSTALLED,
+            InstallationAssignmentStatus.COMPLETED,
+        ]
+        for a in assignments
+    )
+
+
+def get_installation_days(session: Session, instance: SalesOrderItemInstance) -> float:
+    """Días presupuestados de la versión de producto de la instancia (1 si no hay)."""
+    version = resolve_instance_context(session, instance).version
+    return float(version.installation_days) if version and version.installation_days else 1.0
+
+
+# ------------------------------------------------------------
+# Carga al camión (escaneo del bulto)
+# ------------------------------------------------------------
+def confirm_load(
+    session: Session,
+    assignment_id: int,
+    user: User,
+    now: Optional[datetime] = None,
+) -> Tuple[InstallationAssignment, SalesOrderItemInstance, dict, int]:
+    """
+    El líder confirma la carga: equipo definitivo, instancia a CARGADO 🔵🔵,
+    baja contable de inventario y nómina PENDING_SIGNATURE.
+    Regresa (asignación, instancia, consumo de inventario, registros de nómina creados).
+    """
+    if user.role not in LOAD_ROLES:
+        raise InstallationFlowError("Solo el equipo de instalación puede escanear QRs.", status_code=403)
+
+    assignment = _get_assignment(session, assignment_id)
+    if assignment.status != InstallationAssignmentStatus.SCHEDULED:
+        raise InstallationFlowError(
+            f"Esta asignación ya fue procesada. Status actual: {assignment.status}",
+        )
+
+    # Verificar que quien escanea es el líder asignado
+    if user.id != assignment.leader_user_id:
+        raise InstallationFlowError(
+            "Solo el Líder asignado puede confirmar la carga al camión.",
+            status_code=403,
+        )
+
+    instance = session.get(SalesOrderItemInstance, assignment.instance_id)
+    if not instance:
+        raise InstallationFlowError("Instancia no encontrada.", status_code=404)
+
+    if instance.production_status not in [InstanceStatus.READY]:
+        raise InstallationFlowError(
+            f"Bloqueo Logístico: la instancia debe estar en READY para cargarse. "
+            f"Status actual: {instance.production_status}",
+        )
+
+    now = now or datetime.utcnow()
+
+    # Confirmar equipo y marcar IN_PROGRESS
+    assignment.status = InstallationAssignmentStatus.IN_PROGRESS
+    assignment.started_at = now
+    session.add(assignment)
+
+    # Cambiar instancia a CARGADO 🔵🔵
+    instance.production_status = InstanceStatus.CARGADO
+    instance.current_location = "En Tránsito (Camión)"
+    session.add(instance)
+
+    # ── BAJA CONTABLE DE INVENTARIO ──────────────────────────
+    # Regla inmutable: la baja ocurre al escanear QR (CARGADO)
+    # Se consumen las reservas ACTIVA de esta instancia: agregadas por material,
+    # con UPDATE atómico y Kárdex multi-fila (SALIDA por carga al camión).
+    consumption = InventoryManager.consume_instance_reservations(
+        session,
+        instance.id,
+        transaction_type="SALIDA_INSTALACION",
+        reason_code="CARGA_CAMION",
+        project_id=getattr(instance, 'sales_order_id', None),
+    )
+    # ─────────────────────────────────────────────────────────
+
+    # Leer tabulador global
+    config = get_global_config(session)
+    leader_rate = config.default_leader_daily_rate if config else 800.0
+    helper_rate = config.default_helper_daily_rate if config else 700.0
+
+    # Días de instalación de la receta
+    installation_days = get_installation_days(session, instance)
+
+    # Generar nómina con el equipo DEFINITIVO confirmado en este momento
+    crew = [(assignment.leader_user_id, PayrollPaymentType.LEADER, leader_rate)]
+    crew += [
+        (helper_id, PayrollPaymentType.HELPER, helper_rate)
+        for helper_id in (assignment.helper_1_user_id, assignment.helper_2_user_id)
+        if helper_id
+    ]
+    for user_id, payment_type, rate in crew:
+        session.add(PayrollPayment(
+            installation_assignment_id=assignment.id,
+            user_id=user_id,
+            payment_type=payment_type,
+            days_worked=installation_days,
+            daily_rate=rate,
+            total_amount=round(installation_days * rate, 2),
+            status=PayrollStatus.PENDING_SIGNATURE,
+        ))
+
+    return assignment, instance, consumption, len(crew)
+
+
+# ------------------------------------------------------------
+# Carril instalado y firma del cliente
+# ------------------------------------------------------------
+def mark_installed(session: Session, assignment_id: int) -> InstallationAssignment:
+    """Verde Simple 🟢: el carril quedó instalado, esperando firma."""
+    assignment = _get_assignment(session, assignment_id)
+    if assignment.status not in [
+        InstallationAssignmentStatus.IN_PROGRESS,
+        InstallationAssignmentStatus.SCHEDULED,
+    ]:
+        raise InstallationFlowError("Solo se puede marcar como instalado desde SCHEDULED o IN_PROGRESS.")
+
+    assignment.status = InstallationAssignmentStatus.INSTALLED
+    session.add(assignment)
+    return assignment
+
+
+def register_signature(
+    session: Session,
+    assignment_id: int,
+    signature_url: str,
+    now: Optional[datetime] = None,
+) -> Tuple[InstallationAssignment, dict]:
+    """
+    Firma de conformidad: cierra la asignación (garantía de 1 año) y dispara el
+    Doble Verde 🟢🟢 de la instancia. Regresa (asignación, resultado de trigger_double_green).
+    """
+    assignment = _get_assignment(session, assignment_id)
+    if not check_all_lanes_installed(session, assignment.instance_id):
+        raise InstallationFlowError(
+            "No se puede firmar hasta que todos los carriles estén marcados como instalados."
+        )
+
+    now = now or datetime.utcnow()
+
+    assignment.client_signature_url = signature_url
+    assignment.status = InstallationAssignmentStatus.COMPLETED
+    assignment.completed_at = now
+    assignment.warranty_end_date = datetime(now.year + 1, now.month, now.day)
+    session.add(assignment)
+
+    # → cambia a CLOSED, registra signed_received_at, libera nómina a READY_TO_PAY
+    double_green_result = {"payroll_released": [], "instance_id": None}
+    instance = session.get(SalesOrderItemInstance, assignment.instance_id)
+    if instance:
+        instance.current_location = "Instalado en Obra"
+        session.add(instance)
+        double_green_result = trigger_double_green(instance, session, signed_at=now)
+    return assignment, double_green_result
+
+
+# ------------------------------------------------------------
+# Evidencia fotográfica
+# ------------------------------------------------------------
+def get_evidence_instance(session: Session, instance_id: int, user: User) -> SalesOrderItemInstance:
+    """Valida permiso e instancia ANTES de subir fotos."""
+    if user.role not in EVIDENCE_ROLES:
+        raise InstallationFlowError("No tienes permiso para subir evidencia.", status_code=403)
+    instance = session.get(SalesOrderItemInstance, instance_id)
+    if not instance:
+        raise InstallationFlowError("Instancia no encontrada.", status_code=404)
+    return instance
+
+
+def append_evidence(session: Session, instance: SalesOrderItemInstance, urls: List[str]) -> SalesOrderItemInstance:
+    """Agrega (append) las URLs. Sin candado de tiempo: vale aunque la instancia ya esté CLOSED."""
+    instance.evidence_photos_urls = (instance.evidence_photos_urls or []) + list(urls)
+    session.add(instance)
+    return instance
@@ -0,0 +1,91 @@
+"""
+instance_context.py  –  Contexto comercial de una instancia
+
+Muchas pantallas suben la cadena instancia -> partida -> OV -> cliente (y a veces
+-> versión -> maestro para la categoría) con 3-5 consultas por instancia.
+resolve_instance_contexts() resuelve MUCHAS instancias con UN join, y guarda el
+resultado en session.info: como la sesión vive lo que dura el request, volver a
+pedir la misma instancia en ese request ya no consulta nada.
+
+Las entidades del contexto quedan ligadas a la sesión (identity map), así que un
+session.get(SalesOrder, id) posterior tampoco va a la BD.
+"""
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Union
+
+from sqlmodel import Session, select
+
+from app.models.design import ProductMaster, ProductVersion
+from app.models.foundations import Client
+from app.models.sales import SalesOrder, SalesOrderItem, SalesOrderItemInstance
+
+_CACHE_KEY = "instance_context"
+_CHUNK_SIZE = 500
+
+
+@dataclass
+class InstanceContext:
+    instance_id: int
+    item: Optional[SalesOrderItem] = None
+    order: Optional[SalesOrder] = None
+    client: Optional[Client] = None
+    version: Optional[ProductVersion] = None
+    master: Optional[ProductMaster] = None
+
+    @property
+    def order_folio(self) -> Optional[str]:
+        return f"OV-{str(self.order.id).zfill(4)}" if self.order else None
+
+    @property
+    def project_name(self) -> Optional[str]:
+        return self.order.project_name if self.order else None
+
+    @property
+    def client_name(self) -> Optional[str]:
+        if not self.client:
+            return None
+        return getattr(self.client, "full_name", None) or getattr(self.client, "business_name", None)
+
+    @property
+    def product_name(self) -> Optional[str]:
+        return self.item.product_name if self.item else None
+
+    @property
+    def product_category(self) -> Optional[str]:
+        return self.master.category if self.master else None
+
+
+InstanceRef = Union[int, SalesOrderItemInstance]
+
+
+def _instance_id(ref: InstanceRef) -> int:
+    return ref.id if isinstance(ref, SalesOrderItemInstance) else int(ref)
+
+
+def resolve_instance_contexts(session: Session, instances: Iterable[InstanceRef]) -> Dict[int, InstanceContext]:
+    """{instance_id: InstanceContext}. Acepta ids o instancias; las que no existen no aparecen."""
+    cache: Dict[int, InstanceContext] = session.info.setdefault(_CACHE_KEY, {})
+    wanted = {_instance_id(ref) for ref in instances}
+    missing = sorted(wanted - cache.keys())
+
+    for start in range(0, len(missing), _CHUNK_SIZE):
+        chunk = missing[start:start + _CHUNK_SIZE]
+        rows = session.exec(
+            select(SalesOrderItemInstance.id, SalesOrderItem, SalesOrder, Client, ProductVersion, ProductMaster)
+            .outerjoin(SalesOrderItem, SalesOrderItem.id == SalesOrderItemInstance.sales_order_item_id)
+            .outerjoin(SalesOrder, SalesOrder.id == SalesOrderItem.sales_order_id)
+            .outerjoin(Client, Client.id == SalesOrder.client_id)
+            .outerjoin(ProductVersion, ProductVersion.id == SalesOrderItem.origin_version_id)
+            .outerjoin(ProductMaster, ProductMaster.id == ProductVersion.master_id)
+            .where(SalesOrderItemInstance.id.in_(chunk))
+        ).all()
+        for instance_id, item, order, client, version, master in rows:
+            cache[instance_id] = InstanceContext(instance_id, item, order, client, version, master)
+
+    return {instance_id: cache[instance_id] for instance_id in wanted if instance_id in cache}
+
+
+def resolve_instance_context(session: Session, instance: InstanceRef) -> InstanceContext:
+    """Contexto de una instancia; si no existe, un contexto vacío (todo None)."""
+    instance_id = _instance_id(instance)
+    return resolve_instance_contexts(session, [instance_id]).get(instance_id) or InstanceContext(instance_id)
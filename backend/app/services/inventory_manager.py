@@ -1,7 +1,9 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import select, func
+from sqlalchemy import select, func, update
 from app.models.material import Material
-from app.models.inventory import InventoryTransaction, PurchaseOrder, PurchaseOrderItem
+from app.models.inventory import InventoryTransaction, InventoryReservation, PurchaseOrder, PurchaseOrderItem
+from app.services.scheduler import notify_stock_changed
+from app.services.stock_mutation import StockMutation
 import math
 from datetime import datetime
 
@@ -24,6 +26,8 @@ class InventoryManager:
         if not material:
             return None
 
+        mutation = StockMutation(session)
+
         # 1. Cálculo de Costo Unitario (Last Purchase Price con Redondeo SGP)
         new_unit_cost = material.current_cost
         if transaction_type == "PURCHASE_ENTRY" and quantity_usage_units > 0:
@@ -33,30 +37,69 @@ class InventoryManager:
                 new_unit_cost = 0.01
             
             # Actualizamos el maestro con el último precio de factura
-            material.current_cost = new_unit_cost
+            mutation.set_cost(material.id, new_unit_cost)
 
-        # 2. Actualización de Existencias
-        material.physical_stock += quantity_usage_units
-        
+        # 2. Existencias (incremento atómico) + 3. Kárdex (Trazabilidad Total)
         # Blindaje: El stock físico no puede ser menor a cero en la realidad
-        if material.physical_stock < 0:
-            material.physical_stock = 0.0
-
-        # 3. Registro en el Kárdex (Trazabilidad Total)
-        db_transaction = InventoryTransaction(
-            reception_id=reception_id,
-            material_id=material.id,
-            quantity=quantity_usage_units,
+        mutation.add(
+            material.id,
+            quantity_usage_units,
+            transaction_type,
             unit_cost=new_unit_cost,
+            reception_id=reception_id,
+            created_at=datetime.utcnow(),
+            floor_zero=True,
             subtotal=total_line_cost if quantity_usage_units > 0 else (quantity_usage_units * new_unit_cost),
-            transaction_type=transaction_type,
-            created_at=datetime.utcnow()
         )
-        
-        session.add(material)
-        session.add(db_transaction)
+        mutation.apply()
         return material
 
+    @staticmethod
+    def consume_instance_reservations(
+        session: Session,
+        instance_id: int,
+        transaction_type: str = "SALIDA_INSTALACION",
+        reason_code: str = "CARGA_CAMION",
+        project_id: int = None,
+    ) -> dict:
+        """
+        BAJA CONTABLE POR RESERVAS (carga al camión)
+        Consume las reservas ACTIVA de una instancia sin leer-modificar-escribir:
+
+          1. UN UPDATE ... RETURNING marca las reservas como CONSUMIDA. Sólo la
+             transacción que las reclama las ve, así que dos escaneos simultáneos
+             de la misma instancia no descuentan dos veces.
+          2. Se agregan por material y se aplican con StockMutation: bloqueo en
+             orden de material_id, incrementos atómicos (physical y committed) con
+             piso en cero y Kárdex multi-fila (un renglón por material).
+
+        No hace commit: la transacción es del endpoint.
+        Retorna {"reservations": n, "materials": {material_id: cantidad}}.
+        """
+        claimed = session.execute(
+            update(InventoryReservation)
+            .where(InventoryReservation.instance_id == instance_id)
+            .where(InventoryReservation.status == "ACTIVA")
+            .values(status="CONSUMIDA")
+            .returning(InventoryReservation.material_id, InventoryReservation.quantity_reserved)
+            .execution_options(synchronize_session=False)
+        ).all()
+
+        per_material = {}
+        for material_id, qty in claimed:
+            per_material[material_id] = per_material.get(material_id, 0.0) + float(qty or 0.0)
+
+        mutation = StockMutation(session)
+        for material_id, qty in per_material.items():
+            mutation.add(
+                material_id, -qty, transaction_type,
+                reason_code=reason_code, project_id=project_id, floor_zero=True,
+            )
+            mutation.reserve(material_id, -qty, floor_zero=True)
+        mutation.apply()
+
+        return {"reservations": len(claimed), "materials": per_material}
+
     @staticmethod
     def get_low_stock_materials(session: Session, threshold_percent: float = 0.20):
         """
@@ -130,6 +173,7 @@ def registrar_movimiento_inventario(
         created_at=created_at,
     )
     db.add(movimiento)
+    notify_stock_changed(db)
     return movimiento
 
 
@@ -154,4 +198,59 @@ def calcular_saldo_a_fecha(db, material_id: int, fecha) -> float:
     if resultado is None:
         return 0.0
     valor = resultado[0] if hasattr(resultado, "__getitem__") else resultado
-    return float(valor) if valor is not None else 0.0
\ No newline at end of file
+    return float(valor) if valor is not None else 0.0
+
+def sembrar_saldo_apertura(db) -> dict:
+    """
+    SIEMBRA DE SALDO DE APERTURA DEL KÁRDEX (Fase 3A).
+
+    Por cada material con stock y SIN AJUSTE_INICIAL, registra un AJUSTE_INICIAL
+    por su physical_stock actual. NO modifica physical_stock (solo deja el rastro
+    histórico) y no hace commit. Una consulta para saber quién ya tiene apertura
+    y UN INSERT multi-fila.
+    """
+    ya_sembrados = set(db.execute(
+        select(InventoryTransaction.material_id)
+        .where(InventoryTransaction.transaction_type == "AJUSTE_INICIAL")
+        .distinct()
+    ).scalars().all())
+    materiales = db.execute(
+        select(Material.id, Material.physical_stock, Material.current_cost)
+    ).all()
+
+    ahora = datetime.now()
+    renglones = []
+    saltados_existente = 0
+    saltados_stock_cero = 0
+    for material_id, physical_stock, current_cost in materiales:
+        if material_id in ya_sembrados:
+            saltados_existente += 1
+            continue
+        stock_actual = float(physical_stock or 0.0)
+        if stock_actual <= 0:
+            saltados_stock_cero += 1
+            continue
+        costo = float(current_cost or 0.0)
+        renglones.append({
+            "material_id": material_id,
+            "quantity": stock_actual,
+            "unit_cost": costo,
+            "subtotal": stock_actual * costo,
+            "transaction_type": "AJUSTE_INICIAL",
+            "reception_id": None,
+            "project_id": None,
+            "operator_badge": None,
+            "reason_code": "SALDO_APERTURA",
+            "created_at": ahora,
+        })
+
+    if renglones:
+        db.execute(InventoryTransaction.__table__.insert(), renglones)
+
+    return {
+        "ok": True,
+        "sembrados": len(renglones),
+        "saltados_por_existir": saltados_existente,
+        "saltados_por_stock_cero": saltados_stock_cero,
+        "total_materiales": len(materiales),
+    }
@@ -0,0 +1,493 @@
+"""
+job_runner.py  –  Trabajos en segundo plano (sin broker)
+
+La tabla background_jobs ES la cola. Un endpoint encola (enqueue) y responde de
+inmediato con el id; los hilos trabajadores de cada proceso toman trabajos con
+un UPDATE condicional (status='QUEUED' -> 'RUNNING'), así que con varios
+procesos de gunicorn un trabajo nunca se ejecuta dos veces.
+
+  - Progreso:   el handler llama ctx.progress(%, mensaje); también es el latido.
+  - Cancelación: cancel() marca cancel_requested; el siguiente ctx.progress()
+                 lanza JobCancelled. Un trabajo QUEUED se cancela directo.
+  - Reintentos: si el handler falla, se reencola con espera exponencial
+                (JOB_RETRY_BASE_SECONDS * 2^(intento-1)) hasta max_attempts.
+  - Caídas:     un RUNNING sin latido en JOB_LEASE_SECONDS se reencola. El
+                trabajador que lo tenía lo nota en su siguiente ctx.progress()
+                (JobLeaseLost) y su resultado final se descarta: sólo escribe quien
+                tiene la concesión (locked_by + attempts).
+  - Archivos:   store_job_file() guarda el archivo subido en la BD por bloques;
+                cualquier instancia del backend puede tomar el trabajo y leerlo.
+
+Los handlers se registran con @job_handler("TIPO") y reciben
+(session, payload, ctx); lo que regresen se guarda como result.
+"""
+import io
+import os
+import threading
+import traceback
+from datetime import datetime, timedelta
+from typing import Any, BinaryIO, Callable, Dict, Optional
+from uuid import uuid4
+
+from fastapi.encoders import jsonable_encoder
+from sqlmodel import Session, select
+from sqlalchemy import delete, func, update
+
+from app.core.config import settings
+from app.core.database import engine
+from app.models.jobs import BackgroundJob, JobFileChunk
+
+TERMINAL_STATUSES = ("SUCCEEDED", "FAILED", "CANCELLED")
+MAX_RETRY_DELAY_SECONDS = 60 * 60
+JOB_FILE_CHUNK_BYTES = 1024 * 1024
+
+
+class JobCancelled(Exception):
+    """Lo lanza ctx.progress() cuando alguien pidió cancelar el trabajo."""
+
+
+class JobLeaseLost(JobCancelled):
+    """Lo lanza ctx.progress() si el trabajo ya no es de este trabajador (se reencoló)."""
+
+
+class JobError(ValueError):
+    """Error de negocio al encolar o administrar un trabajo."""
+
+    def __init__(self, detail: str, status_code: int = 400):
+        self.detail = detail
+        self.status_code = status_code
+        super().__init__(detail)
+
+
+# ============================================================
+# REGISTRO DE HANDLERS
+# ============================================================
+JOB_HANDLERS: Dict[str, Callable] = {}
+
+
+def job_handler(kind: str):
+    def register(func: Callable[[Session, dict, "JobContext"], Optional[dict]]):
+        JOB_HANDLERS[kind] = func
+        return func
+    return register
+
+
+def _leased(job_id: int, worker_name: str, attempt: int):
+    """UPDATE que sólo aplica si este trabajador sigue teniendo la concesión del trabajo."""
+    return (
+        update(BackgroundJob)
+        .where(BackgroundJob.id == job_id)
+        .where(BackgroundJob.status == "RUNNING")
+        .where(BackgroundJob.locked_by == worker_name)
+        .where(BackgroundJob.attempts == attempt)
+    )
+
+
+class JobContext:
+    """Lo que un handler puede hacer con su propio trabajo (en una sesión aparte)."""
+
+    def __init__(self, job_id: int, worker_name: str, attempt: int):
+        self.job_id = job_id
+        self.worker_name = worker_name
+        self.attempt = attempt
+
+    def progress(self, percent: Optional[float] = None, message: Optional[str] = None) -> None:
+        """Latido (+ avance). Lanza JobCancelled si lo cancelaron y JobLeaseLost si ya no es nuestro."""
+        values: Dict[str, Any] = {"heartbeat_at": datetime.utcnow()}
+        if percent is not None:
+            values["progress"] = max(0.0, min(100.0, float(percent)))
+        if message is not None:
+            values["progress_message"] = message
+        with Session(engine) as session:
+            held = session.exec(_leased(self.job_id, self.worker_name, self.attempt).values(**values)).rowcount
+            session.commit()
+            if not held:
+                raise JobLeaseLost()
+            cancel = session.exec(
+                select(BackgroundJob.cancel_requested).where(BackgroundJob.id == self.job_id)
+            ).one()
+        if cancel:
+            raise JobCancelled()
+
+    def check_cancelled(self) -> None:
+        self.progress()
+
+
+# ============================================================
+# API PARA ENDPOINTS
+# ============================================================
+
+def enqueue(
+    session: Session,
+    kind: str,
+    payload: Optional[dict] = None,
+    user_id: Optional[int] = None,
+    max_attempts: int = 3,
+) -> BackgroundJob:
+    """Encola y hace commit; despierta a los trabajadores de este proceso."""
+    if kind not in JOB_HANDLERS:
+        raise JobError(f"Tipo de trabajo desconocido: {kind}")
+    job = BackgroundJob(
+        kind=kind,
+        payload=payload or {},
+        max_attempts=max(1, max_attempts),
+        created_by_user_id=user_id,
+    )
+    session.add(job)
+    session.commit()
+    session.refresh(job)
+    worker_pool.wake()
+    return job
+
+
+def cancel(session: Session, job_id: int) -> BackgroundJob:
+    job = session.get(BackgroundJob, job_id)
+    if not job:
+        raise JobError("Trabajo no encontrado", status_code=404)
+    if job.status in TERMINAL_STATUSES:
+        raise JobError(f"El trabajo ya terminó ({job.status}).")
+    # Un QUEUED se cancela directo (condicional: un trabajador pudo tomarlo en este instante)
+    taken = session.exec(
+        update(BackgroundJob)
+        .where(BackgroundJob.id == job_id)
+        .where(BackgroundJob.status == "QUEUED")
+        .values(status="CANCELLED", cancel_requested=True, finished_at=datetime.utcnow())
+    ).rowcount
+    if not taken:
+        session.exec(update(BackgroundJob).where(BackgroundJob.id == job_id).values(cancel_requested=True))
+    session.commit()
+    session.refresh(job)
+    return job
+
+
+def retry(session: Session, job_id: int) -> BackgroundJob:
+    job = session.get(BackgroundJob, job_id)
+    if not job:
+        raise JobError("Trabajo no encontrado", status_code=404)
+    if job.status not in ("FAILED", "CANCELLED"):
+        raise JobError("Solo se puede reintentar un trabajo FAILED o CANCELLED.")
+    job.status = "QUEUED"
+    job.attempts = 0
+    job.cancel_requested = False
+    job.error = None
+    job.progress = 0.0
+    job.progress_message = None
+    job.run_after = datetime.utcnow()
+    job.finished_at = None
+    session.add(job)
+    session.commit()
+    session.refresh(job)
+    worker_pool.wake()
+    return job
+
+
+def store_job_file(session: Session, fileobj: BinaryIO) -> str:
+    """
+    Copia un archivo subido a job_file_chunks (bloques de JOB_FILE_CHUNK_BYTES) y hace
+    commit; regresa la llave para el payload. Se guarda en la BD y no en disco porque
+    el trabajo lo puede tomar otra instancia del backend.
+    """
+    key = uuid4().hex
+    table = JobFileChunk.__table__
+    seq = 0
+    while True:
+        block = fileobj.read(JOB_FILE_CHUNK_BYTES)
+        if not block:
+            break
+        session.execute(table.insert().values(file_key=key, seq=seq, size=len(block), data=block))
+        seq += 1
+    session.commit()
+    return key
+
+
+def delete_job_file(session: Session, key: str) -> None:
+    session.exec(delete(JobFileChunk).where(JobFileChunk.file_key == key))
+    session.commit()
+
+
+class _JobFileReader(io.RawIOBase):
+    """Lectura con seek de un archivo guardado con store_job_file (un bloque en memoria a la vez)."""
+
+    def __init__(self, session: Session, key: str):
+        self._session = session
+        self._key = key
+        self._size = int(session.exec(
+            select(func.coalesce(func.sum(JobFileChunk.size), 0)).where(JobFileChunk.file_key == key)
+        ).one())
+        self._pos = 0
+        self._seq: Optional[int] = None
+        self._block = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self._size}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def readinto(self, buffer) -> int:
+        if self._pos >= self._size:
+            return 0
+        seq, offset = divmod(self._pos, JOB_FILE_CHUNK_BYTES)
+        if seq != self._seq:
+            self._block = self._session.exec(
+                select(JobFileChunk.data)
+                .where(JobFileChunk.file_key == self._key)
+                .where(JobFileChunk.seq == seq)
+            ).one()
+            self._seq = seq
+        data = self._block[offset:offset + len(buffer)]
+        buffer[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+def open_job_file(session: Session, key: str) -> BinaryIO:
+    return io.BufferedReader(_JobFileReader(session, key), buffer_size=JOB_FILE_CHUNK_BYTES)
+
+
+# ============================================================
+# TRABAJADORES
+# ============================================================
+
+def claim_next(worker_name: str) -> Optional[int]:
+    """Toma el siguiente trabajo vencido. UPDATE condicional: sólo un trabajador gana."""
+    now = datetime.utcnow()
+    with Session(engine) as session:
+        # Trabajadores caídos: RUNNING sin latido -> de vuelta a la cola, salvo que ya
+        # agotaran sus intentos (un trabajo que tumba al proceso no se reintenta para siempre)
+        stale = now - timedelta(seconds=settings.JOB_LEASE_SECONDS)
+        session.exec(
+            update(BackgroundJob)
+            .where(BackgroundJob.status == "RUNNING")
+            .where(BackgroundJob.heartbeat_at < stale)
+            .where(BackgroundJob.attempts >= BackgroundJob.max_attempts)
+            .values(
+                status="FAILED",
+                locked_by=None,
+                finished_at=now,
+                error="La concesión venció sin respuesta del trabajador (intentos agotados).",
+            )
+        )
+        session.exec(
+            update(BackgroundJob)
+            .where(BackgroundJob.status == "RUNNING")
+            .where(BackgroundJob.heartbeat_at < stale)
+            .values(status="QUEUED", locked_by=None, run_after=now)
+        )
+        session.commit()
+
+        candidates = session.exec(
+            select(BackgroundJob.id)
+            .where(BackgroundJob.status == "QUEUED")
+            .where(BackgroundJob.run_after <= now)
+            .order_by(BackgroundJob.run_after, BackgroundJob.id)
+            .limit(5)
+        ).all()
+        for job_id in candidates:
+            taken = session.exec(
+                update(BackgroundJob)
+                .where(BackgroundJob.id == job_id)
+                .where(BackgroundJob.status == "QUEUED")
+                .values(
+                    status="RUNNING",
+                    locked_by=worker_name,
+                    heartbeat_at=now,
+                    started_at=now,
+                    attempts=BackgroundJob.attempts + 1,
+                )
+            ).rowcount
+            session.commit()
+            if taken:
+                return job_id
+    return None
+
+
+def execute(job_id: int, worker_name: str) -> None:
+    """
+    Corre el handler y deja el trabajo en SUCCEEDED, CANCELLED, FAILED o reencolado.
+    La escritura final es condicional (locked_by + attempts): si la concesión venció y
+    otro trabajador ya tomó el trabajo, el resultado de esta corrida se descarta.
+    """
+    with Session(engine) as session:
+        job = session.get(BackgroundJob, job_id)
+        if job is None or job.status != "RUNNING" or job.locked_by != worker_name:
+            return
+        kind = job.kind
+        attempt = job.attempts
+        max_attempts = job.max_attempts
+        handler = JOB_HANDLERS.get(kind)
+        payload = dict(job.payload or {})
+
+    result, error, cancelled = None, None, False
+    ctx = JobContext(job_id, worker_name, attempt)
+    try:
+        if handler is None:
+            raise JobError(f"Sin handler para {kind}")
+        with Session(engine) as session:
+            result = handler(session, payload, ctx)
+    except JobLeaseLost:
+        print(f"--> Trabajo {job_id} ({kind}): la concesión venció; se descarta esta corrida.")
+        return
+    except JobCancelled:
+        cancelled = True
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        traceback.print_exc()
+
+    now = datetime.utcnow()
+    with Session(engine) as session:
+        cancel_requested = session.exec(
+            select(BackgroundJob.cancel_requested).where(BackgroundJob.id == job_id)
+        ).one()
+        values: Dict[str, Any] = {"locked_by": None}
+        # Un handler que atrapa la cancelación y falla también cuenta como cancelado
+        if cancelled or (error and cancel_requested):
+            values.update(status="CANCELLED", finished_at=now)
+        elif error:
+            values["error"] = error
+            if attempt < max_attempts and handler is not None:
+                delay = min(settings.JOB_RETRY_BASE_SECONDS * 2 ** (attempt - 1), MAX_RETRY_DELAY_SECONDS)
+                run_after = now + timedelta(seconds=delay)
+                values.update(
+                    status="QUEUED",
+                    run_after=run_after,
+                    progress_message=f"Reintento {attempt + 1} de {max_attempts} a las {run_after:%H:%M:%S} UTC",
+                )
+            else:
+                values.update(status="FAILED", finished_at=now)
+        else:
+            values.update(
+                status="SUCCEEDED",
+                result=jsonable_encoder(result if isinstance(result, dict) else {"value": result}),
+                error=None,
+                progress=100.0,
+                finished_at=now,
+            )
+        written = session.exec(_leased(job_id, worker_name, attempt).values(**values)).rowcount
+        session.commit()
+    if not written:
+        print(f"--> Trabajo {job_id} ({kind}): la concesión venció; se descarta esta corrida.")
+
+
+class WorkerPool:
+    def __init__(self, size: int, poll_seconds: int):
+        self.size = size
+        self.poll_seconds = poll_seconds
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        self._stop.clear()
+        for n in range(self.size):
+            thread = threading.Thread(target=self._loop, args=(f"{os.getpid()}:{n}",), name=f"job-worker-{n}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+
+    def _loop(self, worker_name: str) -> None:
+        while not self._stop.is_set():
+            try:
+                job_id = claim_next(worker_name)
+            except Exception:
+                traceback.print_exc()
+                job_id = None
+            if job_id is not None:
+                # Un error aquí (p. ej. el commit final) no debe matar al hilo: el trabajo
+                # queda RUNNING sin latido y claim_next lo reencola al vencer la concesión.
+                try:
+                    execute(job_id, worker_name)
+                except Exception:
+                    traceback.print_exc()
+                continue
+            self._wake.wait(timeout=self.poll_seconds)
+            self._wake.clear()
+
+
+worker_pool = WorkerPool(settings.JOB_WORKERS, settings.JOB_POLL_SECONDS)
+
+
+def start_job_workers() -> None:
+    if settings.JOB_WORKERS > 0:
+        worker_pool.start()
+
+
+def stop_job_workers() -> None:
+    worker_pool.stop()
+
+
+# ============================================================
+# HANDLERS REGISTRADOS
+# (imports diferidos: los servicios no deben cargarse al importar este módulo)
+# ============================================================
+
+@job_handler("CATALOG_IMPORT")
+def _catalog_import(session: Session, payload: dict, ctx: JobContext) -> dict:
+    """payload: {entity, file_key, filename, user_id}. El archivo se borra al terminar bien."""
+    from app.services.catalog_import import CatalogImporter
+
+    def on_progress(run):
+        percent = 100.0 * run.bytes_processed / run.file_size if run.file_size else None
+        ctx.progress(percent, f"{run.rows_committed} renglones guardados")
+
+    with Session(engine) as files:
+        run = CatalogImporter.run(
+            session, payload["entity"], open_job_file(files, payload["file_key"]),
+            filename=payload.get("filename"), user_id=payload.get("user_id"),
+            on_progress=on_progress,
+        )
+        summary = CatalogImporter.summary(run)
+        delete_job_file(files, payload["file_key"])
+    return summary
+
+
+@job_handler("KARDEX_OPENING")
+def _kardex_opening(session: Session, payload: dict, ctx: JobContext) -> dict:
+    from app.services.inventory_manager import sembrar_saldo_apertura
+    # Dos lecturas y UN INSERT: basta con revisar latido y cancelación antes de escribir
+    ctx.progress(0.0, "Sembrando saldos de apertura")
+    result = sembrar_saldo_apertura(session)
+    session.commit()
+    return result
+
+
+@job_handler("KARDEX_REPLAY")
+def _kardex_replay(session: Session, payload: dict, ctx: JobContext) -> dict:
+    from app.services.kardex_replay import KardexReplay
+    correct = bool(payload.get("correct"))
+    # Latido por bloque leído del Kárdex (la parte larga); la corrección escribe al final
+    report = KardexReplay.replay(session, correct=correct, on_progress=lambda message: ctx.progress(None, message))
+    if correct:
+        session.commit()
+    return report
+
+
+@job_handler("REQUISITION_SWEEP")
+def _requisition_sweep(session: Session, payload: dict, ctx: JobContext) -> dict:
+    from app.services.purchase_manager import PurchaseManager, invalidate_pending_tasks_cache
+
+    def on_progress(done: int, total: int):
+        ctx.progress(100.0 * done / total if total else None, f"{done} de {total} materiales")
+
+    created = PurchaseManager.evaluate_and_create_automatic_requisitions(session, on_progress=on_progress)
+    invalidate_pending_tasks_cache()
+    return {"created_requisitions": created or 0}
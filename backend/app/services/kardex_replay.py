@@ -0,0 +1,242 @@
+"""
+kardex_replay.py  –  Reconstrucción de existencias a partir del Kárdex
+
+physical_stock y committed_stock son contadores desnormalizados; sus libros son:
+  - physical_stock  = SUMA(inventory_transactions.quantity) del material.
+  - committed_stock = SUMA(inventory_reservations.quantity_reserved) ACTIVA del material.
+
+replay() recorre ambos libros en bloques con cursor del lado del servidor
+(yield_per: Postgres no manda todo el resultado de golpe), acumulando sólo un
+total por material, así que la memoria depende del número de materiales y no
+del número de renglones. Reporta cada descuadre y, si se pide, corrige los
+contadores en bloque.
+
+La lectura se acota al último id del Kárdex al iniciar; los movimientos que
+lleguen durante el recorrido no se cuentan en el reporte. La corrección, en
+cambio, vuelve a sumar los libros de los materiales descuadrados con sus filas
+bloqueadas (StockMutation bloquea la misma fila antes de escribir), así que
+nunca pisa un movimiento concurrente.
+"""
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+from sqlmodel import Session, select
+from sqlalchemy import bindparam, func, update
+
+from app.models.inventory import InventoryReservation, InventoryTransaction
+from app.models.material import Material
+from app.services.scheduler import notify_stock_changed
+
+DEFAULT_CHUNK_SIZE = 10_000
+CORRECTION_CHUNK_SIZE = 500
+EPSILON = 1e-6
+
+
+class KardexReplay:
+    # ------------------------------------------------------------
+    # Recorrido de los libros
+    # ------------------------------------------------------------
+    @staticmethod
+    def stream_ledger(
+        session: Session,
+        up_to_id: int,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        on_progress: Optional[Callable[[str], None]] = None,
+    ):
+        """
+        {material_id: suma}, {material_id: tiene AJUSTE_INICIAL}, renglones leídos.
+        Lee en bloques de chunk_size con cursor del servidor; on_progress se llama por bloque.
+        """
+        totals: Dict[int, float] = {}
+        openings: set = set()
+        rows_read = 0
+        result = session.execute(
+            select(
+                InventoryTransaction.material_id,
+                InventoryTransaction.quantity,
+                InventoryTransaction.transaction_type,
+            )
+            .where(InventoryTransaction.id <= up_to_id)
+            .execution_options(yield_per=chunk_size)
+        )
+        for chunk in result.partitions():
+            for material_id, quantity, transaction_type in chunk:
+                totals[material_id] = totals.get(material_id, 0.0) + float(quantity or 0.0)
+                if transaction_type == "AJUSTE_INICIAL":
+                    openings.add(material_id)
+            rows_read += len(chunk)
+            if on_progress:
+                on_progress(f"Kárdex: {rows_read} de hasta {up_to_id} movimientos leídos")
+        return totals, openings, rows_read
+
+    @staticmethod
+    def stream_reservations(
+        session: Session,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        on_progress: Optional[Callable[[str], None]] = None,
+    ):
+        """{material_id: suma de reservas ACTIVA}, renglones leídos."""
+        totals: Dict[int, float] = {}
+        rows_read = 0
+        result = session.execute(
+            select(InventoryReservation.material_id, InventoryReservation.quantity_reserved)
+            .where(InventoryReservation.status == "ACTIVA")
+            .execution_options(yield_per=chunk_size)
+        )
+        for chunk in result.partitions():
+            for material_id, quantity in chunk:
+                totals[material_id] = totals.get(material_id, 0.0) + float(quantity or 0.0)
+            rows_read += len(chunk)
+            if on_progress:
+                on_progress(f"Reservas: {rows_read} leídas")
+        return totals, rows_read
+
+    # ------------------------------------------------------------
+    # Reporte
+    # ------------------------------------------------------------
+    @staticmethod
+    def replay(
+        session: Session,
+        correct: bool = False,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        on_progress: Optional[Callable[[str], None]] = None,
+    ) -> dict:
+        """
+        Recalcula existencias y apartados desde los libros y reporta los descuadres.
+        correct=True además corrige los contadores (el llamador hace commit).
+        on_progress(mensaje) se llama por bloque leído, siempre antes de escribir nada
+        (trabajos en segundo plano: latido y punto de cancelación).
+        """
+        started = time.perf_counter()
+        up_to_id = session.exec(select(func.max(InventoryTransaction.id))).one() or 0
+
+        ledger, openings, ledger_rows = KardexReplay.stream_ledger(session, up_to_id, chunk_size, on_progress)
+        reserved, reservation_rows = KardexReplay.stream_reservations(session, chunk_size, on_progress)
+
+        discrepancies: List[dict] = []
+        materials_checked = 0
+        result = session.execute(
+            select(Material.id, Material.sku, Material.physical_stock, Material.committed_stock)
+            .order_by(Material.id)
+            .execution_options(yield_per=chunk_size)
+        )
+        for chunk in result.partitions():
+            if on_progress:
+                on_progress(f"Materiales: {materials_checked} revisados")
+            for material_id, sku, physical, committed in chunk:
+                materials_checked += 1
+                physical = float(physical or 0.0)
+                committed = float(committed or 0.0)
+                ledger_physical = ledger.get(material_id, 0.0)
+                reserved_committed = reserved.get(material_id, 0.0)
+                physical_diff = physical - ledger_physical
+                committed_diff = committed - reserved_committed
+                if abs(physical_diff) <= EPSILON and abs(committed_diff) <= EPSILON:
+                    continue
+                discrepancies.append({
+                    "material_id": material_id,
+                    "sku": sku,
+                    "physical_stock": physical,
+                    "ledger_physical_stock": round(ledger_physical, 6),
+                    "physical_diff": round(physical_diff, 6),
+                    "committed_stock": committed,
+                    "reserved_committed_stock": round(reserved_committed, 6),
+                    "committed_diff": round(committed_diff, 6),
+                    # Sin saldo de apertura el Kárdex no conoce lo que había antes de encenderse
+                    "has_opening_balance": material_id in openings,
+                })
+
+        # Sin AJUSTE_INICIAL el Kárdex no conoce lo que había antes de encenderse: igualar
+        # physical_stock a su suma borraría ese stock real. A esos sólo se les corrige el
+        # apartado (las reservas sí son un libro completo) y se reportan aparte.
+        skipped_no_opening = [
+            d["material_id"] for d in discrepancies
+            if not d["has_opening_balance"] and abs(d["physical_diff"]) > EPSILON
+        ]
+        corrected = 0
+        if correct and discrepancies:
+            corrected = KardexReplay.correct(
+                session,
+                [d["material_id"] for d in discrepancies],
+                keep_physical=skipped_no_opening,
+            )
+
+        return {
+            "as_of_transaction_id": up_to_id,
+            "ledger_rows": ledger_rows,
+            "reservation_rows": reservation_rows,
+            "materials_checked": materials_checked,
+            "discrepancies": discrepancies,
+            "corrected": corrected,
+            "skipped_no_opening": skipped_no_opening,  # Físico sin corregir: correr KARDEX_OPENING
+            "elapsed_seconds": round(time.perf_counter() - started, 3),
+        }
+
+    # ------------------------------------------------------------
+    # Corrección
+    # ------------------------------------------------------------
+    @staticmethod
+    def correct(session: Session, material_ids: List[int], keep_physical: Iterable[int] = ()) -> int:
+        """
+        Iguala los contadores de los materiales dados a sus libros, por bloques:
+        bloqueo en orden de id + dos sumas agrupadas + UN UPDATE por lotes.
+        Los libros se suman de nuevo con las filas bloqueadas, así que incluyen
+        cualquier movimiento que haya entrado después del reporte.
+        keep_physical: materiales a los que sólo se les corrige committed_stock.
+        """
+        keep_physical = set(keep_physical)
+        table = Material.__table__
+        stmt = (
+            update(table)
+            .where(table.c.id == bindparam("b_id"))
+            .values(physical_stock=bindparam("b_physical"), committed_stock=bindparam("b_committed"))
+        )
+        corrected = 0
+        changed_physical = False
+        ids = sorted(set(material_ids))
+        for start in range(0, len(ids), CORRECTION_CHUNK_SIZE):
+            chunk = ids[start:start + CORRECTION_CHUNK_SIZE]
+            locked = session.exec(
+                select(Material.id, Material.physical_stock, Material.committed_stock)
+                .where(Material.id.in_(chunk))
+                .order_by(Material.id)
+                .with_for_update()
+            ).all()
+            ledger = dict(session.exec(
+                select(InventoryTransaction.material_id, func.sum(InventoryTransaction.quantity))
+                .where(InventoryTransaction.material_id.in_(chunk))
+                .group_by(InventoryTransaction.material_id)
+            ).all())
+            reserved = dict(session.exec(
+                select(InventoryReservation.material_id, func.sum(InventoryReservation.quantity_reserved))
+                .where(InventoryReservation.material_id.in_(chunk))
+                .where(InventoryReservation.status == "ACTIVA")
+                .group_by(InventoryReservation.material_id)
+            ).all())
+
+            params = []
+            for material_id, physical, committed in locked:
+                target_physical = float(ledger.get(material_id) or 0.0)
+                if material_id in keep_physical:
+                    target_physical = float(physical or 0.0)
+                target_committed = float(reserved.get(material_id) or 0.0)
+                physical_off = abs(float(physical or 0.0) - target_physical) > EPSILON
+                committed_off = abs(float(committed or 0.0) - target_committed) > EPSILON
+                if not (physical_off or committed_off):
+                    continue
+                changed_physical = changed_physical or physical_off
+                params.append({
+                    "b_id": material_id,
+                    "b_physical": target_physical,
+                    "b_committed": target_committed,
+                })
+            if params:
+                session.execute(stmt, params)
+                corrected += len(params)
+
+        for obj in list(session.identity_map.values()):
+            if isinstance(obj, Material) and obj.id in ids:
+                session.expire(obj)
+        if changed_physical:
+            notify_stock_changed(session)
+        return corrected
@@ -5,13 +5,17 @@ Responsabilidades:
   1. Calcular el semáforo dinámico de 7 estados para cada instancia.
   2. Disparar el EVENTO MAESTRO de Doble Verde (🟢🟢): cierre + garantía + nómina.
   3. Gestionar reapertura de instancias para Órdenes de Garantía (⚠️).
+  4. Mantener sincronizada la proyección schedule_events (píldoras del calendario).
+  5. Reprogramar en bloque (muchas instancias, un solo UPDATE por lotes).
 """
 from datetime import datetime, timedelta
-from typing import Optional, List, Tuple
-from sqlmodel import Session, select
+from typing import Optional, List, Tuple, Iterable, Dict
+from sqlmodel import Session, select, delete
+from sqlalchemy import bindparam, update
 
 from app.models.sales import SalesOrderItemInstance, InstanceStatus
 from app.models.production import PayrollPayment, InstallationAssignment, PayrollStatus, ProductionBatch, ProductionBatchStatus
+from app.models.planning import ScheduleEvent
 
 
 # ============================================================
@@ -45,6 +49,11 @@ _SEMAPHORE_SEVERITY = {
     SemaphoreColor.DOUBLE_GREEN: 8,
 }
 
+def semaphore_severity(color: str) -> int:
+    """Urgencia de un color: menor = más atrasado (RED=1). Colores fuera de escala al final."""
+    return _SEMAPHORE_SEVERITY.get(color, 99)
+
+
 def _worst_semaphore(colors: list) -> str:
     """Dada una lista de colores, retorna el más atrasado (menor severidad)."""
     if not colors:
@@ -97,10 +106,35 @@ def _compute_track_semaphore(
         return SemaphoreColor.GRAY
 
 
+def load_batch_statuses(
+    session: Session,
+    instances: Iterable[SalesOrderItemInstance],
+) -> Dict[int, str]:
+    """
+    Precarga en UNA consulta el status de todos los lotes (MDF y PIEDRA)
+    referenciados por las instancias. El resultado se pasa a compute_semaphore
+    como `batch_statuses` para evitar un session.get(ProductionBatch) por instancia.
+    """
+    batch_ids = set()
+    for inst in instances:
+        if inst.production_batch_id:
+            batch_ids.add(inst.production_batch_id)
+        if inst.stone_batch_id:
+            batch_ids.add(inst.stone_batch_id)
+    if not batch_ids:
+        return {}
+    rows = session.exec(
+        select(ProductionBatch.id, ProductionBatch.status)
+        .where(ProductionBatch.id.in_(batch_ids))
+    ).all()
+    return {bid: status for bid, status in rows}
+
+
 def compute_semaphore(
     instance: SalesOrderItemInstance,
     reference_date: Optional[datetime] = None,
     session: Optional[Session] = None,
+    batch_statuses: Optional[Dict[int, str]] = None,
 ) -> str:
     """
     Calcula el color del semáforo de una instancia usando la Ley del Track Más Atrasado.
@@ -116,6 +150,7 @@ def compute_semaphore(
 
     Si `session` no se provee, se usa production_status como fallback global (comportamiento legacy).
     Si `session` se provee, se consultan los lotes para determinar el estado real de cada track.
+    Si `batch_statuses` se provee (ver load_batch_statuses), se usa ese mapa en lugar de la session.
     """
     now = reference_date or datetime.utcnow()
 
@@ -130,7 +165,7 @@ def compute_semaphore(
         return SemaphoreColor.DOUBLE_BLUE
 
     # Fallback legacy: si no se pasa session, usar comportamiento antiguo basado en production_status
-    if session is None:
+    if session is None and batch_statuses is None:
         if instance.production_status == InstanceStatus.READY:
             return SemaphoreColor.BLUE_GREEN
         if instance.production_status == InstanceStatus.IN_PRODUCTION:
@@ -161,16 +196,22 @@ def compute_semaphore(
     mdf_dates = [d for d in [instance.scheduled_prod_mdf, instance.scheduled_inst_mdf] if d is not None]
     mdf_batch_status = None
     if instance.production_batch_id:
-        mdf_batch = session.get(ProductionBatch, instance.production_batch_id)
-        mdf_batch_status = mdf_batch.status if mdf_batch else None
+        if batch_statuses is not None:
+            mdf_batch_status = batch_statuses.get(instance.production_batch_id)
+        else:
+            mdf_batch = session.get(ProductionBatch, instance.production_batch_id)
+            mdf_batch_status = mdf_batch.status if mdf_batch else None
     mdf_color = _compute_track_semaphore(mdf_dates, instance.production_batch_id, mdf_batch_status, now)
 
     # Track PIEDRA
     stone_dates = [d for d in [instance.scheduled_prod_stone, instance.scheduled_inst_stone] if d is not None]
     stone_batch_status = None
     if instance.stone_batch_id:
-        stone_batch = session.get(ProductionBatch, instance.stone_batch_id)
-        stone_batch_status = stone_batch.status if stone_batch else None
+        if batch_statuses is not None:
+            stone_batch_status = batch_statuses.get(instance.stone_batch_id)
+        else:
+            stone_batch = session.get(ProductionBatch, instance.stone_batch_id)
+            stone_batch_status = stone_batch.status if stone_batch else None
     stone_color = _compute_track_semaphore(stone_dates, instance.stone_batch_id, stone_batch_status, now)
 
     # Recolectar tracks activos (None = track no aplica a esta instancia)
@@ -217,6 +258,80 @@ LANE_LABELS = {
 }
 
 
+# ============================================================
+# 2.B PROYECCIÓN schedule_events (índice del Calendario Maestro)
+# ============================================================
+
+def sync_schedule_events(
+    session: Session,
+    instances: Iterable[SalesOrderItemInstance],
+) -> None:
+    """
+    Reemplaza las píldoras de las instancias dadas por las que dictan sus
+    4 campos scheduled_*. Debe llamarse en la MISMA transacción que modifica
+    las fechas (antes del commit) para que calendario e instancia no diverjan.
+
+    Las instancias canceladas conservan su proyección: el filtro de
+    is_cancelled se aplica al consultar, igual que antes.
+    """
+    instances = [inst for inst in instances if inst.id is not None]
+    if not instances:
+        return
+
+    session.exec(
+        delete(ScheduleEvent).where(
+            ScheduleEvent.instance_id.in_([inst.id for inst in instances])
+        )
+    )
+    rows = [
+        {"instance_id": inst.id, "lane": code, "scheduled_at": getattr(inst, field)}
+        for inst in instances
+        for field, code in LANE_CODES.items()
+        if getattr(inst, field) is not None
+    ]
+    if rows:
+        session.execute(ScheduleEvent.__table__.insert(), rows)
+
+
+def rebuild_schedule_events(session: Session, chunk_size: int = 2000) -> int:
+    """
+    Reconstruye desde cero la proyección schedule_events recorriendo todas las
+    instancias por bloques de `chunk_size` (orden por id). No hace commit.
+    Retorna el número de píldoras generadas.
+    """
+    session.exec(delete(ScheduleEvent))
+
+    total = 0
+    last_id = 0
+    while True:
+        chunk = session.exec(
+            select(
+                SalesOrderItemInstance.id,
+                SalesOrderItemInstance.scheduled_prod_mdf,
+                SalesOrderItemInstance.scheduled_prod_stone,
+                SalesOrderItemInstance.scheduled_inst_mdf,
+                SalesOrderItemInstance.scheduled_inst_stone,
+            )
+            .where(SalesOrderItemInstance.id > last_id)
+            .order_by(SalesOrderItemInstance.id)
+            .limit(chunk_size)
+        ).all()
+        if not chunk:
+            break
+
+        rows = []
+        for inst_id, pm, pp, im, ip in chunk:
+            for code, dt in (("PM", pm), ("PP", pp), ("IM", im), ("IP", ip)):
+                if dt is not None:
+                    rows.append({"instance_id": inst_id, "lane": code, "scheduled_at": dt})
+        if rows:
+            session.execute(ScheduleEvent.__table__.insert(), rows)
+            total += len(rows)
+        last_id = chunk[-1][0]
+
+    return total
+
+
 # ============================================================
 # 3. EVENTO MAESTRO: DOBLE VERDE 🟢🟢 (Firma de Conformidad)
 # ============================================================
@@ -292,6 +407,7 @@ def reopen_as_warranty(
 
     session.add(instance)
     session.flush()
+    sync_schedule_events(session, [instance])
 
     return {
         "instance_id": instance.id,
@@ -349,3 +465,100 @@ def recalculate_dates_proportionally(
             updates[field] = current + delta
 
     return updates
+
+
+# ============================================================
+# 6. REPROGRAMACIÓN MASIVA (un proveedor se retrasa: mover muchas píldoras)
+# ============================================================
+
+class _RescheduledView:
+    """La instancia con sus fechas nuevas, sin tocar el objeto de la sesión (para semáforo y píldoras)."""
+
+    def __init__(self, instance: SalesOrderItemInstance, updates: dict):
+        self._instance = instance
+        self._updates = updates
+
+    def __getattr__(self, name):
+        if name in self._updates:
+            return self._updates[name]
+        return getattr(self._instance, name)
+
+
+def _schedule_dict(source) -> Dict[str, Optional[str]]:
+    return {
+        code: getattr(source, field).isoformat() if getattr(source, field) else None
+        for field, code in LANE_CODES.items()
+    }
+
+
+def bulk_reschedule(
+    session: Session,
+    instances: List[SalesOrderItemInstance],
+    moved_field: str,
+    delta: timedelta,
+    proportional: bool = True,
+    apply: bool = False,
+    reference_date: Optional[datetime] = None,
+) -> dict:
+    """
+    Recorre `delta` la píldora `moved_field` de cada instancia (y, con
+    proportional=True, las siguientes de la cadena, igual que el Drag & Drop).
+    Las instancias sin fecha en ese carril se omiten.
+
+    apply=False: sólo calcula (vista previa). apply=True: escribe TODAS las
+    instancias con UN UPDATE por lotes (executemany) y sincroniza schedule_events
+    en la transacción actual. No hace commit.
+    """
+    now = reference_date or datetime.utcnow()
+    moving = [inst for inst in instances if getattr(inst, moved_field) is not None]
+    batch_statuses = load_batch_statuses(session, moving)
+
+    planned = []
+    for inst in moving:
+        new_date = getattr(inst, moved_field) + delta
+        if proportional:
+            updates = recalculate_dates_proportionally(inst, moved_field, new_date)
+        else:
+            updates = {moved_field: new_date}
+        planned.append((inst, updates, _RescheduledView(inst, updates)))
+
+    result_rows = []
+    changes: Dict[str, int] = {}
+    for inst, updates, view in planned:
+        before = compute_semaphore(inst, now, batch_statuses=batch_statuses)
+        after = compute_semaphore(view, now, batch_statuses=batch_statuses)
+        if before != after:
+            key = f"{before}->{after}"
+            changes[key] = changes.get(key, 0) + 1
+        result_rows.append({
+            "id": inst.id,
+            "custom_name": inst.custom_name,
+            "updated_fields": list(updates.keys()),
+            "schedule_before": _schedule_dict(inst),
+            "schedule_after": _schedule_dict(view),
+            "semaphore_before": before,
+            "semaphore_after": after,
+        })
+
+    if apply and planned:
+        table = SalesOrderItemInstance.__table__
+        stmt = (
+            update(table)
+            .where(table.c.id == bindparam("b_id"))
+            .values({field: bindparam(f"b_{field}") for field in LANE_CODES})
+        )
+        session.execute(stmt, [
+            {"b_id": inst.id, **{f"b_{field}": getattr(view, field) for field in LANE_CODES}}
+            for inst, _, view in planned
+        ])
+        sync_schedule_events(session, [view for _, _, view in planned])
+        # Los objetos de la sesión ya no reflejan la BD
+        for inst, _, _ in planned:
+            session.expire(inst)
+
+    return {
+        "count": len(planned),
+        "skipped_without_date": len(instances) - len(moving),
+        "semaphore_changes": changes,
+        "instances": result_rows,
+    }
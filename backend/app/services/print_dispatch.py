@@ -0,0 +1,175 @@
+"""
+print_dispatch.py  –  Despacho de etiquetas a los agentes de impresión
+
+Antes cada agente consultaba /print_jobs/pending y recibía el ZPL de TODOS los
+trabajos pendientes en cada vuelta, incluso los que ya tenía. Ahora:
+
+  1. El agente pide trabajo con long-poll (POST /production/print_jobs/claim):
+     si no hay nada, la petición espera hasta `wait` segundos y responde en
+     cuanto se crea una etiqueta (notify_print_jobs() en este proceso; los de
+     otros procesos se ven en la siguiente revisión cada PRINT_RECHECK_SECONDS).
+  2. Tomar es atómico: UN UPDATE ... RETURNING pasa los trabajos de PENDING a
+     CLAIMED con arrendamiento (lease). Dos agentes nunca reciben el mismo
+     trabajo, y el ZPL viaja una sola vez por toma.
+  3. El agente confirma con mark_print_job_printed (PRINTED). Si se cae antes,
+     al vencer lease_expires_at el trabajo vuelve a PENDING y otro lo toma.
+"""
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlmodel import Session, select
+from sqlalchemy import update
+
+from app.core.config import settings
+from app.core.database import engine
+from app.models.production import PrintJob
+
+MAX_CLAIM_BATCH = 50
+
+# Contador en proceso: cambia cada vez que se crean trabajos. Los long-polls lo
+# vigilan en memoria y sólo van a la BD cuando cambia (o cada PRINT_RECHECK_SECONDS).
+_version = 0
+_version_lock = threading.Lock()
+
+
+class PrintDispatchError(ValueError):
+    def __init__(self, detail: str, status_code: int = 400):
+        self.detail = detail
+        self.status_code = status_code
+        super().__init__(detail)
+
+
+def notify_print_jobs() -> None:
+    """Llamar después del commit que crea PrintJobs: despierta a los agentes que esperan."""
+    global _version
+    with _version_lock:
+        _version += 1
+
+
+def requeue_expired(session: Session, now: Optional[datetime] = None) -> int:
+    """CLAIMED con arrendamiento vencido (agente caído) -> PENDING."""
+    now = now or datetime.utcnow()
+    return session.exec(
+        update(PrintJob)
+        .where(PrintJob.status == "CLAIMED")
+        .where(PrintJob.lease_expires_at < now)
+        .values(status="PENDING", claimed_by=None, lease_expires_at=None)
+    ).rowcount
+
+
+def claim(session: Session, agent_id: str, limit: int = 20, lease_seconds: Optional[int] = None) -> List[PrintJob]:
+    """Toma hasta `limit` trabajos PENDING para el agente (hace commit)."""
+    now = datetime.utcnow()
+    lease = timedelta(seconds=lease_seconds or settings.PRINT_LEASE_SECONDS)
+    requeue_expired(session, now)
+    due = select(PrintJob.id).where(PrintJob.status == "PENDING") \
+        .order_by(PrintJob.created_at, PrintJob.id).limit(max(1, min(limit, MAX_CLAIM_BATCH)))
+    claimed_ids = session.execute(
+        update(PrintJob)
+        .where(PrintJob.id.in_(due.scalar_subquery()))
+        .where(PrintJob.status == "PENDING")
+        .values(
+            status="CLAIMED",
+            claimed_by=agent_id,
+            claimed_at=now,
+            lease_expires_at=now + lease,
+            claim_count=PrintJob.claim_count + 1,
+        )
+        .returning(PrintJob.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    session.commit()
+    if not claimed_ids:
+        return []
+    return session.exec(
+        select(PrintJob).where(PrintJob.id.in_(claimed_ids)).order_by(PrintJob.created_at, PrintJob.id)
+    ).all()
+
+
+def _claim_in_new_session(agent_id: str, limit: int, lease_seconds: Optional[int]) -> List[dict]:
+    with Session(engine) as session:
+        return [claimed_job_payload(job) for job in claim(session, agent_id, limit, lease_seconds)]
+
+
+async def wait_and_claim(
+    agent_id: str,
+    limit: int = 20,
+    wait_seconds: float = 25.0,
+    lease_seconds: Optional[int] = None,
+) -> List[dict]:
+    """
+    Long-poll: regresa en cuanto hay trabajos o al cumplirse wait_seconds (lista vacía).
+    La espera no ocupa hilos ni conexiones: sólo el claim corre en el threadpool,
+    con su propia sesión. Quien llama debe soltar antes la suya (ver claim_print_jobs).
+    """
+    deadline = time.monotonic() + max(0.0, min(wait_seconds, settings.PRINT_LONG_POLL_MAX_SECONDS))
+    while True:
+        seen_version = _version
+        jobs = await run_in_threadpool(_claim_in_new_session, agent_id, limit, lease_seconds)
+        if jobs or time.monotonic() >= deadline:
+            return jobs
+        recheck_at = min(deadline, time.monotonic() + settings.PRINT_RECHECK_SECONDS)
+        while time.monotonic() < recheck_at and _version == seen_version:
+            await asyncio.sleep(0.2)
+
+
+def claimed_job_payload(job: PrintJob) -> dict:
+    return {
+        "id": job.id,
+        "instance_id": job.instance_id,
+        "bundle_number": job.bundle_number,
+        "total_bundles": job.total_bundles,
+        "bundle_type": job.bundle_type,
+        "zpl_content": job.zpl_content,
+        "is_reprint": job.is_reprint,
+        "claim_count": job.claim_count,
+        "lease_expires_at": job.lease_expires_at,
+    }
+
+
+def acknowledge(session: Session, job_id: int, agent_id: Optional[str] = None) -> PrintJob:
+    """
+    Marca un trabajo como impreso. Idempotente. Si el trabajo ya lo tomó OTRO
+    agente (el arrendamiento de éste venció y se reasignó) se rechaza con 409.
+    """
+    job = session.get(PrintJob, job_id)
+    if not job:
+        raise PrintDispatchError("Trabajo de impresión no encontrado.", status_code=404)
+    if job.status == "PRINTED":
+        return job
+    if agent_id and job.status == "CLAIMED" and job.claimed_by and job.claimed_by != agent_id:
+        raise PrintDispatchError(
+            f"El trabajo lo tomó otro agente ({job.claimed_by}) tras vencer el arrendamiento.",
+            status_code=409,
+        )
+    job.status = "PRINTED"
+    job.printed_at = datetime.utcnow()
+    job.lease_expires_at = None
+    session.add(job)
+    session.commit()
+    session.refresh(job)
+    return job
+
+
+def release(session: Session, job_id: int, agent_id: Optional[str] = None, error: bool = False) -> PrintJob:
+    """El agente devuelve un trabajo que no pudo imprimir: a PENDING (o ERROR si error=True)."""
+    job = session.get(PrintJob, job_id)
+    if not job:
+        raise PrintDispatchError("Trabajo de impresión no encontrado.", status_code=404)
+    if job.status != "CLAIMED":
+        raise PrintDispatchError(f"El trabajo no está tomado (estado {job.status}).", status_code=409)
+    if agent_id and job.claimed_by and job.claimed_by != agent_id:
+        raise PrintDispatchError("El trabajo lo tiene otro agente.", status_code=409)
+    job.status = "ERROR" if error else "PENDING"
+    job.claimed_by = None
+    job.lease_expires_at = None
+    session.add(job)
+    session.commit()
+    session.refresh(job)
+    if not error:
+        notify_print_jobs()
+    return job
@@ -3,14 +3,36 @@ from sqlalchemy import select, text
 from app.models.inventory import PurchaseRequisition, PurchaseOrder, PurchaseOrderItem
 from app.models.material import Material 
 from app.models.foundations import Provider
-from typing import List, Dict
+from typing import Callable, Dict, List, Optional
+import threading
+import time
 import traceback
 
+# Cache en proceso del contador del menú lateral (el frontend lo consulta cada pocos segundos)
+PENDING_TASKS_CACHE_TTL_SECONDS = 5.0
+_pending_tasks_cache: Dict = {"value": None, "expires_at": 0.0}
+_pending_tasks_lock = threading.Lock()
+
+REQUISITION_EVAL_BATCH = 200  # Materiales por confirmación en la evaluación automática
+
+
+def invalidate_pending_tasks_cache() -> None:
+    """Fuerza a que la siguiente consulta del contador vaya a la BD."""
+    with _pending_tasks_lock:
+        _pending_tasks_cache["expires_at"] = 0.0
+
+
 class PurchaseManager:
     @staticmethod
-    def evaluate_and_create_automatic_requisitions(db: Session) -> int:
+    def evaluate_and_create_automatic_requisitions(
+        db: Session,
+        on_progress: Optional[Callable[[int, int], None]] = None,
+    ) -> int:
         """
         EL CEREBRO DE VALENTINA (V4.0 - MATEMÁTICA ANTI-BUCLES)
+        Confirma por bloques de materiales; on_progress(hechos, total) se llama tras cada
+        confirmación (trabajo en segundo plano: latido y punto de cancelación). Con
+        on_progress los errores suben al llamador en vez de regresar 0.
         """
         try:
             db.execute(text("UPDATE purchase_requisitions SET status = 'PENDIENTE' WHERE status = 'AUTOMATICA'"))
@@ -50,8 +72,13 @@ class PurchaseManager:
                         transit_dict[m_id] = transit_dict.get(m_id, 0.0) + float(item['quantity_ordered'] or 0.0)
 
             created_count = 0
-            
-            for mat in materials:
+            db.commit()  # Auto-cierre confirmado antes del recorrido por bloques
+
+            for done, mat in enumerate(materials, start=1):
+                if done % REQUISITION_EVAL_BATCH == 0:
+                    db.commit()
+                    if on_progress:
+                        on_progress(done, len(materials))
                 m_id = mat['id']
                 phys = float(mat['physical_stock'] or 0.0)
                 min_s = float(mat['min_stock'] or 0.0)
@@ -92,11 +119,45 @@ class PurchaseManager:
             return created_count
 
         except Exception as e:
+            if on_progress is not None:
+                db.rollback()
+                raise  # El trabajo registra el error (o la cancelación) y decide el reintento
             print(f"\n🚨 ERROR CRÍTICO EN VALENTINA: {e}")
             traceback.print_exc()
             db.rollback()
             return 0
 
+    @staticmethod
+    def get_pending_task_counts(db: Session) -> Dict:
+        """
+        Contadores del menú lateral de Compras. Sólo lectura: UNA consulta con
+        tres subconsultas escalares, servida desde cache por PENDING_TASKS_CACHE_TTL_SECONDS.
+        """
+        now = time.monotonic()
+        with _pending_tasks_lock:
+            if _pending_tasks_cache["value"] is not None and now < _pending_tasks_cache["expires_at"]:
+                return dict(_pending_tasks_cache["value"])
+
+        row = db.execute(text("""
+            SELECT
+                (SELECT COUNT(id) FROM purchase_requisitions WHERE UPPER(status) IN ('PENDIENTE', 'EN_COMPRA')) AS reqs,
+                (SELECT COUNT(id) FROM purchase_orders WHERE UPPER(status) = 'DRAFT') AS to_authorize,
+                (SELECT COUNT(id) FROM purchase_orders WHERE UPPER(status) = 'AUTORIZADA') AS to_dispatch
+        """)).mappings().first()
+
+        reqs_pendientes = int(row["reqs"] or 0)
+        orders_to_authorize = int(row["to_authorize"] or 0)
+        orders_to_dispatch = int(row["to_dispatch"] or 0)
+        value = {
+            "pending_requisitions": reqs_pendientes,
+            "orders_to_authorize": orders_to_authorize,
+            "total_alerts": reqs_pendientes + orders_to_authorize + orders_to_dispatch,
+        }
+        with _pending_tasks_lock:
+            _pending_tasks_cache["value"] = value
+            _pending_tasks_cache["expires_at"] = now + PENDING_TASKS_CACHE_TTL_SECONDS
+        return dict(value)
+
     @staticmethod
     def get_consolidated_requisitions(db: Session) -> List[Dict]:
         statement = select(PurchaseRequisition).where(
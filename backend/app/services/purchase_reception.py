@@ -0,0 +1,483 @@
+"""
+purchase_reception.py  –  Motor de Recepción de Órdenes de Compra
+
+Responsabilidades:
+  1. Bloquear las OCs a recibir (FOR UPDATE) para que dos recepciones
+     simultáneas de la misma OC no pierdan quantity_received.
+  2. Precargar TODAS las partidas con su material en UNA consulta
+     (para una o varias OCs).
+  3. Ingresar existencias con StockMutation (incrementos atómicos en un
+     UPDATE por lotes) y el Kárdex con UN INSERT multi-fila.
+  4. Conciliar anticipos con UNA consulta agrupada (facturas ANT-* + pagos PAID).
+  5. Generar la CxP (o la factura PAID si el anticipo cubrió todo) por OC.
+
+Varias OCs se reciben en la MISMA transacción: si una falla (p.ej. folio de
+factura duplicado) no se aplica ninguna. Este módulo no hace commit.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlmodel import Session, select, text
+from sqlalchemy import func
+
+from app.models.inventory import PurchaseOrder, PurchaseOrderItem
+from app.models.material import Material
+from app.models.foundations import Provider
+from app.models.finance import (
+    PurchaseInvoice, PurchaseInvoiceItem, SupplierPayment, PaymentStatus, InvoiceStatus,
+)
+from app.services.stock_mutation import StockMutation
+
+
+class ReceptionError(ValueError):
+    """Error de negocio en la recepción; trae el status HTTP que debe devolver el endpoint."""
+
+    def __init__(self, detail: str, status_code: int = 400):
+        self.detail = detail
+        self.status_code = status_code
+        super().__init__(detail)
+
+
+class ParsedReception:
+    """Cantidades y ediciones que manda el frontend para UNA OC."""
+
+    def __init__(self, data: dict):
+        self.data = data
+        # Si el frontend manda item_id, usamos esa clave para soportar múltiples
+        # renglones del mismo SKU (ej. piedra con precios diferentes).
+        # Si no, usamos SKU como antes (compatibilidad hacia atrás).
+        self.received_map: Dict[str, float] = {}        # sku -> qty
+        self.edited_by_sku: Dict[str, dict] = {}        # sku -> campos editados
+        self.edited_by_item_id: Dict[int, dict] = {}    # item_id -> campos (prioridad sobre SKU)
+        self.received_by_item_id: Dict[int, float] = {} # item_id -> qty (prioridad sobre SKU)
+        self.new_rows: List[dict] = []                  # renglones agregados en la recepción
+
+        for ri in (data.get("received_items") or []):
+            _sku = ri.get("sku", "")
+            _item_id = ri.get("item_id")
+            _rq = ri.get("received_qty")
+            if _rq is None:
+                _rq = ri.get("expected_qty") or 0
+            self.received_map[_sku] = self.received_map.get(_sku, 0) + float(_rq)
+            _edit_data = {
+                "sku": ri.get("sku"),
+                "description": ri.get("description"),
+                "unit_cost": ri.get("unit_cost"),
+            }
+            if _item_id:
+                self.edited_by_item_id[int(_item_id)] = _edit_data
+                self.received_by_item_id[int(_item_id)] = float(_rq)
+            else:
+                self.edited_by_sku[_sku] = _edit_data
+
+            if ri.get("is_new") and ri.get("material_id"):
+                self.new_rows.append(ri)
+
+    def qty_for(self, item: PurchaseOrderItem, key: str) -> float:
+        if item.id in self.received_by_item_id:
+            return self.received_by_item_id[item.id]
+        return self.received_map.get(key, 0)
+
+    def edited_for(self, item: PurchaseOrderItem, sku: Optional[str]) -> dict:
+        return self.edited_by_item_id.get(item.id) or self.edited_by_sku.get(sku or "", {})
+
+
+class PurchaseReceptionEngine:
+    # ------------------------------------------------------------
+    # Cargas en bloque
+    # ------------------------------------------------------------
+    @staticmethod
+    def lock_orders(session: Session, po_ids: List[int]) -> Dict[int, PurchaseOrder]:
+        orders = session.exec(
+            select(PurchaseOrder)
+            .where(PurchaseOrder.id.in_(po_ids))
+            .order_by(PurchaseOrder.id)
+            .with_for_update()
+        ).all()
+        return {po.id: po for po in orders}
+
+    @staticmethod
+    def seed_new_items(session: Session, parsed: Dict[int, ParsedReception]) -> None:
+        """
+        Renglones NUEVOS agregados en la recepción (is_new=True + material_id):
+        se crea su PurchaseOrderItem (quantity_ordered=0) para que el flujo normal
+        (stock, kárdex, factura) lo procese como a cualquier renglón.
+        UNA consulta para saber qué materiales ya tienen renglón en cada OC.
+        """
+        if not any(p.new_rows for p in parsed.values()):
+            return
+        existing = set(session.exec(
+            select(PurchaseOrderItem.purchase_order_id, PurchaseOrderItem.material_id)
+            .where(PurchaseOrderItem.purchase_order_id.in_(list(parsed)))
+            .where(PurchaseOrderItem.material_id != None)
+        ).all())
+        for po_id, reception in parsed.items():
+            for ri in reception.new_rows:
+                key = (po_id, ri.get("material_id"))
+                if key in existing:
+                    continue  # Evitar duplicar si ya existe un renglón de ese material
+                existing.add(key)
+                _new_cost = ri.get("unit_cost")
+                session.add(PurchaseOrderItem(
+                    purchase_order_id=po_id,
+                    material_id=ri.get("material_id"),
+                    quantity_ordered=0,
+                    quantity_received=0,
+                    expected_unit_cost=float(_new_cost) if _new_cost is not None else 0.0,
+                ))
+        session.flush()  # Asigna id y deja los nuevos items visibles a la carga siguiente
+
+    @staticmethod
+    def load_items(
+        session: Session,
+        po_ids: List[int],
+    ) -> Dict[int, List[Tuple[PurchaseOrderItem, Optional[Material]]]]:
+        """{po_id: [(partida, material|None), ...]} con UN join para todas las OCs."""
+        rows = session.exec(
+            select(PurchaseOrderItem, Material)
+            .outerjoin(Material, Material.id == PurchaseOrderItem.material_id)
+            .where(PurchaseOrderItem.purchase_order_id.in_(po_ids))
+            .order_by(PurchaseOrderItem.purchase_order_id, PurchaseOrderItem.id)
+        ).all()
+        grouped: Dict[int, List[Tuple[PurchaseOrderItem, Optional[Material]]]] = {po_id: [] for po_id in po_ids}
+        for item, mat in rows:
+            grouped[item.purchase_order_id].append((item, mat))
+        return grouped
+
+    @staticmethod
+    def load_advances(
+        session: Session,
+        folios: List[str],
+    ) -> Dict[str, List[Tuple[PurchaseInvoice, float]]]:
+        """
+        Facturas de anticipo (ANT-{folio}) con lo que Tesorería realmente pagó,
+        en UNA consulta agrupada: {folio_oc: [(factura, pagado), ...]}.
+        """
+        if not folios:
+            return {}
+        paid_status = getattr(PaymentStatus, "PAID", "PAID")
+        paid_sum = (
+            select(
+                SupplierPayment.purchase_invoice_id.label("invoice_id"),
+                func.sum(SupplierPayment.amount).label("paid"),
+            )
+            .where(SupplierPayment.status == paid_status)
+            .group_by(SupplierPayment.purchase_invoice_id)
+            .subquery()
+        )
+        rows = session.exec(
+            select(PurchaseInvoice, func.coalesce(paid_sum.c.paid, 0.0))
+            .outerjoin(paid_sum, paid_sum.c.invoice_id == PurchaseInvoice.id)
+            .where(PurchaseInvoice.invoice_number.in_([f"ANT-{f}" for f in folios]))
+        ).all()
+        advances: Dict[str, List[Tuple[PurchaseInvoice, float]]] = {}
+        for invoice, paid in rows:
+            advances.setdefault(invoice.invoice_number[len("ANT-"):], []).append((invoice, float(paid or 0.0)))
+        return advances
+
+    # ------------------------------------------------------------
+    # Existencias
+    # ------------------------------------------------------------
+    @staticmethod
+    def apply_stock_entries(session: Session, entries: List[dict]) -> Dict[int, dict]:
+        """
+        entries: [{"material_id", "quantity", "unit_cost"}] (cantidad en unidad de uso).
+        StockMutation suma por material, bloquea en orden de id y aplica los
+        incrementos atómicos en un solo UPDATE por lotes; el Kárdex conserva un
+        renglón por partida recibida, en UN INSERT multi-fila.
+        """
+        mutation = StockMutation(session)
+        for entry in entries:
+            mutation.add(
+                entry["material_id"],
+                entry["quantity"],
+                "ENTRADA_COMPRA",
+                unit_cost=entry["unit_cost"],
+                reason_code="RECEPCION_OC",
+            )
+        return mutation.apply()
+
+    # ------------------------------------------------------------
+    # Partidas de UNA OC (en memoria)
+    # ------------------------------------------------------------
+    @staticmethod
+    def process_items(
+        items: List[Tuple[PurchaseOrderItem, Optional[Material]]],
+        reception: ParsedReception,
+        stock_entries: List[dict],
+    ) -> List[dict]:
+        """
+        Acumula quantity_received, agenda las entradas de stock (sólo materiales
+        físicos) y devuelve el detalle de renglones para la CxP (Camino B).
+        """
+        invoice_detail_rows = []
+        for item, mat in items:
+            qty_this_delivery = 0.0
+
+            if item.material_id:
+                if mat:
+                    mat_sku = mat.sku or ""
+                    route = (getattr(mat, 'production_route', 'MATERIAL') or 'MATERIAL').upper()
+                    qty_this_delivery = reception.qty_for(item, mat_sku)
+
+                    # Solo ingresar stock para materiales físicos
+                    if route == 'MATERIAL' and qty_this_delivery > 0:
+                        factor = float(getattr(mat, 'conversion_factor', 1) or 1)
+                        _edited_cost = reception.edited_for(item, mat_sku).get("unit_cost")
+                        stock_entries.append({
+                            "material_id": mat.id,
+                            "quantity": qty_this_delivery * factor,
+                            "unit_cost": float(_edited_cost) if _edited_cost is not None
+                                         else float(getattr(item, 'expected_unit_cost', 0.0) or 0.0),
+                        })
+            else:
+                # Item sin material (descripción libre)
+                qty_this_delivery = reception.qty_for(item, item.custom_description or "")
+
+            # Acumular quantity_received para TODOS los items
+            item.quantity_received = float(item.quantity_received or 0) + qty_this_delivery
+
+            # Camino B: snapshot de este renglón para guardarlo si se genera CxP
+            if qty_this_delivery > 0:
+                _base_sku = mat.sku if (item.material_id and mat) else None
+                _edited = reception.edited_for(item, _base_sku)
+                if item.material_id and mat:
+                    _desc_default = mat.name
+                    _sku_default = mat.sku
+                else:
+                    _desc_default = item.custom_description
+                    _sku_default = None
+                _final_cost = _edited.get("unit_cost")
+                if _final_cost is None:
+                    _final_cost = float(getattr(item, 'expected_unit_cost', 0.0) or 0.0)
+                invoice_detail_rows.append({
+                    "purchase_order_item_id": item.id,
+                    "material_id": item.material_id,
+                    "description": _edited.get("description") or _desc_default,
+                    "sku": _edited.get("sku") or _sku_default,
+                    "quantity_received": qty_this_delivery,
+                    "unit_cost": float(_final_cost),
+                })
+        return invoice_detail_rows
+
+    @staticmethod
+    def close_items_and_resolve_status(
+        po: PurchaseOrder,
+        items: List[Tuple[PurchaseOrderItem, Optional[Material]]],
+        items_to_close: List[int],
+    ) -> None:
+        """
+        Cierre diferido de renglones marcados en la recepción (misma regla que /no-more):
+        recibido > 0 -> satisfecho; recibido 0 -> cancelado. Luego recalcula el
+        estado real de la OC con quantity_received YA actualizado.
+        """
+        to_close = {int(i) for i in items_to_close}
+        _hay_pendiente = False
+        _hay_recibido = False
+        for item, _ in items:
+            _rec = float(item.quantity_received or 0)
+            if item.id in to_close:
+                item.is_cancelled = _rec <= 0
+                item.is_fulfilled = _rec > 0
+                item.cancel_reason = "Cerrado durante recepción"
+
+            if item.is_cancelled or item.is_fulfilled:
+                if _rec > 0:
+                    _hay_recibido = True
+                continue
+            _ord = float(item.quantity_ordered or 0)
+            if _rec > 0:
+                _hay_recibido = True
+            if _ord > 0 and _rec < _ord:
+                _hay_pendiente = True
+
+        if not _hay_pendiente:
+            po.status = "RECIBIDA_TOTAL" if _hay_recibido else "CANCELADA"
+        else:
+            po.status = "RECIBIDA_PARCIAL"
+
+    # ------------------------------------------------------------
+    # Finanzas de UNA OC
+    # ------------------------------------------------------------
+    @staticmethod
+    def settle_finances(
+        session: Session,
+        po: PurchaseOrder,
+        data: dict,
+        invoice_detail_rows: List[dict],
+        advances: List[Tuple[PurchaseInvoice, float]],
+        providers: Dict[int, Provider],
+    ) -> Optional[int]:
+        """Anticipo vs saldo: genera la CxP (retorna su id) o la factura PAID."""
+        # MATEMÁTICAS DE ANTICIPO VS SALDO
+        total_pagado_anticipos = 0.0
+        for ant, pagado in advances:
+            # Sumamos solo lo que Tesorería realmente pagó y aprobó
+            total_pagado_anticipos += pagado
+            # Matamos el documento proforma en Finanzas
+            ant.status = getattr(InvoiceStatus, "PAID", "PAID")
+            ant.outstanding_balance = 0
+            session.add(ant)
+
+        # La Resta: Total Real - Lo que ya pagó Finanzas
+        tax_rate = float(data.get("tax_rate", 0.16) or 0.16)
+        # Subtotal calculado del detalle real (suma de qty*unit_cost editado)
+        _subtotal_detalle = sum(r["quantity_received"] * r["unit_cost"] for r in invoice_detail_rows)
+        if _subtotal_detalle > 0:
+            total_recibido_con_iva = round(_subtotal_detalle * (1 + tax_rate), 2)
+        else:
+            # Respaldo: usar el invoice_total tecleado (comportamiento viejo)
+            total_recibido_con_iva = float(data.get("invoice_total", 0))
+        saldo_restante = total_recibido_con_iva - total_pagado_anticipos
+        invoice_folio = data.get("invoice_folio")
+
+        # Si hay saldo vivo, se genera la deuda en CxP
+        if saldo_restante > 0.01:
+            if invoice_folio:
+                existing_ap = session.exec(text("""
+                    SELECT id FROM accounts_payable
+                    WHERE provider_id = :prov AND invoice_folio = :folio AND status != 'CANCELADO'
+                """).bindparams(prov=po.provider_id, folio=invoice_folio)).first()
+                existing_inv = existing_ap or session.exec(select(PurchaseInvoice).where(
+                    PurchaseInvoice.invoice_number == invoice_folio,
+                    PurchaseInvoice.provider_id == po.provider_id
+                )).first()
+                if existing_inv:
+                    raise ReceptionError(f"La factura {invoice_folio} ya está registrada para este proveedor.")
+
+            prov = providers.get(po.provider_id)
+            credit_days = getattr(prov, 'credit_days', 0) or 0
+            due_date = datetime.now() + timedelta(days=credit_days)
+
+            _subtotal = round(saldo_restante / (1 + tax_rate), 2) if (1 + tax_rate) != 0 else saldo_restante
+            _tax_amount = round(saldo_restante - _subtotal, 2)
+
+            result_ap = session.exec(text("""
+                INSERT INTO accounts_payable (
+                    provider_id, purchase_order_id, invoice_folio,
+                    total_amount, subtotal, tax_rate, tax_amount,
+                    due_date, status, created_at, overhead_category
+                ) VALUES (
+                    :prov_id, :po_id, :folio, :total, :subtotal, :tax_rate, :tax_amount,
+                    :due, 'PENDIENTE', :now, :category
+                )
+                RETURNING id
+            """).bindparams(
+                prov_id=po.provider_id,
+                po_id=po.id,
+                folio=invoice_folio,
+                total=saldo_restante,
+                subtotal=_subtotal,
+                tax_rate=tax_rate,
+                tax_amount=_tax_amount,
+                due=due_date,
+                now=datetime.now(),
+                category=getattr(po, 'overhead_category', None)
+            ))
+            new_ap_id = result_ap.scalar() if hasattr(result_ap, "scalar") else result_ap.first()[0]
+
+            # Camino B: detalle de materiales que ampara esta CxP/entrega (UN INSERT)
+            if invoice_detail_rows:
+                now = datetime.now()
+                session.execute(PurchaseInvoiceItem.__table__.insert(), [
+                    {**row, "accounts_payable_id": new_ap_id, "created_at": now}
+                    for row in invoice_detail_rows
+                ])
+            return new_ap_id
+
+        # Anticipo cubrió el 100% — crear la factura directamente como PAID
+        # sin pasar por accounts_payable ni _sync_pos_to_invoices
+        invoice_total = total_recibido_con_iva if total_recibido_con_iva > 0 else float(data.get("invoice_total", 0))
+        if invoice_folio and invoice_total > 0:
+            # Candado anti-duplicados
+            existing = session.exec(select(PurchaseInvoice).where(
+                PurchaseInvoice.invoice_number == invoice_folio,
+                PurchaseInvoice.provider_id == po.provider_id
+            )).first()
+            if existing:
+                raise ReceptionError(f"La factura {invoice_folio} ya está registrada para este proveedor.")
+            _subtotal = round(invoice_total / (1 + tax_rate), 2)
+            session.add(PurchaseInvoice(
+                provider_id=po.provider_id,
+                invoice_number=invoice_folio,
+                issue_date=datetime.now().date(),
+                due_date=datetime.now().date(),
+                total_amount=invoice_total,
+                outstanding_balance=0.0,
+                status=getattr(InvoiceStatus, "PAID", "PAID"),
+                subtotal=_subtotal,
+                tax_rate=tax_rate,
+                tax_amount=round(invoice_total - _subtotal, 2),
+            ))
+        return None
+
+    # ------------------------------------------------------------
+    # Orquestación
+    # ------------------------------------------------------------
+    @staticmethod
+    def receive_many(session: Session, receptions: List[Tuple[int, dict]]) -> List[dict]:
+        """
+        Recibe una o varias OCs en la transacción actual (todo o nada).
+        receptions: [(po_id, data)] con el mismo `data` que PUT /orders/{po_id}/receive.
+
+        Consultas fijas por lote: OCs (con bloqueo) + renglones existentes (si hay
+        nuevos) + partidas con material + anticipos + proveedores; luego StockMutation
+        (bloqueo + UPDATE por lotes + INSERT de Kárdex) y, por OC, su CxP.
+        """
+        po_ids = []
+        parsed: Dict[int, ParsedReception] = {}
+        for po_id, data in receptions:
+            if po_id in parsed:
+                raise ReceptionError(f"La OC {po_id} viene repetida en la recepción.")
+            po_ids.append(po_id)
+            parsed[po_id] = ParsedReception(data or {})
+
+        orders = PurchaseReceptionEngine.lock_orders(session, po_ids)
+        missing = [po_id for po_id in po_ids if po_id not in orders]
+        if missing:
+            raise ReceptionError("Orden no encontrada", status_code=404)
+
+        PurchaseReceptionEngine.seed_new_items(session, parsed)
+        items_by_po = PurchaseReceptionEngine.load_items(session, po_ids)
+        advances = PurchaseReceptionEngine.load_advances(session, [orders[p].folio for p in po_ids])
+        provider_ids = {orders[p].provider_id for p in po_ids}
+        providers = {
+            prov.id: prov
+            for prov in session.exec(select(Provider).where(Provider.id.in_(provider_ids))).all()
+        }
+
+        stock_entries: List[dict] = []
+        results = []
+        for po_id in po_ids:
+            po = orders[po_id]
+            reception = parsed[po_id]
+            data = reception.data
+
+            setattr(po, 'invoice_folio_reported', data.get("invoice_folio"))
+            setattr(po, 'invoice_total_reported', data.get("invoice_total"))
+            po.is_advance = False
+
+            detail_rows = PurchaseReceptionEngine.process_items(
+                items_by_po[po_id], reception, stock_entries
+            )
+            ap_id = PurchaseReceptionEngine.settle_finances(
+                session, po, data, detail_rows, advances.get(po.folio, []), providers
+            )
+            PurchaseReceptionEngine.close_items_and_resolve_status(
+                po, items_by_po[po_id], data.get("items_to_close") or []
+            )
+            session.add(po)
+            results.append({
+                "po_id": po.id,
+                "folio": po.folio,
+                "status": po.status,
+                "received_lines": len(detail_rows),
+                "accounts_payable_id": ap_id,
+            })
+
+        PurchaseReceptionEngine.apply_stock_entries(session, stock_entries)
+        return results
+
+    @staticmethod
+    def receive(session: Session, po_id: int, data: dict) -> dict:
+        return PurchaseReceptionEngine.receive_many(session, [(po_id, data)])[0]
@@ -0,0 +1,234 @@
+"""
+qr_resolver.py  –  ¿Qué es este QR? (escáner del iPad)
+
+El QR de un bulto trae "{qr_code}-{bundle_number}" (label_printer.generate_zpl_label),
+donde qr_code es el de la instancia (índice único). preview-scan y scan-qr piden el
+id de la asignación por adelantado; aquí se parte del contenido crudo del QR y se
+regresa todo lo que el iPad necesita para decidir: instancia, OV y cliente, bultos,
+asignación vigente y las acciones que el usuario puede hacer.
+
+resolve_scans() atiende muchos escaneos juntos (la tableta que vuelve a tener red)
+con un número fijo de consultas, sin importar cuántos sean:
+instancias por qr_code, contexto comercial, etiquetas impresas, asignaciones
+abiertas y nombres del equipo.
+"""
+import re
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlmodel import Session, select
+from sqlalchemy import func
+
+from app.models.production import InstallationAssignment, InstallationAssignmentStatus, PrintJob
+from app.models.sales import InstanceStatus, SalesOrderItemInstance
+from app.models.users import User, UserRole
+from app.services.instance_context import resolve_instance_contexts
+
+MAX_BATCH = 500
+_CHUNK_SIZE = 500
+_BUNDLE_SUFFIX = re.compile(r"^(.+)-(\d{1,4})$")
+
+# Mismos permisos que los endpoints de logistics.py
+PREVIEW_ROLES = {UserRole.LOGISTICS, UserRole.DIRECTOR, UserRole.MANAGER, UserRole.PRODUCTION}
+LOAD_ROLES = {UserRole.LOGISTICS, UserRole.DIRECTOR, UserRole.MANAGER}
+AUTHORIZE_ROLES = {UserRole.PRODUCTION, UserRole.DIRECTOR, UserRole.MANAGER}
+EVIDENCE_ROLES = {UserRole.LOGISTICS, UserRole.DIRECTOR, UserRole.MANAGER}
+
+
+def parse_qr_payload(raw: str) -> List[Tuple[str, Optional[int]]]:
+    """
+    Candidatos (qr_code, bundle_number) de un QR crudo, en orden de preferencia.
+    "abc-...-3" puede ser el bulto 3 de "abc-..." o un qr_code que termina en
+    "-3" (los de traceability): se prueban los dos y gana el que exista.
+    """
+    payload = (raw or "").strip()
+    if not payload:
+        return []
+    candidates: List[Tuple[str, Optional[int]]] = []
+    bundle = _BUNDLE_SUFFIX.match(payload)
+    if bundle:
+        candidates.append((bundle.group(1), int(bundle.group(2))))
+    candidates.append((payload, None))
+    return candidates
+
+
+def _bundle_type(instance: SalesOrderItemInstance, bundle_number: Optional[int]) -> Optional[str]:
+    """Los bultos se numeran seguidos: primero los MDF, luego los de herrajes."""
+    if not bundle_number:
+        return None
+    mdf = instance.mdf_bundles or 0
+    hardware = instance.hardware_bundles or 0
+    if 1 <= bundle_number <= mdf:
+        return "MDF"
+    if mdf < bundle_number <= mdf + hardware:
+        return "HERRAJES"
+    return None
+
+
+def _pick_active(assignments: List[InstallationAssignment]) -> Optional[InstallationAssignment]:
+    """La que está en curso; si no, la próxima programada; si no, la instalada esperando firma."""
+    for status in (
+        InstallationAssignmentStatus.IN_PROGRESS,
+        InstallationAssignmentStatus.SCHEDULED,
+        InstallationAssignmentStatus.INSTALLED,
+    ):
+        matching = [a for a in assignments if a.status == status]
+        if matching:
+            return min(matching, key=lambda a: (a.assignment_date, a.id))
+    return None
+
+
+def _allowed_actions(
+    user: User,
+    instance: SalesOrderItemInstance,
+    active: Optional[InstallationAssignment],
+    open_assignments: List[InstallationAssignment],
+) -> Tuple[List[str], Optional[str]]:
+    """(acciones permitidas, bloqueo) con las mismas reglas que los endpoints de logística."""
+    actions: List[str] = []
+    if user.role in EVIDENCE_ROLES:
+        actions.append("upload_evidence")
+    if active is None:
+        return actions, "La instancia no tiene una instalación asignada."
+
+    block = None
+    if active.status != InstallationAssignmentStatus.SCHEDULED:
+        block = f"Esta asignación ya fue procesada (status: {active.status})."
+    elif instance.production_status != InstanceStatus.READY:
+        block = (
+            "La instancia debe estar READY para cargarse. "
+            f"Status actual: {instance.production_status}."
+        )
+
+    if user.role in PREVIEW_ROLES:
+        actions.append("preview_scan")
+    if block is None and user.role in LOAD_ROLES and user.id == active.leader_user_id:
+        actions.append("confirm_load")
+    if active.status == InstallationAssignmentStatus.SCHEDULED and user.role in AUTHORIZE_ROLES:
+        actions.append("reassign_team")
+    if active.status in (InstallationAssignmentStatus.SCHEDULED, InstallationAssignmentStatus.IN_PROGRESS):
+        actions.append("mark_installed")
+    if all(a.status == InstallationAssignmentStatus.INSTALLED for a in open_assignments):
+        actions.append("sign")
+    return actions, block
+
+
+def _member(users: Dict[int, User], user_id: Optional[int]) -> Optional[dict]:
+    if not user_id:
+        return None
+    user = users.get(user_id)
+    return {"id": user_id, "name": user.full_name if user else None}
+
+
+def resolve_scans(session: Session, payloads: Iterable[str], user: User) -> List[dict]:
+    """Un resultado por QR, en el mismo orden. Los que no existen regresan found=False."""
+    payloads = list(payloads)
+    parsed = [parse_qr_payload(raw) for raw in payloads]
+    codes = sorted({code for candidates in parsed for code, _ in candidates})
+
+    instances: Dict[str, SalesOrderItemInstance] = {}
+    for start in range(0, len(codes), _CHUNK_SIZE):
+        for instance in session.exec(
+            select(SalesOrderItemInstance)
+            .where(SalesOrderItemInstance.qr_code.in_(codes[start:start + _CHUNK_SIZE]))
+        ).all():
+            instances[instance.qr_code] = instance
+
+    matches: List[Optional[Tuple[SalesOrderItemInstance, Optional[int]]]] = []
+    for candidates in parsed:
+        match = next(((instances[code], bundle) for code, bundle in candidates if code in instances), None)
+        matches.append(match)
+
+    instance_ids = sorted({instance.id for instance, _ in filter(None, matches)})
+    contexts = resolve_instance_contexts(session, instance_ids)
+    printed: Dict[int, int] = {}
+    assignments: Dict[int, List[InstallationAssignment]] = defaultdict(list)
+    for start in range(0, len(instance_ids), _CHUNK_SIZE):
+        chunk = instance_ids[start:start + _CHUNK_SIZE]
+        # DISTINCT bundle_number para no contar reimpresiones
+        printed.update(session.exec(
+            select(PrintJob.instance_id, func.count(func.distinct(PrintJob.bundle_number)))
+            .where(PrintJob.instance_id.in_(chunk))
+            .group_by(PrintJob.instance_id)
+        ).all())
+        for assignment in session.exec(
+            select(InstallationAssignment)
+            .where(InstallationAssignment.instance_id.in_(chunk))
+            .where(InstallationAssignment.status != InstallationAssignmentStatus.COMPLETED)
+        ).all():
+            assignments[assignment.instance_id].append(assignment)
+
+    member_ids = {
+        user_id
+        for open_assignments in assignments.values()
+        for a in open_assignments
+        for user_id in (a.leader_user_id, a.helper_1_user_id, a.helper_2_user_id)
+        if user_id
+    }
+    users: Dict[int, User] = {}
+    if member_ids:
+        users = {u.id: u for u in session.exec(select(User).where(User.id.in_(member_ids))).all()}
+
+    results = []
+    for raw, match in zip(payloads, matches):
+        if match is None:
+            results.append({"payload": raw, "found": False})
+            continue
+        instance, bundle_number = match
+        ctx = contexts.get(instance.id)
+        open_assignments = assignments.get(instance.id, [])
+        active = _pick_active(open_assignments)
+        actions, block = _allowed_actions(user, instance, active, open_assignments)
+        mdf = instance.mdf_bundles or 0
+        hardware = instance.hardware_bundles or 0
+        bundle_type = _bundle_type(instance, bundle_number)
+
+        results.append({
+            "payload": raw,
+            "found": True,
+            "qr_code": instance.qr_code,
+            "bundle_number": bundle_number,
+            "bundle_type": bundle_type,
+            # Un número de bulto que no está en los declarados: etiqueta vieja o de otra casa
+            "bundle_valid": bundle_number is None or bundle_type is not None,
+            "instance": {
+                "id": instance.id,
+                "name": instance.custom_name,
+                "street": instance.street,
+                "lot": instance.lot,
+                "production_status": instance.production_status,
+                "current_location": instance.current_location,
+                "is_cancelled": instance.is_cancelled,
+            },
+            "order": {
+                "id": ctx.order.id if ctx and ctx.order else None,
+                "folio": ctx.order_folio if ctx else None,
+                "project_name": ctx.project_name if ctx else None,
+                "client_name": ctx.client_name if ctx else None,
+                "product_name": ctx.product_name if ctx else None,
+            },
+            "bundles": {
+                "mdf": mdf,
+                "herrajes": hardware,
+                "total": mdf + hardware,
+                "labels_printed": printed.get(instance.id, 0),
+            },
+            "active_assignment": active and {
+                "id": active.id,
+                "lane": active.lane,
+                "assignment_date": active.assignment_date,
+                "status": active.status,
+                "leader": _member(users, active.leader_user_id),
+                "helpers": [
+                    m for m in (
+                        _member(users, active.helper_1_user_id),
+                        _member(users, active.helper_2_user_id),
+                    ) if m
+                ],
+                "is_current_user_leader": user.id == active.leader_user_id,
+            },
+            "open_assignments": len(open_assignments),
+            "allowed_actions": actions,
+            "bloqueo": block,
+        })
+    return results
@@ -0,0 +1,168 @@
+"""
+recipe_index.py  –  Índice de recetas por categoría
+
+Herrajes de instalación, material clave de los lotes, simulación y asignación
+filtraban la receta (VersionComponent) por categoría de material: cargando
+Material uno por uno y normalizando la categoría (ELECTRODOMÉSTICO con o sin
+tilde) en cada request. Aquí cada ProductVersion se lee UNA vez con un join y
+queda en memoria ya repartida por categoría normalizada:
+
+    {version_id: {"TABLERO": (RecipeLine, ...), "HERRAJES": (...), ...}}
+
+  - get_recipes / get_recipe: lectura a través del índice; las versiones que
+    faltan se cargan juntas con la sesión del llamador.
+  - lines_in / material_quantities: filtros por categoría sobre el índice.
+  - invalidate_recipe_index(version_ids) al guardar o borrar versiones;
+    invalidate_material(material_id) al editar un material; sin argumentos
+    vacía todo (importación CSV). Con varios procesos, los demás se enteran al
+    vencer RECIPE_INDEX_TTL_SECONDS.
+"""
+import threading
+import time
+import unicodedata
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlmodel import Session, select
+
+from app.core.config import settings
+from app.models.design import VersionComponent
+from app.models.material import Material
+
+_CHUNK_SIZE = 500
+
+
+@dataclass(frozen=True)
+class RecipeLine:
+    material_id: int
+    sku: str
+    name: str
+    category: str  # Tal como está capturada en el material
+    usage_unit: str
+    quantity: float
+
+
+Recipe = Dict[str, Tuple[RecipeLine, ...]]
+
+# generation cambia en cada invalidación: una carga que empezó antes de
+# invalidar no puede dejar en el índice la receta vieja.
+_recipes: Dict[int, Recipe] = {}
+_state = {"expires_at": 0.0, "generation": 0}
+_lock = threading.Lock()
+
+
+def normalize_category(category: Optional[str]) -> str:
+    """' Electrodoméstico' -> 'ELECTRODOMESTICO'."""
+    text = unicodedata.normalize("NFKD", (category or "").strip().upper())
+    return "".join(ch for ch in text if not unicodedata.combining(ch))
+
+
+def normalize_categories(categories: Iterable[str]) -> frozenset:
+    return frozenset(normalize_category(c) for c in categories)
+
+
+def _load(session: Session, version_ids: List[int]) -> Dict[int, Recipe]:
+    buckets: Dict[int, Dict[str, List[RecipeLine]]] = {version_id: {} for version_id in version_ids}
+    rows = session.exec(
+        select(
+            VersionComponent.version_id, VersionComponent.quantity,
+            Material.id, Material.sku, Material.name, Material.category, Material.usage_unit,
+        )
+        .join(Material, Material.id == VersionComponent.material_id)
+        .where(VersionComponent.version_id.in_(version_ids))
+        .order_by(VersionComponent.version_id, VersionComponent.id)
+    ).all()
+    for version_id, quantity, material_id, sku, name, category, usage_unit in rows:
+        buckets[version_id].setdefault(normalize_category(category), []).append(RecipeLine(
+            material_id=material_id,
+            sku=sku,
+            name=name,
+            category=category or "",
+            usage_unit=usage_unit or "",
+            quantity=float(quantity or 0.0),
+        ))
+    return {
+        version_id: {category: tuple(lines) for category, lines in recipe.items()}
+        for version_id, recipe in buckets.items()
+    }
+
+
+def get_recipes(session: Session, version_ids: Iterable[Optional[int]]) -> Dict[int, Recipe]:
+    """{version_id: receta por categoría}. Una versión sin componentes trae {}."""
+    wanted = {version_id for version_id in version_ids if version_id is not None}
+    with _lock:
+        if _state["expires_at"] < time.monotonic():
+            _recipes.clear()
+            _state["generation"] += 1
+            _state["expires_at"] = time.monotonic() + settings.RECIPE_INDEX_TTL_SECONDS
+        found = {version_id: _recipes[version_id] for version_id in wanted if version_id in _recipes}
+        generation = _state["generation"]
+
+    missing = sorted(wanted - found.keys())
+    for start in range(0, len(missing), _CHUNK_SIZE):
+        loaded = _load(session, missing[start:start + _CHUNK_SIZE])
+        found.update(loaded)
+        with _lock:
+            if _state["generation"] == generation:
+                _recipes.update(loaded)
+    return found
+
+
+def get_recipe(session: Session, version_id: Optional[int]) -> Recipe:
+    if version_id is None:
+        return {}
+    return get_recipes(session, [version_id]).get(version_id, {})
+
+
+def lines_in(recipe: Recipe, categories: Iterable[str]) -> List[RecipeLine]:
+    """Renglones de la receta cuya categoría (normalizada) está en `categories`."""
+    categories = categories if isinstance(categories, frozenset) else normalize_categories(categories)
+    return [line for category, lines in recipe.items() if category in categories for line in lines]
+
+
+def material_quantities(
+    session: Session,
+    version_ids: Iterable[Optional[int]],
+    include: Optional[Iterable[str]] = None,
+    exclude: Iterable[str] = (),
+) -> Dict[int, Dict[int, float]]:
+    """
+    {version_id: {material_id: cantidad}} sumando los componentes repetidos de
+    una receta. Sólo aparecen las versiones con al menos un material que pase el filtro.
+    """
+    include = normalize_categories(include) if include is not None else None
+    exclude = normalize_categories(exclude)
+    result: Dict[int, Dict[int, float]] = {}
+    for version_id, recipe in get_recipes(session, version_ids).items():
+        totals: Dict[int, float] = {}
+        for category, lines in recipe.items():
+            if category in exclude or (include is not None and category not in include):
+                continue
+            for line in lines:
+                totals[line.material_id] = totals.get(line.material_id, 0.0) + line.quantity
+        if totals:
+            result[version_id] = totals
+    return result
+
+
+def invalidate_recipe_index(version_ids: Optional[Iterable[int]] = None) -> None:
+    """Saca del índice esas versiones (o todas, sin argumento)."""
+    with _lock:
+        if version_ids is None:
+            _recipes.clear()
+        else:
+            for version_id in version_ids:
+                _recipes.pop(version_id, None)
+        _state["generation"] += 1
+
+
+def invalidate_material(material_id: int) -> None:
+    """Saca las versiones que usan el material (cambió su nombre, unidad o categoría)."""
+    with _lock:
+        stale = [
+            version_id for version_id, recipe in _recipes.items()
+            if any(line.material_id == material_id for lines in recipe.values() for line in lines)
+        ]
+        for version_id in stale:
+            del _recipes[version_id]
+        _state["generation"] += 1
@@ -0,0 +1,246 @@
+"""
+scheduler.py  –  Tareas periódicas del backend (sin broker)
+
+Un hilo daemon por tarea que corre:
+  - Periódicamente (respaldo), cada `interval_seconds`.
+  - Con debounce cuando algo la dispara (ej. un movimiento de stock): cada
+    disparo recorre la corrida a `debounce_seconds` en el futuro, sin pasar
+    de `max_delay_seconds` desde el primer disparo pendiente. Así una
+    recepción de 40 partidas provoca UNA corrida, no 40.
+
+Cada corrida abre su propia sesión y deja constancia en scheduled_job_runs
+(última hora, resultado y error). Los endpoints sólo leen: ya no evalúan.
+"""
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from sqlalchemy import event
+from sqlmodel import Session
+
+from app.core.config import settings
+from app.core.database import engine
+from app.models.jobs import ScheduledJobRun
+
+
+class PeriodicJob:
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[Session], Optional[int]],
+        interval_seconds: int,
+        debounce_seconds: int,
+        max_delay_seconds: int,
+        on_finished: Optional[Callable[[], None]] = None,
+    ):
+        self.name = name
+        self.func = func
+        self.interval_seconds = interval_seconds
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.on_finished = on_finished
+
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()  # Una corrida a la vez por proceso
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self._next_periodic = time.monotonic()
+        self._pending_first: Optional[float] = None  # Primer disparo sin atender
+        self._pending_deadline: Optional[float] = None
+        self._pending_reason: Optional[str] = None
+
+    # ------------------------------------------------------------
+    # Disparo con debounce
+    # ------------------------------------------------------------
+    def trigger(self, reason: str = "STOCK_CHANGE") -> None:
+        """Pide una corrida pronto. Barato: no toca la BD; se puede llamar en cada movimiento."""
+        now = time.monotonic()
+        with self._lock:
+            if self._pending_first is None:
+                self._pending_first = now
+            self._pending_deadline = min(
+                now + self.debounce_seconds,
+                self._pending_first + self.max_delay_seconds,
+            )
+            self._pending_reason = reason
+        self._wake.set()
+
+    def pending_run_at(self) -> Optional[datetime]:
+        with self._lock:
+            deadline = self._pending_deadline
+        if deadline is None:
+            return None
+        return datetime.utcnow() + timedelta(seconds=max(0.0, deadline - time.monotonic()))
+
+    # ------------------------------------------------------------
+    # Ciclo del hilo
+    # ------------------------------------------------------------
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name=f"job-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def _loop(self) -> None:
+        trigger = "STARTUP"
+        while not self._stop.is_set():
+            now = time.monotonic()
+            with self._lock:
+                due_pending = self._pending_deadline is not None and now >= self._pending_deadline
+                if due_pending:
+                    trigger = self._pending_reason or "STOCK_CHANGE"
+                    self._pending_first = self._pending_deadline = self._pending_reason = None
+                wake_at = self._next_periodic
+                if self._pending_deadline is not None:
+                    wake_at = min(wake_at, self._pending_deadline)
+
+            if due_pending or now >= self._next_periodic:
+                skip_if_recent = not due_pending and trigger == "PERIODIC"
+                self.run_now(trigger, skip_if_recent=skip_if_recent)
+                self._next_periodic = time.monotonic() + self.interval_seconds
+                trigger = "PERIODIC"
+                continue
+
+            self._wake.wait(timeout=max(0.0, wake_at - now))
+            self._wake.clear()
+
+    # ------------------------------------------------------------
+    # Corrida
+    # ------------------------------------------------------------
+    def run_now(self, trigger: str = "MANUAL", skip_if_recent: bool = False) -> Optional[int]:
+        """
+        Ejecuta la tarea en este hilo y registra la corrida.
+        skip_if_recent: con varios workers de uvicorn cada proceso tiene su hilo;
+        la corrida periódica se omite si otro proceso ya corrió hace menos de medio intervalo.
+        """
+        with self._run_lock:
+            started = datetime.utcnow()
+            with Session(engine) as session:
+                run = session.get(ScheduledJobRun, self.name) or ScheduledJobRun(job_name=self.name)
+                if (
+                    skip_if_recent
+                    and run.last_started_at
+                    and started - run.last_started_at < timedelta(seconds=self.interval_seconds / 2)
+                ):
+                    return None
+                run.last_started_at = started
+                run.last_trigger = trigger
+                session.add(run)
+                session.commit()
+
+            result, error = None, None
+            try:
+                with Session(engine) as session:
+                    result = self.func(session)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                traceback.print_exc()
+
+            with Session(engine) as session:
+                run = session.get(ScheduledJobRun, self.name) or ScheduledJobRun(job_name=self.name)
+                run.last_finished_at = datetime.utcnow()
+                run.last_status = "ERROR" if error else "OK"
+                run.last_result = result if isinstance(result, int) else None
+                run.last_error = error
+                run.run_count = (run.run_count or 0) + 1
+                session.add(run)
+                session.commit()
+
+            if self.on_finished:
+                self.on_finished()
+            return result
+
+    def status(self, session: Session) -> dict:
+        run = session.get(ScheduledJobRun, self.name)
+        return {
+            "job_name": self.name,
+            "last_started_at": run.last_started_at if run else None,
+            "last_finished_at": run.last_finished_at if run else None,
+            "last_status": run.last_status if run else None,
+            "last_result": run.last_result if run else None,
+            "last_error": run.last_error if run else None,
+            "last_trigger": run.last_trigger if run else None,
+            "run_count": run.run_count if run else 0,
+            "pending_run_at": self.pending_run_at(),
+            "is_running": bool(self._thread and self._thread.is_alive()),
+        }
+
+
+# ============================================================
+# TAREAS REGISTRADAS
+# ============================================================
+
+def _evaluate_requisitions(session: Session) -> int:
+    # Import diferido: purchase_manager no debe cargarse al importar este módulo
+    from app.services.purchase_manager import PurchaseManager
+    return PurchaseManager.evaluate_and_create_automatic_requisitions(session)
+
+
+def _invalidate_purchase_badge() -> None:
+    from app.services.purchase_manager import invalidate_pending_tasks_cache
+    invalidate_pending_tasks_cache()
+
+
+requisition_job = PeriodicJob(
+    name="purchase_requisitions",
+    func=_evaluate_requisitions,
+    interval_seconds=settings.REQUISITION_EVAL_INTERVAL_SECONDS,
+    debounce_seconds=settings.REQUISITION_EVAL_DEBOUNCE_SECONDS,
+    max_delay_seconds=settings.REQUISITION_EVAL_MAX_DELAY_SECONDS,
+    on_finished=_invalidate_purchase_badge,
+)
+
+SCHEDULED_JOBS = [requisition_job]
+
+
+_STOCK_CHANGED_KEY = "stock_changed_pending"
+_STOCK_HOOKED_KEY = "stock_changed_hooked"
+
+
+def _notify_after_commit(session) -> None:
+    if session.info.pop(_STOCK_CHANGED_KEY, False):
+        requisition_job.trigger("STOCK_CHANGE")
+
+
+def _forget_after_rollback(session) -> None:
+    session.info.pop(_STOCK_CHANGED_KEY, None)
+
+
+def notify_stock_changed(session: Optional[Session] = None) -> None:
+    """
+    Hook para cualquier movimiento de existencias: agenda la evaluación de requisiciones.
+    Con `session` el aviso sale hasta que esa transacción confirma (y no sale si se
+    revierte): la evaluación nunca lee movimientos sin confirmar.
+    """
+    if session is None:
+        requisition_job.trigger("STOCK_CHANGE")
+        return
+    session.info[_STOCK_CHANGED_KEY] = True
+    if not session.info.get(_STOCK_HOOKED_KEY):
+        session.info[_STOCK_HOOKED_KEY] = True
+        event.listen(session, "after_commit", _notify_after_commit)
+        event.listen(session, "after_rollback", _forget_after_rollback)
+
+
+def start_scheduler() -> None:
+    if not settings.SCHEDULER_ENABLED:
+        return
+    for job in SCHEDULED_JOBS:
+        job.start()
+
+
+def stop_scheduler() -> None:
+    for job in SCHEDULED_JOBS:
+        job.stop()
@@ -0,0 +1,337 @@
+"""
+search_index.py  –  Búsqueda unificada: OV, casas (instancias), QR, OC y materiales
+
+Un solo punto de entrada, search(session, q), que regresa resultados de todos
+los tipos ordenados por relevancia y tolera errores de dedo:
+
+  - Postgres: índices GIN de trigramas (pg_trgm, migración x0r1s2t3u4v5) sobre
+    los campos que se buscan. Cada tipo es una rama de UN UNION ALL que filtra
+    con `q <% campo` (word_similarity) o `campo ILIKE %q%`; ambos operadores
+    usan el índice, así que no se recorre ninguna tabla completa.
+  - SQLite (desarrollo local): una tabla virtual FTS5 con tokenizer trigram
+    (search_fts) que se reconstruye desde las tablas cada
+    SEARCH_SQLITE_REFRESH_SECONDS. Los candidatos salen de los trigramas de la
+    búsqueda y se califican en Python con difflib.
+
+Coincidencias exactas (folio de OV "OV-0012", QR de instancia o de bulto
+"{qr}-{bulto}") van primero con calificación 1.0. Al final, una consulta por
+tipo arma título y subtítulo de los resultados.
+"""
+import re
+import threading
+import time
+from difflib import SequenceMatcher
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlmodel import Session, select
+from sqlalchemy import case, func, literal, or_, text, union_all
+
+from app.core.config import settings
+from app.models.foundations import Client, Provider
+from app.models.inventory import PurchaseOrder
+from app.models.material import Material
+from app.models.sales import SalesOrder, SalesOrderItem, SalesOrderItemInstance
+
+SEARCH_TYPES = ("order", "instance", "purchase_order", "material")
+MAX_RESULTS = 50
+SUBSTRING_BONUS = 0.25  # Contener la búsqueda tal cual pesa más que parecerse
+_ORDER_FOLIO = re.compile(r"^(?:OV[-\s]?)?0*(\d{1,9})$", re.IGNORECASE)
+_BUNDLE_QR = re.compile(r"^(.+)-(\d{1,4})$")
+
+# Hit interno: (tipo, id) -> (calificación, extra)
+Hits = Dict[Tuple[str, int], Tuple[float, dict]]
+
+
+def _keep_best(hits: Hits, kind: str, entity_id: int, score: float, extra: Optional[dict] = None) -> None:
+    key = (kind, entity_id)
+    if key not in hits or hits[key][0] < score:
+        hits[key] = (float(score), extra or {})
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+# ------------------------------------------------------------
+# Coincidencias exactas (mismo código en ambos motores)
+# ------------------------------------------------------------
+def _exact_hits(session: Session, q: str, types: Iterable[str], hits: Hits) -> None:
+    types = set(types)
+    folio = _ORDER_FOLIO.match(q)
+    if folio and "order" in types:
+        order_id = int(folio.group(1))
+        if session.get(SalesOrder, order_id):
+            _keep_best(hits, "order", order_id, 1.0 + SUBSTRING_BONUS)
+
+    if "instance" in types:
+        # QR de la instancia tal cual, o el de un bulto: "{qr}-{número de bulto}"
+        candidates = {q: None}
+        bundle = _BUNDLE_QR.match(q)
+        if bundle:
+            candidates[bundle.group(1)] = int(bundle.group(2))
+        rows = session.exec(
+            select(SalesOrderItemInstance.id, SalesOrderItemInstance.qr_code)
+            .where(SalesOrderItemInstance.qr_code.in_(list(candidates)))
+        ).all()
+        for instance_id, qr_code in rows:
+            bundle_number = candidates[qr_code]
+            extra = {"bundle_number": bundle_number} if bundle_number else {}
+            _keep_best(hits, "instance", instance_id, 1.0 + SUBSTRING_BONUS, extra)
+
+
+# ------------------------------------------------------------
+# Postgres: pg_trgm
+# ------------------------------------------------------------
+def _trgm_branch(kind: str, id_column, columns: list, q: str, like: str, source, *where):
+    similarity = func.greatest(*[func.word_similarity(q, func.coalesce(c, "")) for c in columns])
+    contains = or_(*[c.ilike(like, escape="\\") for c in columns])
+    stmt = (
+        select(
+            literal(kind).label("kind"),
+            id_column.label("entity_id"),
+            (similarity + case((contains, SUBSTRING_BONUS), else_=0.0)).label("score"),
+        )
+        .select_from(source)
+        .where(or_(*[literal(q).op("<%")(c) for c in columns], contains))
+    )
+    for condition in where:
+        stmt = stmt.where(condition)
+    return stmt
+
+
+def _postgres_hits(session: Session, q: str, types: Iterable[str], limit: int, hits: Hits) -> None:
+    session.execute(
+        text("SELECT set_config('pg_trgm.word_similarity_threshold', :t, true)"),
+        {"t": str(settings.SEARCH_MIN_SCORE)},
+    )
+    like = f"%{_escape_like(q)}%"
+    client_source = SalesOrder.__table__.join(Client.__table__, Client.id == SalesOrder.client_id)
+    po_source = PurchaseOrder.__table__.join(Provider.__table__, Provider.id == PurchaseOrder.provider_id)
+
+    branches = []
+    if "order" in types:
+        # Proyecto y cliente en ramas separadas: cada una usa su propio índice
+        branches.append(_trgm_branch("order", SalesOrder.id, [SalesOrder.project_name], q, like, SalesOrder.__table__))
+        branches.append(_trgm_branch("order", SalesOrder.id, [Client.full_name], q, like, client_source))
+    if "instance" in types:
+        branches.append(_trgm_branch(
+            "instance", SalesOrderItemInstance.id,
+            [SalesOrderItemInstance.custom_name, SalesOrderItemInstance.street, SalesOrderItemInstance.lot],
+            q, like, SalesOrderItemInstance.__table__, SalesOrderItemInstance.is_cancelled == False,
+        ))
+    if "purchase_order" in types:
+        branches.append(_trgm_branch("purchase_order", PurchaseOrder.id, [PurchaseOrder.folio], q, like, PurchaseOrder.__table__))
+        branches.append(_trgm_branch("purchase_order", PurchaseOrder.id, [Provider.business_name], q, like, po_source))
+    if "material" in types:
+        branches.append(_trgm_branch(
+            "material", Material.id, [Material.sku, Material.name], q, like, Material.__table__,
+            Material.is_active == True,
+        ))
+    if not branches:
+        return
+
+    ranked = union_all(*branches).subquery()
+    rows = session.execute(
+        select(ranked.c.kind, ranked.c.entity_id, ranked.c.score)
+        .order_by(ranked.c.score.desc())
+        .limit(limit * 3)  # Holgura: una OV puede llegar por proyecto y por cliente
+    ).all()
+    for kind, entity_id, score in rows:
+        _keep_best(hits, kind, entity_id, score)
+
+
+# ------------------------------------------------------------
+# SQLite: FTS5 con trigramas (desarrollo local)
+# ------------------------------------------------------------
+_fts_lock = threading.Lock()
+_fts_built_at = 0.0
+
+_FTS_SOURCES = (
+    ("order", """
+        SELECT so.id, COALESCE(so.project_name, '') || ' ' || COALESCE(c.full_name, '')
+        FROM sales_orders so LEFT JOIN clients_v2 c ON c.id = so.client_id
+    """),
+    ("instance", """
+        SELECT id, COALESCE(custom_name, '') || ' ' || COALESCE(street, '') || ' ' || COALESCE(lot, '')
+        FROM sales_order_item_instances WHERE is_cancelled = 0
+    """),
+    ("purchase_order", """
+        SELECT po.id, COALESCE(po.folio, '') || ' ' || COALESCE(p.business_name, '')
+        FROM purchase_orders po LEFT JOIN providers p ON p.id = po.provider_id
+    """),
+    ("material", """
+        SELECT id, COALESCE(sku, '') || ' ' || COALESCE(name, '')
+        FROM materials WHERE is_active = 1
+    """),
+)
+
+
+def rebuild_sqlite_index(session: Session) -> None:
+    """Reconstruye search_fts desde las tablas (en su propia transacción)."""
+    global _fts_built_at
+    with session.get_bind().begin() as conn:
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS search_fts "
+            "USING fts5(kind UNINDEXED, entity_id UNINDEXED, body, tokenize='trigram')"
+        ))
+        conn.execute(text("DELETE FROM search_fts"))
+        for kind, source in _FTS_SOURCES:
+            conn.execute(text(
+                f"INSERT INTO search_fts (kind, entity_id, body) SELECT '{kind}', src.* FROM ({source}) AS src"
+            ))
+    _fts_built_at = time.monotonic()
+
+
+def _ensure_sqlite_index(session: Session) -> None:
+    if time.monotonic() - _fts_built_at < settings.SEARCH_SQLITE_REFRESH_SECONDS:
+        return
+    with _fts_lock:
+        if time.monotonic() - _fts_built_at >= settings.SEARCH_SQLITE_REFRESH_SECONDS:
+            rebuild_sqlite_index(session)
+
+
+def text_score(q: str, body: str) -> float:
+    """Parecido de cada palabra buscada con la mejor palabra del texto (promedio) + bono por contenerla."""
+    query_words = q.lower().split()
+    body_lower = (body or "").lower()
+    body_words = body_lower.split()
+    if not query_words or not body_words:
+        return 0.0
+    similarity = sum(
+        max(SequenceMatcher(None, word, candidate).ratio() for candidate in body_words)
+        for word in query_words
+    ) / len(query_words)
+    return similarity + (SUBSTRING_BONUS if q.lower() in body_lower else 0.0)
+
+
+def _sqlite_hits(session: Session, q: str, types: Iterable[str], limit: int, hits: Hits) -> None:
+    _ensure_sqlite_index(session)
+    types = list(types)
+    kinds = ", ".join(f"'{kind}'" for kind in types)
+    trigrams = {
+        word[i:i + 3].replace('"', '""')
+        for word in q.lower().split() if len(word) >= 3
+        for i in range(len(word) - 2)
+    }
+    if trigrams:
+        rows = session.execute(
+            text(
+                f"SELECT kind, entity_id, body FROM search_fts "
+                f"WHERE search_fts MATCH :expr AND kind IN ({kinds}) ORDER BY rank LIMIT :n"
+            ),
+            {"expr": " OR ".join(f'"{t}"' for t in sorted(trigrams)), "n": max(200, limit * 10)},
+        ).all()
+    else:
+        # Menos de 3 letras: no hay trigramas, basta con contener el texto
+        rows = session.execute(
+            text(f"SELECT kind, entity_id, body FROM search_fts WHERE body LIKE :like ESCAPE '\\' AND kind IN ({kinds}) LIMIT :n"),
+            {"like": f"%{_escape_like(q)}%", "n": limit * 3},
+        ).all()
+    for kind, entity_id, body in rows:
+        score = text_score(q, body)
+        if score >= settings.SEARCH_MIN_SCORE:
+            _keep_best(hits, kind, int(entity_id), score)
+
+
+# ------------------------------------------------------------
+# Títulos y subtítulos (una consulta por tipo)
+# ------------------------------------------------------------
+def _folio(order_id: Optional[int]) -> Optional[str]:
+    return f"OV-{str(order_id).zfill(4)}" if order_id else None
+
+
+def _join(*parts) -> str:
+    return " · ".join(str(p) for p in parts if p)
+
+
+def _describe(session: Session, keys: List[Tuple[str, int]]) -> Dict[Tuple[str, int], dict]:
+    ids: Dict[str, List[int]] = {}
+    for kind, entity_id in keys:
+        ids.setdefault(kind, []).append(entity_id)
+    described: Dict[Tuple[str, int], dict] = {}
+
+    if ids.get("order"):
+        for order_id, project, status, client in session.exec(
+            select(SalesOrder.id, SalesOrder.project_name, SalesOrder.status, Client.full_name)
+            .outerjoin(Client, Client.id == SalesOrder.client_id)
+            .where(SalesOrder.id.in_(ids["order"]))
+        ).all():
+            described[("order", order_id)] = {
+                "title": _folio(order_id),
+                "subtitle": _join(client, project),
+                "status": getattr(status, "value", status),
+            }
+    if ids.get("instance"):
+        for instance_id, name, street, lot, qr_code, status, order_id, client in session.exec(
+            select(
+                SalesOrderItemInstance.id, SalesOrderItemInstance.custom_name,
+                SalesOrderItemInstance.street, SalesOrderItemInstance.lot,
+                SalesOrderItemInstance.qr_code, SalesOrderItemInstance.production_status,
+                SalesOrderItem.sales_order_id, Client.full_name,
+            )
+            .join(SalesOrderItem, SalesOrderItem.id == SalesOrderItemInstance.sales_order_item_id)
+            .join(SalesOrder, SalesOrder.id == SalesOrderItem.sales_order_id)
+            .outerjoin(Client, Client.id == SalesOrder.client_id)
+            .where(SalesOrderItemInstance.id.in_(ids["instance"]))
+        ).all():
+            described[("instance", instance_id)] = {
+                "title": name,
+                "subtitle": _join(_folio(order_id), client, street and f"Calle {street}", lot and f"Lote {lot}"),
+                "status": getattr(status, "value", status),
+                "order_id": order_id,
+                "qr_code": qr_code,
+            }
+    if ids.get("purchase_order"):
+        for po_id, folio, status, provider in session.exec(
+            select(PurchaseOrder.id, PurchaseOrder.folio, PurchaseOrder.status, Provider.business_name)
+            .outerjoin(Provider, Provider.id == PurchaseOrder.provider_id)
+            .where(PurchaseOrder.id.in_(ids["purchase_order"]))
+        ).all():
+            described[("purchase_order", po_id)] = {"title": folio, "subtitle": provider, "status": status}
+    if ids.get("material"):
+        for material_id, sku, name, category in session.exec(
+            select(Material.id, Material.sku, Material.name, Material.category)
+            .where(Material.id.in_(ids["material"]))
+        ).all():
+            described[("material", material_id)] = {"title": name, "subtitle": _join(sku, category)}
+    return described
+
+
+# ------------------------------------------------------------
+# Punto de entrada
+# ------------------------------------------------------------
+def search(
+    session: Session,
+    q: str,
+    types: Optional[Iterable[str]] = None,
+    limit: int = 20,
+) -> dict:
+    q = " ".join((q or "").split())
+    types = [t for t in (types or SEARCH_TYPES) if t in SEARCH_TYPES]
+    limit = max(1, min(limit, MAX_RESULTS))
+    started = time.perf_counter()
+    postgres = session.get_bind().dialect.name == "postgresql"
+
+    hits: Hits = {}
+    if q and types:
+        _exact_hits(session, q, types, hits)
+        if postgres:
+            _postgres_hits(session, q, types, limit, hits)
+        else:
+            _sqlite_hits(session, q, types, limit, hits)
+
+    ranked = sorted(hits.items(), key=lambda item: (-item[1][0], item[0]))[:limit]
+    described = _describe(session, [key for key, _ in ranked])
+    results = []
+    for (kind, entity_id), (score, extra) in ranked:
+        info = described.get((kind, entity_id))
+        if info is None:
+            continue  # Se borró entre la búsqueda y la descripción (o el índice local está viejo)
+        results.append({"type": kind, "id": entity_id, "score": round(score, 3), **info, **extra})
+
+    return {
+        "query": q,
+        "engine": "postgres-trgm" if postgres else "sqlite-fts5",
+        "took_ms": round((time.perf_counter() - started) * 1000, 1),
+        "results": results,
+    }
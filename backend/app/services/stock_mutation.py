@@ -0,0 +1,276 @@
+"""
+stock_mutation.py  –  Servicio único de mutación de existencias
+
+Todo cambio a materials.physical_stock / committed_stock pasa por aquí:
+  - Se acumulan los deltas por material (varias partidas del mismo material = un delta).
+  - apply() hace, sin importar cuántos materiales se toquen:
+      1. UN SELECT ... FOR UPDATE de los materiales en orden de id (Postgres bloquea
+         las filas; dos transacciones nunca se cruzan porque bloquean en el mismo orden).
+      2. UN UPDATE por lotes (executemany) con incrementos atómicos
+         physical_stock = physical_stock + :delta  (nunca leer-modificar-escribir en Python).
+      3. UN INSERT multi-fila al Kárdex (inventory_transactions) con un renglón por
+         movimiento físico. Si el piso en cero recorta una salida, se registra el
+         recorte como AJUSTE_PISO_CERO para que el Kárdex siga cuadrando con el stock.
+
+committed_stock (apartados) no lleva Kárdex: su libro son las InventoryReservation.
+No hace commit: la transacción es del llamador.
+"""
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlmodel import Session, select
+from sqlalchemy import DateTime, bindparam, case, func, update
+
+from app.models.inventory import InventoryTransaction
+from app.models.material import Material
+from app.services.scheduler import notify_stock_changed
+
+
+class StockMutation:
+    def __init__(self, session: Session):
+        self.session = session
+        self._physical: Dict[int, float] = {}
+        self._committed: Dict[int, float] = {}
+        self._floor_physical: set = set()
+        self._floor_committed: set = set()
+        self._targets: Dict[int, float] = {}     # material_id -> physical_stock absoluto
+        self._costs: Dict[int, float] = {}       # material_id -> nuevo current_cost
+        self._ledger: List[dict] = []
+
+    # ------------------------------------------------------------
+    # Acumular movimientos
+    # ------------------------------------------------------------
+    def add(
+        self,
+        material_id: int,
+        quantity: float,
+        tipo: str,
+        unit_cost: Optional[float] = None,
+        reason_code: Optional[str] = None,
+        project_id: Optional[int] = None,
+        reception_id: Optional[int] = None,
+        created_at: Optional[datetime] = None,
+        floor_zero: bool = False,
+        record: bool = True,
+        subtotal: Optional[float] = None,
+    ) -> "StockMutation":
+        """
+        Movimiento físico: quantity positiva para entradas, negativa para salidas.
+        unit_cost None = costo actual del material al aplicar.
+        subtotal None = |quantity| * unit_cost.
+        record=False sólo para revertir el efecto de un renglón de Kárdex que el
+        llamador está borrando (el libro ya queda cuadrado con el borrado).
+        """
+        quantity = float(quantity or 0.0)
+        self._physical[material_id] = self._physical.get(material_id, 0.0) + quantity
+        if floor_zero:
+            self._floor_physical.add(material_id)
+        if record and quantity != 0:
+            self._ledger.append({
+                "material_id": material_id,
+                "quantity": quantity,
+                "unit_cost": unit_cost,
+                "subtotal": subtotal,
+                "transaction_type": tipo,
+                "reason_code": reason_code,
+                "project_id": project_id,
+                "reception_id": reception_id,
+                "created_at": created_at,
+            })
+        return self
+
+    def set_physical(
+        self,
+        material_id: int,
+        value: float,
+        tipo: str,
+        reason_code: Optional[str] = None,
+    ) -> "StockMutation":
+        """
+        Fija el stock físico (conteo). Al Kárdex va la diferencia contra el valor bloqueado
+        ya sumados los demás movimientos encolados para ese material.
+        """
+        self._targets[material_id] = float(value)
+        self._physical.setdefault(material_id, 0.0)
+        self._ledger.append({
+            "material_id": material_id,
+            "quantity": None,  # Se resuelve en apply() contra el valor bloqueado
+            "unit_cost": None,
+            "subtotal": None,
+            "transaction_type": tipo,
+            "reason_code": reason_code,
+            "project_id": None,
+            "reception_id": None,
+            "created_at": None,
+        })
+        return self
+
+    def reserve(self, material_id: int, quantity: float, floor_zero: bool = False) -> "StockMutation":
+        """Delta de committed_stock (positivo aparta, negativo libera)."""
+        self._committed[material_id] = self._committed.get(material_id, 0.0) + float(quantity or 0.0)
+        if floor_zero:
+            self._floor_committed.add(material_id)
+        return self
+
+    def set_cost(self, material_id: int, cost: float) -> "StockMutation":
+        self._costs[material_id] = float(cost)
+        self._physical.setdefault(material_id, 0.0)
+        return self
+
+    @property
+    def material_ids(self) -> List[int]:
+        return sorted(set(self._physical) | set(self._committed))
+
+    # ------------------------------------------------------------
+    # Aplicar
+    # ------------------------------------------------------------
+    def apply(self) -> Dict[int, dict]:
+        """
+        Aplica todo en la transacción actual. Retorna {material_id: {physical_stock,
+        committed_stock, current_cost, previous_physical_stock}} ya actualizados.
+        Materiales inexistentes se omiten. Una instancia se aplica una sola vez.
+        """
+        ids = self.material_ids
+        if not ids:
+            return {}
+
+        # 1. Bloqueo en orden de id + valores vigentes
+        locked = {
+            row[0]: {
+                "physical_stock": float(row[1] or 0.0),
+                "committed_stock": float(row[2] or 0.0),
+                "current_cost": float(row[3] or 0.0),
+            }
+            for row in self.session.exec(
+                select(Material.id, Material.physical_stock, Material.committed_stock, Material.current_cost)
+                .where(Material.id.in_(ids))
+                .order_by(Material.id)
+                .with_for_update()
+            ).all()
+        }
+
+        # Conteos absolutos → delta contra el valor bloqueado MÁS lo ya encolado para ese
+        # material: el renglón del conteo es sólo la diferencia que falta para llegar al
+        # valor contado (los movimientos encolados llevan su propio renglón).
+        count_deltas: Dict[int, float] = {}
+        for material_id, target in self._targets.items():
+            if material_id in locked:
+                count_deltas[material_id] = target - (locked[material_id]["physical_stock"] + self._physical[material_id])
+                self._physical[material_id] += count_deltas[material_id]
+
+        # 2. UN UPDATE por lotes con incrementos atómicos
+        table = Material.__table__
+        new_physical = func.coalesce(table.c.physical_stock, 0.0) + bindparam("b_dp")
+        new_committed = func.coalesce(table.c.committed_stock, 0.0) + bindparam("b_dc")
+        stmt = (
+            update(table)
+            .where(table.c.id == bindparam("b_id"))
+            .values(
+                physical_stock=case(
+                    ((bindparam("b_fp") == 1) & (new_physical < 0), 0.0), else_=new_physical
+                ),
+                committed_stock=case(
+                    ((bindparam("b_fc") == 1) & (new_committed < 0), 0.0), else_=new_committed
+                ),
+                current_cost=func.coalesce(bindparam("b_cost"), table.c.current_cost),
+                # Un UPDATE directo no pasa por _stamp_material: la huella de costo se
+                # mueve aquí y sólo si el costo cambió (updated_at lo fija su onupdate)
+                cost_updated_at=func.coalesce(
+                    bindparam("b_cost_at", type_=DateTime), table.c.cost_updated_at
+                ),
+            )
+        )
+        stamped_at = datetime.utcnow()
+        params = []
+        after: Dict[int, dict] = {}
+        clamped: Dict[int, float] = {}
+        for material_id in ids:
+            if material_id not in locked:
+                continue
+            dp = self._physical.get(material_id, 0.0)
+            dc = self._committed.get(material_id, 0.0)
+            fp = material_id in self._floor_physical
+            fc = material_id in self._floor_committed
+            params.append({
+                "b_id": material_id,
+                "b_dp": dp,
+                "b_dc": dc,
+                "b_fp": 1 if fp else 0,
+                "b_fc": 1 if fc else 0,
+                "b_cost": self._costs.get(material_id),
+                "b_cost_at": (
+                    stamped_at
+                    if material_id in self._costs
+                    and self._costs[material_id] != locked[material_id]["current_cost"]
+                    else None
+                ),
+            })
+            current = locked[material_id]
+            physical = current["physical_stock"] + dp
+            if fp and physical < 0:
+                clamped[material_id] = -physical
+                physical = 0.0
+            committed = current["committed_stock"] + dc
+            if fc and committed < 0:
+                committed = 0.0
+            after[material_id] = {
+                "previous_physical_stock": current["physical_stock"],
+                "physical_stock": physical,
+                "committed_stock": committed,
+                "current_cost": self._costs.get(material_id, current["current_cost"]),
+            }
+        if params:
+            self.session.execute(stmt, params)
+
+        # 3. Kárdex: UN INSERT multi-fila
+        now = datetime.now()
+        ledger_rows = []
+        for mov in self._ledger:
+            material_id = mov["material_id"]
+            if material_id not in locked:
+                continue
+            quantity = mov["quantity"]
+            if quantity is None:
+                quantity = count_deltas[material_id]
+                if quantity == 0:
+                    continue
+            unit_cost = mov["unit_cost"]
+            if unit_cost is None:
+                unit_cost = after[material_id]["current_cost"]
+            ledger_rows.append({
+                "material_id": material_id,
+                "quantity": quantity,
+                "unit_cost": unit_cost,
+                "subtotal": mov["subtotal"] if mov["subtotal"] is not None else abs(quantity) * unit_cost,
+                "transaction_type": mov["transaction_type"],
+                "reception_id": mov["reception_id"],
+                "project_id": mov["project_id"],
+                "operator_badge": None,
+                "reason_code": mov["reason_code"],
+                "created_at": mov["created_at"] or now,
+            })
+        for material_id, amount in clamped.items():
+            ledger_rows.append({
+                "material_id": material_id,
+                "quantity": amount,
+                "unit_cost": after[material_id]["current_cost"],
+                "subtotal": amount * after[material_id]["current_cost"],
+                "transaction_type": "AJUSTE_PISO_CERO",
+                "reception_id": None,
+                "project_id": None,
+                "operator_badge": None,
+                "reason_code": "PISO_CERO",
+                "created_at": now,
+            })
+        if ledger_rows:
+            self.session.execute(InventoryTransaction.__table__.insert(), ledger_rows)
+
+        # Los Material cargados en la sesión quedan con valores viejos
+        for obj in list(self.session.identity_map.values()):
+            if isinstance(obj, Material) and obj.id in after:
+                self.session.expire(obj)
+
+        if any(self._physical.get(mid) for mid in after):
+            notify_stock_changed(self.session)
+
+        return after
@@ -0,0 +1,145 @@
+"""
+Benchmark del feed del Calendario Maestro a 50k instancias.
+
+Compara la consulta legacy (OR de los 4 rangos scheduled_* sobre la tabla de
+instancias) contra la consulta de rango sobre la proyección schedule_events.
+Usa una base SQLite temporal; no toca la base configurada.
+
+Uso (desde backend/):  python -m scripts.bench_calendar_feed [n_instancias]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+from sqlmodel import SQLModel, Session, create_engine, select
+
+import app.models  # noqa: F401 — registra todas las tablas
+from app.models.foundations import Client, TaxRate
+from app.models.sales import SalesOrder, SalesOrderItem, SalesOrderItemInstance
+from app.models.planning import ScheduleEvent
+from app.services.planning_service import rebuild_schedule_events
+from app.api.v1.endpoints.planning import CALENDAR_INSTANCE_COLUMNS
+
+N_INSTANCES = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+BASE_DATE = datetime(2026, 1, 1)
+
+
+def _seed(session: Session, n: int) -> None:
+    session.add(TaxRate(id=1, name="IVA", rate=0.16))
+    session.add(Client(id=1, full_name="Cliente Bench", email="bench@example.com", phone="0"))
+    session.add(SalesOrder(id=1, client_id=1, tax_rate_id=1, project_name="Bench",
+                           valid_until=BASE_DATE))
+    session.add(SalesOrderItem(id=1, sales_order_id=1, product_name="Cocina", quantity=n, unit_price=1.0))
+    session.flush()
+
+    rnd = random.Random(26)
+    rows = []
+    for i in range(1, n + 1):
+        pm = BASE_DATE + timedelta(days=rnd.randint(0, 720))
+        rows.append({
+            "id": i,
+            "sales_order_item_id": 1,
+            "custom_name": f"Casa {i}",
+            "production_status": "PENDING",
+            "is_cancelled": False,
+            "hardware_dispatched": False,
+            "is_warranty_reopened": False,
+            "scheduled_prod_mdf": pm,
+            "scheduled_prod_stone": pm + timedelta(days=3) if i % 2 else None,
+            "scheduled_inst_mdf": pm + timedelta(days=10),
+            "scheduled_inst_stone": pm + timedelta(days=14) if i % 2 else None,
+        })
+    session.execute(SalesOrderItemInstance.__table__.insert(), rows)
+    session.commit()
+
+
+def _legacy_stmt(columns, start: datetime, end: datetime):
+    I = SalesOrderItemInstance
+    return select(*columns).where(I.is_cancelled == False).where(
+        ((I.scheduled_prod_mdf >= start) & (I.scheduled_prod_mdf <= end))
+        | ((I.scheduled_prod_stone >= start) & (I.scheduled_prod_stone <= end))
+        | ((I.scheduled_inst_mdf >= start) & (I.scheduled_inst_mdf <= end))
+        | ((I.scheduled_inst_stone >= start) & (I.scheduled_inst_stone <= end))
+    )
+
+
+def _projection_stmt(columns, start: datetime, end: datetime):
+    return (
+        select(*columns)
+        .select_from(ScheduleEvent)
+        .join(SalesOrderItemInstance, SalesOrderItemInstance.id == ScheduleEvent.instance_id)
+        .where(ScheduleEvent.scheduled_at >= start)
+        .where(ScheduleEvent.scheduled_at <= end)
+        .where(SalesOrderItemInstance.is_cancelled == False)
+    )
+
+
+def _legacy_filter(session: Session, start: datetime, end: datetime) -> int:
+    return session.exec(_legacy_stmt([func.count()], start, end)).one()
+
+
+def _projection_filter(session: Session, start: datetime, end: datetime) -> int:
+    return session.exec(_projection_stmt([func.count()], start, end)).one()
+
+
+def _legacy_rows(session: Session, start: datetime, end: datetime) -> int:
+    rows = session.exec(_legacy_stmt([SalesOrderItemInstance], start, end)).all()
+    session.expunge_all()
+    return len(rows)
+
+
+def _projection_rows(session: Session, start: datetime, end: datetime) -> int:
+    rows = session.exec(_projection_stmt(
+        [ScheduleEvent.lane, ScheduleEvent.scheduled_at, *CALENDAR_INSTANCE_COLUMNS], start, end
+    )).all()
+    return len(rows)
+
+
+def _time(fn, *args, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def run():
+    tmpdir = tempfile.mkdtemp()
+    engine = create_engine(f"sqlite:///{os.path.join(tmpdir, 'bench.db')}")
+    SQLModel.metadata.create_all(engine)
+
+    with Session(engine) as session:
+        t0 = time.perf_counter()
+        _seed(session, N_INSTANCES)
+        print(f"Semilla: {N_INSTANCES} instancias en {time.perf_counter() - t0:.2f}s")
+
+        t0 = time.perf_counter()
+        pills = rebuild_schedule_events(session)
+        session.commit()
+        print(f"Rebuild: {pills} píldoras en {time.perf_counter() - t0:.2f}s")
+
+        session.expunge_all()
+        start = datetime(2026, 6, 1)
+        windows = [
+            ("Semana", start + timedelta(days=7)),
+            ("Mes", datetime(2026, 6, 30, 23, 59, 59)),
+            ("Trimestre", datetime(2026, 8, 31, 23, 59, 59)),
+        ]
+        print(f"{'Ventana':<10} {'filtro legacy':>14} {'filtro índice':>14} {'filas legacy':>13} {'filas índice':>13}")
+        for label, end in windows:
+            print(
+                f"{label:<10} "
+                f"{_time(_legacy_filter, session, start, end) * 1000:11.1f} ms "
+                f"{_time(_projection_filter, session, start, end) * 1000:11.1f} ms "
+                f"{_time(_legacy_rows, session, start, end) * 1000:10.1f} ms "
+                f"{_time(_projection_rows, session, start, end) * 1000:10.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,41 @@
+"""
+Benchmark del reparto voraz del Planeador de Factibilidad (sólo memoria, sin BD).
+
+Uso (desde backend/):  python -m scripts.bench_feasibility_planner [n_instancias]
+"""
+import random
+import sys
+import time
+
+from app.services.batch_simulator import allocate_greedy
+
+N_INSTANCES = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+N_VERSIONS = 300
+N_MATERIALS = 800
+COMPONENTS_PER_RECIPE = 25
+
+
+def run():
+    rnd = random.Random(28)
+    recipes = {
+        v: {rnd.randrange(N_MATERIALS): rnd.uniform(0.5, 6.0) for _ in range(COMPONENTS_PER_RECIPE)}
+        for v in range(N_VERSIONS)
+    }
+    available = {m: rnd.uniform(0, 400) for m in range(N_MATERIALS)}
+    critical = {m: m % 4 == 0 for m in range(N_MATERIALS)}
+    demands = [
+        {"instance_id": i, "version_id": rnd.randrange(N_VERSIONS)}
+        for i in range(N_INSTANCES)
+    ]
+
+    t0 = time.perf_counter()
+    results = allocate_greedy(demands, recipes, dict(available), critical)
+    elapsed = time.perf_counter() - t0
+
+    releasable = sum(1 for r in results if r["releasable"])
+    print(f"{N_INSTANCES} instancias, {COMPONENTS_PER_RECIPE} componentes/receta: "
+          f"{elapsed * 1000:.1f} ms ({releasable} liberables)")
+
+
+if __name__ == "__main__":
+    run()
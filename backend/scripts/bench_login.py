@@ -0,0 +1,129 @@
+"""
+Benchmark de inicio de sesión (bcrypt) a distintos costos.
+
+1. Costo puro: verificaciones por segundo de bcrypt.checkpw en un hilo.
+2. Ráfaga por el API: N logins simultáneos contra /login/access-token mientras
+   un hilo sonda pide GET / cada 20 ms; reporta logins/s, respuestas 503 y la
+   latencia de la sonda (lo que siente el resto del API durante la ráfaga).
+
+Usa una base SQLite temporal; no toca la base configurada. PASSWORD_HASH_WORKERS
+y PASSWORD_HASH_MAX_PENDING se toman del entorno como en producción.
+
+Uso (desde backend/):  python -m scripts.bench_login [costos] [logins_simultaneos]
+    python -m scripts.bench_login 8,10,12 40
+"""
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+_tmp = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/bench_login.db"
+os.environ.setdefault("SCHEDULER_ENABLED", "false")
+os.environ.setdefault("JOB_WORKERS", "0")
+os.environ.setdefault("EMAIL_SENDER_ENABLED", "false")
+
+import bcrypt  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlmodel import Session, delete  # noqa: E402
+
+from app.core.config import settings  # noqa: E402
+from app.core.database import engine  # noqa: E402
+from app.core.security import get_password_hash  # noqa: E402
+from app.main import app  # noqa: E402
+from app.models.users import User  # noqa: E402
+
+COSTS = [int(c) for c in sys.argv[1].split(",")] if len(sys.argv) > 1 else [8, 10, 12]
+BURST = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+PASSWORD = "turno-7am"
+
+
+def _raw_checks_per_second(rounds: int, seconds: float = 1.0) -> float:
+    hashed = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(rounds=rounds))
+    done, started = 0, time.perf_counter()
+    while time.perf_counter() - started < seconds or done < 2:
+        bcrypt.checkpw(PASSWORD.encode(), hashed)
+        done += 1
+    return done / (time.perf_counter() - started)
+
+
+def _seed_users(rounds: int, n: int) -> None:
+    hashed = get_password_hash(PASSWORD, rounds=rounds)
+    with Session(engine) as session:
+        session.exec(delete(User).where(User.email.like("bench%")))
+        session.execute(User.__table__.insert(), [
+            {"email": f"bench{i}@example.com", "hashed_password": hashed, "full_name": f"Instalador {i}",
+             "is_active": True, "role": "LOGISTICS", "commission_rate": 0.0, "monthly_sales_target": 0.0,
+             "global_commission_rate": 0.0, "is_superuser": False}
+            for i in range(n)
+        ])
+        session.commit()
+
+
+def _burst(client: TestClient, n: int) -> dict:
+    statuses = []
+    probe_latencies = []
+    stop_probe = threading.Event()
+
+    def login(i: int) -> None:
+        r = client.post("/api/v1/login/access-token",
+                        data={"username": f"bench{i}@example.com", "password": PASSWORD})
+        statuses.append(r.status_code)
+
+    def probe() -> None:
+        while not stop_probe.is_set():
+            t0 = time.perf_counter()
+            client.get("/")
+            probe_latencies.append((time.perf_counter() - t0) * 1000)
+            time.sleep(0.02)
+
+    prober = threading.Thread(target=probe)
+    prober.start()
+    time.sleep(0.1)
+    threads = [threading.Thread(target=login, args=(i,)) for i in range(n)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    stop_probe.set()
+    prober.join()
+
+    ok = statuses.count(200)
+    probe_latencies.sort()
+    return {
+        "ok": ok,
+        "busy_503": statuses.count(503),
+        "other": len(statuses) - ok - statuses.count(503),
+        "logins_per_s": ok / elapsed if elapsed else 0.0,
+        "elapsed_s": elapsed,
+        "probe_p50_ms": statistics.median(probe_latencies) if probe_latencies else 0.0,
+        "probe_p95_ms": probe_latencies[int(len(probe_latencies) * 0.95) - 1] if probe_latencies else 0.0,
+        "probe_max_ms": probe_latencies[-1] if probe_latencies else 0.0,
+    }
+
+
+def main() -> None:
+    print(f"bcrypt: hilos dedicados={settings.PASSWORD_HASH_WORKERS}  "
+          f"fila máx={settings.PASSWORD_HASH_MAX_PENDING}  ráfaga={BURST}")
+    print(f"{'costo':>5} {'checks/s':>9} {'ms/check':>9} | {'logins/s':>8} {'ok':>4} {'503':>4} "
+          f"{'total s':>7} | {'sonda p50':>9} {'p95':>7} {'máx':>7}")
+    with TestClient(app) as client:
+        for rounds in COSTS:
+            raw = _raw_checks_per_second(rounds)
+            _seed_users(rounds, BURST)
+            # El rehash al costo configurado también corre en la ráfaga: se fija para no medirlo
+            settings.BCRYPT_ROUNDS = rounds
+            r = _burst(client, BURST)
+            print(f"{rounds:>5} {raw:>9.1f} {1000 / raw:>9.1f} | {r['logins_per_s']:>8.1f} {r['ok']:>4} "
+                  f"{r['busy_503']:>4} {r['elapsed_s']:>7.2f} | {r['probe_p50_ms']:>7.1f}ms "
+                  f"{r['probe_p95_ms']:>5.1f}ms {r['probe_max_ms']:>5.1f}ms")
+            if r["other"]:
+                print(f"      ¡{r['other']} respuestas inesperadas!")
+
+
+if __name__ == "__main__":
+    main()
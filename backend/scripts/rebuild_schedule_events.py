@@ -0,0 +1,20 @@
+"""
+Reconstruye la proyección schedule_events (píldoras del Calendario Maestro)
+a partir de los 4 campos scheduled_* de sales_order_item_instances.
+
+Uso (desde backend/):  python -m scripts.rebuild_schedule_events
+"""
+from sqlmodel import Session
+from app.core.database import engine
+from app.services.planning_service import rebuild_schedule_events
+
+
+def rebuild():
+    with Session(engine) as session:
+        total = rebuild_schedule_events(session)
+        session.commit()
+    print(f"Píldoras reconstruidas: {total}")
+
+
+if __name__ == "__main__":
+    rebuild()
@@ -0,0 +1,42 @@
+"""
+Recalcula physical_stock y committed_stock desde sus libros (Kárdex y reservas
+ACTIVA) y reporta los descuadres. Con --correct iguala los contadores.
+
+Uso (desde backend/):  python -m scripts.replay_kardex [--correct] [--chunk N]
+"""
+import argparse
+
+from sqlmodel import Session
+
+from app.core.database import engine
+from app.services.kardex_replay import DEFAULT_CHUNK_SIZE, KardexReplay
+
+
+def replay():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--correct", action="store_true", help="Corregir los contadores descuadrados")
+    parser.add_argument("--chunk", type=int, default=DEFAULT_CHUNK_SIZE, help="Renglones por bloque")
+    args = parser.parse_args()
+
+    with Session(engine) as session:
+        report = KardexReplay.replay(session, correct=args.correct, chunk_size=args.chunk)
+        if args.correct:
+            session.commit()
+
+    print(f"Kárdex hasta id {report['as_of_transaction_id']}: {report['ledger_rows']} movimientos, "
+          f"{report['reservation_rows']} reservas activas, {report['materials_checked']} materiales "
+          f"en {report['elapsed_seconds']}s")
+    if report["discrepancies"]:
+        print(f"{'SKU':<20} {'físico':>12} {'Kárdex':>12} {'apartado':>12} {'reservas':>12}  apertura")
+        for d in report["discrepancies"]:
+            print(f"{d['sku']:<20} {d['physical_stock']:12.2f} {d['ledger_physical_stock']:12.2f} "
+                  f"{d['committed_stock']:12.2f} {d['reserved_committed_stock']:12.2f}  "
+                  f"{'sí' if d['has_opening_balance'] else 'NO'}")
+    print(f"Descuadres: {len(report['discrepancies'])}. Corregidos: {report['corrected']}.")
+    if args.correct and report["skipped_no_opening"]:
+        print(f"{len(report['skipped_no_opening'])} material(es) sin saldo de apertura: su físico NO se "
+              f"corrigió. Corre primero el saldo de apertura del Kárdex (KARDEX_OPENING).")
+
+
+if __name__ == "__main__":
+    replay()
@@ -0,0 +1,240 @@
+"""
+Prueba de estrés de concurrencia del inventario (StockMutation).
+
+Varios hilos reciben mercancía (entradas de OC) y escanean bultos (consumo de
+reservas) sobre los MISMOS materiales al mismo tiempo; algunos escaneos se
+repiten a propósito. Al final verifica que:
+  - physical_stock de cada material = suma de su Kárdex (no se perdió ninguna
+    actualización ni hay movimiento sin renglón).
+  - committed_stock = suma de sus reservas ACTIVA.
+  - Ninguna instancia se consumió dos veces.
+
+Por omisión usa una base SQLite temporal (los bloqueos son de archivo, así que
+se reintenta cuando la base está ocupada). Para probar los bloqueos de fila de
+Postgres, apuntar STRESS_DATABASE_URL a una base VACÍA de pruebas:
+
+Uso (desde backend/):  python -m scripts.stress_inventory_concurrency [hilos] [operaciones_por_hilo]
+"""
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError
+from sqlmodel import SQLModel, Session, create_engine, select
+
+import app.models  # noqa: F401 — registra todas las tablas
+from app.models.foundations import Client, TaxRate
+from app.models.inventory import InventoryReservation, InventoryTransaction
+from app.models.material import Material
+from app.models.production import ProductionBatch
+from app.models.sales import SalesOrder, SalesOrderItem, SalesOrderItemInstance
+from app.services.inventory_manager import InventoryManager
+from app.services.stock_mutation import StockMutation
+
+N_THREADS = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+OPS_PER_THREAD = int(sys.argv[2]) if len(sys.argv) > 2 else 150
+N_MATERIALS = 6
+INITIAL_STOCK = 200.0
+MAX_RETRIES = 50
+
+
+def _engine():
+    url = os.environ.get("STRESS_DATABASE_URL")
+    if url:
+        return create_engine(url, pool_size=N_THREADS, max_overflow=N_THREADS)
+    tmpdir = tempfile.mkdtemp()
+    return create_engine(
+        f"sqlite:///{os.path.join(tmpdir, 'stress.db')}",
+        connect_args={"check_same_thread": False, "timeout": 30},
+    )
+
+
+def _seed(engine, n_instances: int) -> None:
+    rnd = random.Random(33)
+    with Session(engine) as session:
+        session.add(TaxRate(id=1, name="IVA", rate=0.16))
+        session.add(Client(id=1, full_name="Cliente Estrés", email="stress@example.com", phone="0"))
+        session.add(SalesOrder(id=1, client_id=1, tax_rate_id=1, project_name="Estrés",
+                               valid_until=datetime(2027, 1, 1)))
+        session.add(SalesOrderItem(id=1, sales_order_id=1, product_name="Cocina",
+                                   quantity=n_instances, unit_price=1.0))
+        session.add(ProductionBatch(id=1, folio="LOTE-STRESS-0001", batch_type="MDF"))
+        session.flush()
+
+        session.execute(SalesOrderItemInstance.__table__.insert(), [
+            {
+                "id": i,
+                "sales_order_item_id": 1,
+                "custom_name": f"Casa {i}",
+                "production_status": "READY",
+                "is_cancelled": False,
+                "hardware_dispatched": False,
+                "is_warranty_reopened": False,
+            }
+            for i in range(1, n_instances + 1)
+        ])
+
+        reservations = []
+        committed = {m: 0.0 for m in range(1, N_MATERIALS + 1)}
+        for i in range(1, n_instances + 1):
+            for material_id in rnd.sample(range(1, N_MATERIALS + 1), 3):
+                qty = float(rnd.randint(1, 8))
+                reservations.append({
+                    "production_batch_id": 1,
+                    "instance_id": i,
+                    "material_id": material_id,
+                    "quantity_reserved": qty,
+                    "status": "ACTIVA",
+                    "created_at": datetime.utcnow(),
+                })
+                committed[material_id] += qty
+        session.execute(InventoryReservation.__table__.insert(), reservations)
+
+        for material_id in range(1, N_MATERIALS + 1):
+            session.add(Material(
+                id=material_id, sku=f"STR{material_id}", name=f"Material {material_id}",
+                category="TABLERO", production_route="MATERIAL",
+                purchase_unit="PZA", usage_unit="PZA", current_cost=10.0,
+                physical_stock=INITIAL_STOCK, committed_stock=committed[material_id],
+            ))
+        session.flush()
+        # El saldo inicial también va al Kárdex, para que la verificación sea una suma
+        session.execute(InventoryTransaction.__table__.insert(), [
+            {
+                "material_id": material_id,
+                "quantity": INITIAL_STOCK,
+                "unit_cost": 10.0,
+                "subtotal": INITIAL_STOCK * 10.0,
+                "transaction_type": "AJUSTE_INICIAL",
+                "reason_code": "SALDO_APERTURA",
+                "created_at": datetime.utcnow(),
+            }
+            for material_id in range(1, N_MATERIALS + 1)
+        ])
+        session.commit()
+
+
+def _with_retry(engine, fn, stats: dict) -> None:
+    for _ in range(MAX_RETRIES):
+        try:
+            with Session(engine) as session:
+                fn(session)
+                session.commit()
+            return
+        except OperationalError:
+            # SQLite: "database is locked" al subir de lectura a escritura
+            stats["retries"] += 1
+            time.sleep(random.uniform(0.001, 0.01))
+    stats["failed"] += 1
+
+
+def _worker(engine, seed: int, queue: list, queue_lock: threading.Lock, stats: dict) -> None:
+    rnd = random.Random(seed)
+    for _ in range(OPS_PER_THREAD):
+        if rnd.random() < 0.5:
+            lines = [(rnd.randint(1, N_MATERIALS), float(rnd.randint(1, 20))) for _ in range(rnd.randint(1, 4))]
+
+            def receive(session, lines=lines):
+                mutation = StockMutation(session)
+                for material_id, qty in lines:
+                    mutation.add(material_id, qty, "ENTRADA_COMPRA", unit_cost=10.0, reason_code="RECEPCION_OC")
+                mutation.apply()
+
+            _with_retry(engine, receive, stats)
+            stats["receptions"] += 1
+        else:
+            with queue_lock:
+                if not queue:
+                    continue
+                # 1 de cada 5 escaneos repite una instancia ya escaneada
+                instance_id = queue.pop() if rnd.random() > 0.2 or not stats["scanned"] else rnd.choice(stats["scanned"])
+                stats["scanned"].append(instance_id)
+
+            def scan(session, instance_id=instance_id):
+                InventoryManager.consume_instance_reservations(session, instance_id)
+
+            _with_retry(engine, scan, stats)
+            stats["scans"] += 1
+
+
+def _verify(engine) -> bool:
+    ok = True
+    with Session(engine) as session:
+        ledger = dict(session.exec(
+            select(InventoryTransaction.material_id, func.sum(InventoryTransaction.quantity))
+            .group_by(InventoryTransaction.material_id)
+        ).all())
+        active = dict(session.exec(
+            select(InventoryReservation.material_id, func.sum(InventoryReservation.quantity_reserved))
+            .where(InventoryReservation.status == "ACTIVA")
+            .group_by(InventoryReservation.material_id)
+        ).all())
+        consumed_scans = session.exec(
+            select(func.count()).select_from(InventoryTransaction)
+            .where(InventoryTransaction.transaction_type == "SALIDA_INSTALACION")
+        ).one()
+        consumed_instances = session.exec(
+            select(func.count(func.distinct(InventoryReservation.instance_id)))
+            .where(InventoryReservation.status == "CONSUMIDA")
+        ).one()
+        consumed_pairs = session.exec(
+            select(func.count()).select_from(InventoryReservation)
+            .where(InventoryReservation.status == "CONSUMIDA")
+        ).one()
+
+        print(f"{'Material':<10} {'físico':>10} {'Kárdex':>10} {'apartado':>10} {'reservas':>10}")
+        for m in session.exec(select(Material).order_by(Material.id)).all():
+            expected_physical = float(ledger.get(m.id) or 0.0)
+            expected_committed = float(active.get(m.id) or 0.0)
+            row_ok = (abs(m.physical_stock - expected_physical) < 1e-6
+                      and abs(m.committed_stock - expected_committed) < 1e-6)
+            ok = ok and row_ok
+            print(f"{m.sku:<10} {m.physical_stock:10.1f} {expected_physical:10.1f} "
+                  f"{m.committed_stock:10.1f} {expected_committed:10.1f} {'' if row_ok else '  <-- DESCUADRE'}")
+
+    # Cada reserva consumida produce exactamente un renglón de salida (una por material)
+    if consumed_scans != consumed_pairs:
+        print(f"Salidas en Kárdex ({consumed_scans}) != reservas consumidas ({consumed_pairs})")
+        ok = False
+    print(f"Instancias consumidas: {consumed_instances}")
+    return ok
+
+
+def run():
+    engine = _engine()
+    SQLModel.metadata.create_all(engine)
+    n_instances = N_THREADS * OPS_PER_THREAD // 2
+    _seed(engine, n_instances)
+
+    queue = list(range(1, n_instances + 1))
+    random.Random(0).shuffle(queue)
+    stats = {"receptions": 0, "scans": 0, "retries": 0, "failed": 0, "scanned": []}
+    lock = threading.Lock()
+    threads = [
+        threading.Thread(target=_worker, args=(engine, seed, queue, lock, stats))
+        for seed in range(N_THREADS)
+    ]
+
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    print(f"{N_THREADS} hilos x {OPS_PER_THREAD} ops en {elapsed:.2f}s: "
+          f"{stats['receptions']} recepciones, {stats['scans']} escaneos "
+          f"({len(stats['scanned']) - len(set(stats['scanned']))} repetidos), "
+          f"{stats['retries']} reintentos, {stats['failed']} fallidas")
+    ok = _verify(engine) and stats["failed"] == 0
+    print("OK: el inventario cuadra con el Kárdex." if ok else "FALLA: hay descuadres.")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    run()